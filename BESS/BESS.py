@@ -6,9 +6,12 @@ for the Breathing Earth Systems Simulator (BESS)
 
 import logging
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
+from functools import partial
+from glob import glob
 from os.path import join, abspath, dirname, expanduser
-from typing import Union, Callable, List
+from typing import Union, Callable, List, Dict
 
 import numpy as np
 from dateutil import parser
@@ -22,7 +25,15 @@ from GEDI import GEDICanopyHeight
 from GEOS5FP import GEOS5FP
 from ORNL.MODISCI import MODISCI
 from SRTM import SRTM
+from model.memoization import memoize_stage
+from model.model import suppress_diagnostics, peak_memory_MB
+from model.precision import DEFAULT_DTYPE, precision_inputs
+from model.writer import IntermediateWriter
 from rasters import Raster, RasterGeometry, RasterGrid
+from timer import Timer
+
+from . import kernel
+from .static_cache import DEFAULT_CACHE_STATIC, DEFAULT_STATIC_CACHE, StaticCache, static_layer
 
 __author__ = "Gregory Halverson, Robert Freepartner"
 
@@ -35,6 +46,10 @@ DEFAULT_BESS_INTERMEDIATE = "BESS_intermediate"
 DEFAULT_PREVIEW_QUALITY = 20
 DEFAULT_RESAMPLING = "cubic"
 DEFAULT_PASSES = 1
+DEFAULT_FUSED_KERNEL = False
+DEFAULT_CONVERGENCE_TOLERANCE = None
+DEFAULT_PARALLEL_C3_C4 = False
+DEFAULT_BLOCK_ROWS = None
 
 DEFAULT_DOWNSCALE_AIR = True
 DEFAULT_DOWNSCALE_HUMIDITY = True
@@ -42,6 +57,22 @@ DEFAULT_DOWNSCALE_MOISTURE = True
 
 GEOS_IN_SENTINEL_COARSE_CELL_SIZE = 13720
 
+# static parameters resampled together into the per-tile static cache
+STATIC_LAYERS = [
+    "fC4",
+    "alf",
+    "kn",
+    "b0_C3",
+    "m_C3",
+    "m_C4",
+    "peakVCmax_C3",
+    "peakVCmax_C4",
+    "canopy_height_meters",
+    "CI",
+    "NDVI_minimum",
+    "NDVI_maximum"
+]
+
 DEFAULT_OUTPUT_VARIABLES = [
     "GPP",
     "GPP_daily",
@@ -71,6 +102,27 @@ class CINotAvailable(IOError):
     pass
 
 
+def quadratic_root(a: Union[Raster, float], b: Union[Raster, float], c: Union[Raster, float]) -> Raster:
+    """
+    Root of the colimitation and Paw and Gao quadratics, (-b + sign(b) * sqrt(b^2 - 4ac)) / 2a.
+    The numerator cancels two nearly equal terms when 4ac is small next to b^2,
+    so the root is calculated in float64 and returned in the precision of the coefficients.
+    :param a: quadratic coefficient
+    :param b: linear coefficient
+    :param c: constant coefficient
+    :return: root of the quadratic
+    """
+    dtype = np.result_type(*[value if np.isscalar(value) else np.asarray(value) for value in (a, b, c)])
+    a64, b64, c64 = [np.asarray(value, dtype=np.float64) for value in (a, b, c)]
+    root = ((-b64 + np.sign(b64) * np.sqrt(b64 * b64 - 4.0 * a64 * c64)) / (2.0 * a64)).astype(dtype, copy=False)
+
+    for value in (b, c, a):
+        if isinstance(value, Raster):
+            return value.contain(root)
+
+    return root
+
+
 class BESS(FLiES):
     logger = logging.getLogger(__name__)
 
@@ -99,7 +151,17 @@ class BESS(FLiES):
             downscale_moisture: bool = DEFAULT_DOWNSCALE_MOISTURE,
             save_intermediate: bool = False,
             include_preview: bool = True,
-            show_distribution: bool = True):
+            show_distribution: bool = True,
+            intermediate_writer: IntermediateWriter = None,
+            distribution_sample_fraction: float = None,
+            memoize: bool = False,
+            dtype: Union[str, type, np.dtype] = DEFAULT_DTYPE,
+            fused_kernel: bool = DEFAULT_FUSED_KERNEL,
+            convergence_tolerance: float = DEFAULT_CONVERGENCE_TOLERANCE,
+            parallel_C3_C4: bool = DEFAULT_PARALLEL_C3_C4,
+            block_rows: int = DEFAULT_BLOCK_ROWS,
+            cache_static: bool = DEFAULT_CACHE_STATIC,
+            static_cache_directory: str = None):
         if working_directory is None:
             working_directory = DEFAULT_WORKING_DIRECTORY
 
@@ -128,7 +190,11 @@ class BESS(FLiES):
             resampling=resampling,
             save_intermediate=save_intermediate,
             show_distribution=show_distribution,
-            include_preview=include_preview
+            include_preview=include_preview,
+            intermediate_writer=intermediate_writer,
+            distribution_sample_fraction=distribution_sample_fraction,
+            memoize=memoize,
+            dtype=dtype
         )
 
         if GEDI_connection is None:
@@ -160,6 +226,30 @@ class BESS(FLiES):
         self.ORNL_connection = ORNL_connection
         self.passes = passes
         self.initialize_Tf_with_ST = initialize_Tf_with_ST
+
+        if fused_kernel and not kernel.NUMBA_AVAILABLE:
+            self.logger.warning("numba is not installed, using vectorized BESS carbon and water flux iteration")
+            fused_kernel = False
+
+        self.fused_kernel = fused_kernel
+        self.convergence_tolerance = convergence_tolerance
+        self.parallel_C3_C4 = parallel_C3_C4
+
+        if block_rows is not None and block_rows < 1:
+            raise ValueError(f"invalid number of rows per BESS block: {block_rows}")
+
+        self.block_rows = block_rows
+
+        if cache_static:
+            if static_cache_directory is None:
+                static_cache_directory = join(static_directory, DEFAULT_STATIC_CACHE)
+
+            static_cache_directory = abspath(expanduser(static_cache_directory))
+            self.logger.info(f"caching BESS static parameters: {cl.dir(static_cache_directory)}")
+            self.static_cache = StaticCache(static_cache_directory, STATIC_LAYERS, sources=self.static_sources())
+        else:
+            self.static_cache = None
+
         self.downscale_air = downscale_air
         self.downscale_humidity = downscale_humidity
         self.downscale_moisture = downscale_moisture
@@ -286,78 +376,136 @@ class BESS(FLiES):
         self.logger.info("retrieving GEOS-5 FP wind speed raster in meters per second")
         return self.GEOS5FP_connection.wind_speed(time_UTC=time_UTC, geometry=geometry, resampling=self.resampling)
 
+    @static_layer
     def fC4(self, geometry: RasterGeometry) -> Raster:
         filename = join(abspath(dirname(__file__)), "c4_percent_1d_f32.tif")
-        image = rt.Raster.open(filename, geometry=geometry, resampling=self.resampling, nodata=np.nan)
+        image = self.cast(rt.Raster.open(filename, geometry=geometry, resampling=self.resampling, nodata=np.nan))
         image = rt.clip(image, 0, 100)
 
         return image
 
+    @static_layer
     def alf(self, geometry: RasterGeometry) -> Raster:
         filename = join(abspath(dirname(__file__)), "alf.tif")
-        image = rt.Raster.open(filename, geometry=geometry, resampling=self.resampling)
+        image = self.cast(rt.Raster.open(filename, geometry=geometry, resampling=self.resampling))
 
         return image
 
+    @static_layer
     def kn(self, geometry: RasterGeometry) -> Raster:
         filename = join(abspath(dirname(__file__)), "kn.tif")
-        image = rt.Raster.open(filename, geometry=geometry, resampling=self.resampling)
+        image = self.cast(rt.Raster.open(filename, geometry=geometry, resampling=self.resampling))
 
         return image
 
+    @static_layer
     def b0_C3(self, geometry: RasterGeometry) -> Raster:
         filename = join(abspath(dirname(__file__)), "b0_C3.tif")
-        image = rt.Raster.open(filename, geometry=geometry, resampling=self.resampling)
+        image = self.cast(rt.Raster.open(filename, geometry=geometry, resampling=self.resampling))
 
         return image
 
+    @static_layer
     def m_C3(self, geometry: RasterGeometry) -> Raster:
         filename = join(abspath(dirname(__file__)), "m_C3.tif")
-        image = rt.Raster.open(filename, geometry=geometry, resampling=self.resampling)
+        image = self.cast(rt.Raster.open(filename, geometry=geometry, resampling=self.resampling))
 
         return image
 
+    @static_layer
     def m_C4(self, geometry: RasterGeometry) -> Raster:
         filename = join(abspath(dirname(__file__)), "m_C4.tif")
-        image = rt.Raster.open(filename, geometry=geometry, resampling=self.resampling)
+        image = self.cast(rt.Raster.open(filename, geometry=geometry, resampling=self.resampling))
 
         return image
 
+    @static_layer
     def peakVCmax_C3(self, geometry: RasterGeometry) -> Raster:
         filename = join(abspath(dirname(__file__)), "peakVCmax_C3.tif")
-        image = rt.Raster.open(filename, geometry=geometry, resampling=self.resampling, nodata=np.nan)
+        image = self.cast(rt.Raster.open(filename, geometry=geometry, resampling=self.resampling, nodata=np.nan))
 
         return image
 
+    @static_layer
     def peakVCmax_C4(self, geometry: RasterGeometry) -> Raster:
         filename = join(abspath(dirname(__file__)), "peakVCmax_C4.tif")
-        image = rt.Raster.open(filename, geometry=geometry, resampling=self.resampling, nodata=np.nan)
+        image = self.cast(rt.Raster.open(filename, geometry=geometry, resampling=self.resampling, nodata=np.nan))
 
         return image
 
+    @static_layer
     def canopy_height_meters(self, geometry: RasterGeometry) -> Raster:
-        image = self.GEDI_connection.canopy_height_meters(geometry=geometry, resampling=self.resampling)
+        image = self.cast(self.GEDI_connection.canopy_height_meters(geometry=geometry, resampling=self.resampling))
         image = rt.clip(image, 0, None)
 
         return image
 
+    @static_layer
     def CI(self, geometry: RasterGeometry) -> Raster:
-        return self.ORNL_connection.CI(geometry=geometry, resampling=self.resampling)
+        return self.cast(self.ORNL_connection.CI(geometry=geometry, resampling=self.resampling))
 
+    @static_layer
     def NDVI_minimum(self, geometry: RasterGeometry) -> Raster:
         filename = join(abspath(dirname(__file__)), "NDVI_minimum.tif")
-        image = rt.Raster.open(filename, geometry=geometry, resampling=self.resampling, nodata=np.nan)
+        image = self.cast(rt.Raster.open(filename, geometry=geometry, resampling=self.resampling, nodata=np.nan))
         image = rt.clip(image, -1, 1)
 
         return image
 
+    @static_layer
     def NDVI_maximum(self, geometry: RasterGeometry) -> Raster:
         filename = join(abspath(dirname(__file__)), "NDVI_maximum.tif")
-        image = rt.Raster.open(filename, geometry=geometry, resampling=self.resampling, nodata=np.nan)
+        image = self.cast(rt.Raster.open(filename, geometry=geometry, resampling=self.resampling, nodata=np.nan))
         image = rt.clip(image, -1, 1)
 
         return image
 
+    def static_sources(self) -> List[str]:
+        """
+        List the datasets the static parameters are resampled from, which key the static cache.
+        :return: list of filenames
+        """
+        sources = sorted(glob(join(abspath(dirname(__file__)), "*.tif")))
+
+        for filename in (getattr(self.GEDI_connection, "VRT_filename", None), getattr(self.ORNL_connection, "filename", None)):
+            if filename is not None:
+                sources.append(filename)
+
+        return sources
+
+    def static_layers(self, geometry: RasterGrid) -> Dict[str, Raster]:
+        """
+        Resample every static parameter to a tile grid, bypassing the static cache.
+        :param geometry: tile grid
+        :return: dictionary of static parameter rasters keyed by layer name
+        """
+        return {name: getattr(BESS, name).__wrapped__(self, geometry=geometry) for name in STATIC_LAYERS}
+
+    def warm_static_cache(self, tiles: List[str], cell_size: float = None) -> List[str]:
+        """
+        Resample the static parameters of a list of Sentinel tiles into the static cache ahead of processing.
+        :param tiles: names of Sentinel tiles
+        :param cell_size: cell size of tile grids in meters, defaults to the Sentinel tile grid
+        :return: filenames of cached tiles
+        """
+        if self.static_cache is None:
+            raise ValueError("BESS static cache is not enabled")
+
+        from sentinel_tile_grid import sentinel_tile_grid
+
+        filenames = []
+
+        for tile in tiles:
+            timer = Timer()
+            geometry = sentinel_tile_grid.grid(tile, cell_size=cell_size)
+            self.static_cache.load(geometry, self.resampling, lambda: self.static_layers(geometry))
+            filename = self.static_cache.filename(geometry, self.resampling)
+            self.logger.info(f"static parameters of tile {cl.place(tile)} cached ({cl.time(timer)} seconds): {cl.file(filename)}")
+            filenames.append(filename)
+
+        return filenames
+
+    @memoize_stage()
     def meteorology(
             self,
             date_UTC: date,
@@ -481,12 +629,14 @@ class BESS(FLiES):
         omegaS = rt.where(np.isnan(omegaS) | np.isinf(omegaS), 0, omegaS)
         omegaS = np.real(omegaS)
         # Day length
-        DL = 24.0 / np.pi * omegaS
+        DL = self.cast(24.0 / np.pi * omegaS)
         # snapshot radiation
         Ra = 1333.6 * dr * np.cos(SZA * np.pi / 180.0)
         # Daily mean radiation
+        # the sunset hour angle and daily radiation use float64 latitude near the poles and are cast afterwards
         RaDaily = 1333.6 / np.pi * dr * (omegaS * np.sin(latitude * np.pi / 180.0) * np.sin(delta)
                                          + np.cos(latitude * np.pi / 180.0) * np.cos(delta) * np.sin(omegaS))
+        RaDaily = self.cast(RaDaily)
         # clear-sky solar radiation
         Rgo = (0.75 + 2e-5 * elevation_m) * Ra  # [W m-2]
 
@@ -540,25 +690,26 @@ class BESS(FLiES):
 
         fStress = RH ** (VPD_Pa / 1000.0)
 
-        MET.Ps = Ps_Pa
-        MET.VPD = VPD_Pa
-        MET.RH = RH
-        MET.desTa = desTa
-        MET.ddesTa = ddesTa
-        MET.gamma = gamma
-        MET.Cp = Cp
-        MET.rhoa = rhoa
-        MET.epsa = epsa
-        MET.R = R
-        MET.Rc = Rc
-        MET.Rs = Rs
-        MET.SFd = SFd
-        MET.SFd2 = SFd2
-        MET.DL = DL
-        MET.Ra = Ra
-        MET.fStress = fStress
-
-        return MET
+        # an instance rather than the class with images assigned, so that the stage can be memoized
+        return MET(
+            Ps=Ps_Pa,
+            VPD=VPD_Pa,
+            RH=RH,
+            desTa=desTa,
+            ddesTa=ddesTa,
+            gamma=gamma,
+            Cp=Cp,
+            rhoa=rhoa,
+            epsa=epsa,
+            R=R,
+            Rc=Rc,
+            Rs=Rs,
+            SFd=SFd,
+            SFd2=SFd2,
+            DL=DL,
+            Ra=Ra,
+            fStress=fStress
+        )
 
     def VCmax(
             self,
@@ -611,6 +762,7 @@ class BESS(FLiES):
 
         return VCmax_C3_sun, VCmax_C4_sun, VCmax_C3_sh, VCmax_C4_sh
 
+    @memoize_stage()
     def canopy_shortwave_radiation(
             self,
             date_UTC: date,
@@ -827,15 +979,21 @@ class BESS(FLiES):
         APAR_Sh = APAR_Sh * 4.56
         self.diagnostic(APAR_Sh, "APAR_Sh", date_UTC, target)
 
-        CSR.fSun = fSun
-        CSR.APAR_Sun = APAR_Sun
-        CSR.APAR_Sh = APAR_Sh
-        CSR.ASW_Sun = ASW_Sun
-        CSR.ASW_Sh = ASW_Sh
-        CSR.ASW_Soil = ASW_Soil
-        CSR.G = G
-
-        return CSR
+        # an instance rather than the class with images assigned, so that the stage can be memoized,
+        # with the maximum carboxylation rates, which this stage does not compute, left empty
+        return CSR(
+            fSun=fSun,
+            APAR_Sun=APAR_Sun,
+            APAR_Sh=APAR_Sh,
+            ASW_Sun=ASW_Sun,
+            ASW_Sh=ASW_Sh,
+            ASW_Soil=ASW_Soil,
+            G=G,
+            Vcmax25_C3Sun=None,
+            Vcmax25_C3Sh=None,
+            Vcmax25_C4Sun=None,
+            Vcmax25_C4Sh=None
+        )
 
     def canopy_longwave_radiation(
             self,
@@ -952,12 +1110,12 @@ class BESS(FLiES):
         a = 0.83
         b = -(Je + Ji)
         c = Je * Ji
-        Jei = (-b + np.sign(b) * np.sqrt(b * b - 4.0 * a * c)) / (2.0 * a)
+        Jei = quadratic_root(a, b, c)
         Jei = np.real(Jei)
         a = 0.93
         b = -(Jei + Jc)
         c = Jei * Jc
-        Jeic = (-b + np.sign(b) * np.sqrt(b * b - 4.0 * a * c)) / (2.0 * a)
+        Jeic = quadratic_root(a, b, c)
         Jeic = np.real(Jeic)
 
         # Net assimilation
@@ -1035,12 +1193,12 @@ class BESS(FLiES):
         a = 0.98
         b = -(JC + JE)
         c = JC * JE
-        JCE = (-b + np.sign(b) * np.sqrt(b * b - 4.0 * a * c)) / (2.0 * a)
+        JCE = quadratic_root(a, b, c)
         JCE = np.real(JCE)
         a = 0.95
         b = -(JCE + JS)
         c = JCE * JS
-        JCES = (-b + np.sign(b) * np.sqrt(b * b - 4.0 * a * c)) / (2.0 * a)
+        JCES = quadratic_root(a, b, c)
         JCES = np.real(JCES)
 
         # Net assimilation
@@ -1073,7 +1231,8 @@ class BESS(FLiES):
             b0: Raster,
             flgC4: bool,
             carbon: int,
-            iter: int) -> namedtuple:
+            iter: int,
+            partition: str = None) -> namedtuple:
         """
         =============================================================================
 
@@ -1112,15 +1271,21 @@ class BESS(FLiES):
 
         EB = namedtuple('EB', 'Rn, LE, H, Tf, gs, Ci')
 
+        # sunlit and shaded diagnostics are written separately
+        if partition is None:
+            suffix = f"C{carbon}_I{iter}"
+        else:
+            suffix = f"{partition}_C{carbon}_I{iter}"
+
         # Convert factor
         cf = 0.446 * (273.15 / Tf_K) * (Ps_Pa / 101325.0)
-        self.diagnostic(cf, f"cf_C{carbon}_I{iter}", date_UTC, target)
+        self.diagnostic(cf, f"cf_{suffix}", date_UTC, target)
         # Stefan_Boltzmann_constant
         sigma = 5.670373e-8  # [W m-2 K-4] (Wiki)
 
         # Stomatal H2O conductance
         gs1 = m * RH * An / Ca + b0  # [mol m-2 s-1]
-        self.diagnostic(gs1, f"gs1_C{carbon}_I{iter}", date_UTC, target)
+        self.diagnostic(gs1, f"gs1_{suffix}", date_UTC, target)
 
         # Intercellular CO2 concentration
         Ci = Ca - 1.6 * An / gs1  # [umol./mol]
@@ -1130,15 +1295,15 @@ class BESS(FLiES):
         else:
             Ci = rt.clip(Ci, 0.5 * Ca, 0.9 * Ca)
 
-        self.diagnostic(Ci, f"Ci_C{carbon}_I{iter}", date_UTC, target)
+        self.diagnostic(Ci, f"Ci_{suffix}", date_UTC, target)
 
         # Stomatal resistance to vapour transfer from cell to leaf surface
         rs = 1.0 / (gs1 / cf * 1e-2)  # [s m-1]
-        self.diagnostic(rs, f"rs_C{carbon}_I{iter}", date_UTC, target)
+        self.diagnostic(rs, f"rs_{suffix}", date_UTC, target)
 
         # Stomatal H2O conductance
         gs2 = 1.0 / rs  # [m s-1]
-        self.diagnostic(gs2, f"gs1_C{carbon}_I{iter}", date_UTC, target)
+        self.diagnostic(gs2, f"gs2_{suffix}", date_UTC, target)
 
         # Canopy net radiation
         Rn = rt.clip(ASW + ALW - 4.0 * 0.98 * sigma * (Ta_K ** 3) * (Tf_K - Ta_K), 0, None)
@@ -1146,22 +1311,22 @@ class BESS(FLiES):
         # To reduce redundant computation
         rc = rs
         ddesTa_Rc2 = ddesTa * Rc * Rc
-        self.diagnostic(ddesTa_Rc2, f"ddesTa_Rc2_C{carbon}_I{iter}", date_UTC, target)
+        self.diagnostic(ddesTa_Rc2, f"ddesTa_Rc2_{suffix}", date_UTC, target)
         gamma_Rc_rc = gamma * (Rc + rc)
-        self.diagnostic(gamma_Rc_rc, f"gamma_Rc_rc_C{carbon}_I{iter}", date_UTC, target)
+        self.diagnostic(gamma_Rc_rc, f"gamma_Rc_rc_{suffix}", date_UTC, target)
         rhoa_Cp_gamma_Rc_rc = rhoa * Cp * gamma_Rc_rc
-        self.diagnostic(rhoa_Cp_gamma_Rc_rc, f"rhoa_Cp_gamma_Rc_rc_C{carbon}_I{iter}", date_UTC, target)
+        self.diagnostic(rhoa_Cp_gamma_Rc_rc, f"rhoa_Cp_gamma_Rc_rc_{suffix}", date_UTC, target)
 
         # Solution (Paw and Gao 1988)
         a = 1.0 / 2.0 * ddesTa_Rc2 / rhoa_Cp_gamma_Rc_rc  # Eq. (10b)
-        self.diagnostic(a, f"a_C{carbon}_I{iter}", date_UTC, target)
+        self.diagnostic(a, f"a_{suffix}", date_UTC, target)
         b = -1.0 - Rc * desTa / gamma_Rc_rc - ddesTa_Rc2 * Rn / rhoa_Cp_gamma_Rc_rc  # Eq. (10c)
-        self.diagnostic(b, f"b_C{carbon}_I{iter}", date_UTC, target)
+        self.diagnostic(b, f"b_{suffix}", date_UTC, target)
         c = rhoa * Cp / gamma_Rc_rc * VPD_Pa + desTa * Rc / gamma_Rc_rc * Rn + 1.0 / 2.0 * ddesTa_Rc2 / rhoa_Cp_gamma_Rc_rc * Rn * Rn  # Eq. (10d) in Paw and Gao (1988)
-        self.diagnostic(c, f"c_C{carbon}_I{iter}", date_UTC, target)
-        LE = (-b + np.sign(b) * np.sqrt(b * b - 4.0 * a * c)) / (2.0 * a)  # Eq. (10a)
+        self.diagnostic(c, f"c_{suffix}", date_UTC, target)
+        LE = quadratic_root(a, b, c)  # Eq. (10a)
         LE = np.real(LE)
-        self.diagnostic(LE, f"LE_raw_C{carbon}_I{iter}", date_UTC, target)
+        self.diagnostic(LE, f"LE_raw_{suffix}", date_UTC, target)
 
         # Constraints
         # LE[LE > Rn] = Rn[LE > Rn]
@@ -1173,11 +1338,11 @@ class BESS(FLiES):
 
         # Update
         H = rt.clip(Rn - LE, 0, Rn)
-        self.diagnostic(Rc, f"Rc_C{carbon}_I{iter}", date_UTC, target)
-        self.diagnostic(rhoa, f"rhoa_C{carbon}_I{iter}", date_UTC, target)
-        self.diagnostic(Cp, f"Cp_C{carbon}_I{iter}", date_UTC, target)
+        self.diagnostic(Rc, f"Rc_{suffix}", date_UTC, target)
+        self.diagnostic(rhoa, f"rhoa_{suffix}", date_UTC, target)
+        self.diagnostic(Cp, f"Cp_{suffix}", date_UTC, target)
         dT = rt.clip(Rc / (rhoa * Cp) * H, -20, 20)  # Eq. (6)
-        self.diagnostic(dT, f"dT_C{carbon}_I{iter}", date_UTC, target)
+        self.diagnostic(dT, f"dT_{suffix}", date_UTC, target)
         Tf_K = Ta_K + dT
 
         EB.Rn = Rn
@@ -1230,6 +1395,278 @@ class BESS(FLiES):
 
         return SOIL
 
+    def carbon_water_flux_pass(
+            self,
+            date_UTC: date,
+            target: str,
+            state: Dict[str, Union[Raster, np.ndarray]],
+            inputs: Dict[str, Union[Raster, np.ndarray, float]],
+            C4: bool,
+            iter: int) -> Dict[str, Union[Raster, np.ndarray]]:
+        """
+        Run one pass of the carbon and water flux iteration.
+        :param date_UTC: date of the calculation
+        :param target: name of the target
+        :param state: sunlit, shaded and soil temperatures, intercellular CO2 and fluxes from the previous pass
+        :param inputs: inputs of the iteration, either rasters or 1-D arrays of the same pixels as the state
+        :param C4: process for C4 plants instead of C3
+        :param iter: number of the pass
+        :return: state after this pass
+        """
+        if C4:
+            carbon = 4
+        else:
+            carbon = 3
+
+        epsf = 0.98
+        epss = 0.96
+
+        Tf_Sun_K = state["Tf_Sun_K"]
+        Tf_Sh_K = state["Tf_Sh_K"]
+        Ts_K = state["Ts_K"]
+        Tf_K = state["Tf_K"]
+        Ci_Sun = state["Ci_Sun"]
+        Ci_Sh = state["Ci_Sh"]
+        An_Sun = state["An_Sun"]
+        An_Sh = state["An_Sh"]
+        Rn_Sun = state["Rn_Sun"]
+        Rn_Sh = state["Rn_Sh"]
+        Rn_Soil = state["Rn_Soil"]
+        LE_Sun = state["LE_Sun"]
+        LE_Sh = state["LE_Sh"]
+        LE_Soil = state["LE_Soil"]
+        H_Sun = state["H_Sun"]
+
+        LAI = inputs["LAI"]
+        SZA = inputs["SZA"]
+        Ta_K = inputs["Ta_K"]
+        epsa = inputs["epsa"]
+        APAR_Sun = inputs["APAR_Sun"]
+        APAR_Sh = inputs["APAR_Sh"]
+        ASW_Sun = inputs["ASW_Sun"]
+        ASW_Sh = inputs["ASW_Sh"]
+        ASW_Soil = inputs["ASW_Soil"]
+        Vcmax25_Sun = inputs["Vcmax25_Sun"]
+        Vcmax25_Sh = inputs["Vcmax25_Sh"]
+        Ps_Pa = inputs["Ps_Pa"]
+        alf = inputs["alf"]
+        Ca = inputs["Ca"]
+        RH = inputs["RH"]
+        VPD_Pa = inputs["VPD_Pa"]
+        desTa = inputs["desTa"]
+        ddesTa = inputs["ddesTa"]
+        gamma = inputs["gamma"]
+        Cp = inputs["Cp"]
+        rhoa = inputs["rhoa"]
+        Rc = inputs["Rc"]
+        Rs = inputs["Rs"]
+        m = inputs["m"]
+        b0 = inputs["b0"]
+        G = inputs["G"]
+        fSun = inputs["fSun"]
+
+        # Longwave radiation
+        # CLR:[ALW_Sun, ALW_Sh, ALW_Soil, Ls, La]
+        CLR = self.canopy_longwave_radiation(
+            LAI=LAI,  # leaf area index (LAI) [-]
+            SZA=SZA,  # solar zenith angle (degrees)
+            Ts_K=Ts_K,  # soil temperature (Ts) [K]
+            Tf_K=Tf_K,  # foliage temperature (Tf) [K]
+            Ta_K=Ta_K,  # air temperature (Ta) [K]
+            epsa=epsa,  # clear-sky emissivity (epsa) [-]
+            epsf=epsf,  # foliage emissivity (epsf) [-]
+            epss=epss  # soil emissivity (epss) [-],
+        )
+
+        ALW_Sun = CLR.ALW_Sun
+        self.diagnostic(ALW_Sun, f"ALW_Sun_C{carbon}_I{iter}", date_UTC, target)
+        ALW_Sh = CLR.ALW_Sh
+        self.diagnostic(ALW_Sh, f"ALW_Sh_C{carbon}_I{iter}", date_UTC, target)
+        ALW_Soil = CLR.ALW_Soil
+        self.diagnostic(ALW_Soil, f"ALW_Soil_C{carbon}_I{iter}", date_UTC, target)
+        La = CLR.La
+        self.diagnostic(La, f"La_C{carbon}_I{iter}", date_UTC, target)
+        Ls = CLR.Ls
+        self.diagnostic(Ls, f"LS_C{carbon}_I{iter}", date_UTC, target)
+        Lf = CLR.Lf
+        self.diagnostic(Lf, f"Lf_C{carbon}_I{iter}", date_UTC, target)
+
+        # Photosynthesis (sunlit)
+        if C4:
+            An_Sun = self.C4_photosynthesis(
+                Tf_K=Tf_Sun_K,  # sunlit leaf temperature (Tf) [K]
+                Ci=Ci_Sun,  # sunlit intercellular CO2 concentration (Ci) [umol mol-1]
+                APAR=APAR_Sun,  # sunlit absorbed photosynthetically active radiation (APAR) [umol m-2 s-1]
+                Vcmax25=Vcmax25_Sun  # sunlit maximum carboxylation rate at 25C (Vcmax25) [umol m-2 s-1]
+            )
+        else:
+            An_Sun = self.C3_photosynthesis(
+                Tf_K=Tf_Sun_K,  # sunlit leaf temperature (Tf) [K]
+                Ci=Ci_Sun,  # sunlit intercellular CO2 concentration (Ci) [umol mol-1]
+                APAR=APAR_Sun,  # sunlit absorbed photosynthetically active radiation (APAR) [umol m-2 s-1]
+                Vcmax25=Vcmax25_Sun,  # sunlit maximum carboxylation rate at 25C (Vcmax25) [umol m-2 s-1]
+                Ps_Pa=Ps_Pa,  # surface pressure (Ps) [Pa]
+                alf=alf  # TODO document alf
+            )
+
+        self.diagnostic(An_Sun, f"An_Sun_C{carbon}_I{iter}", date_UTC, target)
+
+        # Energy balance (sunlit)
+        # EB:[Rn, LE, H, Tf, gs, Ci]
+        EB_Sun = self.energy_balance(
+            date_UTC=date_UTC,
+            target=target,
+            An=An_Sun,  # net assimulation (An) [umol m-2 s-1]
+            ASW=ASW_Sun,  # total absorbed shortwave radiation by sunlit canopy (ASW) [umol m-2 s-1]
+            ALW=ALW_Sun,  # total absorbed longwave radiation by sunlit canopy (ALW) [umol m-2 s-1]
+            Tf_K=Tf_Sun_K,  # sunlit leaf temperature (Tf) [K]
+            Ps_Pa=Ps_Pa,  # surface pressure (Ps) [Pa]
+            Ca=Ca,  # ambient CO2 concentration (Ca) [umol mol-1]
+            Ta_K=Ta_K,  # air temperature (Ta) [K]
+            RH=RH,  # relative humidity (RH) [-]
+            VPD_Pa=VPD_Pa,  # water vapour deficit (VPD) [Pa]
+            desTa=desTa,  # 1st derivative of saturated vapour pressure (desTa)
+            ddesTa=ddesTa,  # 2nd derivative of saturated vapour pressure (ddesTa)
+            gamma=gamma,  # psychrometric constant (gamma) [pa K-1]
+            Cp=Cp,  # TODO document specific heat
+            rhoa=rhoa,  # air density (rhoa) [kg m-3]
+            Rc=Rc,  # TODO is this Ra or Rc in Ball-Berry?
+            m=m,  # Ball-Berry slope (m) [-]
+            b0=b0,  # Ball-Berry intercept (b0) [-]
+            flgC4=C4,  # process for C4 plants instead of C3
+            carbon=carbon,
+            iter=iter,
+            partition="Sun"
+        )
+
+        # Get EB_Sun values
+        Rn_Sun = rt.where(np.isnan(EB_Sun.Rn), Rn_Sun, EB_Sun.Rn)
+        self.diagnostic(Rn_Sun, f"Rn_Sun_C{carbon}_I{iter}", date_UTC, target)
+        LE_Sun = rt.where(np.isnan(EB_Sun.LE), LE_Sun, EB_Sun.LE)
+        self.diagnostic(LE_Sun, f"LE_Sun_C{carbon}_I{iter}", date_UTC, target)
+        H_Sun = rt.where(np.isnan(EB_Sun.H), H_Sun, EB_Sun.H)
+        self.diagnostic(H_Sun, f"H_Sun_C{carbon}_I{iter}", date_UTC, target)
+        Tf_Sun_K = rt.where(np.isnan(EB_Sun.Tf), Tf_Sun_K, EB_Sun.Tf)
+        self.diagnostic(Tf_Sun_K, f"Tf_Sun_K_C{carbon}_I{iter}", date_UTC, target)
+        # gs_Sun = rt.where(np.isnan(EB_Sun.gs), gs_Sun, EB_Sun.gs)
+        # self.diagnostic(gs_Sun, f"gs_Sun_C{carbon}_I{iter}", date_UTC, target)
+        Ci_Sun = rt.where(np.isnan(EB_Sun.Ci), Ci_Sun, EB_Sun.Ci)
+        self.diagnostic(Ci_Sun, f"Ci_Sun_C{carbon}_I{iter}", date_UTC, target)
+
+        # Photosynthesis (shade)
+        if C4:
+            An_Sh = self.C4_photosynthesis(
+                Tf_K=Tf_Sh_K,  # shaded leaf temperature (Tf) [K]
+                Ci=Ci_Sh,  # shaded intercellular CO2 concentration (Ci) [umol mol-1]
+                APAR=APAR_Sh,  # shaded absorbed photosynthetically active radiation (APAR) [umol m-2 s-1]
+                Vcmax25=Vcmax25_Sh  # shaded maximum carboxylation rate at 25C (Vcmax25) [umol m-2 s-1]
+            )
+        else:
+            An_Sh = self.C3_photosynthesis(
+                Tf_K=Tf_Sh_K,  # shaded leaf temperature (Tf) [K]
+                Ci=Ci_Sh,  # shaed intercellular CO2 concentration (Ci) [umol mol-1]
+                APAR=APAR_Sh,  # shaded absorbed photosynthetically active radiation (APAR) [umol m-2 s-1]
+                Vcmax25=Vcmax25_Sh,  # shaded maximum carboxylation rate at 25C (Vcmax25) [umol m-2 s-1]
+                Ps_Pa=Ps_Pa,  # surface pressure (Ps) [Pa]
+                alf=alf  # TODO document alf
+            )
+
+        self.diagnostic(An_Sh, f"An_Sh_C{carbon}_I{iter}", date_UTC, target)
+
+        # Energy balance (shade)
+        # EB_Sh:[Rn_Sh, LE_Sh, H_Sh, Tf_Sh, gs_Sh, Ci_Sh]
+        EB_Sh = self.energy_balance(
+            date_UTC=date_UTC,
+            target=target,
+            An=An_Sh,  # net assimulation (An) [umol m-2 s-1]
+            ASW=ASW_Sh,  # total absorbed shortwave radiation by shaded canopy (ASW) [umol m-2 s-1]
+            ALW=CLR.ALW_Sh,  # total absorbed longwave radiation by shaded canopy (ALW) [umol m-2 s-1]
+            Tf_K=Tf_Sh_K,  # shaded leaf temperature (Tf) [K]
+            Ps_Pa=Ps_Pa,  # surface pressure (Ps) [Pa]
+            Ca=Ca,  # ambient CO2 concentration (Ca) [umol mol-1]
+            Ta_K=Ta_K,  # air temperature (Ta) [K]
+            RH=RH,  # relative humidity (RH) [-]
+            VPD_Pa=VPD_Pa,  # water vapour deficit (VPD) [Pa]
+            desTa=desTa,  # 1st derivative of saturated vapour pressure (desTa)
+            ddesTa=ddesTa,  # 2nd derivative of saturated vapour pressure (ddesTa)
+            gamma=gamma,  # psychrometric constant (gamma) [pa K-1]
+            Cp=Cp,  # TODO document specific heat
+            rhoa=rhoa,  # air density (rhoa) [kg m-3]
+            Rc=Rc,  # TODO is this Ra or Rc in Ball-Berry?
+            m=m,  # Ball-Berry slope (m) [-]
+            b0=b0,  # Ball-Berry intercept (b0) [-]
+            flgC4=C4,  # process for C4 plants instead of C3
+            carbon=carbon,
+            iter=iter,
+            partition="Sh"
+        )
+
+        # Get EB_Sh values
+        Rn_Sh = rt.where(np.isnan(EB_Sh.Rn), Rn_Sh, EB_Sh.Rn)
+        self.diagnostic(Rn_Sh, f"Rn_Sh_C{carbon}_I{iter}", date_UTC, target)
+        LE_Sh = rt.where(np.isnan(EB_Sh.LE), LE_Sh, EB_Sh.LE)
+        self.diagnostic(LE_Sh, f"LE_Sh_C{carbon}_I{iter}", date_UTC, target)
+        # H_Sh = rt.where(np.isnan(EB_Sh.H), H_Sh, EB_Sh.H)
+        # self.diagnostic(H_Sh, f"H_Sh_C{carbon}_I{iter}", date_UTC, target)
+        Tf_Sh_K = rt.where(np.isnan(EB_Sh.Tf), Tf_Sh_K, EB_Sh.Tf)
+        self.diagnostic(Tf_Sh_K, f"Tf_Sh_K_C{carbon}_I{iter}", date_UTC, target)
+        # gs_Sh = rt.where(np.isnan(EB_Sh.gs), gs_Sh, EB_Sh.gs)
+        # self.diagnostic(gs_Sh, f"gs_Sh_C{carbon}_I{iter}", date_UTC, target)
+        Ci_Sh = rt.where(np.isnan(EB_Sh.Ci), Ci_Sh, EB_Sh.Ci)
+        self.diagnostic(Ci_Sh, f"Ci_Sh_C{carbon}_I{iter}", date_UTC, target)
+
+        # Soil
+        # SOIL:[Rn, LE, H, Ts]
+        SOIL = self.soil(
+            Ts=Ts_K,
+            Ta=Ta_K,
+            G=G,
+            VPD=VPD_Pa,
+            RH=RH,
+            gamma=gamma,
+            Cp=Cp,
+            rhoa=rhoa,
+            desTa=desTa,
+            Rs=Rs,
+            ASW_Soil=ASW_Soil,
+            ALW_Soil=CLR.ALW_Soil,
+            Ls=CLR.Ls,
+            epsa=epsa
+        )
+
+        Rn_Soil = rt.where(np.isnan(SOIL.Rn), Rn_Soil, SOIL.Rn)
+        self.diagnostic(Rn_Soil, f"Rn_Soil_C{carbon}_I{iter}", date_UTC, target)
+        LE_Soil = rt.where(np.isnan(SOIL.LE), LE_Soil, SOIL.LE)
+        self.diagnostic(LE_Soil, f"LE_Soil_C{carbon}_I{iter}", date_UTC, target)
+        # H_Soil = rt.where(np.isnan(SOIL.H), H_Soil, SOIL.H)
+        # self.diagnostic(H_Soil, f"H_Soil_C{carbon}_I{iter}", date_UTC, target)
+        Ts_K = rt.where(np.isnan(SOIL.Ts), Ts_K, SOIL.Ts)
+        self.diagnostic(Ts_K, f"Ts_K_C{carbon}_I{iter}", date_UTC, target)
+
+        # Composite components
+        # Tf = (Tf_Sun.^4.*fSun + Tf_Sh.^4.*(1-fSun)).^0.25;
+        Tf_K_new = (((Tf_Sun_K ** 4) * fSun + (Tf_Sh_K ** 4) * (1 - fSun)) ** 0.25)
+        Tf_K = rt.where(np.isnan(Tf_K_new), Tf_K, Tf_K_new)
+        self.diagnostic(Tf_K, f"Tf_K_C{carbon}_I{iter}", date_UTC, target)
+
+        return {
+            "Tf_Sun_K": Tf_Sun_K,
+            "Tf_Sh_K": Tf_Sh_K,
+            "Ts_K": Ts_K,
+            "Tf_K": Tf_K,
+            "Ci_Sun": Ci_Sun,
+            "Ci_Sh": Ci_Sh,
+            "An_Sun": An_Sun,
+            "An_Sh": An_Sh,
+            "Rn_Sun": Rn_Sun,
+            "Rn_Sh": Rn_Sh,
+            "Rn_Soil": Rn_Soil,
+            "LE_Sun": LE_Sun,
+            "LE_Sh": LE_Sh,
+            "LE_Soil": LE_Soil,
+            "H_Sun": H_Sun
+        }
+
     def carbon_water_fluxes(
             self,
             date_UTC: date,
@@ -1272,6 +1709,53 @@ class BESS(FLiES):
         else:
             carbon = 3
 
+        if self.fused_kernel:
+            # the fused kernel skips the diagnostics of each iteration
+            self.logger.info(f"running fused BESS C{carbon} carbon and water flux kernel for {cl.val(self.passes)} passes")
+
+            outputs = kernel.carbon_water_fluxes(
+                shape=ST_K.shape,
+                passes=self.passes,
+                C4=C4,
+                initialize_Tf_with_ST=self.initialize_Tf_with_ST,
+                convergence_tolerance=self.convergence_tolerance,
+                ST_K=ST_K,
+                LAI=LAI,
+                Ta_K=Ta_K,
+                APAR_Sun=APAR_Sun,
+                APAR_Sh=APAR_Sh,
+                ASW_Sun=ASW_Sun,
+                ASW_Sh=ASW_Sh,
+                Vcmax25_Sun=Vcmax25_Sun,
+                Vcmax25_Sh=Vcmax25_Sh,
+                m=m,
+                b0=b0 * fStress,
+                fSun=fSun,
+                ASW_Soil=ASW_Soil,
+                G=G,
+                SZA=SZA,
+                Ca=Ca,
+                Ps_Pa=Ps_Pa,
+                gamma=gamma,
+                Cp=Cp,
+                rhoa=rhoa,
+                VPD_Pa=VPD_Pa,
+                RH=RH,
+                desTa=desTa,
+                ddesTa=ddesTa,
+                epsa=epsa,
+                Rc=Rc,
+                Rs=Rs,
+                alf=alf
+            )
+
+            for name, array in outputs.items():
+                image = Raster(array, geometry=ST_K.geometry)
+                self.diagnostic(image, f"{name}_C{carbon}", date_UTC, target)
+                setattr(CWF, name, image)
+
+            return CWF
+
             # Constraints
         if C4:
             GPP_max = 50
@@ -1334,190 +1818,69 @@ class BESS(FLiES):
         H_Soil = Ts_K * 0
         gs_Soil = Ts_K * 0
 
-        # Iteration
-        for iter in range(1, self.passes + 1):
-
-            # Longwave radiation
-            # CLR:[ALW_Sun, ALW_Sh, ALW_Soil, Ls, La]
-            CLR = self.canopy_longwave_radiation(
-                LAI=LAI,  # leaf area index (LAI) [-]
-                SZA=SZA,  # solar zenith angle (degrees)
-                Ts_K=Ts_K,  # soil temperature (Ts) [K]
-                Tf_K=Tf_K,  # foliage temperature (Tf) [K]
-                Ta_K=Ta_K,  # air temperature (Ta) [K]
-                epsa=epsa,  # clear-sky emissivity (epsa) [-]
-                epsf=epsf,  # foliage emissivity (epsf) [-]
-                epss=epss  # soil emissivity (epss) [-],
-            )
-
-            ALW_Sun = CLR.ALW_Sun
-            self.diagnostic(ALW_Sun, f"ALW_Sun_C{carbon}_I{iter}", date_UTC, target)
-            ALW_Sh = CLR.ALW_Sh
-            self.diagnostic(ALW_Sh, f"ALW_Sh_C{carbon}_I{iter}", date_UTC, target)
-            ALW_Soil = CLR.ALW_Soil
-            self.diagnostic(ALW_Soil, f"ALW_Soil_C{carbon}_I{iter}", date_UTC, target)
-            La = CLR.La
-            self.diagnostic(La, f"La_C{carbon}_I{iter}", date_UTC, target)
-            Ls = CLR.Ls
-            self.diagnostic(Ls, f"LS_C{carbon}_I{iter}", date_UTC, target)
-            Lf = CLR.Lf
-            self.diagnostic(Lf, f"Lf_C{carbon}_I{iter}", date_UTC, target)
-
-            # Photosynthesis (sunlit)
-            if C4:
-                An_Sun = self.C4_photosynthesis(
-                    Tf_K=Tf_Sun_K,  # sunlit leaf temperature (Tf) [K]
-                    Ci=Ci_Sun,  # sunlit intercellular CO2 concentration (Ci) [umol mol-1]
-                    APAR=APAR_Sun,  # sunlit absorbed photosynthetically active radiation (APAR) [umol m-2 s-1]
-                    Vcmax25=Vcmax25_Sun  # sunlit maximum carboxylation rate at 25C (Vcmax25) [umol m-2 s-1]
-                )
-            else:
-                An_Sun = self.C3_photosynthesis(
-                    Tf_K=Tf_Sun_K,  # sunlit leaf temperature (Tf) [K]
-                    Ci=Ci_Sun,  # sunlit intercellular CO2 concentration (Ci) [umol mol-1]
-                    APAR=APAR_Sun,  # sunlit absorbed photosynthetically active radiation (APAR) [umol m-2 s-1]
-                    Vcmax25=Vcmax25_Sun,  # sunlit maximum carboxylation rate at 25C (Vcmax25) [umol m-2 s-1]
-                    Ps_Pa=Ps_Pa,  # surface pressure (Ps) [Pa]
-                    alf=alf  # TODO document alf
-                )
-
-            self.diagnostic(An_Sun, f"An_Sun_C{carbon}_I{iter}", date_UTC, target)
-
-            # Energy balance (sunlit)
-            # EB:[Rn, LE, H, Tf, gs, Ci]
-            EB_Sun = self.energy_balance(
-                date_UTC=date_UTC,
-                target=target,
-                An=An_Sun,  # net assimulation (An) [umol m-2 s-1]
-                ASW=ASW_Sun,  # total absorbed shortwave radiation by sunlit canopy (ASW) [umol m-2 s-1]
-                ALW=ALW_Sun,  # total absorbed longwave radiation by sunlit canopy (ALW) [umol m-2 s-1]
-                Tf_K=Tf_Sun_K,  # sunlit leaf temperature (Tf) [K]
-                Ps_Pa=Ps_Pa,  # surface pressure (Ps) [Pa]
-                Ca=Ca,  # ambient CO2 concentration (Ca) [umol mol-1]
-                Ta_K=Ta_K,  # air temperature (Ta) [K]
-                RH=RH,  # relative humidity (RH) [-]
-                VPD_Pa=VPD_Pa,  # water vapour deficit (VPD) [Pa]
-                desTa=desTa,  # 1st derivative of saturated vapour pressure (desTa)
-                ddesTa=ddesTa,  # 2nd derivative of saturated vapour pressure (ddesTa)
-                gamma=gamma,  # psychrometric constant (gamma) [pa K-1]
-                Cp=Cp,  # TODO document specific heat
-                rhoa=rhoa,  # air density (rhoa) [kg m-3]
-                Rc=Rc,  # TODO is this Ra or Rc in Ball-Berry?
-                m=m,  # Ball-Berry slope (m) [-]
-                b0=b0,  # Ball-Berry intercept (b0) [-]
-                flgC4=C4,  # process for C4 plants instead of C3
-                carbon=carbon,
-                iter=iter
-            )
-
-            # Get EB_Sun values
-            Rn_Sun = rt.where(np.isnan(EB_Sun.Rn), Rn_Sun, EB_Sun.Rn)
-            self.diagnostic(Rn_Sun, f"Rn_Sun_C{carbon}_I{iter}", date_UTC, target)
-            LE_Sun = rt.where(np.isnan(EB_Sun.LE), LE_Sun, EB_Sun.LE)
-            self.diagnostic(LE_Sun, f"LE_Sun_C{carbon}_I{iter}", date_UTC, target)
-            H_Sun = rt.where(np.isnan(EB_Sun.H), H_Sun, EB_Sun.H)
-            self.diagnostic(H_Sun, f"H_Sun_C{carbon}_I{iter}", date_UTC, target)
-            Tf_Sun_K = rt.where(np.isnan(EB_Sun.Tf), Tf_Sun_K, EB_Sun.Tf)
-            self.diagnostic(Tf_Sun_K, f"Tf_Sun_K_C{carbon}_I{iter}", date_UTC, target)
-            # gs_Sun = rt.where(np.isnan(EB_Sun.gs), gs_Sun, EB_Sun.gs)
-            # self.diagnostic(gs_Sun, f"gs_Sun_C{carbon}_I{iter}", date_UTC, target)
-            Ci_Sun = rt.where(np.isnan(EB_Sun.Ci), Ci_Sun, EB_Sun.Ci)
-            self.diagnostic(Ci_Sun, f"Ci_Sun_C{carbon}_I{iter}", date_UTC, target)
-
-            # Photosynthesis (shade)
-            if C4:
-                An_Sh = self.C4_photosynthesis(
-                    Tf_K=Tf_Sh_K,  # shaded leaf temperature (Tf) [K]
-                    Ci=Ci_Sh,  # shaded intercellular CO2 concentration (Ci) [umol mol-1]
-                    APAR=APAR_Sh,  # shaded absorbed photosynthetically active radiation (APAR) [umol m-2 s-1]
-                    Vcmax25=Vcmax25_Sh  # shaded maximum carboxylation rate at 25C (Vcmax25) [umol m-2 s-1]
-                )
-            else:
-                An_Sh = self.C3_photosynthesis(
-                    Tf_K=Tf_Sh_K,  # shaded leaf temperature (Tf) [K]
-                    Ci=Ci_Sh,  # shaed intercellular CO2 concentration (Ci) [umol mol-1]
-                    APAR=APAR_Sh,  # shaded absorbed photosynthetically active radiation (APAR) [umol m-2 s-1]
-                    Vcmax25=Vcmax25_Sh,  # shaded maximum carboxylation rate at 25C (Vcmax25) [umol m-2 s-1]
-                    Ps_Pa=Ps_Pa,  # surface pressure (Ps) [Pa]
-                    alf=alf  # TODO document alf
-                )
-
-            self.diagnostic(An_Sh, f"An_Sh_C{carbon}_I{iter}", date_UTC, target)
-
-            # Energy balance (shade)
-            # EB_Sh:[Rn_Sh, LE_Sh, H_Sh, Tf_Sh, gs_Sh, Ci_Sh]
-            EB_Sh = self.energy_balance(
-                date_UTC=date_UTC,
-                target=target,
-                An=An_Sh,  # net assimulation (An) [umol m-2 s-1]
-                ASW=ASW_Sh,  # total absorbed shortwave radiation by shaded canopy (ASW) [umol m-2 s-1]
-                ALW=CLR.ALW_Sh,  # total absorbed longwave radiation by shaded canopy (ALW) [umol m-2 s-1]
-                Tf_K=Tf_Sh_K,  # shaded leaf temperature (Tf) [K]
-                Ps_Pa=Ps_Pa,  # surface pressure (Ps) [Pa]
-                Ca=Ca,  # ambient CO2 concentration (Ca) [umol mol-1]
-                Ta_K=Ta_K,  # air temperature (Ta) [K]
-                RH=RH,  # relative humidity (RH) [-]
-                VPD_Pa=VPD_Pa,  # water vapour deficit (VPD) [Pa]
-                desTa=desTa,  # 1st derivative of saturated vapour pressure (desTa)
-                ddesTa=ddesTa,  # 2nd derivative of saturated vapour pressure (ddesTa)
-                gamma=gamma,  # psychrometric constant (gamma) [pa K-1]
-                Cp=Cp,  # TODO document specific heat
-                rhoa=rhoa,  # air density (rhoa) [kg m-3]
-                Rc=Rc,  # TODO is this Ra or Rc in Ball-Berry?
-                m=m,  # Ball-Berry slope (m) [-]
-                b0=b0,  # Ball-Berry intercept (b0) [-]
-                flgC4=C4,  # process for C4 plants instead of C3
-                carbon=carbon,
-                iter=iter
-            )
+        state = {
+            "Tf_Sun_K": Tf_Sun_K,
+            "Tf_Sh_K": Tf_Sh_K,
+            "Ts_K": Ts_K,
+            "Tf_K": Tf_K,
+            "Ci_Sun": Ci_Sun,
+            "Ci_Sh": Ci_Sh,
+            "An_Sun": An_Sun,
+            "An_Sh": An_Sh,
+            "Rn_Sun": Rn_Sun,
+            "Rn_Sh": Rn_Sh,
+            "Rn_Soil": Rn_Soil,
+            "LE_Sun": LE_Sun,
+            "LE_Sh": LE_Sh,
+            "LE_Soil": LE_Soil,
+            "H_Sun": H_Sun
+        }
+
+        inputs = {
+            "LAI": LAI,
+            "SZA": SZA,
+            "Ta_K": Ta_K,
+            "epsa": epsa,
+            "APAR_Sun": APAR_Sun,
+            "APAR_Sh": APAR_Sh,
+            "ASW_Sun": ASW_Sun,
+            "ASW_Sh": ASW_Sh,
+            "ASW_Soil": ASW_Soil,
+            "Vcmax25_Sun": Vcmax25_Sun,
+            "Vcmax25_Sh": Vcmax25_Sh,
+            "Ps_Pa": Ps_Pa,
+            "alf": alf,
+            "Ca": Ca,
+            "RH": RH,
+            "VPD_Pa": VPD_Pa,
+            "desTa": desTa,
+            "ddesTa": ddesTa,
+            "gamma": gamma,
+            "Cp": Cp,
+            "rhoa": rhoa,
+            "Rc": Rc,
+            "Rs": Rs,
+            "m": m,
+            "b0": b0,
+            "G": G,
+            "fSun": fSun
+        }
 
-            # Get EB_Sh values
-            Rn_Sh = rt.where(np.isnan(EB_Sh.Rn), Rn_Sh, EB_Sh.Rn)
-            self.diagnostic(Rn_Sh, f"Rn_Sh_C{carbon}_I{iter}", date_UTC, target)
-            LE_Sh = rt.where(np.isnan(EB_Sh.LE), LE_Sh, EB_Sh.LE)
-            self.diagnostic(LE_Sh, f"LE_Sh_C{carbon}_I{iter}", date_UTC, target)
-            # H_Sh = rt.where(np.isnan(EB_Sh.H), H_Sh, EB_Sh.H)
-            # self.diagnostic(H_Sh, f"H_Sh_C{carbon}_I{iter}", date_UTC, target)
-            Tf_Sh_K = rt.where(np.isnan(EB_Sh.Tf), Tf_Sh_K, EB_Sh.Tf)
-            self.diagnostic(Tf_Sh_K, f"Tf_Sh_K_C{carbon}_I{iter}", date_UTC, target)
-            # gs_Sh = rt.where(np.isnan(EB_Sh.gs), gs_Sh, EB_Sh.gs)
-            # self.diagnostic(gs_Sh, f"gs_Sh_C{carbon}_I{iter}", date_UTC, target)
-            Ci_Sh = rt.where(np.isnan(EB_Sh.Ci), Ci_Sh, EB_Sh.Ci)
-            self.diagnostic(Ci_Sh, f"Ci_Sh_C{carbon}_I{iter}", date_UTC, target)
-
-            # Soil
-            # SOIL:[Rn, LE, H, Ts]
-            SOIL = self.soil(
-                Ts=Ts_K,
-                Ta=Ta_K,
-                G=G,
-                VPD=VPD_Pa,
-                RH=RH,
-                gamma=gamma,
-                Cp=Cp,
-                rhoa=rhoa,
-                desTa=desTa,
-                Rs=Rs,
-                ASW_Soil=ASW_Soil,
-                ALW_Soil=CLR.ALW_Soil,
-                Ls=CLR.Ls,
-                epsa=epsa
-            )
+        # Iteration
+        if self.convergence_tolerance is None:
+            for iter in range(1, self.passes + 1):
+                state = self.carbon_water_flux_pass(date_UTC, target, state, inputs, C4, iter)
+        else:
+            state = self.carbon_water_fluxes_active_set(date_UTC, target, state, inputs, C4)
 
-            Rn_Soil = rt.where(np.isnan(SOIL.Rn), Rn_Soil, SOIL.Rn)
-            self.diagnostic(Rn_Soil, f"Rn_Soil_C{carbon}_I{iter}", date_UTC, target)
-            LE_Soil = rt.where(np.isnan(SOIL.LE), LE_Soil, SOIL.LE)
-            self.diagnostic(LE_Soil, f"LE_Soil_C{carbon}_I{iter}", date_UTC, target)
-            # H_Soil = rt.where(np.isnan(SOIL.H), H_Soil, SOIL.H)
-            # self.diagnostic(H_Soil, f"H_Soil_C{carbon}_I{iter}", date_UTC, target)
-            Ts_K = rt.where(np.isnan(SOIL.Ts), Ts_K, SOIL.Ts)
-            self.diagnostic(Ts_K, f"Ts_K_C{carbon}_I{iter}", date_UTC, target)
-
-            # Composite components
-            # Tf = (Tf_Sun.^4.*fSun + Tf_Sh.^4.*(1-fSun)).^0.25;
-            Tf_K_new = (((Tf_Sun_K ** 4) * fSun + (Tf_Sh_K ** 4) * (1 - fSun)) ** 0.25)
-            Tf_K = rt.where(np.isnan(Tf_K_new), Tf_K, Tf_K_new)
-            self.diagnostic(Tf_K, f"Tf_K_C{carbon}_I{iter}", date_UTC, target)
+        An_Sun = state["An_Sun"]
+        An_Sh = state["An_Sh"]
+        Rn_Sun = state["Rn_Sun"]
+        Rn_Sh = state["Rn_Sh"]
+        Rn_Soil = state["Rn_Soil"]
+        LE_Sun = state["LE_Sun"]
+        LE_Sh = state["LE_Sh"]
+        LE_Soil = state["LE_Soil"]
 
         self.diagnostic(LE_Soil, f"LE_soil_C{carbon}", date_UTC, target)
         LE_canopy = rt.clip(LE_Sun + LE_Sh, 0, 1000)
@@ -1552,9 +1915,166 @@ class BESS(FLiES):
 
         return CWF
 
+    def carbon_water_fluxes_active_set(
+            self,
+            date_UTC: date,
+            target: str,
+            state: Dict[str, Raster],
+            inputs: Dict[str, Union[Raster, float]],
+            C4: bool) -> Dict[str, Raster]:
+        """
+        Run the carbon and water flux iteration only on pixels that have not converged.
+        Valid pixels are compacted into 1-D arrays, and after each pass the pixels whose foliage and soil temperatures
+        changed by less than the convergence tolerance are dropped from the active set.
+        Pixels without an initial temperature, such as masked water and cloud, are never iterated.
+        :param date_UTC: date of the calculation
+        :param target: name of the target
+        :param state: initial state of the iteration
+        :param inputs: inputs of the iteration
+        :param C4: process for C4 plants instead of C3
+        :return: state after the iteration
+        """
+        geometry = state["Tf_K"].geometry
+        shape = state["Tf_K"].shape
+        full_state = {name: np.array(np.broadcast_to(value, shape)).ravel() for name, value in state.items()}
+        active = np.flatnonzero(~np.isnan(full_state["Tf_K"]))
+        active_state = {name: value[active] for name, value in full_state.items()}
+
+        # scalar inputs are shared by every pixel
+        active_inputs = {
+            name: value if np.ndim(value) == 0 else np.asarray(np.broadcast_to(value, shape)).ravel()[active]
+            for name, value
+            in inputs.items()
+        }
+
+        for iter in range(1, self.passes + 1):
+            if active.size == 0:
+                break
+
+            active_percent = 100 * active.size / len(full_state["Tf_K"])
+            self.logger.info(
+                f"BESS C{4 if C4 else 3} pass {cl.val(iter)} / {cl.val(self.passes)} "
+                f"active pixels: {cl.val(active.size)} ({cl.val(f'{active_percent:0.2f}%')})")
+
+            with suppress_diagnostics():
+                updated_state = self.carbon_water_flux_pass(date_UTC, target, active_state, active_inputs, C4, iter)
+
+            updated_state = {name: np.asarray(value) for name, value in updated_state.items()}
+
+            for name, value in updated_state.items():
+                full_state[name][active] = value
+
+            change = np.fmax(
+                np.abs(updated_state["Tf_K"] - active_state["Tf_K"]),
+                np.abs(updated_state["Ts_K"] - active_state["Ts_K"])
+            )
+
+            # pixels with an undefined change cannot improve
+            unconverged = change >= self.convergence_tolerance
+            active = active[unconverged]
+            active_state = {name: value[unconverged] for name, value in updated_state.items()}
+            active_inputs = {
+                name: value if np.ndim(value) == 0 else value[unconverged]
+                for name, value
+                in active_inputs.items()
+            }
+
+        self.logger.info(f"BESS C{4 if C4 else 3} iteration finished with {cl.val(active.size)} unconverged pixels")
+
+        return {name: Raster(value.reshape(shape), geometry=geometry) for name, value in full_state.items()}
+
+    def C3_C4_fluxes(self, carbon_water_fluxes: Callable, C3_inputs: Dict, C4_inputs: Dict) -> (namedtuple, namedtuple):
+        """
+        Run the C3 and C4 carbon and water flux branches, concurrently when parallel C3 and C4 processing is enabled.
+        :param carbon_water_fluxes: function running one branch from the inputs specific to the branch
+        :param C3_inputs: inputs of the C3 branch
+        :param C4_inputs: inputs of the C4 branch
+        :return: C3 fluxes and C4 fluxes
+        """
+        timer = Timer()
+
+        if self.parallel_C3_C4:
+            # NumPy releases the GIL in array operations, so the independent branches overlap on two threads
+            with ThreadPoolExecutor(max_workers=2, thread_name_prefix="BESS") as executor:
+                CWF_C3_future = executor.submit(carbon_water_fluxes, **C3_inputs)
+                CWF_C4_future = executor.submit(carbon_water_fluxes, **C4_inputs)
+                CWF_C3 = CWF_C3_future.result()
+                CWF_C4 = CWF_C4_future.result()
+        else:
+            CWF_C3 = carbon_water_fluxes(**C3_inputs)
+            CWF_C4 = carbon_water_fluxes(**C4_inputs)
+
+        mode = "concurrent" if self.parallel_C3_C4 else "sequential"
+        self.logger.info(f"{mode} C3 and C4 carbon and water fluxes completed ({cl.time(timer)} seconds)")
+        # the high-water mark of the whole process, which earlier stages may have set
+        peak_MB = peak_memory_MB()
+
+        if peak_MB is not None:
+            self.logger.info(f"peak resident memory of process so far: {cl.val(f'{peak_MB:0.0f}')} MB")
+
+        return CWF_C3, CWF_C4
+
+    def process_blocks(self, stage: Callable, geometry: RasterGeometry, **kwargs) -> namedtuple:
+        """
+        Run a pixel-independent stage over strips of rows when block processing is enabled,
+        so that the intermediates of the stage only ever cover one strip of the tile.
+        The outputs of each strip are written into images preallocated for the whole tile.
+        Diagnostics are skipped within strips, and the strips are not memoized individually.
+        :param stage: bound stage method returning a namedtuple of images
+        :param geometry: raster geometry of the tile
+        :param kwargs: stage arguments, where rasters covering the tile are split into strips
+        :return: namedtuple of output images covering the tile
+        """
+        rows, cols = geometry.shape
+
+        if self.block_rows is None or rows <= self.block_rows:
+            return stage(**kwargs)
+
+        # call the stage itself rather than its memoization wrapper
+        function = getattr(stage.__func__, "__wrapped__", stage.__func__)
+        strip_count = (rows + self.block_rows - 1) // self.block_rows
+        self.logger.info(
+            f"processing {cl.name(stage.__name__)} in {cl.val(strip_count)} blocks of {cl.val(self.block_rows)} rows")
+        outputs = {}
+        name = None
+
+        for start in range(0, rows, self.block_rows):
+            strip = slice(start, min(start + self.block_rows, rows))
+            strip_kwargs = {}
+
+            for key, value in kwargs.items():
+                if isinstance(value, (Raster, np.ndarray)) and value.shape == (rows, cols):
+                    value = value[strip, :]
+
+                strip_kwargs[key] = value
+
+            with suppress_diagnostics():
+                result = function(self, **strip_kwargs)
+
+            # stages return either a namedtuple or a namedtuple class with images assigned to its fields
+            name = result.__name__ if isinstance(result, type) else type(result).__name__
+
+            for field in result._fields:
+                value = getattr(result, field)
+
+                if not isinstance(value, (Raster, np.ndarray)):
+                    continue
+
+                array = np.asarray(value)
+
+                if field not in outputs:
+                    outputs[field] = np.empty((rows, cols), dtype=array.dtype)
+
+                outputs[field][strip, :] = array
+
+        Outputs = namedtuple(name, list(outputs))
+
+        return Outputs(**{field: Raster(array, geometry=geometry) for field, array in outputs.items()})
+
     def interpolate_fC4(self, C3: Raster, C4: Raster, fC4: Raster):
         return C3 * (1 - fC4) + C4 * fC4
 
+    @precision_inputs
     def BESS(
             self,
             geometry: RasterGeometry,
@@ -1828,7 +2348,9 @@ class BESS(FLiES):
         PARDir = VISdir
         self.diagnostic(PARDir, "PARDir", date_UTC, target)
 
-        CSR = self.canopy_shortwave_radiation(
+        CSR = self.process_blocks(
+            self.canopy_shortwave_radiation,
+            geometry,
             date_UTC=date_UTC,
             target=target,
             PARDiff=VISdiff,
@@ -1863,7 +2385,11 @@ class BESS(FLiES):
 
         self.diagnostic(Ca, "Ca", date_UTC, target)
 
-        CWF_C3 = self.carbon_water_fluxes(
+        # C3 and C4 branches share every input except photosynthetic capacity and the Ball-Berry parameters
+        carbon_water_fluxes = partial(
+            self.process_blocks,
+            self.carbon_water_fluxes,
+            geometry,
             date_UTC=date_UTC,
             target=target,
             ST_K=ST_K,
@@ -1873,10 +2399,6 @@ class BESS(FLiES):
             APAR_Sh=APAR_Sh,
             ASW_Sun=ASW_Sun,
             ASW_Sh=ASW_Sh,
-            Vcmax25_Sun=VCmax_C3_sun,
-            Vcmax25_Sh=VCmax_C3_sh,
-            m=m_C3,
-            b0=b0_C3,
             fSun=fSun,
             ASW_Soil=ASW_Soil,
             G=G,
@@ -1895,46 +2417,27 @@ class BESS(FLiES):
             Rs=MET.Rs,
             alf=alf,
             fStress=MET.fStress,
-            FVC=FVC,
+            FVC=FVC
+        )
+
+        C3_inputs = dict(
+            Vcmax25_Sun=VCmax_C3_sun,
+            Vcmax25_Sh=VCmax_C3_sh,
+            m=m_C3,
+            b0=b0_C3,
             C4=False
         )
 
-        CWF_C4 = self.carbon_water_fluxes(
-            date_UTC=date_UTC,
-            target=target,
-            ST_K=ST_K,
-            LAI=LAI,
-            Ta_K=Ta_K,
-            APAR_Sun=APAR_Sun,
-            APAR_Sh=APAR_Sh,
-            ASW_Sun=ASW_Sun,
-            ASW_Sh=ASW_Sh,
+        C4_inputs = dict(
             Vcmax25_Sun=VCmax_C4_sun,
             Vcmax25_Sh=VCmax_C4_sh,
             m=m_C4,
             b0=b0_C4,
-            fSun=fSun,
-            ASW_Soil=ASW_Soil,
-            G=G,
-            SZA=SZA,
-            Ca=Ca,
-            Ps_Pa=MET.Ps,
-            gamma=MET.gamma,
-            Cp=MET.Cp,
-            rhoa=MET.rhoa,
-            VPD_Pa=MET.VPD,
-            RH=MET.RH,
-            desTa=MET.desTa,
-            ddesTa=MET.ddesTa,
-            epsa=MET.epsa,
-            Rc=MET.Rc,
-            Rs=MET.Rs,
-            alf=alf,
-            fStress=MET.fStress,
-            FVC=FVC,
             C4=True
         )
 
+        CWF_C3, CWF_C4 = self.C3_C4_fluxes(carbon_water_fluxes, C3_inputs, C4_inputs)
+
         GPP = rt.clip(self.interpolate_fC4(CWF_C3.GPP, CWF_C4.GPP, fC4), 0, 50)
         GPP = GPP.mask(~np.isnan(ST_K))
         self.diagnostic(GPP, "GPP", date_UTC, target)
@@ -0,0 +1,350 @@
+"""
+Fused per-pixel kernel for the BESS carbon and water flux iteration
+
+The vectorized path in BESS.carbon_water_fluxes evaluates the longwave, photosynthesis, energy balance and soil
+equations as whole-raster operations, allocating a temporary raster for every operator.
+This kernel runs the same iteration pixel by pixel over contiguous float32 arrays,
+keeping the intermediate values of each pixel in registers.
+The equations and the order of their clipping and NaN handling follow the vectorized path,
+so the two agree to within floating point tolerance.
+The kernel is compiled with Numba when it is installed.
+"""
+
+import logging
+
+import numpy as np
+
+__author__ = "Gregory Halverson"
+
+logger = logging.getLogger(__name__)
+
+try:
+    from numba import njit, prange
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+
+        return lambda function: function
+
+SIGMA = 5.670373e-8  # [W m-2 K-4] (Wiki)
+EPSF = 0.98
+EPSS = 0.96
+KD = 0.78
+
+# order of the per-pixel inputs of the kernel
+KERNEL_INPUTS = (
+    "ST_K",
+    "LAI",
+    "Ta_K",
+    "APAR_Sun",
+    "APAR_Sh",
+    "ASW_Sun",
+    "ASW_Sh",
+    "Vcmax25_Sun",
+    "Vcmax25_Sh",
+    "m",
+    "b0",
+    "fSun",
+    "ASW_Soil",
+    "G",
+    "SZA",
+    "Ca",
+    "Ps_Pa",
+    "gamma",
+    "Cp",
+    "rhoa",
+    "VPD_Pa",
+    "RH",
+    "desTa",
+    "ddesTa",
+    "epsa",
+    "Rc",
+    "Rs",
+    "alf"
+)
+
+# order of the per-pixel outputs of the kernel
+KERNEL_OUTPUTS = ("GPP", "LE", "LE_soil", "LE_canopy", "Rn", "Rn_soil", "Rn_canopy")
+
+
+@njit(cache=True)
+def clip_min(value, minimum):
+    # matches rt.clip, which leaves NaN in place
+    return minimum if value < minimum else value
+
+
+@njit(cache=True)
+def clip_max(value, maximum):
+    return maximum if value > maximum else value
+
+
+@njit(cache=True)
+def merge(previous, value):
+    # keep the previous estimate where an update is undefined
+    return previous if np.isnan(value) else value
+
+
+@njit(cache=True)
+def quadratic(a, b, c):
+    return (-b + np.sign(b) * np.sqrt(b * b - 4.0 * a * c)) / (2.0 * a)
+
+
+@njit(cache=True)
+def C4_photosynthesis(Tf_K, Ci, APAR, Vcmax25):
+    item = (Tf_K - 298.15) / 10.0
+    Q10_item = 2.0 ** item
+    k = 0.7 * Q10_item
+    Vcmax = Vcmax25 * Q10_item / ((1.0 + np.exp(0.3 * (286.15 - Tf_K))) * (1.0 + np.exp(0.3 * (Tf_K - 309.15))))
+    Rd = 0.8 * Q10_item / (1.0 + np.exp(1.3 * (Tf_K - 328.15)))
+    Je = Vcmax
+    Ji = 0.067 * APAR
+    Jc = Ci * 1e-6 * k * 1e6
+    Jei = quadratic(0.83, -(Je + Ji), Je * Ji)
+    Jeic = quadratic(0.93, -(Jei + Jc), Jei * Jc)
+
+    return clip_min(Jeic - Rd, 0.0)
+
+
+@njit(cache=True)
+def C3_photosynthesis(Tf_K, Ci, APAR, Vcmax25, Ps_Pa, alf):
+    R = 8.314e-3
+    O2 = Ps_Pa * 0.21
+    Pi = Ci * 1e-6 * Ps_Pa
+    item = (Tf_K - 298.15) / 10
+    KC = 30 * 2.1 ** item
+    KO = 30000 * 1.2 ** item
+    K = KC * (1.0 + O2 / KO)
+    tao = 2600 * 0.57 ** item
+    GammaS = O2 / (2.0 * tao)
+    Vcmax = Vcmax25 * 2.4 ** item / (1.0 + np.exp((-220.0 + 0.703 * Tf_K) / (R * Tf_K)))
+    Rd = 0.015 * Vcmax / (1.0 + np.exp(1.3 * (Tf_K - 273.15 - 55.0)))
+    JC = Vcmax * (Pi - GammaS) / (Pi + K)
+    JE = alf * APAR * (Pi - GammaS) / (Pi + 2.0 * GammaS)
+    JS = Vcmax / 2.0
+    JCE = quadratic(0.98, -(JC + JE), JC * JE)
+    JCES = quadratic(0.95, -(JCE + JS), JCE * JS)
+
+    return clip_min(JCES - Rd, 0.0)
+
+
+@njit(cache=True)
+def energy_balance(An, ASW, ALW, Tf_K, Ps_Pa, Ca, Ta_K, RH, VPD_Pa, desTa, ddesTa, gamma, Cp, rhoa, Rc, m, b0, C4):
+    cf = 0.446 * (273.15 / Tf_K) * (Ps_Pa / 101325.0)
+    gs1 = m * RH * An / Ca + b0
+    Ci = Ca - 1.6 * An / gs1
+
+    if C4:
+        Ci = clip_max(clip_min(Ci, 0.2 * Ca), 0.6 * Ca)
+    else:
+        Ci = clip_max(clip_min(Ci, 0.5 * Ca), 0.9 * Ca)
+
+    rs = 1.0 / (gs1 / cf * 1e-2)
+    Rn = clip_min(ASW + ALW - 4.0 * 0.98 * SIGMA * (Ta_K ** 3) * (Tf_K - Ta_K), 0.0)
+    ddesTa_Rc2 = ddesTa * Rc * Rc
+    gamma_Rc_rc = gamma * (Rc + rs)
+    rhoa_Cp_gamma_Rc_rc = rhoa * Cp * gamma_Rc_rc
+    a = 1.0 / 2.0 * ddesTa_Rc2 / rhoa_Cp_gamma_Rc_rc
+    b = -1.0 - Rc * desTa / gamma_Rc_rc - ddesTa_Rc2 * Rn / rhoa_Cp_gamma_Rc_rc
+    c = rhoa * Cp / gamma_Rc_rc * VPD_Pa + desTa * Rc / gamma_Rc_rc * Rn + 1.0 / 2.0 * ddesTa_Rc2 / rhoa_Cp_gamma_Rc_rc * Rn * Rn
+    LE = clip_max(clip_min(quadratic(a, b, c), 0.0), Rn)
+
+    if Ta_K < 273.15:
+        LE = 0.0
+
+    H = clip_max(clip_min(Rn - LE, 0.0), Rn)
+    dT = clip_max(clip_min(Rc / (rhoa * Cp) * H, -20.0), 20.0)
+
+    return Rn, LE, Ta_K + dT, Ci
+
+
+@njit(cache=True)
+def soil(Ts, Ta, G, VPD, RH, gamma, Cp, rhoa, desTa, Rs, ASW_Soil, ALW_Soil, Ls, epsa):
+    Rn = clip_min(ASW_Soil + ALW_Soil - Ls - 4.0 * epsa * SIGMA * (Ta ** 3) * (Ts - Ta), 0.0)
+    LE = clip_max(clip_min(desTa / (desTa + gamma) * (Rn - G) * (RH ** (VPD / 1000.0)), 0.0), Rn)
+    H = clip_max(clip_min(Rn - G - LE, 0.0), Rn)
+    dT = clip_max(clip_min(Rs / (rhoa * Cp) * H, -20.0), 20.0)
+
+    return Rn, LE, Ta + dT
+
+
+@njit(cache=True, parallel=True)
+def carbon_water_fluxes_kernel(inputs, outputs, passes, C4, initialize_Tf_with_ST, convergence_tolerance):
+    """
+    Run the BESS carbon and water flux iteration for every pixel.
+    :param inputs: float32 matrix with one row per name in KERNEL_INPUTS and one column per pixel
+    :param outputs: float32 matrix receiving one row per name in KERNEL_OUTPUTS
+    :param passes: number of iterations
+    :param C4: process for C4 plants instead of C3
+    :param initialize_Tf_with_ST: initialize soil and canopy temperatures to surface temperature instead of air temperature
+    :param convergence_tolerance: change in foliage and soil temperature in K below which a pixel stops iterating,
+        or a negative number to run every pass
+    """
+    GPP_max = 50.0 if C4 else 40.0
+    chi = 0.4 if C4 else 0.7
+
+    for i in prange(inputs.shape[1]):
+        ST_K = np.float64(inputs[0, i])
+        LAI = np.float64(inputs[1, i])
+        Ta_K = np.float64(inputs[2, i])
+        APAR_Sun = np.float64(inputs[3, i])
+        APAR_Sh = np.float64(inputs[4, i])
+        ASW_Sun = np.float64(inputs[5, i])
+        ASW_Sh = np.float64(inputs[6, i])
+        Vcmax25_Sun = np.float64(inputs[7, i])
+        Vcmax25_Sh = np.float64(inputs[8, i])
+        m = np.float64(inputs[9, i])
+        b0 = np.float64(inputs[10, i])
+        fSun = np.float64(inputs[11, i])
+        ASW_Soil = np.float64(inputs[12, i])
+        G = np.float64(inputs[13, i])
+        SZA = np.float64(inputs[14, i])
+        Ca = np.float64(inputs[15, i])
+        Ps_Pa = np.float64(inputs[16, i])
+        gamma = np.float64(inputs[17, i])
+        Cp = np.float64(inputs[18, i])
+        rhoa = np.float64(inputs[19, i])
+        VPD_Pa = np.float64(inputs[20, i])
+        RH = np.float64(inputs[21, i])
+        desTa = np.float64(inputs[22, i])
+        ddesTa = np.float64(inputs[23, i])
+        epsa = np.float64(inputs[24, i])
+        Rc = np.float64(inputs[25, i])
+        Rs = np.float64(inputs[26, i])
+        alf = np.float64(inputs[27, i])
+
+        Tf_K = ST_K if initialize_Tf_with_ST else Ta_K
+        Tf_Sun_K = Tf_K
+        Tf_Sh_K = Tf_K
+        Ts_K = Tf_K
+        Ci_Sun = Ca * chi
+        Ci_Sh = Ca * chi
+        zero = Tf_K * 0
+        An_Sun = zero
+        An_Sh = zero
+        Rn_Sun = zero
+        Rn_Sh = zero
+        Rn_Soil = zero
+        LE_Sun = zero
+        LE_Sh = zero
+        LE_Soil = zero
+
+        # the beam extinction and the exponentials of leaf area do not change between iterations
+        kb = 0.5 / np.cos(clip_max(SZA, 89.0) * np.pi / 180.0)
+        exp_kd_LAI = np.exp(-KD * LAI)
+        exp_kb_LAI = np.exp(-kb * LAI)
+        exp_kb_kd_LAI = np.exp(-(kb + KD) * LAI)
+        La = clip_min(epsa * SIGMA * Ta_K ** 4, 0.0)
+
+        for iteration in range(passes):
+            previous_Tf_K = Tf_K
+            previous_Ts_K = Ts_K
+
+            # longwave radiation
+            Ls = clip_min(EPSS * SIGMA * Ts_K ** 4, 0.0)
+            Lf = clip_min(EPSF * SIGMA * Tf_K ** 4, 0.0)
+            ALW_Sun = ((Ls - Lf) * KD * (exp_kd_LAI - exp_kb_LAI) / (KD - kb) + KD * (La - Lf) * (1.0 - exp_kb_kd_LAI)) / (KD + kb)
+            ALW_Sh = (1.0 - exp_kd_LAI) * (Ls + La - 2 * Lf) - ALW_Sun
+            ALW_Soil = (1.0 - exp_kd_LAI) * Lf + exp_kd_LAI * La
+
+            # sunlit canopy
+            if C4:
+                An_Sun = C4_photosynthesis(Tf_Sun_K, Ci_Sun, APAR_Sun, Vcmax25_Sun)
+            else:
+                An_Sun = C3_photosynthesis(Tf_Sun_K, Ci_Sun, APAR_Sun, Vcmax25_Sun, Ps_Pa, alf)
+
+            Rn, LE, Tf, Ci = energy_balance(
+                An_Sun, ASW_Sun, ALW_Sun, Tf_Sun_K, Ps_Pa, Ca, Ta_K, RH, VPD_Pa,
+                desTa, ddesTa, gamma, Cp, rhoa, Rc, m, b0, C4
+            )
+
+            Rn_Sun = merge(Rn_Sun, Rn)
+            LE_Sun = merge(LE_Sun, LE)
+            Tf_Sun_K = merge(Tf_Sun_K, Tf)
+            Ci_Sun = merge(Ci_Sun, Ci)
+
+            # shaded canopy
+            if C4:
+                An_Sh = C4_photosynthesis(Tf_Sh_K, Ci_Sh, APAR_Sh, Vcmax25_Sh)
+            else:
+                An_Sh = C3_photosynthesis(Tf_Sh_K, Ci_Sh, APAR_Sh, Vcmax25_Sh, Ps_Pa, alf)
+
+            Rn, LE, Tf, Ci = energy_balance(
+                An_Sh, ASW_Sh, ALW_Sh, Tf_Sh_K, Ps_Pa, Ca, Ta_K, RH, VPD_Pa,
+                desTa, ddesTa, gamma, Cp, rhoa, Rc, m, b0, C4
+            )
+
+            Rn_Sh = merge(Rn_Sh, Rn)
+            LE_Sh = merge(LE_Sh, LE)
+            Tf_Sh_K = merge(Tf_Sh_K, Tf)
+            Ci_Sh = merge(Ci_Sh, Ci)
+
+            # soil
+            Rn, LE, Ts = soil(Ts_K, Ta_K, G, VPD_Pa, RH, gamma, Cp, rhoa, desTa, Rs, ASW_Soil, ALW_Soil, Ls, epsa)
+            Rn_Soil = merge(Rn_Soil, Rn)
+            LE_Soil = merge(LE_Soil, LE)
+            Ts_K = merge(Ts_K, Ts)
+
+            # composite foliage temperature
+            Tf_K = merge(Tf_K, ((Tf_Sun_K ** 4) * fSun + (Tf_Sh_K ** 4) * (1 - fSun)) ** 0.25)
+
+            if convergence_tolerance >= 0:
+                change = max(abs(Tf_K - previous_Tf_K), abs(Ts_K - previous_Ts_K))
+
+                # pixels with an undefined change cannot improve
+                if not change >= convergence_tolerance:
+                    break
+
+        outputs[0, i] = clip_max(clip_min(An_Sun + An_Sh, 0.0), GPP_max)
+        outputs[1, i] = clip_max(clip_min(LE_Sun + LE_Sh + LE_Soil, 0.0), 1000.0)
+        outputs[2, i] = LE_Soil
+        outputs[3, i] = clip_max(clip_min(LE_Sun + LE_Sh, 0.0), 1000.0)
+        outputs[4, i] = clip_max(clip_min(Rn_Sun + Rn_Sh + Rn_Soil, 0.0), 1000.0)
+        outputs[5, i] = Rn_Soil
+        outputs[6, i] = clip_min(Rn_Sun + Rn_Sh, 0.0)
+
+
+def carbon_water_fluxes(
+        shape: tuple,
+        passes: int,
+        C4: bool,
+        initialize_Tf_with_ST: bool,
+        convergence_tolerance: float = None,
+        **inputs) -> dict:
+    """
+    Pack the inputs of the BESS carbon and water flux iteration and run the fused kernel.
+    :param shape: shape of the rasters
+    :param passes: number of iterations
+    :param C4: process for C4 plants instead of C3
+    :param initialize_Tf_with_ST: initialize soil and canopy temperatures to surface temperature instead of air temperature
+    :param convergence_tolerance: change in foliage and soil temperature in K below which a pixel stops iterating
+    :param inputs: rasters, arrays or scalars for every name in KERNEL_INPUTS
+    :return: dictionary of float32 arrays for every name in KERNEL_OUTPUTS
+    """
+    size = int(np.prod(shape))
+    packed = np.empty((len(KERNEL_INPUTS), size), dtype=np.float32)
+
+    for index, name in enumerate(KERNEL_INPUTS):
+        packed[index] = np.broadcast_to(np.asarray(inputs[name], dtype=np.float32), shape).ravel()
+
+    outputs = np.empty((len(KERNEL_OUTPUTS), size), dtype=np.float32)
+
+    if convergence_tolerance is None:
+        convergence_tolerance = -1.0
+
+    with np.errstate(all="ignore"):
+        carbon_water_fluxes_kernel(
+            packed,
+            outputs,
+            int(passes),
+            bool(C4),
+            bool(initialize_Tf_with_ST),
+            float(convergence_tolerance)
+        )
+
+    return {name: outputs[index].reshape(shape) for index, name in enumerate(KERNEL_OUTPUTS)}
@@ -0,0 +1,196 @@
+"""
+Per-tile cache of static BESS parameters resampled to the tile grid
+"""
+
+import hashlib
+import logging
+from functools import wraps
+from os import makedirs, replace, stat
+from os.path import join, exists, abspath
+from threading import Lock
+from typing import Callable, Dict, List
+
+import numpy as np
+import rasterio
+
+import colored_logging as cl
+from rasters import Raster, RasterGeometry, RasterGrid
+
+__author__ = "Gregory Halverson"
+
+DEFAULT_CACHE_STATIC = False
+DEFAULT_STATIC_CACHE = "BESS_static_cache"
+STATIC_CACHE_VERSION = 2
+
+logger = logging.getLogger(__name__)
+
+
+def static_cache_key(layers: List[str], geometry: RasterGrid, resampling: str, sources: List[str] = None) -> str:
+    """
+    Key of the cached static parameters of a tile.
+    The filename, size and modification time of each source dataset are part of the key,
+    so that replacing a source dataset resamples the static parameters again.
+    :param layers: names of static parameter layers
+    :param geometry: tile grid
+    :param resampling: resampling method
+    :param sources: optional filenames of the datasets the static parameters are resampled from
+    :return: hexadecimal key
+    """
+    hasher = hashlib.sha256()
+    hasher.update(f"{STATIC_CACHE_VERSION}:{','.join(layers)}:{resampling}".encode())
+    hasher.update(repr(tuple(geometry.affine)[:6]).encode())
+    hasher.update(repr(geometry.shape).encode())
+    hasher.update(geometry.crs.to_wkt().encode())
+
+    for filename in sources or []:
+        filename = abspath(filename)
+
+        if exists(filename):
+            status = stat(filename)
+            hasher.update(f"{filename}:{status.st_size}:{status.st_mtime_ns}".encode())
+        else:
+            hasher.update(f"{filename}:missing".encode())
+
+    return hasher.hexdigest()[:32]
+
+
+class StaticCache:
+    """
+    Directory of static parameters resampled to tile grids, one multi-band GeoTIFF per tile and resampling method
+    with a band for each layer, so that every static parameter of a tile loads with a single read.
+    Each band is written in the widest precision of the layers and read back in the precision of its own layer,
+    so cached parameters match the parameters resampled without the cache.
+    The most recently loaded tile is also kept in memory, since the layers of a tile are requested one at a time.
+    """
+    def __init__(self, directory: str, layers: List[str], sources: List[str] = None):
+        self.directory = directory
+        self.layers = list(layers)
+        self.sources = list(sources) if sources is not None else []
+        self.hits = 0
+        self.misses = 0
+        self._filename = None
+        self._arrays = None
+        self._lock = Lock()
+
+    def __repr__(self):
+        return f"StaticCache(directory={self.directory}, layers={len(self.layers)}, hits={self.hits}, misses={self.misses})"
+
+    def filename(self, geometry: RasterGrid, resampling: str) -> str:
+        return join(self.directory, f"{static_cache_key(self.layers, geometry, resampling, self.sources)}.tif")
+
+    def read(self, filename: str) -> Dict[str, np.ndarray]:
+        with rasterio.open(filename) as file:
+            arrays = file.read()
+            names = file.descriptions
+            dtypes = [file.tags(band).get("dtype") for band in range(1, file.count + 1)]
+
+        if list(names) != self.layers:
+            raise ValueError(f"static cache file has layers {names} instead of {self.layers}: {filename}")
+
+        return {name: array.astype(dtype, copy=False) for name, array, dtype in zip(self.layers, arrays, dtypes)}
+
+    def write(self, filename: str, geometry: RasterGrid, layers: Dict[str, Raster]):
+        rows, cols = geometry.shape
+        arrays = [np.asarray(layers[name]) for name in self.layers]
+        # a single dtype for every band that holds each layer without loss
+        dtype = np.result_type(np.float32, *[array.dtype for array in arrays])
+        makedirs(self.directory, exist_ok=True)
+        # write to a temporary file so that a crash never leaves a partial tile under the key
+        temporary_filename = f"{filename}.{id(layers)}.tmp.tif"
+
+        with rasterio.open(
+                temporary_filename,
+                "w",
+                driver="GTiff",
+                width=cols,
+                height=rows,
+                count=len(self.layers),
+                dtype=dtype.name,
+                crs=geometry.crs.to_wkt(),
+                transform=geometry.affine,
+                nodata=np.nan,
+                tiled=True,
+                compress="deflate") as file:
+            for band, (name, array) in enumerate(zip(self.layers, arrays), start=1):
+                file.write(array.astype(dtype, copy=False), band)
+                file.set_band_description(band, name)
+                file.update_tags(band, dtype=array.dtype.name)
+
+        replace(temporary_filename, filename)
+
+    def load(self, geometry: RasterGrid, resampling: str, build: Callable[[], Dict[str, Raster]]) -> Dict[str, np.ndarray]:
+        """
+        Load the static parameters of a tile, building and caching them on the first request.
+        :param geometry: tile grid
+        :param resampling: resampling method
+        :param build: function resampling every static parameter layer to the tile grid
+        :return: dictionary of static parameter arrays keyed by layer name, shared with later requests
+        """
+        filename = self.filename(geometry, resampling)
+
+        with self._lock:
+            arrays = self._arrays if filename == self._filename else None
+
+            if arrays is None and exists(filename):
+                try:
+                    logger.info(f"loading static parameters: {cl.file(filename)}")
+                    arrays = self.read(filename)
+                except Exception as e:
+                    logger.warning(f"unable to load static parameters: {cl.file(filename)}")
+                    logger.warning(e)
+
+            if arrays is None:
+                self.misses += 1
+                logger.info(f"resampling static parameters for static cache: {cl.file(filename)}")
+                layers = build()
+
+                try:
+                    self.write(filename, geometry, layers)
+                except Exception as e:
+                    logger.warning(f"unable to write static parameters: {cl.file(filename)}")
+                    logger.warning(e)
+
+                arrays = {name: np.asarray(layers[name]) for name in self.layers}
+            else:
+                self.hits += 1
+
+            self._filename = filename
+            self._arrays = arrays
+
+        return arrays
+
+    def layer(self, name: str, geometry: RasterGrid, resampling: str, build: Callable[[], Dict[str, Raster]]) -> Raster:
+        """
+        Load one static parameter of a tile.
+        :param name: name of static parameter layer
+        :param geometry: tile grid
+        :param resampling: resampling method
+        :param build: function resampling every static parameter layer to the tile grid
+        :return: static parameter raster
+        """
+        arrays = self.load(geometry, resampling, build)
+
+        # callers may modify the rasters they receive, so each one gets its own array
+        return Raster(np.array(arrays[name]), geometry=geometry, nodata=np.nan)
+
+
+def static_layer(method: Callable) -> Callable:
+    """
+    Decorate a static parameter method of a model to read the parameter from the static cache of the model,
+    which resamples every static parameter of a tile together the first time the tile is requested.
+    Geometries other than raster grids bypass the cache.
+    :param method: method resampling a static parameter to a geometry
+    :return: decorated method
+    """
+    name = method.__name__
+
+    @wraps(method)
+    def wrapper(self, geometry: RasterGeometry) -> Raster:
+        static_cache = getattr(self, "static_cache", None)
+
+        if static_cache is None or not isinstance(geometry, RasterGrid):
+            return method(self, geometry=geometry)
+
+        return self.cast(static_cache.layer(name, geometry, self.resampling, lambda: self.static_layers(geometry)))
+
+    return wrapper
@@ -0,0 +1,177 @@
+"""
+NumPy inference engine for the FLiES artificial neural network
+"""
+
+import json
+import logging
+import warnings
+from threading import Lock
+from typing import Callable, Dict, List, Tuple
+
+import h5py
+import numpy as np
+
+import colored_logging as cl
+
+__author__ = "Gregory Halverson"
+
+logger = logging.getLogger(__name__)
+
+KERAS_BACKEND = "keras"
+NUMPY_BACKEND = "numpy"
+ANN_BACKENDS = (KERAS_BACKEND, NUMPY_BACKEND)
+DEFAULT_ANN_BACKEND = KERAS_BACKEND
+DEFAULT_BATCH_SIZE = 65536
+
+ACTIVATIONS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0, out=x),
+    "sigmoid": lambda x: np.reciprocal(np.add(np.exp(np.negative(x, out=x), out=x), 1, out=x), out=x),
+    "tanh": lambda x: np.tanh(x, out=x)
+}
+
+_models = {}
+_model_lock = Lock()
+
+
+class UnsupportedANNError(ValueError):
+    pass
+
+
+class NumPyANN:
+    """
+    Feed-forward pass of a Keras sequential model of dense layers as batched float32 NumPy matrix products.
+    """
+    def __init__(self, layers: List[Tuple[np.ndarray, np.ndarray, str]], filename: str = None):
+        for kernel, bias, activation in layers:
+            if activation not in ACTIVATIONS:
+                raise UnsupportedANNError(f"unsupported activation: {activation}")
+
+        self.layers = [
+            (np.ascontiguousarray(kernel, dtype=np.float32), np.ascontiguousarray(bias, dtype=np.float32), activation)
+            for kernel, bias, activation
+            in layers
+        ]
+
+        self.filename = filename
+
+    def __repr__(self):
+        return f"NumPyANN({' -> '.join(str(kernel.shape[1]) for kernel, bias, activation in self.layers)})"
+
+    @property
+    def input_size(self) -> int:
+        return self.layers[0][0].shape[0]
+
+    @property
+    def output_size(self) -> int:
+        return self.layers[-1][0].shape[1]
+
+    @classmethod
+    def open(cls, filename: str) -> "NumPyANN":
+        """
+        Read the layer weights of a Keras sequential model from an HDF5 file without loading Keras.
+        :param filename: filename of Keras HDF5 model
+        :return: NumPy inference engine
+        """
+        with h5py.File(filename, "r") as file:
+            model_config = file.attrs["model_config"]
+
+            if isinstance(model_config, bytes):
+                model_config = model_config.decode()
+
+            model_config = json.loads(model_config)
+            config = model_config["config"]
+            layer_configs = config["layers"] if isinstance(config, dict) else config
+            weights = file["model_weights"]
+            layers = []
+
+            for layer_config in layer_configs:
+                class_name = layer_config["class_name"]
+
+                if class_name == "InputLayer":
+                    continue
+
+                if class_name != "Dense":
+                    raise UnsupportedANNError(f"unsupported layer: {class_name}")
+
+                name = layer_config["config"]["name"]
+                group = weights[name]
+
+                while "kernel:0" not in group and len(group.keys()) == 1:
+                    group = group[list(group.keys())[0]]
+
+                kernel = group["kernel:0"][()]
+
+                if layer_config["config"].get("use_bias", True):
+                    bias = group["bias:0"][()]
+                else:
+                    bias = np.zeros(kernel.shape[1], dtype=np.float32)
+
+                layers.append((kernel, bias, layer_config["config"].get("activation", "linear")))
+
+        return cls(layers, filename=filename)
+
+    def predict(self, inputs: np.ndarray, batch_size: int = DEFAULT_BATCH_SIZE) -> np.ndarray:
+        """
+        Run the forward pass in batches.
+        :param inputs: matrix of inputs with one row per sample
+        :param batch_size: number of samples per batch
+        :return: float32 matrix of outputs with one row per sample
+        """
+        inputs = np.asarray(inputs, dtype=np.float32)
+        outputs = np.empty((inputs.shape[0], self.output_size), dtype=np.float32)
+
+        with warnings.catch_warnings():
+            # sigmoid saturates to zero for large negative inputs
+            warnings.simplefilter("ignore", RuntimeWarning)
+
+            for start in range(0, inputs.shape[0], batch_size):
+                end = min(start + batch_size, inputs.shape[0])
+                values = inputs[start:end]
+
+                for kernel, bias, activation in self.layers:
+                    values = values @ kernel
+                    values += bias
+                    values = ACTIVATIONS[activation](values)
+
+                outputs[start:end] = values
+
+        return outputs
+
+
+def load_keras_model(filename: str) -> Callable:
+    """
+    Load a Keras model, importing TensorFlow only when the Keras backend is used.
+    :param filename: filename of Keras HDF5 model
+    :return: Keras model
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        import tensorflow as tf
+        tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
+        from keras.models import load_model
+
+    return load_model(filename)
+
+
+def load_ANN_model(filename: str, backend: str = DEFAULT_ANN_BACKEND) -> Callable:
+    """
+    Load the FLiES artificial neural network for a given inference backend.
+    :param filename: filename of Keras HDF5 model
+    :param backend: "keras" or "numpy"
+    :return: model with a predict method
+    """
+    if backend not in ANN_BACKENDS:
+        raise ValueError(f"invalid FLiES ANN backend: {backend}")
+
+    logger.info(f"loading FLiES ANN with {cl.name(backend)} backend: {cl.file(filename)}")
+
+    if backend == KERAS_BACKEND:
+        return load_keras_model(filename)
+
+    # the NumPy engine holds only its weights, so it is shared across instances
+    with _model_lock:
+        if filename not in _models:
+            _models[filename] = NumPyANN.open(filename)
+
+        return _models[filename]
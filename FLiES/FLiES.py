@@ -12,21 +12,17 @@ from time import process_time
 from typing import Callable, Union
 
 import numpy as np
-import pandas as pd
 from dateutil import parser
 from scipy.stats import zscore
 
 import colored_logging as cl
+from FLiES.ANN import load_ANN_model, DEFAULT_ANN_BACKEND
+from FLiES.atype_ctype import ANN_atype_ctype
 from FLiES.daylight_hours import day_angle_rad_from_doy, solar_dec_deg_from_day_angle_rad
 from FLiES.solar_zenith_angle import sza_deg_from_lat_dec_hour
 from model.model import Model
-
-with warnings.catch_warnings():
-    warnings.simplefilter("ignore")
-    import tensorflow as tf
-    tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
-    # from keras.engine.saving import load_model
-    from keras.models import load_model
+from model.precision import DEFAULT_DTYPE, precision_inputs
+from model.writer import IntermediateWriter
 
 import rasters as rt
 from GEOS5FP import GEOS5FP
@@ -47,6 +43,7 @@ DEFAULT_RESAMPLING = "cubic"
 DEFAULT_SAVE_INTERMEDIATE = True
 DEFAULT_SHOW_DISTRIBUTION = True
 DEFAULT_DYNAMIC_ATYPE_CTYPE = False
+DEFAULT_ANN_CHUNK_SIZE = 2 ** 18
 
 
 class SentinelNotAvailable(IOError):
@@ -85,7 +82,12 @@ class FLiES(Model):
             save_intermediate: bool = DEFAULT_SAVE_INTERMEDIATE,
             show_distribution: bool = DEFAULT_SHOW_DISTRIBUTION,
             include_preview: bool = DEFAULT_INCLUDE_PREVIEW,
-            dynamic_atype_ctype: bool = DEFAULT_DYNAMIC_ATYPE_CTYPE):
+            dynamic_atype_ctype: bool = DEFAULT_DYNAMIC_ATYPE_CTYPE,
+            backend: str = DEFAULT_ANN_BACKEND,
+            intermediate_writer: IntermediateWriter = None,
+            distribution_sample_fraction: float = None,
+            memoize: bool = False,
+            dtype: Union[str, type, np.dtype] = DEFAULT_DTYPE):
 
         if working_directory is None:
             working_directory = DEFAULT_WORKING_DIRECTORY
@@ -119,7 +121,8 @@ class FLiES(Model):
                 GEOS5FP_connection = GEOS5FP(
                     working_directory=working_directory,
                     download_directory=GEOS5FP_download,
-                    products_directory=GEOS5FP_products
+                    products_directory=GEOS5FP_products,
+                    dtype=dtype
                 )
             except Exception as e:
                 self.logger.exception(e)
@@ -138,7 +141,7 @@ class FLiES(Model):
             ANN_model_filename = DEFAULT_MODEL_FILENAME
 
         if ANN_model is None:
-            ANN_model = load_model(ANN_model_filename)
+            ANN_model = load_ANN_model(ANN_model_filename, backend=backend)
 
         super(FLiES, self).__init__(
             working_directory=working_directory,
@@ -148,17 +151,22 @@ class FLiES(Model):
             resampling=resampling,
             save_intermediate=save_intermediate,
             show_distribution=show_distribution,
-            include_preview=include_preview
+            include_preview=include_preview,
+            intermediate_writer=intermediate_writer,
+            distribution_sample_fraction=distribution_sample_fraction,
+            memoize=memoize,
+            dtype=dtype
         )
 
         self.ANN_model = ANN_model
+        self.backend = backend
         self.dynamic_atype_ctype = dynamic_atype_ctype
 
     def UTC_to_solar(self, time_UTC: datetime, lon: float) -> datetime:
         return time_UTC + timedelta(hours=(np.radians(lon) / np.pi * 12))
 
     def UTC_offset_hours(self, geometry: RasterGeometry) -> Raster:
-        return Raster(np.radians(geometry.lon) / np.pi * 12, geometry=geometry)
+        return self.cast(Raster(np.radians(geometry.lon) / np.pi * 12, geometry=geometry))
 
     def day_of_year(self, time_UTC: datetime, geometry: RasterGeometry) -> Raster:
         doy_UTC = time_UTC.timetuple().tm_yday
@@ -206,38 +214,17 @@ class FLiES(Model):
         SZA_deg = sza_deg_from_lat_dec_hour(latitude, solar_dec_deg, hour_of_day)
         # print("SZA: {}".format(np.nanmean(SZA_deg)))
 
-        SZA = Raster(SZA_deg, geometry=geometry)
+        # solar geometry is calculated from the float64 coordinates of the geometry and cast afterwards
+        SZA = self.cast(Raster(SZA_deg, geometry=geometry))
 
         return SZA
 
     def generate_atype_ctype(self, COT: Raster, KG_climate: Raster, geometry: RasterGeometry, dynamic_atype_ctype: bool = True) -> (Raster, Raster):
-        atype = np.full(geometry.shape, 1, dtype=np.uint16)
-        ctype = np.full(geometry.shape, 0, dtype=np.uint16)
-
         if dynamic_atype_ctype:
-            atype = np.where((COT == 0) & ((KG_climate == 5) | (KG_climate == 6)), 1, atype)
-            ctype = np.where((COT == 0) & ((KG_climate == 5) | (KG_climate == 6)), 0, ctype)
-
-            atype = np.where((COT == 0) & ((KG_climate == 3) | (KG_climate == 4)), 2, atype)
-            ctype = np.where((COT == 0) & ((KG_climate == 3) | (KG_climate == 4)), 0, ctype)
-
-            atype = np.where((COT == 0) & (KG_climate == 1), 4, atype)
-            ctype = np.where((COT == 0) & (KG_climate == 1), 0, ctype)
-
-            atype = np.where((COT == 0) & (KG_climate == 2), 5, atype)
-            ctype = np.where((COT == 0) & (KG_climate == 2), 0, ctype)
-
-            atype = np.where((COT > 0) & ((KG_climate == 5) | (KG_climate == 6)), 1, atype)
-            ctype = np.where((COT > 0) & ((KG_climate == 5) | (KG_climate == 6)), 1, ctype)
-
-            atype = np.where((COT > 0) & ((KG_climate == 3) | (KG_climate == 4)), 2, atype)
-            ctype = np.where((COT > 0) & ((KG_climate == 3) | (KG_climate == 4)), 1, ctype)
-
-            atype = np.where((COT > 0) & (KG_climate == 2), 5, atype)
-            ctype = np.where((COT > 0) & (KG_climate == 2), 1, ctype)
-
-            atype = np.where((COT > 0) & (KG_climate == 1), 4, atype)
-            ctype = np.where((COT > 0) & (KG_climate == 1), 3, ctype)
+            atype, ctype = ANN_atype_ctype(COT, KG_climate)
+        else:
+            atype = np.full(geometry.shape, 1, dtype=np.uint8)
+            ctype = np.full(geometry.shape, 0, dtype=np.uint8)
 
         atype = Raster(atype, geometry=geometry)
         ctype = Raster(ctype, geometry=geometry)
@@ -255,50 +242,52 @@ class FLiES(Model):
             ozone_cm: Raster,
             albedo: Raster,
             elevation_km: Raster,
-            SZA: Raster) -> (Raster, Raster, Raster, Raster, Raster, Raster, Raster):
-
-        ctype_flat = np.array(ctype).flatten()
-        atype_flat = np.array(atype).flatten()
-        COT_flat = np.array(COT).flatten()
-        AOT_flat = np.array(AOT).flatten()
-        vapor_gccm_flat = np.array(vapor_gccm).flatten()
-        ozone_cm_flat = np.array(ozone_cm).flatten()
-        albedo_flat = np.array(albedo).flatten()
-        elevation_km_flat = np.array(elevation_km).flatten()
-        SZA_flat = np.array(SZA).flatten()
-
-        inputs = pd.DataFrame({
-            "ctype": ctype_flat,
-            "atype": atype_flat,
-            "COT": COT_flat,
-            "AOT": AOT_flat,
-            "vapor_gccm": vapor_gccm_flat,
-            "ozone_cm": ozone_cm_flat,
-            "albedo": albedo_flat,
-            "elevation_km": elevation_km_flat,
-            "SZA": SZA_flat
-        })
-
-        inputs["ctype0"] = np.float32(inputs.ctype == 0)
-        inputs["ctype1"] = np.float32(inputs.ctype == 1)
-        inputs["ctype3"] = np.float32(inputs.ctype == 3)
-        inputs["atype1"] = np.float32(inputs.ctype == 1)
-        inputs["atype2"] = np.float32(inputs.ctype == 2)
-        inputs["atype4"] = np.float32(inputs.ctype == 4)
-        inputs["atype5"] = np.float32(inputs.ctype == 5)
-
-        inputs = inputs[
-            ["ctype0", "ctype1", "ctype3", "atype1", "atype2", "atype4", "atype5", "COT", "AOT", "vapor_gccm",
-             "ozone_cm", "albedo", "elevation_km", "SZA"]]
-        outputs = self.ANN_model.predict(inputs)
+            SZA: Raster,
+            chunk_size: int = DEFAULT_ANN_CHUNK_SIZE) -> (Raster, Raster, Raster, Raster, Raster, Raster, Raster):
+
         shape = COT.shape
-        tm = Raster(np.clip(outputs[:, 0].reshape(shape), 0, 1).astype(np.float32), geometry=geometry, nodata=np.nan)
-        puv = Raster(np.clip(outputs[:, 1].reshape(shape), 0, 1).astype(np.float32), geometry=geometry, nodata=np.nan)
-        pvis = Raster(np.clip(outputs[:, 2].reshape(shape), 0, 1).astype(np.float32), geometry=geometry, nodata=np.nan)
-        pnir = Raster(np.clip(outputs[:, 3].reshape(shape), 0, 1).astype(np.float32), geometry=geometry, nodata=np.nan)
-        fduv = Raster(np.clip(outputs[:, 4].reshape(shape), 0, 1).astype(np.float32), geometry=geometry, nodata=np.nan)
-        fdvis = Raster(np.clip(outputs[:, 5].reshape(shape), 0, 1).astype(np.float32), geometry=geometry, nodata=np.nan)
-        fdnir = Raster(np.clip(outputs[:, 6].reshape(shape), 0, 1).astype(np.float32), geometry=geometry, nodata=np.nan)
+        ctype_flat = np.asarray(ctype).ravel()
+        continuous_inputs = [
+            np.asarray(image, dtype=np.float32).ravel()
+            for image
+            in (COT, AOT, vapor_gccm, ozone_cm, albedo, elevation_km, SZA)
+        ]
+
+        # pixels missing any input predict NaN, so they are left out of the input matrix
+        valid = np.full(ctype_flat.shape, True)
+
+        for image in continuous_inputs:
+            valid &= ~np.isnan(image)
+
+        indices = np.flatnonzero(valid)
+        self.logger.info(f"predicting FLiES ANN for {cl.val(len(indices))} of {cl.val(valid.size)} pixels")
+
+        # one-hot encoded types followed by COT, AOT, vapor_gccm, ozone_cm, albedo, elevation_km and SZA
+        inputs = np.empty((len(indices), 14), dtype=np.float32)
+        ctype_valid = ctype_flat[indices]
+
+        for column, value in enumerate((0, 1, 3)):
+            inputs[:, column] = ctype_valid == value
+
+        # the aerosol type columns are encoded from the cloud type, matching the inputs the network was run with
+        for column, value in enumerate((1, 2, 4, 5), start=3):
+            inputs[:, column] = ctype_valid == value
+
+        for column, image in enumerate(continuous_inputs, start=7):
+            np.take(image, indices, out=inputs[:, column])
+
+        outputs = np.full((7, valid.size), np.nan, dtype=np.float32)
+
+        for start in range(0, len(indices), chunk_size):
+            end = min(start + chunk_size, len(indices))
+            predicted = np.asarray(self.ANN_model.predict(inputs[start:end]))
+            outputs[:, indices[start:end]] = np.clip(predicted, 0, 1).T
+
+        tm, puv, pvis, pnir, fduv, fdvis, fdnir = [
+            Raster(output.reshape(shape), geometry=geometry, nodata=np.nan)
+            for output
+            in outputs
+        ]
 
         return tm, puv, pvis, pnir, fduv, fdvis, fdnir
 
@@ -320,8 +309,9 @@ class FLiES(Model):
 
     def elevation_km(self, geometry: RasterGeometry) -> Raster:
         self.logger.info("retrieving SRTM elevation raster in kilometers")
-        return self.SRTM_connection.elevation_km(geometry)
+        return self.cast(self.SRTM_connection.elevation_km(geometry))
 
+    @precision_inputs
     def FLiES(
             self,
             geometry: RasterGeometry,
@@ -490,7 +480,8 @@ class FLiES(Model):
         sunrise_deg = rt.where(sunrise_cos >= 1, 0, sunrise_deg)
         sunrise_deg = rt.where(sunrise_cos <= -1, 180, sunrise_deg)
 
-        return sunrise_deg
+        # the arc cosine is sensitive near the poles, so the sunrise angle is cast only after it is calculated
+        return self.cast(sunrise_deg)
 
     def sunrise_from_sha(self, sha_deg: Raster) -> Raster:
         """
@@ -8,7 +8,8 @@ import logging
 import warnings
 from datetime import datetime
 from os.path import join, abspath, dirname
-from typing import Callable
+from threading import Lock
+from typing import Callable, Union
 
 import netCDF4
 from dateutil import parser
@@ -16,19 +17,16 @@ from dateutil import parser
 from MCD12.MCD12C1 import MCD12C1
 from rasters import RasterGeometry, Raster
 
-with warnings.catch_warnings():
-    warnings.simplefilter("ignore")
-    import tensorflow as tf
-
-    tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
-    # from keras.engine.saving import load_model
-
 from GEOS5FP import GEOS5FP
 from SRTM import SRTM
+from model.precision import DEFAULT_DTYPE
+from model.writer import IntermediateWriter
 
 import numpy as np
 import rasters as rt
 
+from .ANN import DEFAULT_ANN_BACKEND
+from .atype_ctype import LUT_atype_ctype
 from .FLiES import FLiES
 
 __author__ = "Gregory Halverson, Robert Freepartner"
@@ -45,93 +43,109 @@ DEFAULT_SAVE_INTERMEDIATE = True
 DEFAULT_SHOW_DISTRIBUTION = True
 DEFAULT_DYNAMIC_ATYPE_CTYPE = False
 
+CTAUREF_FACTORS = np.array([0.1, 0.5, 1, 5, 10, 20, 40, 60, 80, 110])
 
-def query_FLiES(filename, ctype, atype, ctop_index, albedo_index, The0_index, ctauref_index, tauref_index):
-    with netCDF4.Dataset(filename, 'r') as f:
-        return f['SWin'][0][ctype, atype, ctop_index, albedo_index, The0_index, ctauref_index, tauref_index]
-
-
-def interpolate_The0(filename, ctype, atype, ctop_index, albedo_index, The0, ctauref_index, tauref_index):
-    # constrain solar zenith angle
-    The0 = rt.clip(The0, 5, 85)
-
-    # get low index for solar zenith angle
-    The0_index_low = np.clip(np.floor(The0 / 5.0).astype(np.int32) - 1, 0, 16).astype(np.int32)
-
-    # get high index for solar zenith angle
-    The0_index_high = np.clip(np.ceil(The0 / 5.0).astype(np.int32) - 1, 0, 16).astype(np.int32)
+_LUTS = {}
+_LUT_LOCK = Lock()
 
-    # query closest incoming shortwave
-    SWin_The0_low = query_FLiES(filename, ctype, atype, ctop_index, albedo_index, The0_index_low, ctauref_index,
-                                tauref_index)
 
-    # query next closest incoming shortwave
-    SWin_The0_high = query_FLiES(filename, ctype, atype, ctop_index, albedo_index, The0_index_high, ctauref_index,
-                                 tauref_index)
+def load_LUT(filename: str = None) -> np.ndarray:
+    """
+    Load the incoming shortwave array of the FLiES lookup table into memory once per process.
+    :param filename: filename of lookup table, defaults to the bundled FLiESLUT.nc
+    :return: 7-D array of incoming shortwave indexed by ctype, atype, ctop, albedo, The0, ctauref, tauref
+    """
+    if filename is None:
+        filename = LUT_FILENAME
 
-    The0_slope = (SWin_The0_high - SWin_The0_low) / 5.0
-    The0_intermediate = The0 - np.floor(The0 / 5.0) * 5.0
-    SWin = SWin_The0_low + The0_slope * The0_intermediate
+    filename = abspath(filename)
 
-    return SWin
+    with _LUT_LOCK:
+        if filename not in _LUTS:
+            with netCDF4.Dataset(filename, 'r') as f:
+                LUT = np.ma.filled(f['SWin'][0], np.nan)
 
+            LUT.setflags(write=False)
+            _LUTS[filename] = LUT
 
-def interploate_ctauref(
-        filename,
-        ctype,
-        atype,
-        ctop_index,
-        albedo_index,
-        The0,
-        ctauref,
-        tauref_index):
-    ctauref_factors = np.array([0.1, 0.5, 1, 5, 10, 20, 40, 60, 80, 110])
-    ctauref_index = np.digitize(np.clip(ctauref, 0.1, 110), (ctauref_factors)[:-1])
+        return _LUTS[filename]
 
-    ctauref_index = np.where(np.isnan(ctauref), 0, ctauref_index)
 
-    ctauref_intermediate = ctauref - ctauref_factors[ctauref_index]
+def interpolate_LUT(
+        LUT: np.ndarray,
+        ctype: np.ndarray,
+        atype: np.ndarray,
+        ctop_index: np.ndarray,
+        albedo_index: np.ndarray,
+        The0: np.ndarray,
+        ctauref: np.ndarray,
+        tauref_index: np.ndarray,
+        interpolate_cot: bool = True) -> np.ndarray:
+    """
+    Interpolate incoming shortwave from the in-memory lookup table over solar zenith angle and cloud optical thickness.
+    All bracketing indices and weights are calculated in one pass
+    and every corner of the interpolation is fetched with a single gather from the flattened table.
+    :param LUT: 7-D lookup table returned by load_LUT
+    :param ctype: vector of cloud type indices
+    :param atype: vector of aerosol type indices
+    :param ctop_index: vector of cloud top indices
+    :param albedo_index: vector of albedo indices
+    :param The0: vector of solar zenith angles in degrees
+    :param ctauref: vector of cloud optical thickness
+    :param tauref_index: vector of aerosol optical thickness indices
+    :param interpolate_cot: interpolate over cloud optical thickness instead of using the closest value
+    :return: vector of incoming shortwave
+    """
+    # constrain solar zenith angle
+    The0 = np.clip(The0, 5, 85)
 
-    warnings.filterwarnings('ignore')
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        The0_index_low = np.clip(np.floor(The0 / 5.0).astype(np.int32) - 1, 0, 16)
+        The0_index_high = np.clip(np.ceil(The0 / 5.0).astype(np.int32) - 1, 0, 16)
 
-    ctauref_index2 = np.clip(np.where(ctauref_intermediate < 0, ctauref_index - 1, ctauref_index + 1), 0, 9)
+    The0_intermediate = The0 - np.floor(The0 / 5.0) * 5.0
 
-    warnings.resetwarnings()
+    if interpolate_cot:
+        ctauref_index = np.digitize(np.clip(ctauref, 0.1, 110), CTAUREF_FACTORS[:-1])
+        ctauref_index = np.where(np.isnan(ctauref), 0, ctauref_index)
+        ctauref_intermediate = ctauref - CTAUREF_FACTORS[ctauref_index]
+        ctauref_index2 = np.clip(np.where(ctauref_intermediate < 0, ctauref_index - 1, ctauref_index + 1), 0, 9)
+        ctauref_indices = [ctauref_index, ctauref_index2]
+    else:
+        ctauref_breaks = (CTAUREF_FACTORS[1:] + CTAUREF_FACTORS[:-1]) / 2.0
+        ctauref_indices = [np.digitize(ctauref, ctauref_breaks, right=True)]
 
-    ctauref_delta = ctauref_factors[ctauref_index2] - ctauref_factors[ctauref_index]
+    shape = LUT.shape
+    strides = np.cumprod((1,) + shape[::-1])[::-1][1:]
+    base_index = ctype * strides[0] + atype * strides[1] + ctop_index * strides[2] + albedo_index * strides[3] + tauref_index * strides[6]
 
-    SWin_ctauref1 = interpolate_The0(
-        filename,
-        ctype,
-        atype,
-        ctop_index,
-        albedo_index,
-        The0,
-        ctauref_index,
-        tauref_index
-    )
+    flat_indices = np.stack([
+        base_index + The0_index * strides[4] + index * strides[5]
+        for index in ctauref_indices
+        for The0_index in (The0_index_low, The0_index_high)
+    ])
 
-    SWin_ctauref2 = interpolate_The0(
-        filename,
-        ctype,
-        atype,
-        ctop_index,
-        albedo_index,
-        The0,
-        ctauref_index2,
-        tauref_index
-    )
+    corners = LUT.ravel()[flat_indices]
 
-    warnings.filterwarnings('ignore')
+    # interpolate over solar zenith angle for each bracketing cloud optical thickness
+    SWin_by_ctauref = [
+        corners[2 * i] + (corners[2 * i + 1] - corners[2 * i]).astype(np.float64) / 5.0 * The0_intermediate
+        for i in range(len(ctauref_indices))
+    ]
 
-    ctauref_slope = (SWin_ctauref2 - SWin_ctauref1) / ctauref_delta
+    if not interpolate_cot:
+        return SWin_by_ctauref[0]
 
-    warnings.resetwarnings()
+    SWin_ctauref1, SWin_ctauref2 = SWin_by_ctauref
+    ctauref_delta = CTAUREF_FACTORS[ctauref_index2] - CTAUREF_FACTORS[ctauref_index]
 
-    correction = ctauref_slope * ctauref_intermediate
-    SWin = SWin_ctauref1 + np.where(np.isnan(correction), 0, correction)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        ctauref_slope = (SWin_ctauref2 - SWin_ctauref1) / ctauref_delta
+        correction = ctauref_slope * ctauref_intermediate
 
-    return SWin
+    return SWin_ctauref1 + np.where(np.isnan(correction), 0, correction)
 
 
 def FLiES_lookup(
@@ -143,7 +157,8 @@ def FLiES_lookup(
         ctauref: np.ndarray,
         tauref: np.ndarray,
         LUT_filename: str = None,
-        interpolate_cot: bool = True):
+        interpolate_cot: bool = True,
+        mask: np.ndarray = None):
     if LUT_filename is None:
         LUT_filename = LUT_FILENAME
 
@@ -171,32 +186,35 @@ def FLiES_lookup(
     ctauref = np.where(ctauref > 130, 130, ctauref)
     ctauref = np.where(ctauref <= 0, 0.01, ctauref)
 
-    if interpolate_cot:
-        SWin = interploate_ctauref(
-            LUT_filename,
-            ctype,
-            atype,
-            ctop_index,
-            albedo_index,
-            The0,
-            ctauref,
-            tauref_index
-        )
+    ctype, atype, ctop_index, albedo_index, The0, ctauref, tauref_index = np.broadcast_arrays(
+        ctype,
+        atype,
+        ctop_index,
+        albedo_index,
+        The0,
+        ctauref,
+        tauref_index
+    )
+
+    if mask is None:
+        mask = np.full(The0.shape, True)
     else:
-        ctauref_factors = np.array([0.1, 0.5, 1, 5, 10, 20, 40, 60, 80, 110])
-        ctauref_breaks = (ctauref_factors[1:] + ctauref_factors[:-1]) / 2.0
-        ctauref_index = np.digitize(ctauref, ctauref_breaks, right=True)
-
-        SWin = interpolate_The0(
-            LUT_filename,
-            ctype,
-            atype,
-            ctop_index,
-            albedo_index,
-            The0,
-            ctauref_index,
-            tauref_index
-        )
+        mask = np.broadcast_to(mask, The0.shape)
+
+    SWin = np.full(The0.shape, np.nan, dtype=np.float64)
+
+    # only the unmasked pixels are gathered from the lookup table
+    SWin[mask] = interpolate_LUT(
+        load_LUT(LUT_filename),
+        ctype[mask].astype(np.int64),
+        atype[mask].astype(np.int64),
+        ctop_index[mask],
+        albedo_index[mask],
+        The0[mask],
+        ctauref[mask],
+        tauref_index[mask],
+        interpolate_cot=interpolate_cot
+    )
 
     SWin = np.where(np.isinf(SWin), np.nan, SWin)
 
@@ -231,11 +249,8 @@ def FLiES_LUT(
     # 0: cloud-free
     # 1: stratus continental
     # 2: cumulous continental
-    ctype = np.where(np.logical_and(cloud_mask, koppen_geiger == 1), 2, 1)
-    ctype = np.where(np.logical_not(cloud_mask), 0, ctype)
-
     # set aerosol type by IGBP
-    atype = np.where(IGBP == 13, 1, 0)
+    atype, ctype = LUT_atype_ctype(cloud_mask, koppen_geiger, IGBP)
 
     # calculate incoming shortwave using FLiES lookup table
     SWin = FLiES_lookup(
@@ -245,7 +260,8 @@ def FLiES_LUT(
         albedo,
         SZA,
         COT,
-        AOT
+        AOT,
+        mask=~np.isnan(COT)
     )
 
     # constrain incoming shortwave to top of atmosphere
@@ -280,7 +296,12 @@ class FLiESLUT(FLiES):
             save_intermediate: bool = DEFAULT_SAVE_INTERMEDIATE,
             show_distribution: bool = DEFAULT_SHOW_DISTRIBUTION,
             include_preview: bool = DEFAULT_INCLUDE_PREVIEW,
-            dynamic_atype_ctype: bool = DEFAULT_DYNAMIC_ATYPE_CTYPE):
+            dynamic_atype_ctype: bool = DEFAULT_DYNAMIC_ATYPE_CTYPE,
+            backend: str = DEFAULT_ANN_BACKEND,
+            intermediate_writer: IntermediateWriter = None,
+            distribution_sample_fraction: float = None,
+            memoize: bool = False,
+            dtype: Union[str, type, np.dtype] = DEFAULT_DTYPE):
         super(FLiESLUT, self).__init__(
             working_directory=working_directory,
             static_directory=static_directory,
@@ -296,7 +317,12 @@ class FLiESLUT(FLiES):
             resampling=resampling,
             save_intermediate=save_intermediate,
             show_distribution=show_distribution,
-            include_preview=include_preview
+            include_preview=include_preview,
+            backend=backend,
+            intermediate_writer=intermediate_writer,
+            distribution_sample_fraction=distribution_sample_fraction,
+            memoize=memoize,
+            dtype=dtype
         )
 
         self.ANN_model = ANN_model
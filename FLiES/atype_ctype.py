@@ -0,0 +1,94 @@
+"""
+Table-driven aerosol type and cloud type classification for FLiES
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+__author__ = "Gregory Halverson"
+
+# simplified Koppen-Geiger climate classes 1 through 6 index the table columns,
+# column 0 holds the default for any other class
+KG_CLASSES = 6
+
+# aerosol and cloud types for the ANN by cloud state and Koppen-Geiger class
+# rows: unknown cloud state (COT missing or negative), clear (COT == 0), cloudy (COT > 0)
+ANN_ATYPE_TABLE = np.array([
+    [1, 1, 1, 1, 1, 1, 1],
+    [1, 4, 5, 2, 2, 1, 1],
+    [1, 4, 5, 2, 2, 1, 1]
+], dtype=np.uint8)
+
+ANN_CTYPE_TABLE = np.array([
+    [0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0],
+    [0, 3, 1, 1, 1, 1, 1]
+], dtype=np.uint8)
+
+# cloud types for the lookup table by cloud mask and Koppen-Geiger class
+# rows: clear, cloudy
+LUT_CTYPE_TABLE = np.array([
+    [0, 0, 0, 0, 0, 0, 0],
+    [1, 2, 1, 1, 1, 1, 1]
+], dtype=np.uint8)
+
+# table columns of every uint8 Koppen-Geiger class
+KG_UINT8_INDEX = np.where(np.arange(256) <= KG_CLASSES, np.arange(256), 0).astype(np.intp)
+
+# IGBP class 13 is urban and built-up
+URBAN_IGBP = 13
+
+
+def KG_index(KG_climate: np.ndarray) -> np.ndarray:
+    """
+    Map Koppen-Geiger climate classes to table columns, sending missing or unknown classes to column 0.
+    :param KG_climate: array of simplified Koppen-Geiger climate classes
+    :return: array of table column indices
+    """
+    KG_climate = np.asarray(KG_climate)
+
+    if KG_climate.dtype == np.uint8:
+        return KG_UINT8_INDEX[KG_climate]
+
+    known = (KG_climate >= 1) & (KG_climate <= KG_CLASSES) & (KG_climate == np.floor(KG_climate))
+
+    return np.where(known, KG_climate, 0).astype(np.intp)
+
+
+def cloud_state(COT: np.ndarray) -> np.ndarray:
+    """
+    Classify cloud optical thickness as unknown (0), clear (1) or cloudy (2).
+    :param COT: array of cloud optical thickness
+    :return: array of cloud state indices
+    """
+    COT = np.asarray(COT)
+
+    return (COT >= 0).astype(np.intp) + (COT > 0)
+
+
+def ANN_atype_ctype(COT: np.ndarray, KG_climate: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Classify aerosol type and cloud type for the FLiES ANN from cloud optical thickness and climate.
+    :param COT: array of cloud optical thickness
+    :param KG_climate: array of simplified Koppen-Geiger climate classes
+    :return: uint8 arrays of aerosol type and cloud type
+    """
+    index = cloud_state(COT) * (KG_CLASSES + 1) + KG_index(KG_climate)
+
+    return ANN_ATYPE_TABLE.ravel()[index], ANN_CTYPE_TABLE.ravel()[index]
+
+
+def LUT_atype_ctype(cloud_mask: np.ndarray, KG_climate: np.ndarray, IGBP: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Classify aerosol type and cloud type for the FLiES lookup table from cloud mask, climate and land cover.
+    :param cloud_mask: boolean array of cloudy pixels
+    :param KG_climate: array of simplified Koppen-Geiger climate classes
+    :param IGBP: array of IGBP land cover classes
+    :return: uint8 arrays of aerosol type and cloud type
+    """
+    cloudy = np.asarray(cloud_mask).astype(bool).astype(np.intp)
+    atype = (np.asarray(IGBP) == URBAN_IGBP).astype(np.uint8)
+    ctype = LUT_CTYPE_TABLE[cloudy, KG_index(KG_climate)]
+
+    return atype, ctype
@@ -2,7 +2,10 @@ import json
 import logging
 import os
 import posixpath
+import socket
 import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, time, timedelta, date
 from time import sleep
 from os import makedirs
@@ -10,12 +13,15 @@ from os.path import dirname, basename, splitext, expanduser, getsize
 from os.path import exists
 from os.path import join
 from shutil import move
-from typing import List, Any, Union
+from threading import Lock, RLock
+from typing import Iterable, List, Any, Union, Dict, Tuple
 
+import netCDF4
 import numpy as np
 import pandas as pd
 import rasterio
 import requests
+from affine import Affine
 from bs4 import BeautifulSoup
 from dateutil import parser
 from matplotlib.colors import LinearSegmentedColormap
@@ -26,9 +32,13 @@ from urllib3 import Retry
 import colored_logging as cl
 import rasters as rt
 from downscaling import linear_downscale, DEFAULT_UPSAMPLING, DEFAULT_DOWNSAMPLING, bias_correct
-from rasters import Raster, RasterGeometry
+from rasters import Raster, RasterGeometry, RasterGrid, WGS84
 from timer import Timer
 
+from .manifest import GEOS5FPManifest
+from .regridding import RegriddingPlans, DEFAULT_PLANS_DIRECTORY, geometry_key, sample_points
+from .store import GEOS5FPStore, DEFAULT_STORE_CHUNK_HOURS, DEFAULT_STORE_CHUNK_CELLS, NETCDF_LOCK
+
 __author__ = 'Gregory Halverson'
 
 logger = logging.getLogger(__name__)
@@ -42,7 +52,46 @@ DEFAULT_WORKING_DIRECTORY = "."
 DEFAULT_DOWNLOAD_DIRECTORY = "GEOS5FP_download"
 DEFAULT_PRODUCTS_DIRECTORY = "GEOS5FP_products"
 DEFAULT_USE_HTTP_LISTING = False
+DEFAULT_LOCAL_FIRST = False
+# read only the window of each granule around a target geometry, opt-in like the regridding plans
+DEFAULT_SUBSET_READS = False
+# margin of source cells around the target geometry kept for resampling kernels
+DEFAULT_WINDOW_MARGIN_CELLS = 4
+DEFAULT_OFFLINE = False
+DEFAULT_REGRIDDING_PLANS = False
 DEFAULT_COARSE_CELL_SIZE_METERS = 27440
+DEFAULT_CACHE_SIZE_BYTES = 1000000000
+DEFAULT_PREFETCH_WORKERS = 4
+DEFAULT_PREFETCH_WAIT_SECONDS = 30
+DEFAULT_CHUNK_SIZE = 2 ** 20
+# None keeps the precision of the interpolated granules
+DEFAULT_DTYPE = None
+
+# 1:30, 4:30, 7:30, 10:30, 13:30, 16:30, 19:30, 22:30 UTC
+TAVG3_EXPECTED_HOURS = [1.5, 4.5, 7.5, 10.5, 13.5, 16.5, 19.5, 22.5]
+
+PRODUCT_INTERVALS = {
+    "tavg1_2d_rad_Nx": 1,
+    "tavg1_2d_slv_Nx": 1,
+    "tavg1_2d_lnd_Nx": 1,
+    "tavg1_2d_flx_Nx": 1,
+    "inst3_2d_asm_Nx": 3
+}
+
+PRODUCT_EXPECTED_HOURS = {
+    "tavg3_2d_aer_Nx": TAVG3_EXPECTED_HOURS,
+    "tavg3_2d_chm_Nx": TAVG3_EXPECTED_HOURS
+}
+
+# products used by the L3T/L4T JET models
+DEFAULT_PREFETCH_PRODUCTS = [
+    "tavg1_2d_slv_Nx",
+    "tavg1_2d_rad_Nx",
+    "tavg1_2d_lnd_Nx",
+    "inst3_2d_asm_Nx",
+    "tavg3_2d_aer_Nx",
+    "tavg3_2d_chm_Nx"
+]
 
 SM_CMAP = LinearSegmentedColormap.from_list("SM", [
     "#f6e8c3",
@@ -137,6 +186,203 @@ def HTTP_listing(
     return directories
 
 
+def GEOS5FP_grid(lat: np.ndarray, lon: np.ndarray) -> RasterGrid:
+    """
+    Generate the north-up geographic grid of a GEOS-5 FP field from its coordinate vectors.
+    :param lat: vector of cell-center latitudes
+    :param lon: vector of cell-center longitudes
+    :return: raster grid of the field
+    """
+    lat = np.array(lat, dtype=np.float64)
+    lon = np.array(lon, dtype=np.float64)
+    cell_width = float(lon[1] - lon[0])
+    cell_height = float(abs(lat[1] - lat[0]))
+    affine = Affine(cell_width, 0, float(np.min(lon)) - cell_width / 2, 0, -cell_height, float(np.max(lat)) + cell_height / 2)
+    grid = RasterGrid.from_affine(affine, len(lat), len(lon), crs=WGS84)
+
+    return grid
+
+
+def GEOS5FP_bbox_window(
+        lat: np.ndarray,
+        lon: np.ndarray,
+        bbox: Tuple[float, float, float, float],
+        margin_cells: int = DEFAULT_WINDOW_MARGIN_CELLS) -> Tuple[slice, slice]:
+    """
+    Find the rows and columns of a GEOS-5 FP field covering a longitude/latitude bounding box.
+    :param lat: vector of cell-center latitudes
+    :param lon: vector of cell-center longitudes
+    :param bbox: longitude/latitude bounding box (xmin, ymin, xmax, ymax)
+    :param margin_cells: number of cells to add around the bounding box
+    :return: row slice and column slice into the field
+    """
+    lat = np.array(lat, dtype=np.float64)
+    lon = np.array(lon, dtype=np.float64)
+    lon_min, lat_min, lon_max, lat_max = bbox
+    lat_margin = margin_cells * abs(lat[1] - lat[0])
+    lon_margin = margin_cells * abs(lon[1] - lon[0])
+    row_indices = np.where((lat >= lat_min - lat_margin) & (lat <= lat_max + lat_margin))[0]
+    col_indices = np.where((lon >= lon_min - lon_margin) & (lon <= lon_max + lon_margin))[0]
+
+    if len(row_indices) < 2 or len(col_indices) < 2:
+        return slice(None), slice(None)
+
+    return slice(row_indices[0], row_indices[-1] + 1), slice(col_indices[0], col_indices[-1] + 1)
+
+
+def GEOS5FP_window(
+        lat: np.ndarray,
+        lon: np.ndarray,
+        geometry: RasterGeometry,
+        margin_cells: int = DEFAULT_WINDOW_MARGIN_CELLS) -> Tuple[slice, slice]:
+    """
+    Find the rows and columns of a GEOS-5 FP field covering a target geometry.
+    :param lat: vector of cell-center latitudes
+    :param lon: vector of cell-center longitudes
+    :param geometry: target geometry
+    :param margin_cells: number of cells to add around the target geometry
+    :return: row slice and column slice into the field
+    """
+    return GEOS5FP_bbox_window(lat, lon, geometry.bbox.latlon, margin_cells=margin_cells)
+
+
+def filter_values(data: Raster, min_value: Any = None, max_value: Any = None, exclude_values=None) -> Raster:
+    """
+    Mask excluded values and clip a GEOS-5 FP field to a valid range.
+    :param data: raster of field
+    :param min_value: optional minimum value
+    :param max_value: optional maximum value
+    :param exclude_values: optional values to mask
+    :return: filtered raster
+    """
+    if exclude_values is not None:
+        for exclusion_value in exclude_values:
+            data = rt.where(data == exclusion_value, np.nan, data)
+
+    return rt.clip(data, min_value, max_value)
+
+
+def resample(data: Raster, geometry: RasterGeometry, resampling: str, plans: RegriddingPlans = None) -> Raster:
+    """
+    Resample a GEOS-5 FP field to a target geometry, using a cached regridding plan where supported.
+    :param data: raster of field
+    :param geometry: target geometry
+    :param resampling: sampling method
+    :param plans: optional regridding plan cache
+    :return: resampled raster
+    """
+    if plans is not None and plans.supports(data.geometry, resampling):
+        return plans.regrid(data, geometry, resampling)
+
+    return data.to_geometry(geometry, resampling=resampling)
+
+
+def variable_option(option: Any, variable: str) -> Any:
+    """
+    Select the setting for a variable from a per-variable dictionary or a setting shared by all variables.
+    :param option: dictionary keyed by variable name or single value
+    :param variable: name of variable
+    :return: setting for variable
+    """
+    if isinstance(option, dict):
+        return option.get(variable, None)
+    else:
+        return option
+
+
+def product_gap_hours(interval: float = None, expected_hours: List[float] = None) -> float:
+    """
+    Find the largest number of hours between consecutive granules of a product.
+    :param interval: number of hours between granules
+    :param expected_hours: hours of the day of the granules
+    :return: number of hours
+    """
+    if interval is not None:
+        return interval
+
+    hours = sorted(expected_hours)
+
+    return float(np.max(np.diff(hours + [hours[0] + 24])))
+
+
+def partial_download_filename(filename: str) -> str:
+    """
+    Name the partial file of a download after the host and process writing it.
+    :param filename: destination filename
+    :return: filename of partial download owned by this process
+    """
+    return f"{filename}.{socket.gethostname()}.{os.getpid()}.download"
+
+
+class GEOS5FPCache:
+    """
+    Least-recently-used memory cache of interpolated GEOS-5 FP rasters limited to a total number of bytes.
+    """
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_SIZE_BYTES):
+        if max_bytes is None:
+            max_bytes = DEFAULT_CACHE_SIZE_BYTES
+
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()
+        self._lock = RLock()
+
+    def __repr__(self):
+        return f"GEOS5FPCache(entries={len(self)}, nbytes={self.nbytes}, max_bytes={self.max_bytes}, hits={self.hits}, misses={self.misses})"
+
+    def __len__(self):
+        return len(self._images)
+
+    def __contains__(self, key):
+        return key in self._images
+
+    @staticmethod
+    def _copy(image: Raster) -> Raster:
+        # callers may modify the rasters they receive, so each one gets its own array
+        return Raster(np.array(image), geometry=image.geometry, nodata=image.nodata)
+
+    @staticmethod
+    def _size(image: Raster) -> int:
+        return int(np.size(image)) * np.dtype(image.dtype).itemsize
+
+    def get(self, key) -> Union[Raster, None]:
+        with self._lock:
+            if key not in self._images:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._images.move_to_end(key)
+
+            return self._copy(self._images[key])
+
+    def put(self, key, image: Raster):
+        size = self._size(image)
+
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._images:
+                self.nbytes -= self._size(self._images.pop(key))
+
+            self._images[key] = self._copy(image)
+            self.nbytes += size
+
+            while self.nbytes > self.max_bytes:
+                _, evicted_image = self._images.popitem(last=False)
+                self.nbytes -= self._size(evicted_image)
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
 class GEOS5FPGranule:
     logger = logging.getLogger(__name__)
 
@@ -147,7 +393,9 @@ class GEOS5FPGranule:
             filename: str,
             working_directory: str = None,
             products_directory: str = None,
-            save_products: bool = False):
+            save_products: bool = False,
+            subset: bool = DEFAULT_SUBSET_READS,
+            plans: RegriddingPlans = None):
         if not exists(filename):
             raise IOError(f"GEOS-5 FP file does not exist: {filename}")
 
@@ -171,6 +419,8 @@ class GEOS5FPGranule:
         self.products_directory = products_directory
         self.filename = filename
         self.save_products = save_products
+        self.subset = subset
+        self.plans = plans
 
     @property
     def product(self) -> str:
@@ -222,31 +472,203 @@ class GEOS5FPGranule:
 
         variable_filename = self.variable_filename(variable)
 
+        if geometry is not None and self.subset and not self.save_products:
+            return self.read_many(
+                [variable],
+                geometry=geometry,
+                resampling=resampling,
+                nodata=nodata,
+                min_value=min_value,
+                max_value=max_value,
+                exclude_values=exclude_values
+            )[variable]
+
         if variable_filename is not None and exists(variable_filename):
             data = Raster.open(variable_filename, nodata=nodata)
         else:
             try:
-                data = Raster.open(f'netcdf:"{self.filename}":{variable}', nodata=nodata)
+                with NETCDF_LOCK:
+                    data = Raster.open(f'netcdf:"{self.filename}":{variable}', nodata=nodata)
             except Exception as e:
                 logger.error(e)
                 os.remove(self.filename)
 
                 raise GEOS5FPGranuleNotAvailable(f"removed corrupted GEOS-5 FP file: {self.filename}")
 
-        if exclude_values is not None:
-            for exclusion_value in exclude_values:
-                data = rt.where(data == exclusion_value, np.nan, data)
+        data = self.process(
+            data,
+            variable,
+            geometry=geometry,
+            resampling=resampling,
+            min_value=min_value,
+            max_value=max_value,
+            exclude_values=exclude_values
+        )
+
+        return data
+
+    def process(
+            self,
+            data: Raster,
+            variable: str,
+            geometry: RasterGeometry = None,
+            resampling: str = None,
+            min_value: Any = None,
+            max_value: Any = None,
+            exclude_values=None) -> Raster:
+        if resampling is None:
+            resampling = self.DEFAULT_RESAMPLING_METHOD
+
+        variable_filename = self.variable_filename(variable)
 
-        data = rt.clip(data, min_value, max_value)
+        data = filter_values(data, min_value=min_value, max_value=max_value, exclude_values=exclude_values)
 
         if self.save_products and variable_filename is not None and not exists(variable_filename):
             data.to_geotiff(variable_filename)
 
         if geometry is not None:
-            data = data.to_geometry(geometry, resampling=resampling)
+            data = resample(data, geometry, resampling, plans=self.plans)
 
         return data
 
+    def read_many(
+            self,
+            variables: List[str],
+            geometry: RasterGeometry = None,
+            resampling: str = None,
+            nodata: Any = None,
+            min_value: Any = None,
+            max_value: Any = None,
+            exclude_values=None) -> Dict[str, Raster]:
+        """
+        Read multiple variables from this granule, opening the netCDF file only once.
+        The value limits and exclusion values may be given as dictionaries keyed by variable name.
+        When subsetting is enabled and a target geometry is given,
+        only the window of the global field covering the target geometry is read.
+        :param variables: list of variable names
+        :param geometry: optional target geometry
+        :param resampling: optional sampling method for resampling to target geometry
+        :param nodata: optional nodata value
+        :param min_value: minimum value or dictionary of minimum values by variable
+        :param max_value: maximum value or dictionary of maximum values by variable
+        :param exclude_values: exclusion values or dictionary of exclusion values by variable
+        :return: dictionary of rasters keyed by variable name
+        """
+        if nodata is None:
+            nodata = np.nan
+
+        variables = list(dict.fromkeys(variables))
+        results = {}
+        unread_variables = []
+
+        for variable in variables:
+            variable_filename = self.variable_filename(variable)
+
+            if variable_filename is not None and exists(variable_filename):
+                results[variable] = Raster.open(variable_filename, nodata=nodata)
+            else:
+                unread_variables.append(variable)
+
+        if len(unread_variables) > 0:
+            try:
+                with NETCDF_LOCK, netCDF4.Dataset(self.filename, "r") as dataset:
+                    lat = dataset.variables["lat"][:]
+                    lon = dataset.variables["lon"][:]
+                    flip = lat[0] < lat[-1]
+
+                    if geometry is not None and self.subset and not self.save_products:
+                        rows, cols = GEOS5FP_window(lat, lon, geometry)
+                    else:
+                        rows, cols = slice(None), slice(None)
+
+                    grid = GEOS5FP_grid(lat[rows], lon[cols])
+
+                    for variable in unread_variables:
+                        source = dataset.variables[variable]
+
+                        if source.ndim == 3:
+                            array = source[0, rows, cols]
+                        else:
+                            array = source[rows, cols]
+
+                        array = np.ma.filled(array.astype(np.float32), np.nan)
+
+                        if flip:
+                            array = np.flipud(array)
+
+                        results[variable] = Raster(np.ascontiguousarray(array), geometry=grid, nodata=nodata)
+            except Exception as e:
+                logger.error(e)
+                os.remove(self.filename)
+
+                raise GEOS5FPGranuleNotAvailable(f"removed corrupted GEOS-5 FP file: {self.filename}")
+
+        for variable in variables:
+            results[variable] = self.process(
+                results[variable],
+                variable,
+                geometry=geometry,
+                resampling=resampling,
+                min_value=variable_option(min_value, variable),
+                max_value=variable_option(max_value, variable),
+                exclude_values=variable_option(exclude_values, variable)
+            )
+
+        return results
+
+    def sample(
+            self,
+            variables: List[str],
+            lats: np.ndarray,
+            lons: np.ndarray,
+            resampling: str = "bilinear") -> Dict[str, np.ndarray]:
+        """
+        Sample multiple variables from this granule at a set of points, opening the netCDF file only once.
+        Only the rows of each field spanning the points are read.
+        :param variables: list of variable names
+        :param lats: latitudes of points
+        :param lons: longitudes of points
+        :param resampling: sampling method, bilinear by default
+        :return: dictionary of vectors of sampled values keyed by variable name
+        """
+        lats = np.array(lats, dtype=np.float64).ravel()
+        lons = np.array(lons, dtype=np.float64).ravel()
+        results = {}
+
+        try:
+            with NETCDF_LOCK, netCDF4.Dataset(self.filename, "r") as dataset:
+                lat = np.array(dataset.variables["lat"][:], dtype=np.float64)
+                lon = np.array(dataset.variables["lon"][:], dtype=np.float64)
+
+                if np.all(np.isnan(lats)):
+                    rows = slice(None)
+                else:
+                    lat_margin = 2 * abs(lat[1] - lat[0])
+                    row_indices = np.where((lat >= np.nanmin(lats) - lat_margin) & (lat <= np.nanmax(lats) + lat_margin))[0]
+
+                    if len(row_indices) < 2:
+                        rows = slice(None)
+                    else:
+                        rows = slice(row_indices[0], row_indices[-1] + 1)
+
+                for variable in dict.fromkeys(variables):
+                    source = dataset.variables[variable]
+
+                    if source.ndim == 3:
+                        array = source[0, rows, :]
+                    else:
+                        array = source[rows, :]
+
+                    array = np.ma.filled(array.astype(np.float32), np.nan)
+                    results[variable] = sample_points(array, lat[rows], lon, lats, lons, method=resampling)
+        except Exception as e:
+            logger.error(e)
+            os.remove(self.filename)
+
+            raise GEOS5FPGranuleNotAvailable(f"removed corrupted GEOS-5 FP file: {self.filename}")
+
+        return results
+
 
 class FailedGEOS5FPDownload(ConnectionError):
     pass
@@ -265,7 +687,15 @@ class GEOS5FP:
             download_directory: str = None,
             products_directory: str = None,
             remote: str = None,
-            save_products: bool = False):
+            save_products: bool = False,
+            cache_size_bytes: int = DEFAULT_CACHE_SIZE_BYTES,
+            local_first: bool = DEFAULT_LOCAL_FIRST,
+            offline: bool = DEFAULT_OFFLINE,
+            subset: bool = DEFAULT_SUBSET_READS,
+            regridding_plans: bool = DEFAULT_REGRIDDING_PLANS,
+            plans_directory: str = None,
+            stores_directory: str = None,
+            dtype: Union[str, type, np.dtype] = DEFAULT_DTYPE):
         if working_directory is None:
             working_directory = DEFAULT_WORKING_DIRECTORY
 
@@ -293,25 +723,82 @@ class GEOS5FP:
         if remote is None:
             remote = self.DEFAULT_URL_BASE
 
+        # consolidated stores are only read from a directory given explicitly
+        if stores_directory is not None and stores_directory.startswith("~"):
+            stores_directory = expanduser(stores_directory)
+
+        if regridding_plans:
+            if plans_directory is None:
+                plans_directory = join(working_directory, DEFAULT_PLANS_DIRECTORY)
+
+            if plans_directory.startswith("~"):
+                plans_directory = expanduser(plans_directory)
+
+            logger.info(f"GEOS-5 FP regridding plans directory: {cl.dir(plans_directory)}")
+            plans = RegriddingPlans(plans_directory)
+        else:
+            plans = None
+
         self.working_directory = working_directory
         self.download_directory = download_directory
         self.products_directory = products_directory
         self.remote = remote
         self._listings = {}
         self.filenames = set([])
+        self._filenames_lock = Lock()
+        self._download_locks = {}
+        self._download_locks_lock = Lock()
         self.save_products = save_products
+        self.cache = GEOS5FPCache(max_bytes=cache_size_bytes)
+        self.subset = subset
+        self.plans = plans
+        self.stores_directory = stores_directory
+        self.stores = [] if stores_directory is None else GEOS5FPStore.open_directory(stores_directory)
+        self.local_first = local_first or offline
+        self.offline = offline
+        self._days_available = set([])
+        self._validated_filenames = set([])
+        self.dtype = None if dtype is None else np.dtype(dtype)
+
+        try:
+            self.manifest = GEOS5FPManifest(download_directory)
+        except Exception as e:
+            logger.warning(f"unable to open GEOS-5 FP manifest in download directory: {download_directory}")
+            logger.warning(e)
+            self.manifest = None
+
+        if len(self.stores) > 0:
+            logger.info(f"GEOS-5 FP consolidated stores: {cl.val(len(self.stores))} in {cl.dir(stores_directory)}")
+
+        if self.offline:
+            logger.info("GEOS-5 FP offline mode: resolving granules from download directory only")
+        elif self.local_first:
+            logger.info("GEOS-5 FP local-first mode: resolving granules from download directory before remote")
 
     def __repr__(self):
         display_dict = {
             "URL": self.remote,
             "download_directory": self.download_directory,
-            "products_directory": self.products_directory
+            "products_directory": self.products_directory,
+            "local_first": self.local_first,
+            "offline": self.offline
         }
 
         display_string = json.dumps(display_dict, indent=2)
 
         return display_string
 
+    def cast(self, image: Raster) -> Raster:
+        """
+        Cast an interpolated raster to the precision of this connection before it is cached.
+        :param image: interpolated raster
+        :return: raster in the precision of this connection
+        """
+        if self.dtype is None or image.dtype == self.dtype:
+            return image
+
+        return image.astype(self.dtype)
+
     def _check_remote(self):
         logger.info(f"checking URL: {cl.URL(self.remote)}")
         response = requests.head(self.remote)
@@ -439,10 +926,17 @@ class GEOS5FP:
         if retries is None:
             retries = RETRIES
 
+        if self.offline:
+            return self.local_listing(date_UTC, product_name=product_name)
+
         day_URL = self.day_URL(date_UTC)
 
-        if requests.head(day_URL).status_code == 404:
-            raise GEOS5FPDayNotAvailable(f"GEOS-5 FP day not available: {day_URL}")
+        # only available days are remembered, since a missing day may be published later
+        if day_URL not in self._days_available:
+            if requests.head(day_URL).status_code == 404:
+                raise GEOS5FPDayNotAvailable(f"GEOS-5 FP day not available: {day_URL}")
+
+            self._days_available.add(day_URL)
 
         logger.info(f"listing URL: {cl.URL(day_URL)}")
         # listing = HTTP_listing(day_URL, timeout=timeout, retries=retries)
@@ -471,6 +965,41 @@ class GEOS5FP:
 
         return df
 
+    def local_listing(
+            self,
+            date_UTC: datetime or str,
+            product_name: str = None) -> pd.DataFrame:
+        """
+        List the GEOS-5 FP granules for a given date that are already in the download directory.
+        :param date_UTC: date in UTC
+        :param product_name: optional name of GEOS-5 FP product
+        :return: data frame of times, products and URLs of local granules
+        """
+        if isinstance(date_UTC, str):
+            date_UTC = parser.parse(date_UTC).date()
+
+        day_URL = self.day_URL(date_UTC)
+        directory = self.date_download_directory(date_UTC)
+        logger.info(f"listing directory: {cl.dir(directory)}")
+
+        if exists(directory):
+            filenames = sorted([
+                filename
+                for filename
+                in os.listdir(directory)
+                if filename.endswith(".nc4") and (product_name is None or product_name in filename)
+            ])
+        else:
+            filenames = []
+
+        df = pd.DataFrame({"URL": [posixpath.join(day_URL, filename) for filename in filenames]}, dtype=object)
+        df["time_UTC"] = df["URL"].apply(
+            lambda URL: datetime.strptime(posixpath.basename(URL).split(".")[4], "%Y%m%d_%H%M"))
+        df["product"] = df["URL"].apply(lambda URL: posixpath.basename(URL).split(".")[3])
+        df = df[["time_UTC", "product", "URL"]]
+
+        return df
+
     def generate_filenames(
             self,
             date_UTC: datetime or str,
@@ -548,99 +1077,174 @@ class GEOS5FP:
 
         return filename
 
+    def validate_file(self, filename: str) -> bool:
+        """
+        Check that a downloaded GEOS-5 FP file can be opened, removing it if it is corrupted.
+        Files are only opened if they are not in the download manifest
+        or if their size or modification time changed since they were recorded.
+        :param filename: filename of GEOS-5 FP file
+        :return: True if the file exists and is readable
+        """
+        if filename in self._validated_filenames and exists(filename):
+            return True
+
+        self._validated_filenames.discard(filename)
+
+        if not exists(filename):
+            return False
+
+        if self.manifest is not None and self.manifest.verify(filename):
+            self._validated_filenames.add(filename)
+            return True
+
+        if getsize(filename) == 0:
+            logger.warning(f"removing zero-size corrupted GEOS-5 FP file: {filename}")
+            os.remove(filename)
+            return False
+
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+
+                with NETCDF_LOCK, rasterio.open(filename, "r") as file:
+                    pass
+        except Exception as e:
+            logger.exception(f"unable to open GEOS-5 FP file: {filename}")
+            logger.warning(f"removing corrupted GEOS-5 FP file: {filename}")
+            os.remove(filename)
+
+            if self.manifest is not None:
+                self.manifest.remove(filename)
+
+            return False
+
+        if self.manifest is not None:
+            try:
+                self.manifest.record(filename)
+            except Exception as e:
+                logger.warning(e)
+
+        self._validated_filenames.add(filename)
+
+        return True
+
+    def add_filenames(self, filenames: Iterable[str]):
+        """
+        Record the filenames of granules read by this connection, which concurrent model stages share.
+        :param filenames: filenames of granules
+        """
+        with self._filenames_lock:
+            self.filenames = self.filenames | set(filenames)
+
+    def snapshot_filenames(self) -> List[str]:
+        """
+        Take a snapshot of the filenames of the granules read so far by this connection.
+        :return: sorted list of filenames
+        """
+        with self._filenames_lock:
+            return sorted(self.filenames)
+
+    def download_lock(self, filename: str) -> Lock:
+        """
+        Get the lock that serializes downloads of a file between the threads of this process.
+        :param filename: destination filename
+        :return: lock of file
+        """
+        with self._download_locks_lock:
+            return self._download_locks.setdefault(filename, Lock())
+
+    def granule(self, filename: str) -> GEOS5FPGranule:
+        return GEOS5FPGranule(
+            filename=filename,
+            working_directory=self.working_directory,
+            products_directory=self.products_directory,
+            save_products=self.save_products,
+            subset=self.subset,
+            plans=self.plans
+        )
+
     def download_file(self, URL: str, filename: str = None, retries: int = RETRIES, wait_seconds: int = WAIT_SECONDS) -> GEOS5FPGranule:
         if filename is None:
             filename = self.download_filename(URL)
 
-        if exists(filename) and getsize(filename) == 0:
-            logger.warning(f"removing previously created zero-size corrupted GEOS-5 FP file: {filename}")
-            os.remove(filename)
+        # threads downloading the same granule wait for the first download and then find its file
+        with self.download_lock(filename):
+            if exists(filename) and getsize(filename) == 0:
+                logger.warning(f"removing previously created zero-size corrupted GEOS-5 FP file: {filename}")
+                os.remove(filename)
 
-        while retries > 0:
-            retries -= 1
+            if self.local_first and self.validate_file(filename):
+                logger.info(f"GEOS-5 FP file found: {cl.file(filename)}")
+                return self.granule(filename)
 
-            try:
-                if requests.head(URL).status_code == 404:
-                    directory_URL = posixpath.dirname(URL)
+            if self.offline:
+                raise GEOS5FPGranuleNotAvailable(f"GEOS-5 FP granule not available in offline mode: {filename}")
 
-                    if requests.head(directory_URL).status_code == 404:
-                        raise GEOS5FPDayNotAvailable(f"GEOS-5 FP day not available: {directory_URL}")
-                    else:
-                        raise GEOS5FPGranuleNotAvailable(f"GEOS-5 FP granule not available: {URL}")
+            while retries > 0:
+                retries -= 1
 
-                if exists(filename):
-                    try:
-                        with warnings.catch_warnings():
-                            warnings.simplefilter("ignore")
+                try:
+                    if requests.head(URL).status_code == 404:
+                        directory_URL = posixpath.dirname(URL)
 
-                            with rasterio.open(filename, "r") as file:
-                                pass
-                    except Exception as e:
-                        logger.exception(f"unable to open GEOS-5 FP file: {filename}")
-                        logger.warning(f"removing corrupted GEOS-5 FP file: {filename}")
-                        os.remove(filename)
+                        if requests.head(directory_URL).status_code == 404:
+                            raise GEOS5FPDayNotAvailable(f"GEOS-5 FP day not available: {directory_URL}")
+                        else:
+                            raise GEOS5FPGranuleNotAvailable(f"GEOS-5 FP granule not available: {URL}")
 
-                if exists(filename):
-                    logger.info(f"GEOS-5 FP file found: {cl.file(filename)}")
-                else:
-                    logger.info(f"downloading GEOS-5 FP: {cl.URL(URL)} -> {cl.file(filename)}")
-                    makedirs(dirname(filename), exist_ok=True)
-                    partial_filename = f"{filename}.{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.download"
+                    if exists(filename):
+                        self.validate_file(filename)
+
+                    if exists(filename):
+                        logger.info(f"GEOS-5 FP file found: {cl.file(filename)}")
+                    else:
+                        logger.info(f"downloading GEOS-5 FP: {cl.URL(URL)} -> {cl.file(filename)}")
+                        makedirs(dirname(filename), exist_ok=True)
+                        partial_filename = partial_download_filename(filename)
 
-                    if exists(partial_filename) and getsize(partial_filename) == 0:
-                        logger.warning(f"removing zero-size corrupted GEOS-5 FP file: {partial_filename}")
-                        os.remove(partial_filename)
+                        if exists(partial_filename) and getsize(partial_filename) == 0:
+                            logger.warning(f"removing zero-size corrupted GEOS-5 FP file: {partial_filename}")
+                            os.remove(partial_filename)
 
-                    command = f'wget -c -O "{partial_filename}" "{URL}"'
-                    # logger.info(command)
-                    timer = Timer()
-                    os.system(command)
+                        command = f'wget -c -O "{partial_filename}" "{URL}"'
+                        # logger.info(command)
+                        timer = Timer()
+                        os.system(command)
 
-                    if not exists(partial_filename):
-                        raise IOError(f"unable to download URL: {URL}")
+                        if not exists(partial_filename):
+                            raise IOError(f"unable to download URL: {URL}")
 
-                    if not exists(partial_filename):
-                        raise FailedGEOS5FPDownload(f"GEOS-5 FP partial download file not found: {URL} -> {partial_filename}")
-                    elif exists(partial_filename) and getsize(partial_filename) == 0:
-                        logger.warning(f"removing zero-size corrupted GEOS-5 FP file: {partial_filename}")
-                        os.remove(partial_filename)
-                        raise FailedGEOS5FPDownload(f"zero-size file from GEOS-5 FP download: {URL} -> {partial_filename}")
+                        if not exists(partial_filename):
+                            raise FailedGEOS5FPDownload(f"GEOS-5 FP partial download file not found: {URL} -> {partial_filename}")
+                        elif exists(partial_filename) and getsize(partial_filename) == 0:
+                            logger.warning(f"removing zero-size corrupted GEOS-5 FP file: {partial_filename}")
+                            os.remove(partial_filename)
+                            raise FailedGEOS5FPDownload(f"zero-size file from GEOS-5 FP download: {URL} -> {partial_filename}")
 
-                    move(partial_filename, filename)
+                        move(partial_filename, filename)
 
-                    if not exists(filename):
-                        raise FailedGEOS5FPDownload(f"GEOS-5 FP final download file not found: {URL} -> {filename}")
+                        if not exists(filename):
+                            raise FailedGEOS5FPDownload(f"GEOS-5 FP final download file not found: {URL} -> {filename}")
 
-                    try:
-                        with rasterio.open(filename, "r") as file:
-                            pass
-                    except Exception as e:
-                        logger.exception(f"unable to open GEOS-5 FP file: {filename}")
-                        logger.warning(f"removing corrupted GEOS-5 FP file: {filename}")
-                        os.remove(filename)
-                        raise FailedGEOS5FPDownload(f"GEOS-5 FP corrupted download: {URL} -> {filename}")
+                        if not self.validate_file(filename):
+                            raise FailedGEOS5FPDownload(f"GEOS-5 FP corrupted download: {URL} -> {filename}")
 
-                    logger.info(f"GEOS-5 FP download completed: {cl.file(filename)} ({cl.val(f'{(getsize(filename) / 1000000):0.2f}')} mb) ({cl.time(timer.duration)} seconds)")
+                        logger.info(f"GEOS-5 FP download completed: {cl.file(filename)} ({cl.val(f'{(getsize(filename) / 1000000):0.2f}')} mb) ({cl.time(timer.duration)} seconds)")
 
-                granule = GEOS5FPGranule(
-                    filename=filename,
-                    working_directory=self.working_directory,
-                    products_directory=self.products_directory,
-                    save_products=self.save_products
-                )
+                    granule = self.granule(filename)
 
-                return granule
+                    return granule
 
-            except Exception as e:
-                if retries == 0:
-                    raise e
+                except Exception as e:
+                    if retries == 0:
+                        raise e
 
-                self.logger.warning(e)
-                self.logger.warning(f"waiting {wait_seconds} for GEOS-5 FP download retry")
-                sleep(wait_seconds)
-                continue
+                    self.logger.warning(e)
+                    self.logger.warning(f"waiting {wait_seconds} for GEOS-5 FP download retry")
+                    sleep(wait_seconds)
+                    continue
 
-    def before_and_after(
+    def before_and_after_URLs(
             self,
             time_UTC: datetime or str,
             product: str,
@@ -648,7 +1252,7 @@ class GEOS5FP:
             expected_hours: List[float] = None,
             timeout: float = None,
             retries: int = None,
-            use_http_listing: bool = DEFAULT_USE_HTTP_LISTING) -> (datetime, Raster, datetime, Raster):
+            use_http_listing: bool = DEFAULT_USE_HTTP_LISTING) -> (str, str):
         if isinstance(time_UTC, str):
             time_UTC = parser.parse(time_UTC)
 
@@ -689,39 +1293,19 @@ class GEOS5FP:
             # raise IOError(f"no {product} files found after {time_UTC}")
 
         after_time_UTC, after_URL = after_listing.iloc[0][["time_UTC", "URL"]]
-        before_granule = self.download_file(before_URL)
-        after_granule = self.download_file(after_URL)
 
-        return before_granule, after_granule
+        return before_URL, after_URL
 
-    def interpolate(
+    def before_and_after(
             self,
             time_UTC: datetime or str,
             product: str,
-            variable: str,
-            geometry: RasterGeometry = None,
-            resampling: str = None,
-            cmap=None,
-            min_value: Any = None,
-            max_value: Any = None,
-            exclude_values=None,
             interval: int = None,
             expected_hours: List[float] = None,
             timeout: float = None,
             retries: int = None,
-            use_http_listing: bool = DEFAULT_USE_HTTP_LISTING) -> Raster:
-        if interval is None:
-            if product == "tavg1_2d_rad_Nx":
-                interval = 1
-            elif product == "tavg1_2d_slv_Nx":
-                interval = 1
-            elif product == "inst3_2d_asm_Nx":
-                interval = 3
-
-        if interval is None and expected_hours is None:
-            raise ValueError(f"interval or expected hours not given for {product}")
-
-        before_granule, after_granule = self.before_and_after(
+            use_http_listing: bool = DEFAULT_USE_HTTP_LISTING) -> (GEOS5FPGranule, GEOS5FPGranule):
+        before_URL, after_URL = self.before_and_after_URLs(
             time_UTC,
             product,
             interval=interval,
@@ -731,36 +1315,602 @@ class GEOS5FP:
             use_http_listing=use_http_listing
         )
 
-        logger.info(f"interpolating GEOS-5 FP {cl.name(product)} {cl.name(variable)} from {cl.time(f'{before_granule.time_UTC:%Y-%m-%d %H:%M} UTC ')} and {cl.time(f'{after_granule.time_UTC:%Y-%m-%d %H:%M} UTC')} to {cl.time(f'{time_UTC:%Y-%m-%d %H:%M} UTC')}")
+        before_granule = self.download_file(before_URL)
+        after_granule = self.download_file(after_URL)
 
-        with Timer() as timer:
-            before = before_granule.read(
-                variable,
-                geometry=geometry,
-                resampling=resampling,
-                min_value=min_value,
-                max_value=max_value,
-                exclude_values=exclude_values
+        return before_granule, after_granule
+
+    def session(self, max_workers: int = DEFAULT_PREFETCH_WORKERS, retries: int = RETRIES) -> requests.Session:
+        """
+        Create an HTTP session with a connection pool large enough for concurrent downloads.
+        :param max_workers: number of concurrent connections
+        :param retries: number of retries for server errors
+        :return: requests session
+        """
+        session = requests.Session()
+
+        adapter = HTTPAdapter(
+            pool_connections=max_workers,
+            pool_maxsize=max_workers,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=3,
+                status_forcelist=[500, 502, 503, 504]
             )
+        )
 
-            after = after_granule.read(
-                variable,
-                geometry=geometry,
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        return session
+
+    def fetch_file(
+            self,
+            URL: str,
+            filename: str = None,
+            session: requests.Session = None,
+            retries: int = RETRIES,
+            wait_seconds: int = DEFAULT_PREFETCH_WAIT_SECONDS,
+            timeout: float = WAIT_SECONDS,
+            chunk_size: int = DEFAULT_CHUNK_SIZE) -> str:
+        """
+        Download a GEOS-5 FP file over an HTTP session, resuming a partial download of this process if one exists.
+        :param URL: URL of GEOS-5 FP file
+        :param filename: optional destination filename
+        :param session: optional requests session to share connections between downloads
+        :param retries: number of attempts
+        :param wait_seconds: seconds to wait between attempts
+        :param timeout: connection timeout in seconds
+        :param chunk_size: number of bytes written at a time
+        :return: filename of downloaded file
+        """
+        if filename is None:
+            filename = self.download_filename(URL)
+
+        # threads fetching the same granule wait for the first download and then find its file
+        with self.download_lock(filename):
+            if self.validate_file(filename):
+                return filename
+
+            if session is None:
+                session = requests
+
+            makedirs(dirname(filename), exist_ok=True)
+            # only a partial file written by this process is resumed, since PGEs may share a download directory
+            partial_filename = partial_download_filename(filename)
+
+            while retries > 0:
+                retries -= 1
+
+                try:
+                    if exists(partial_filename):
+                        resume_bytes = getsize(partial_filename)
+                    else:
+                        resume_bytes = 0
+
+                    if resume_bytes > 0:
+                        headers = {"Range": f"bytes={resume_bytes}-"}
+                    else:
+                        headers = {}
+
+                    timer = Timer()
+
+                    with session.get(URL, headers=headers, stream=True, timeout=timeout) as response:
+                        if response.status_code == 404:
+                            raise GEOS5FPGranuleNotAvailable(f"GEOS-5 FP granule not available: {URL}")
+
+                        if response.status_code == 416:
+                            # the partial file is already complete
+                            pass
+                        else:
+                            response.raise_for_status()
+
+                            if response.status_code == 206:
+                                logger.info(f"resuming GEOS-5 FP download at {cl.val(resume_bytes)} bytes: {cl.URL(URL)} -> {cl.file(filename)}")
+                                mode = "ab"
+                            else:
+                                logger.info(f"downloading GEOS-5 FP: {cl.URL(URL)} -> {cl.file(filename)}")
+                                mode = "wb"
+
+                            with open(partial_filename, mode) as file:
+                                for chunk in response.iter_content(chunk_size=chunk_size):
+                                    file.write(chunk)
+
+                    if not exists(partial_filename) or getsize(partial_filename) == 0:
+                        raise FailedGEOS5FPDownload(f"zero-size file from GEOS-5 FP download: {URL} -> {partial_filename}")
+
+                    move(partial_filename, filename)
+
+                    if not self.validate_file(filename):
+                        raise FailedGEOS5FPDownload(f"GEOS-5 FP corrupted download: {URL} -> {filename}")
+
+                    logger.info(f"GEOS-5 FP download completed: {cl.file(filename)} ({cl.val(f'{(getsize(filename) / 1000000):0.2f}')} mb) ({cl.time(timer.duration)} seconds)")
+
+                    return filename
+
+                except GEOS5FPGranuleNotAvailable as e:
+                    raise e
+
+                except Exception as e:
+                    if retries == 0:
+                        raise FailedGEOS5FPDownload(f"unable to download GEOS-5 FP file: {URL} ({e})")
+
+                    logger.warning(e)
+                    logger.warning(f"waiting {wait_seconds} seconds for GEOS-5 FP download retry: {URL}")
+                    sleep(wait_seconds)
+
+    def granule_URLs(
+            self,
+            times_UTC: List[datetime],
+            products: List[str] = None,
+            use_http_listing: bool = DEFAULT_USE_HTTP_LISTING) -> List[str]:
+        """
+        List the unique URLs of the GEOS-5 FP granules needed to interpolate products to a set of times.
+        :param times_UTC: list of date/times in UTC
+        :param products: optional list of GEOS-5 FP product names
+        :param use_http_listing: use HTTP listing instead of generating expected filenames
+        :return: sorted list of unique URLs
+        """
+        if isinstance(times_UTC, (datetime, str)):
+            times_UTC = [times_UTC]
+
+        if products is None:
+            products = DEFAULT_PREFETCH_PRODUCTS
+
+        if isinstance(products, str):
+            products = [products]
+
+        URLs = set([])
+
+        for time_UTC in times_UTC:
+            if isinstance(time_UTC, str):
+                time_UTC = parser.parse(time_UTC)
+
+            for product in products:
+                before_URL, after_URL = self.before_and_after_URLs(
+                    time_UTC,
+                    product,
+                    interval=self.product_interval(product),
+                    expected_hours=PRODUCT_EXPECTED_HOURS.get(product, None),
+                    use_http_listing=use_http_listing
+                )
+
+                URLs |= {before_URL, after_URL}
+
+        return sorted(URLs)
+
+    def prefetch(
+            self,
+            times_UTC: List[datetime],
+            products: List[str] = None,
+            max_workers: int = DEFAULT_PREFETCH_WORKERS,
+            retries: int = RETRIES,
+            wait_seconds: int = DEFAULT_PREFETCH_WAIT_SECONDS,
+            use_http_listing: bool = DEFAULT_USE_HTTP_LISTING) -> List[str]:
+        """
+        Download all GEOS-5 FP granules needed to interpolate products to a batch of times,
+        fetching files concurrently over a shared HTTP session.
+        :param times_UTC: list of date/times in UTC
+        :param products: optional list of GEOS-5 FP product names
+        :param max_workers: maximum number of concurrent downloads
+        :param retries: number of attempts per file
+        :param wait_seconds: seconds to wait between attempts
+        :param use_http_listing: use HTTP listing instead of generating expected filenames
+        :return: list of filenames of available granules
+        """
+        URLs = self.granule_URLs(times_UTC, products=products, use_http_listing=use_http_listing)
+        filenames = {URL: self.download_filename(URL) for URL in URLs}
+        missing_URLs = [URL for URL in URLs if not self.validate_file(filenames[URL])]
+        logger.info(f"GEOS-5 FP prefetch: {cl.val(len(URLs) - len(missing_URLs))} of {cl.val(len(URLs))} granules available locally")
+
+        if len(missing_URLs) == 0:
+            return [filenames[URL] for URL in URLs]
+
+        if self.offline:
+            raise GEOS5FPGranuleNotAvailable(f"{len(missing_URLs)} GEOS-5 FP granules not available in offline mode")
+
+        errors = []
+
+        with Timer() as timer, self.session(max_workers=max_workers, retries=retries) as session:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(
+                        self.fetch_file,
+                        URL,
+                        filename=filenames[URL],
+                        session=session,
+                        retries=retries,
+                        wait_seconds=wait_seconds
+                    ): URL
+                    for URL
+                    in missing_URLs
+                }
+
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.warning(e)
+                        errors.append(futures[future])
+
+            logger.info(f"GEOS-5 FP prefetch of {cl.val(len(missing_URLs) - len(errors))} granules complete ({timer:0.2f} seconds)")
+
+        if len(errors) > 0:
+            raise FailedGEOS5FPDownload(f"unable to prefetch {len(errors)} GEOS-5 FP granules: {', '.join(errors)}")
+
+        return [filenames[URL] for URL in URLs]
+
+    def clear_cache(self):
+        """
+        Release all interpolated rasters held in memory and reset the cache hit and miss counters.
+        """
+        logger.info(f"clearing GEOS-5 FP cache of {cl.val(len(self.cache))} rasters ({cl.val(f'{(self.cache.nbytes / 1000000):0.2f}')} mb)")
+        self.cache.clear()
+
+    def cache_key(
+            self,
+            product: str,
+            variable: str,
+            before_granule: Union[GEOS5FPGranule, str],
+            after_granule: Union[GEOS5FPGranule, str],
+            time_fraction: float,
+            geometry: RasterGeometry = None,
+            resampling: str = None,
+            min_value: Any = None,
+            max_value: Any = None,
+            exclude_values=None) -> Tuple:
+        if resampling is None:
+            resampling = GEOS5FPGranule.DEFAULT_RESAMPLING_METHOD
+
+        if exclude_values is not None:
+            exclude_values = tuple(exclude_values)
+
+        return (
+            product,
+            variable,
+            before_granule if isinstance(before_granule, str) else before_granule.filename,
+            after_granule if isinstance(after_granule, str) else after_granule.filename,
+            round(float(time_fraction), 9),
+            geometry_key(geometry),
+            resampling,
+            min_value,
+            max_value,
+            exclude_values
+        )
+
+    def consolidate(
+            self,
+            start: Union[datetime, str],
+            end: Union[datetime, str],
+            products: Union[List[str], str],
+            variables: Union[List[str], Dict[str, List[str]]],
+            bbox: Tuple[float, float, float, float],
+            chunk_hours: int = DEFAULT_STORE_CHUNK_HOURS,
+            chunk_cells: int = DEFAULT_STORE_CHUNK_CELLS,
+            max_workers: int = DEFAULT_PREFETCH_WORKERS,
+            use_http_listing: bool = DEFAULT_USE_HTTP_LISTING) -> List[GEOS5FPStore]:
+        """
+        Build consolidated time series stores of GEOS-5 FP fields for a region from downloaded granules.
+        One chunked, compressed store is written per product to the stores directory,
+        and interpolation reads from these stores whenever they cover a request.
+        :param start: start date/time in UTC
+        :param end: end date/time in UTC
+        :param products: list of GEOS-5 FP product names
+        :param variables: list of variable names shared by all products or dictionary of variable names keyed by product
+        :param bbox: longitude/latitude bounding box (xmin, ymin, xmax, ymax)
+        :param chunk_hours: number of time steps per chunk
+        :param chunk_cells: number of rows and columns per chunk
+        :param max_workers: maximum number of concurrent downloads
+        :return: list of stores
+        """
+        if self.stores_directory is None:
+            raise ValueError("stores directory not given for GEOS-5 FP consolidation")
+
+        if isinstance(start, str):
+            start = parser.parse(start)
+
+        if isinstance(end, str):
+            end = parser.parse(end)
+
+        if isinstance(products, str):
+            products = [products]
+
+        lon_min, lat_min, lon_max, lat_max = bbox
+        stores = []
+
+        for product in products:
+            product_variables = list(dict.fromkeys(variable_option(variables, product)))
+            times_UTC = [start + timedelta(hours=hours) for hours in range(int((end - start) / timedelta(hours=1)) + 1)]
+
+            filenames = self.prefetch(
+                times_UTC,
+                products=[product],
+                max_workers=max_workers,
+                use_http_listing=use_http_listing
+            )
+
+            granules = sorted([self.granule(filename) for filename in filenames], key=lambda granule: granule.time_UTC)
+            filename = join(
+                self.stores_directory,
+                f"GEOS5FP_{product}_{start:%Y%m%dT%H%M}_{end:%Y%m%dT%H%M}_{lon_min:0.2f}_{lat_min:0.2f}_{lon_max:0.2f}_{lat_max:0.2f}.nc"
+            )
+            partial_filename = f"{filename}.partial"
+
+            logger.info(f"consolidating {cl.val(len(granules))} GEOS-5 FP {cl.name(product)} granules into store: {cl.file(filename)}")
+
+            # the store stays open for writing across granules, so the netCDF lock is held until it is closed
+            with NETCDF_LOCK, Timer() as timer:
+                dataset = None
+
+                try:
+                    for granule in granules:
+                        with netCDF4.Dataset(granule.filename, "r") as source:
+                            lat = source.variables["lat"][:]
+                            lon = source.variables["lon"][:]
+                            rows, cols = GEOS5FP_bbox_window(lat, lon, bbox)
+
+                            if dataset is None:
+                                dataset = GEOS5FPStore.create(
+                                    partial_filename,
+                                    product,
+                                    product_variables,
+                                    lat[rows],
+                                    lon[cols],
+                                    chunk_hours=chunk_hours,
+                                    chunk_cells=chunk_cells
+                                )
+
+                            arrays = {}
+
+                            for variable in product_variables:
+                                if source.variables[variable].ndim == 3:
+                                    arrays[variable] = np.ma.filled(source.variables[variable][0, rows, cols].astype(np.float32), np.nan)
+                                else:
+                                    arrays[variable] = np.ma.filled(source.variables[variable][rows, cols].astype(np.float32), np.nan)
+
+                        GEOS5FPStore.append(dataset, granule.time_UTC, arrays)
+                finally:
+                    if dataset is not None:
+                        dataset.close()
+
+                move(partial_filename, filename)
+                logger.info(f"GEOS-5 FP {cl.name(product)} store complete ({timer:0.2f} seconds)")
+
+            store = GEOS5FPStore(filename)
+            self.stores = [existing for existing in self.stores if existing.filename != store.filename] + [store]
+            stores.append(store)
+
+        return stores
+
+    def find_store(
+            self,
+            time_UTC: datetime,
+            product: str,
+            variable: str,
+            geometry: RasterGeometry = None,
+            max_gap_hours: float = None) -> Union[GEOS5FPStore, None]:
+        """
+        Find a consolidated store covering a variable at a given time over a target geometry.
+        :param time_UTC: date/time in UTC
+        :param product: name of GEOS-5 FP product
+        :param variable: name of variable
+        :param geometry: target geometry
+        :param max_gap_hours: maximum number of hours between the time steps bracketing the time
+        :return: store or None if no store covers the request
+        """
+        if geometry is None or len(self.stores) == 0:
+            return None
+
+        if isinstance(time_UTC, str):
+            time_UTC = parser.parse(time_UTC)
+
+        bbox = geometry.bbox.latlon
+
+        for store in self.stores:
+            if store.covers(product, variable, bbox) and store.bracket(time_UTC, max_gap_hours=max_gap_hours) is not None:
+                return store
+
+        return None
+
+    def interpolate_store(
+            self,
+            store: GEOS5FPStore,
+            time_UTC: datetime or str,
+            variable: str,
+            geometry: RasterGeometry,
+            resampling: str = None,
+            cmap=None,
+            min_value: Any = None,
+            max_value: Any = None,
+            exclude_values=None,
+            max_gap_hours: float = None) -> Raster:
+        """
+        Interpolate a variable to a given time from a consolidated store.
+        :param store: store covering the request
+        :param time_UTC: date/time in UTC
+        :param variable: name of variable
+        :param geometry: target geometry
+        :param resampling: optional sampling method for resampling to target geometry
+        :param max_gap_hours: maximum number of hours between the time steps bracketing the time
+        :return: raster of variable
+        """
+        if isinstance(time_UTC, str):
+            time_UTC = parser.parse(time_UTC)
+
+        if resampling is None:
+            resampling = GEOS5FPGranule.DEFAULT_RESAMPLING_METHOD
+
+        bracket = store.bracket(time_UTC, max_gap_hours=max_gap_hours)
+
+        if bracket is None:
+            raise ValueError(f"GEOS-5 FP store does not bracket {time_UTC:%Y-%m-%d %H:%M} UTC: {store.filename}")
+
+        before_index, after_index = bracket
+        before_time_UTC = store.time_UTC(before_index)
+        after_time_UTC = store.time_UTC(after_index)
+        time_fraction = (time_UTC - before_time_UTC) / (after_time_UTC - before_time_UTC)
+
+        key = self.cache_key(
+            store.product,
+            variable,
+            f"{store.filename}:{before_index}",
+            f"{store.filename}:{after_index}",
+            time_fraction,
+            geometry=geometry,
+            resampling=resampling,
+            min_value=min_value,
+            max_value=max_value,
+            exclude_values=exclude_values
+        )
+
+        interpolated_data = self.cache.get(key)
+
+        if interpolated_data is not None:
+            logger.info(f"GEOS-5 FP {cl.name(store.product)} {cl.name(variable)} found in cache for {cl.time(f'{time_UTC:%Y-%m-%d %H:%M} UTC')}")
+        else:
+            logger.info(f"interpolating GEOS-5 FP {cl.name(store.product)} {cl.name(variable)} from store at {cl.time(f'{before_time_UTC:%Y-%m-%d %H:%M} UTC ')} and {cl.time(f'{after_time_UTC:%Y-%m-%d %H:%M} UTC')} to {cl.time(f'{time_UTC:%Y-%m-%d %H:%M} UTC')}")
+
+            with Timer() as timer:
+                rows, cols = GEOS5FP_window(store.lat, store.lon, geometry)
+                grid = GEOS5FP_grid(store.lat[rows], store.lon[cols])
+                flip = store.lat[0] < store.lat[-1]
+                fields = []
+
+                for index in (before_index, after_index):
+                    array = store.read(variable, index, rows, cols)
+
+                    if flip:
+                        array = np.flipud(array)
+
+                    data = Raster(np.ascontiguousarray(array), geometry=grid, nodata=np.nan)
+                    data = filter_values(data, min_value=min_value, max_value=max_value, exclude_values=exclude_values)
+                    fields.append(resample(data, geometry, resampling, plans=self.plans))
+
+                before, after = fields
+                interpolated_data = self.cast(before + (after - before) * time_fraction)
+                logger.info(f"GEOS-5 FP interpolation complete ({timer:0.2f} seconds)")
+
+            self.cache.put(key, interpolated_data)
+
+        # the store stands in for its granules in the provenance of the products
+        filenames = [store.filename]
+        self.add_filenames(filenames)
+        interpolated_data["filenames"] = filenames
+
+        if cmap is not None:
+            interpolated_data.cmap = cmap
+
+        return interpolated_data
+
+    def product_interval(self, product: str) -> Union[int, None]:
+        return PRODUCT_INTERVALS.get(product, None)
+
+    def interpolate(
+            self,
+            time_UTC: datetime or str,
+            product: str,
+            variable: str,
+            geometry: RasterGeometry = None,
+            resampling: str = None,
+            cmap=None,
+            min_value: Any = None,
+            max_value: Any = None,
+            exclude_values=None,
+            interval: int = None,
+            expected_hours: List[float] = None,
+            timeout: float = None,
+            retries: int = None,
+            use_http_listing: bool = DEFAULT_USE_HTTP_LISTING) -> Raster:
+        if interval is None:
+            interval = self.product_interval(product)
+
+        if interval is None and expected_hours is None:
+            raise ValueError(f"interval or expected hours not given for {product}")
+
+        # a store only stands in for the granules when its time steps are as close as the product's
+        max_gap_hours = product_gap_hours(interval, expected_hours)
+        store = self.find_store(time_UTC, product, variable, geometry=geometry, max_gap_hours=max_gap_hours)
+
+        if store is not None:
+            return self.interpolate_store(
+                store,
+                time_UTC,
+                variable,
+                geometry=geometry,
                 resampling=resampling,
+                cmap=cmap,
                 min_value=min_value,
                 max_value=max_value,
-                exclude_values=exclude_values
+                exclude_values=exclude_values,
+                max_gap_hours=max_gap_hours
             )
 
-            time_fraction = (time_UTC - before_granule.time_UTC) / (after_granule.time_UTC - before_granule.time_UTC)
-            source_diff = after - before
-            interpolated_data = before + source_diff * time_fraction
-            logger.info(f"GEOS-5 FP interpolation complete ({timer:0.2f} seconds)")
+        # the cache is keyed by the local filenames of the granules, so they are only downloaded on a miss
+        before_URL, after_URL = self.before_and_after_URLs(
+            time_UTC,
+            product,
+            interval=interval,
+            expected_hours=expected_hours,
+            timeout=timeout,
+            retries=retries,
+            use_http_listing=use_http_listing
+        )
+
+        before_filename = self.download_filename(before_URL)
+        after_filename = self.download_filename(after_URL)
+        before_time_UTC = self.time_from_URL(before_URL)
+        after_time_UTC = self.time_from_URL(after_URL)
+        time_fraction = (time_UTC - before_time_UTC) / (after_time_UTC - before_time_UTC)
+
+        key = self.cache_key(
+            product,
+            variable,
+            before_filename,
+            after_filename,
+            time_fraction,
+            geometry=geometry,
+            resampling=resampling,
+            min_value=min_value,
+            max_value=max_value,
+            exclude_values=exclude_values
+        )
+
+        interpolated_data = self.cache.get(key)
+
+        if interpolated_data is not None:
+            logger.info(f"GEOS-5 FP {cl.name(product)} {cl.name(variable)} found in cache for {cl.time(f'{time_UTC:%Y-%m-%d %H:%M} UTC')}")
+        else:
+            logger.info(f"interpolating GEOS-5 FP {cl.name(product)} {cl.name(variable)} from {cl.time(f'{before_time_UTC:%Y-%m-%d %H:%M} UTC ')} and {cl.time(f'{after_time_UTC:%Y-%m-%d %H:%M} UTC')} to {cl.time(f'{time_UTC:%Y-%m-%d %H:%M} UTC')}")
+            before_granule = self.download_file(before_URL, filename=before_filename)
+            after_granule = self.download_file(after_URL, filename=after_filename)
+
+            with Timer() as timer:
+                before = before_granule.read(
+                    variable,
+                    geometry=geometry,
+                    resampling=resampling,
+                    min_value=min_value,
+                    max_value=max_value,
+                    exclude_values=exclude_values
+                )
+
+                after = after_granule.read(
+                    variable,
+                    geometry=geometry,
+                    resampling=resampling,
+                    min_value=min_value,
+                    max_value=max_value,
+                    exclude_values=exclude_values
+                )
+
+                source_diff = after - before
+                interpolated_data = self.cast(before + source_diff * time_fraction)
+                logger.info(f"GEOS-5 FP interpolation complete ({timer:0.2f} seconds)")
+
+            self.cache.put(key, interpolated_data)
 
-        before_filename = before_granule.filename
-        after_filename = after_granule.filename
         filenames = [before_filename, after_filename]
-        self.filenames = set(self.filenames) | set(filenames)
+        self.add_filenames(filenames)
         interpolated_data["filenames"] = filenames
 
         if cmap is not None:
@@ -768,6 +1918,258 @@ class GEOS5FP:
 
         return interpolated_data
 
+    def interpolate_many(
+            self,
+            time_UTC: datetime or str,
+            product: str,
+            variables: List[str],
+            geometry: RasterGeometry = None,
+            resampling: str = None,
+            cmap=None,
+            min_value: Any = None,
+            max_value: Any = None,
+            exclude_values=None,
+            interval: int = None,
+            expected_hours: List[float] = None,
+            timeout: float = None,
+            retries: int = None,
+            use_http_listing: bool = DEFAULT_USE_HTTP_LISTING) -> Dict[str, Raster]:
+        """
+        Interpolate multiple variables of the same product to a given time,
+        reading each of the bracketing granules only once.
+        The colormap, value limits and exclusion values may be given as dictionaries keyed by variable name.
+        :param time_UTC: date/time in UTC
+        :param product: name of GEOS-5 FP product
+        :param variables: list of variable names
+        :param geometry: optional target geometry
+        :param resampling: optional sampling method for resampling to target geometry
+        :return: dictionary of rasters keyed by variable name
+        """
+        if isinstance(time_UTC, str):
+            time_UTC = parser.parse(time_UTC)
+
+        if interval is None:
+            interval = self.product_interval(product)
+
+        if interval is None and expected_hours is None:
+            raise ValueError(f"interval or expected hours not given for {product}")
+
+        variables = list(dict.fromkeys(variables))
+        max_gap_hours = product_gap_hours(interval, expected_hours)
+        stores = {variable: self.find_store(time_UTC, product, variable, geometry=geometry, max_gap_hours=max_gap_hours) for variable in variables}
+
+        if all(store is not None for store in stores.values()):
+            return {
+                variable: self.interpolate_store(
+                    stores[variable],
+                    time_UTC,
+                    variable,
+                    geometry=geometry,
+                    resampling=resampling,
+                    cmap=variable_option(cmap, variable),
+                    min_value=variable_option(min_value, variable),
+                    max_value=variable_option(max_value, variable),
+                    exclude_values=variable_option(exclude_values, variable),
+                    max_gap_hours=max_gap_hours
+                )
+                for variable
+                in variables
+            }
+
+        # the cache is keyed by the local filenames of the granules, so they are only downloaded on a miss
+        before_URL, after_URL = self.before_and_after_URLs(
+            time_UTC,
+            product,
+            interval=interval,
+            expected_hours=expected_hours,
+            timeout=timeout,
+            retries=retries,
+            use_http_listing=use_http_listing
+        )
+
+        before_filename = self.download_filename(before_URL)
+        after_filename = self.download_filename(after_URL)
+        before_time_UTC = self.time_from_URL(before_URL)
+        after_time_UTC = self.time_from_URL(after_URL)
+        time_fraction = (time_UTC - before_time_UTC) / (after_time_UTC - before_time_UTC)
+        filenames = [before_filename, after_filename]
+        results = {}
+        keys = {}
+
+        for variable in variables:
+            keys[variable] = self.cache_key(
+                product,
+                variable,
+                before_filename,
+                after_filename,
+                time_fraction,
+                geometry=geometry,
+                resampling=resampling,
+                min_value=variable_option(min_value, variable),
+                max_value=variable_option(max_value, variable),
+                exclude_values=variable_option(exclude_values, variable)
+            )
+
+            cached_data = self.cache.get(keys[variable])
+
+            if cached_data is not None:
+                results[variable] = cached_data
+
+        unread_variables = [variable for variable in variables if variable not in results]
+
+        if len(unread_variables) > 0:
+            logger.info(f"interpolating GEOS-5 FP {cl.name(product)} {', '.join(cl.name(variable) for variable in unread_variables)} from {cl.time(f'{before_time_UTC:%Y-%m-%d %H:%M} UTC ')} and {cl.time(f'{after_time_UTC:%Y-%m-%d %H:%M} UTC')} to {cl.time(f'{time_UTC:%Y-%m-%d %H:%M} UTC')}")
+            before_granule = self.download_file(before_URL, filename=before_filename)
+            after_granule = self.download_file(after_URL, filename=after_filename)
+
+            with Timer() as timer:
+                before = before_granule.read_many(
+                    unread_variables,
+                    geometry=geometry,
+                    resampling=resampling,
+                    min_value=min_value,
+                    max_value=max_value,
+                    exclude_values=exclude_values
+                )
+
+                after = after_granule.read_many(
+                    unread_variables,
+                    geometry=geometry,
+                    resampling=resampling,
+                    min_value=min_value,
+                    max_value=max_value,
+                    exclude_values=exclude_values
+                )
+
+                for variable in unread_variables:
+                    interpolated_data = self.cast(before[variable] + (after[variable] - before[variable]) * time_fraction)
+                    self.cache.put(keys[variable], interpolated_data)
+                    results[variable] = interpolated_data
+
+                logger.info(f"GEOS-5 FP interpolation of {cl.val(len(unread_variables))} variables complete ({timer:0.2f} seconds)")
+
+        for variable in variables:
+            results[variable]["filenames"] = filenames
+            variable_cmap = variable_option(cmap, variable)
+
+            if variable_cmap is not None:
+                results[variable].cmap = variable_cmap
+
+        self.add_filenames(filenames)
+
+        return {variable: results[variable] for variable in variables}
+
+    def extract_points(
+            self,
+            lats: Union[np.ndarray, List[float]],
+            lons: Union[np.ndarray, List[float]],
+            times_UTC: Union[List[datetime], datetime, str],
+            variables: Union[List[str], Dict[str, List[str]]],
+            product: str = None,
+            resampling: str = "bilinear",
+            interval: int = None,
+            expected_hours: List[float] = None,
+            timeout: float = None,
+            retries: int = None,
+            use_http_listing: bool = DEFAULT_USE_HTTP_LISTING) -> pd.DataFrame:
+        """
+        Extract time-interpolated GEOS-5 FP values at a set of point locations and times.
+        Requests are grouped by the granules bracketing their times,
+        so each granule is opened once and all of its points are sampled in a single pass.
+        :param lats: latitudes of points
+        :param lons: longitudes of points
+        :param times_UTC: date/time in UTC of each point or a single date/time shared by all points
+        :param variables: list of variable names of the given product or dictionary of variable names keyed by product
+        :param product: name of GEOS-5 FP product when variables are given as a list
+        :param resampling: spatial sampling method, bilinear by default
+        :return: data frame with one row per point and variable with columns
+            point, lat, lon, time_UTC, product, variable and value
+        """
+        lats = np.array(lats, dtype=np.float64).ravel()
+        lons = np.array(lons, dtype=np.float64).ravel()
+
+        if isinstance(times_UTC, (str, datetime)):
+            times_UTC = [times_UTC] * len(lats)
+
+        times_UTC = [parser.parse(time_UTC) if isinstance(time_UTC, str) else time_UTC for time_UTC in times_UTC]
+
+        if not len(lats) == len(lons) == len(times_UTC):
+            raise ValueError(f"mismatched number of latitudes ({len(lats)}), longitudes ({len(lons)}) and times ({len(times_UTC)})")
+
+        if isinstance(variables, dict):
+            product_variables = variables
+        elif product is None:
+            raise ValueError("product must be given when variables are given as a list")
+        else:
+            product_variables = {product: variables}
+
+        points = pd.DataFrame({"point": np.arange(len(lats)), "lat": lats, "lon": lons, "time_UTC": times_UTC})
+        tables = []
+
+        for product, variables in product_variables.items():
+            variables = list(dict.fromkeys(variables))
+            product_interval = interval
+
+            if product_interval is None:
+                product_interval = self.product_interval(product)
+
+            if product_interval is None and expected_hours is None:
+                raise ValueError(f"interval or expected hours not given for {product}")
+
+            URLs = {}
+
+            for time_UTC in points.time_UTC.unique():
+                URLs[time_UTC] = self.before_and_after_URLs(
+                    pd.Timestamp(time_UTC).to_pydatetime(),
+                    product,
+                    interval=product_interval,
+                    expected_hours=expected_hours,
+                    timeout=timeout,
+                    retries=retries,
+                    use_http_listing=use_http_listing
+                )
+
+            before_URLs = points.time_UTC.map(lambda time_UTC: URLs[time_UTC][0])
+            after_URLs = points.time_UTC.map(lambda time_UTC: URLs[time_UTC][1])
+            granules = {}
+            samples = {}
+
+            logger.info(f"extracting GEOS-5 FP {cl.name(product)} {', '.join(cl.name(variable) for variable in variables)} at {cl.val(len(points))} points from {cl.val(len(set(before_URLs) | set(after_URLs)))} granules")
+
+            with Timer() as timer:
+                for URL in sorted(set(before_URLs) | set(after_URLs)):
+                    granule = self.download_file(URL)
+                    granules[URL] = granule
+                    indices = np.where((before_URLs == URL) | (after_URLs == URL))[0]
+                    samples[URL] = (indices, granule.sample(variables, lats[indices], lons[indices], resampling=resampling))
+
+                before_times = np.array([granules[URL].time_UTC for URL in before_URLs], dtype="datetime64[ns]")
+                after_times = np.array([granules[URL].time_UTC for URL in after_URLs], dtype="datetime64[ns]")
+                point_times = np.array(points.time_UTC, dtype="datetime64[ns]")
+                time_fraction = (point_times - before_times) / (after_times - before_times)
+
+                for variable in variables:
+                    before = np.full(len(points), np.nan, dtype=np.float32)
+                    after = np.full(len(points), np.nan, dtype=np.float32)
+
+                    for URL, (indices, values) in samples.items():
+                        before_mask = np.array(before_URLs.iloc[indices] == URL)
+                        after_mask = np.array(after_URLs.iloc[indices] == URL)
+                        before[indices[before_mask]] = values[variable][before_mask]
+                        after[indices[after_mask]] = values[variable][after_mask]
+
+                    table = points.copy()
+                    table["product"] = product
+                    table["variable"] = variable
+                    table["value"] = before + (after - before) * time_fraction
+                    tables.append(table)
+
+                logger.info(f"GEOS-5 FP point extraction complete ({timer:0.2f} seconds)")
+
+            self.add_filenames(granule.filename for granule in granules.values())
+
+        return pd.concat(tables, ignore_index=True)
+
     def SFMC(self, time_UTC: datetime, geometry: RasterGeometry = None, resampling: str = None) -> Raster:
         """
         top soil layer moisture content cubic meters per cubic meters
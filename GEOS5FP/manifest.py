@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+from os import makedirs
+from os.path import join, exists, abspath, relpath, dirname
+from typing import Union
+
+import colored_logging as cl
+
+__author__ = 'Gregory Halverson'
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MANIFEST_FILENAME = "GEOS5FP_manifest.sqlite"
+CHECKSUM_SAMPLE_BYTES = 2 ** 20
+SQLITE_TIMEOUT_SECONDS = 60
+
+
+def fast_checksum(filename: str, sample_bytes: int = CHECKSUM_SAMPLE_BYTES) -> str:
+    """
+    Calculate a checksum of the size, beginning and end of a file without reading the whole file.
+    :param filename: filename of file
+    :param sample_bytes: number of bytes to read from each end of the file
+    :return: hexadecimal digest
+    """
+    size = os.stat(filename).st_size
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(size).encode())
+
+    with open(filename, "rb") as file:
+        digest.update(file.read(sample_bytes))
+
+        if size > sample_bytes:
+            file.seek(max(sample_bytes, size - sample_bytes))
+            digest.update(file.read(sample_bytes))
+
+    return digest.hexdigest()
+
+
+class GEOS5FPManifest:
+    """
+    Persistent record of the GEOS-5 FP files in a download directory that have been validated.
+    Each entry stores the size, modification time and a fast checksum of a file.
+    A file with the same size and modification time is accepted as is, and a file of the same size with a new
+    modification time, as when a download directory is copied or restored, is accepted if its checksum matches,
+    so a file only needs to be re-validated if its contents change.
+    The manifest is an SQLite database so that concurrent processes can share a download directory.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, download_directory: str, filename: str = None):
+        if filename is None:
+            filename = join(download_directory, DEFAULT_MANIFEST_FILENAME)
+
+        self.download_directory = abspath(download_directory)
+        self.filename = filename
+
+        makedirs(dirname(abspath(self.filename)), exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS validated ("
+                "filename TEXT PRIMARY KEY, "
+                "size INTEGER NOT NULL, "
+                "mtime_ns INTEGER NOT NULL, "
+                "checksum TEXT NOT NULL)"
+            )
+
+    def __repr__(self):
+        return f"GEOS5FPManifest({self.filename})"
+
+    def __len__(self):
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM validated").fetchone()[0]
+
+    @contextmanager
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.filename, timeout=SQLITE_TIMEOUT_SECONDS)
+
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _key(self, filename: str) -> str:
+        return relpath(abspath(filename), self.download_directory)
+
+    def entry(self, filename: str) -> Union[tuple, None]:
+        with self._connect() as connection:
+            return connection.execute(
+                "SELECT size, mtime_ns, checksum FROM validated WHERE filename = ?",
+                (self._key(filename),)
+            ).fetchone()
+
+    def verify(self, filename: str) -> bool:
+        """
+        Check a file against its manifest entry, comparing its checksum if only its modification time has changed.
+        The modification time of the entry is refreshed when the checksum matches.
+        :param filename: filename of GEOS-5 FP file
+        :return: True if the file matches its manifest entry
+        """
+        if not exists(filename):
+            return False
+
+        entry = self.entry(filename)
+
+        if entry is None:
+            return False
+
+        size, mtime_ns, checksum = entry
+        status = os.stat(filename)
+
+        if status.st_size != size:
+            return False
+
+        if status.st_mtime_ns == mtime_ns:
+            return True
+
+        if fast_checksum(filename) != checksum:
+            return False
+
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE validated SET mtime_ns = ? WHERE filename = ?",
+                (status.st_mtime_ns, self._key(filename))
+            )
+
+        logger.info(f"verified checksum of GEOS-5 FP file with new modification time: {cl.file(filename)}")
+
+        return True
+
+    def record(self, filename: str) -> str:
+        """
+        Record a file that has been validated.
+        :param filename: filename of GEOS-5 FP file
+        :return: checksum of file
+        """
+        status = os.stat(filename)
+        checksum = fast_checksum(filename)
+
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO validated (filename, size, mtime_ns, checksum) VALUES (?, ?, ?, ?)",
+                (self._key(filename), status.st_size, status.st_mtime_ns, checksum)
+            )
+
+        logger.info(f"recorded GEOS-5 FP file in manifest: {cl.file(filename)}")
+
+        return checksum
+
+    def remove(self, filename: str):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM validated WHERE filename = ?", (self._key(filename),))
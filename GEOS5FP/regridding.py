@@ -0,0 +1,349 @@
+import hashlib
+import logging
+from os import makedirs
+from os.path import join, exists
+from threading import RLock
+from typing import Tuple, Union
+
+import numpy as np
+
+import colored_logging as cl
+from rasters import Raster, RasterGeometry, RasterGrid
+
+__author__ = 'Gregory Halverson'
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PLANS_DIRECTORY = "GEOS5FP_plans"
+DEFAULT_CHUNK_PIXELS = 2 ** 18
+REGRIDDING_METHODS = ("nearest", "linear", "bilinear", "cubic")
+# Keys cubic convolution parameter used by GDAL
+CUBIC_A = -0.5
+
+
+def geometry_key(geometry: RasterGeometry) -> Union[Tuple, None]:
+    """
+    Generate a hashable key identifying a target geometry.
+    Grids are identified by their projection, affine transform and shape.
+    Other geometries are identified by a digest of their coordinate arrays.
+    :param geometry: target geometry or None
+    :return: hashable key
+    """
+    if geometry is None:
+        return None
+
+    if isinstance(geometry, RasterGrid):
+        return "grid", str(geometry.crs), tuple(geometry.affine), tuple(geometry.shape)
+
+    digest = hashlib.sha1()
+    digest.update(str(geometry.crs).encode())
+    digest.update(np.ascontiguousarray(geometry.x).tobytes())
+    digest.update(np.ascontiguousarray(geometry.y).tobytes())
+
+    return "geolocation", tuple(geometry.shape), digest.hexdigest()
+
+
+def kernel_weights(fraction: np.ndarray, method: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate the offsets and weights of the source cells along one axis.
+    :param fraction: fractional source index of each target cell
+    :param method: nearest, linear, bilinear or cubic
+    :return: integer offsets from the base index and weights for each target cell
+    """
+    if method == "nearest":
+        return np.array([0]), np.ones((len(fraction), 1), dtype=np.float32)
+
+    t = (fraction - np.floor(fraction)).astype(np.float32)
+
+    if method in ("linear", "bilinear"):
+        return np.array([0, 1]), np.stack([1 - t, t], axis=1)
+
+    if method == "cubic":
+        a = CUBIC_A
+        t2 = t * t
+        t3 = t2 * t
+
+        weights = np.stack([
+            a * (t3 - 2 * t2 + t),
+            (a + 2) * t3 - (a + 3) * t2 + 1,
+            -(a + 2) * t3 + (2 * a + 3) * t2 - a * t,
+            -a * t3 + a * t2
+        ], axis=1)
+
+        return np.array([-1, 0, 1, 2]), weights
+
+    raise ValueError(f"unsupported regridding method: {method}")
+
+
+def axis_indices(fraction: np.ndarray, size: int, method: str, wrap: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate the source indices and weights along one axis for fractional source indices.
+    :param fraction: fractional source index of each target cell
+    :param size: number of source cells along the axis
+    :param method: nearest, linear, bilinear or cubic
+    :param wrap: wrap indices around the axis instead of clamping to the edges
+    :return: source indices and weights for each target cell
+    """
+    if method == "nearest":
+        fraction = np.round(fraction)
+
+    offsets, weights = kernel_weights(fraction, method)
+    indices = np.floor(fraction).astype(np.int64)[:, None] + offsets[None, :]
+
+    if wrap:
+        indices = np.mod(indices, size)
+    else:
+        indices = np.clip(indices, 0, size - 1)
+
+    return indices, weights.astype(np.float32)
+
+
+def weighted_gather(
+        source: np.ndarray,
+        rows: np.ndarray,
+        cols: np.ndarray,
+        row_weights: np.ndarray,
+        col_weights: np.ndarray) -> np.ndarray:
+    """
+    Gather the source cells surrounding each target cell and combine them with separable weights.
+    Missing source cells are left out and the remaining weights are renormalized.
+    :return: vector of combined values
+    """
+    values = source[rows[:, :, None], cols[:, None, :]]
+    weights = row_weights[:, :, None] * col_weights[:, None, :]
+    missing = np.isnan(values)
+    weights = np.where(missing, 0, weights)
+    total_weight = np.sum(weights, axis=(1, 2))
+    weighted_sum = np.sum(np.where(missing, 0, values) * weights, axis=(1, 2))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(np.abs(total_weight) > 1e-6, weighted_sum / total_weight, np.nan).astype(np.float32)
+
+
+def sample_points(
+        source: np.ndarray,
+        lat: np.ndarray,
+        lon: np.ndarray,
+        point_lat: np.ndarray,
+        point_lon: np.ndarray,
+        method: str = "bilinear") -> np.ndarray:
+    """
+    Sample a field on a regular latitude/longitude grid at a set of points.
+    :param source: field with rows along latitude and columns along longitude
+    :param lat: vector of cell-center latitudes
+    :param lon: vector of cell-center longitudes
+    :param point_lat: latitudes of points
+    :param point_lon: longitudes of points
+    :param method: nearest, linear, bilinear or cubic
+    :return: vector of sampled values
+    """
+    lat = np.array(lat, dtype=np.float64)
+    lon = np.array(lon, dtype=np.float64)
+    point_lat = np.array(point_lat, dtype=np.float64).ravel()
+    point_lon = np.array(point_lon, dtype=np.float64).ravel()
+    valid = ~np.isnan(point_lat) & ~np.isnan(point_lon)
+    cell_height = lat[1] - lat[0]
+    cell_width = lon[1] - lon[0]
+    row_fraction = (np.where(valid, point_lat, lat[0]) - lat[0]) / cell_height
+    col_fraction = (np.where(valid, point_lon, lon[0]) - lon[0]) / cell_width
+    wrap = abs(len(lon) * cell_width - 360) < abs(cell_width)
+    rows, row_weights = axis_indices(row_fraction, len(lat), method)
+    cols, col_weights = axis_indices(col_fraction, len(lon), method, wrap=wrap)
+    values = weighted_gather(np.asarray(source, dtype=np.float32), rows, cols, row_weights, col_weights)
+
+    return np.where(valid, values, np.nan)
+
+
+class RegriddingPlan:
+    """
+    Precomputed source indices and weights for resampling a geographic grid to a target geometry.
+    Applying a plan to a new field is a single vectorized gather and weighted sum.
+    """
+    def __init__(
+            self,
+            rows: np.ndarray,
+            cols: np.ndarray,
+            row_weights: np.ndarray,
+            col_weights: np.ndarray,
+            valid: np.ndarray,
+            shape: Tuple[int, int],
+            source_shape: Tuple[int, int]):
+        self.rows = rows
+        self.cols = cols
+        self.row_weights = row_weights
+        self.col_weights = col_weights
+        self.valid = valid
+        self.shape = tuple(int(size) for size in shape)
+        self.source_shape = tuple(int(size) for size in source_shape)
+
+    def __repr__(self):
+        return f"RegriddingPlan(source_shape={self.source_shape}, shape={self.shape}, kernel={self.rows.shape[1]}x{self.cols.shape[1]})"
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (self.rows, self.cols, self.row_weights, self.col_weights, self.valid))
+
+    @classmethod
+    def build(cls, source_grid: RasterGrid, target_geometry: RasterGeometry, method: str) -> "RegriddingPlan":
+        """
+        Build a plan for resampling a geographic source grid to a target geometry.
+        :param source_grid: geographic grid of the source field
+        :param target_geometry: target geometry
+        :param method: nearest, linear, bilinear or cubic
+        :return: regridding plan
+        """
+        affine = source_grid.affine
+        source_rows, source_cols = source_grid.shape
+        lat = np.array(target_geometry.lat, dtype=np.float64).ravel()
+        lon = np.array(target_geometry.lon, dtype=np.float64).ravel()
+        valid = ~np.isnan(lat) & ~np.isnan(lon)
+        lat = np.where(valid, lat, 0)
+        lon = np.where(valid, lon, 0)
+
+        # fractional indices relative to the source cell centers
+        col_fraction = (lon - affine.c) / affine.a - 0.5
+        row_fraction = (lat - affine.f) / affine.e - 0.5
+        # global grids wrap around the antimeridian
+        wrap = abs(source_cols * affine.a - 360) < abs(affine.a)
+        rows, row_weights = axis_indices(row_fraction, source_rows, method)
+        cols, col_weights = axis_indices(col_fraction, source_cols, method, wrap=wrap)
+
+        return cls(
+            rows=rows.astype(np.int16),
+            cols=cols.astype(np.int16),
+            row_weights=row_weights,
+            col_weights=col_weights,
+            valid=valid,
+            shape=target_geometry.shape,
+            source_shape=source_grid.shape
+        )
+
+    def apply(self, source: np.ndarray, chunk_pixels: int = DEFAULT_CHUNK_PIXELS) -> np.ndarray:
+        """
+        Resample a source field with this plan.
+        Missing source cells are left out and the remaining weights are renormalized.
+        :param source: source field matching the plan's source shape
+        :param chunk_pixels: number of target cells processed at a time
+        :return: resampled field in the target shape
+        """
+        source = np.asarray(source, dtype=np.float32)
+
+        if source.shape != self.source_shape:
+            raise ValueError(f"source shape {source.shape} does not match regridding plan source shape {self.source_shape}")
+
+        size = len(self.valid)
+        output = np.full(size, np.nan, dtype=np.float32)
+
+        for start in range(0, size, chunk_pixels):
+            end = min(start + chunk_pixels, size)
+
+            output[start:end] = weighted_gather(
+                source,
+                self.rows[start:end],
+                self.cols[start:end],
+                self.row_weights[start:end],
+                self.col_weights[start:end]
+            )
+
+        output = np.where(self.valid, output, np.nan)
+
+        return output.reshape(self.shape)
+
+    def save(self, filename: str):
+        np.savez(
+            filename,
+            rows=self.rows,
+            cols=self.cols,
+            row_weights=self.row_weights,
+            col_weights=self.col_weights,
+            valid=self.valid,
+            shape=np.array(self.shape),
+            source_shape=np.array(self.source_shape)
+        )
+
+    @classmethod
+    def load(cls, filename: str) -> "RegriddingPlan":
+        with np.load(filename) as file:
+            return cls(
+                rows=file["rows"],
+                cols=file["cols"],
+                row_weights=file["row_weights"],
+                col_weights=file["col_weights"],
+                valid=file["valid"],
+                shape=tuple(file["shape"]),
+                source_shape=tuple(file["source_shape"])
+            )
+
+
+class RegriddingPlans:
+    """
+    Cache of regridding plans keyed by source grid, target geometry and method,
+    held in memory and optionally persisted to a directory for reuse across runs.
+    """
+    def __init__(self, directory: str = None):
+        if directory is not None:
+            makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self._plans = {}
+        self._lock = RLock()
+
+    def __repr__(self):
+        return f"RegriddingPlans(directory={self.directory}, plans={len(self._plans)})"
+
+    def __len__(self):
+        return len(self._plans)
+
+    @staticmethod
+    def supports(source_geometry: RasterGeometry, method: str) -> bool:
+        return method in REGRIDDING_METHODS and isinstance(source_geometry, RasterGrid) and source_geometry.is_geographic
+
+    def plan_filename(self, key: Tuple) -> Union[str, None]:
+        if self.directory is None:
+            return None
+
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+
+        return join(self.directory, f"{key[-1]}_{digest}.npz")
+
+    def plan(self, source_grid: RasterGrid, target_geometry: RasterGeometry, method: str) -> RegriddingPlan:
+        key = (geometry_key(source_grid), geometry_key(target_geometry), method)
+
+        with self._lock:
+            if key in self._plans:
+                return self._plans[key]
+
+            filename = self.plan_filename(key)
+
+            if filename is not None and exists(filename):
+                try:
+                    plan = RegriddingPlan.load(filename)
+                    self._plans[key] = plan
+
+                    return plan
+                except Exception as e:
+                    logger.warning(f"unable to load regridding plan: {filename}")
+                    logger.warning(e)
+
+            logger.info(f"building {cl.name(method)} regridding plan from {cl.val(source_grid.shape)} to {cl.val(target_geometry.shape)}")
+            plan = RegriddingPlan.build(source_grid, target_geometry, method)
+            self._plans[key] = plan
+
+            if filename is not None:
+                logger.info(f"saving regridding plan: {cl.file(filename)}")
+                plan.save(filename)
+
+            return plan
+
+    def regrid(self, image: Raster, geometry: RasterGeometry, method: str) -> Raster:
+        """
+        Resample a raster on a geographic grid to a target geometry using a cached plan.
+        :param image: source raster
+        :param geometry: target geometry
+        :param method: nearest, linear, bilinear or cubic
+        :return: resampled raster
+        """
+        plan = self.plan(image.geometry, geometry, method)
+        array = plan.apply(np.array(image))
+
+        return Raster(array, geometry=geometry, nodata=np.nan)
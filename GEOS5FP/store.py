@@ -0,0 +1,213 @@
+import logging
+from datetime import datetime
+from glob import glob
+from os import makedirs
+from os.path import join, exists, abspath, dirname
+from threading import RLock
+from typing import List, Dict, Tuple, Union
+
+import netCDF4
+import numpy as np
+
+import colored_logging as cl
+
+__author__ = 'Gregory Halverson'
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_CHUNK_HOURS = 168
+DEFAULT_STORE_CHUNK_CELLS = 32
+DEFAULT_STORE_COMPRESSION_LEVEL = 4
+TIME_UNITS = "hours since 1970-01-01 00:00:00"
+
+# the HDF5 library under netCDF4 and the GDAL netCDF driver is not thread-safe,
+# so GEOS-5 FP netCDF files are only opened and read while holding this lock
+NETCDF_LOCK = RLock()
+
+
+class GEOS5FPStore:
+    """
+    Consolidated time series of GEOS-5 FP fields for a region, stored as a chunked, compressed netCDF file.
+    Each store holds a single product with dimensions time, lat and lon,
+    so reading a region's forcing for a long period takes a few chunk reads instead of opening every granule.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, filename: str):
+        if not exists(filename):
+            raise IOError(f"GEOS-5 FP store does not exist: {filename}")
+
+        self.filename = abspath(filename)
+
+        with NETCDF_LOCK, netCDF4.Dataset(self.filename, "r") as dataset:
+            self.product = str(dataset.getncattr("product"))
+            self.variables = [str(variable) for variable in dataset.getncattr("variables").split(",")]
+            self.lat = np.array(dataset.variables["lat"][:], dtype=np.float64)
+            self.lon = np.array(dataset.variables["lon"][:], dtype=np.float64)
+            self.hours = np.array(dataset.variables["time"][:], dtype=np.float64)
+
+    def __repr__(self):
+        return f"GEOS5FPStore(product={self.product}, variables={self.variables}, times={len(self)}, filename={self.filename})"
+
+    def __len__(self):
+        return len(self.hours)
+
+    @classmethod
+    def open_directory(cls, directory: str) -> List["GEOS5FPStore"]:
+        """
+        Open all of the stores in a directory.
+        :param directory: directory of stores
+        :return: list of stores
+        """
+        stores = []
+
+        for filename in sorted(glob(join(directory, "*.nc"))):
+            try:
+                stores.append(cls(filename))
+            except Exception as e:
+                logger.warning(f"unable to open GEOS-5 FP store: {filename}")
+                logger.warning(e)
+
+        return stores
+
+    @classmethod
+    def create(
+            cls,
+            filename: str,
+            product: str,
+            variables: List[str],
+            lat: np.ndarray,
+            lon: np.ndarray,
+            chunk_hours: int = DEFAULT_STORE_CHUNK_HOURS,
+            chunk_cells: int = DEFAULT_STORE_CHUNK_CELLS,
+            compression_level: int = DEFAULT_STORE_COMPRESSION_LEVEL) -> netCDF4.Dataset:
+        """
+        Create an empty store to be filled one time step at a time.
+        The caller holds NETCDF_LOCK until the store is closed.
+        :param filename: filename of store
+        :param product: name of GEOS-5 FP product
+        :param variables: list of variable names
+        :param lat: vector of cell-center latitudes of region
+        :param lon: vector of cell-center longitudes of region
+        :param chunk_hours: number of time steps per chunk
+        :param chunk_cells: number of rows and columns per chunk
+        :param compression_level: zlib compression level
+        :return: netCDF dataset open for writing
+        """
+        makedirs(dirname(abspath(filename)), exist_ok=True)
+        dataset = netCDF4.Dataset(filename, "w", format="NETCDF4")
+        dataset.setncattr("product", product)
+        dataset.setncattr("variables", ",".join(variables))
+        dataset.createDimension("time", None)
+        dataset.createDimension("lat", len(lat))
+        dataset.createDimension("lon", len(lon))
+        time = dataset.createVariable("time", "f8", ("time",))
+        time.units = TIME_UNITS
+        dataset.createVariable("lat", "f8", ("lat",))[:] = lat
+        dataset.createVariable("lon", "f8", ("lon",))[:] = lon
+        chunk_sizes = (chunk_hours, min(chunk_cells, len(lat)), min(chunk_cells, len(lon)))
+
+        for variable in variables:
+            dataset.createVariable(
+                variable,
+                "f4",
+                ("time", "lat", "lon"),
+                zlib=True,
+                complevel=compression_level,
+                chunksizes=chunk_sizes,
+                fill_value=np.float32(np.nan)
+            )
+
+        return dataset
+
+    @staticmethod
+    def append(dataset: netCDF4.Dataset, time_UTC: datetime, arrays: Dict[str, np.ndarray]):
+        """
+        Append the fields of one time step to a store open for writing.
+        :param dataset: netCDF dataset returned by create
+        :param time_UTC: date/time in UTC of the fields
+        :param arrays: dictionary of fields keyed by variable name
+        """
+        index = len(dataset.dimensions["time"])
+        dataset.variables["time"][index] = netCDF4.date2num(time_UTC, TIME_UNITS)
+
+        for variable, array in arrays.items():
+            dataset.variables[variable][index, :, :] = array
+
+    def time_UTC(self, index: int) -> datetime:
+        time_UTC = netCDF4.num2date(self.hours[index], TIME_UNITS)
+
+        return datetime(time_UTC.year, time_UTC.month, time_UTC.day, time_UTC.hour, time_UTC.minute)
+
+    @property
+    def bbox(self) -> Tuple[float, float, float, float]:
+        return float(np.min(self.lon)), float(np.min(self.lat)), float(np.max(self.lon)), float(np.max(self.lat))
+
+    def covers(self, product: str, variable: str, bbox: Tuple[float, float, float, float], margin_cells: int = 2) -> bool:
+        """
+        Check if this store holds a variable of a product over a bounding box.
+        :param product: name of GEOS-5 FP product
+        :param variable: name of variable
+        :param bbox: longitude/latitude bounding box (xmin, ymin, xmax, ymax)
+        :param margin_cells: number of cells required around the bounding box for resampling
+        :return: True if the store covers the request
+        """
+        if product != self.product or variable not in self.variables:
+            return False
+
+        lon_min, lat_min, lon_max, lat_max = bbox
+        store_lon_min, store_lat_min, store_lon_max, store_lat_max = self.bbox
+        lat_margin = margin_cells * abs(self.lat[1] - self.lat[0])
+        lon_margin = margin_cells * abs(self.lon[1] - self.lon[0])
+
+        return (
+            lon_min - lon_margin >= store_lon_min and
+            lat_min - lat_margin >= store_lat_min and
+            lon_max + lon_margin <= store_lon_max and
+            lat_max + lat_margin <= store_lat_max
+        )
+
+    def bracket(self, time_UTC: datetime, max_gap_hours: float = None) -> Union[Tuple[int, int], None]:
+        """
+        Find the time steps immediately before and after a given time.
+        :param time_UTC: date/time in UTC
+        :param max_gap_hours: optional maximum number of hours between the time steps, such as the interval of the product
+        :return: indices of the time steps before and after, or None if the store does not bracket the time
+        """
+        hours = netCDF4.date2num(time_UTC, TIME_UNITS)
+        before_indices = np.where(self.hours < hours)[0]
+        after_indices = np.where(self.hours > hours)[0]
+
+        if len(before_indices) == 0 or len(after_indices) == 0:
+            return None
+
+        before_index = int(before_indices[np.argmax(self.hours[before_indices])])
+        after_index = int(after_indices[np.argmin(self.hours[after_indices])])
+
+        # a store missing time steps would otherwise interpolate across the gap
+        if max_gap_hours is not None and self.hours[after_index] - self.hours[before_index] > max_gap_hours:
+            return None
+
+        return before_index, after_index
+
+    def read(self, variable: str, index: int, rows: slice = None, cols: slice = None) -> np.ndarray:
+        """
+        Read the field of a variable at one time step.
+        :param variable: name of variable
+        :param index: index of time step
+        :param rows: optional row slice
+        :param cols: optional column slice
+        :return: field with rows along ascending latitude
+        """
+        if rows is None:
+            rows = slice(None)
+
+        if cols is None:
+            cols = slice(None)
+
+        with NETCDF_LOCK, netCDF4.Dataset(self.filename, "r") as dataset:
+            array = dataset.variables[variable][index, rows, cols]
+
+        logger.info(f"read GEOS-5 FP {cl.name(self.product)} {cl.name(variable)} from store: {cl.file(self.filename)}")
+
+        return np.ma.filled(array.astype(np.float32), np.nan)
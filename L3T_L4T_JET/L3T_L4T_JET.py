@@ -27,7 +27,7 @@ from ECOSTRESS.L4_ESI import L4TESI
 from ECOSTRESS.L4_WUE import L4TWUE
 from ECOSTRESS.exit_codes import SUCCESS_EXIT_CODE, ECOSTRESSExitCodeException, RUNCONFIG_FILENAME_NOT_SUPPLIED, \
     MissingRunConfigValue, InputFilesInaccessible, UnableToParseRunConfig, BlankOutput, DaytimeFilter, BLANK_OUTPUT, \
-    ANCILLARY_SERVER_UNREACHABLE
+    ANCILLARY_SERVER_UNREACHABLE, ProductWriteFailed
 from ECOSTRESS.runconfig import read_runconfig, ECOSTRESSRunConfig
 from ECOSTRESS_colors import ET_COLORMAP, SM_COLORMAP, WATER_COLORMAP, CLOUD_COLORMAP, RH_COLORMAP, GPP_COLORMAP
 from FLiES import BlankOutputError
@@ -43,6 +43,8 @@ from PTJPLSM import PTJPLSM
 from STIC import STIC
 from downscaling.linear_downscale import linear_downscale, bias_correct
 from model.model import check_distribution
+from model.scheduler import StageGraph, DEFAULT_STAGE_WORKERS
+from model.writer import IntermediateWriter, IntermediateWriteError
 from rasters import Raster, RasterGrid, RasterGeometry
 from timer import Timer
 
@@ -65,6 +67,7 @@ DEFAULT_MODISCI_DIRECTORY = "MODISCI_download"
 DEFAULT_MCD12C1_DIRECTORY = "MCD12C1_download"
 DEFAULT_SOIL_GRIDS_DIRECTORY = "SoilGrids_download"
 DEFAULT_GEOS5FP_DIRECTORY = "GEOS5FP_download"
+DEFAULT_BESS_STATIC_CACHE_DIRECTORY = "BESS_static_cache"
 
 L3T_SEB_SHORT_NAME = "ECO_L3T_SEB"
 L3T_SEB_LONG_NAME = "ECOSTRESS Tiled Surface Energy Balance Instantaneous L3 Global 70 m"
@@ -89,6 +92,29 @@ GEOS_IN_SENTINEL_COARSE_CELL_SIZE = 13720
 STRIP_CONSOLE = False
 SAVE_INTERMEDIATE = False
 SHOW_DISTRIBUTION = True
+DISTRIBUTION_SAMPLE_FRACTION = 1.0
+# memoized model stages do not run, so their diagnostics are not written as intermediate files
+MEMOIZE = False
+# None computes in the precision of the inputs, "float32" keeps every model intermediate in float32
+COMPUTE_DTYPE = None
+BESS_FUSED_KERNEL = False
+BESS_CONVERGENCE_TOLERANCE = None
+BESS_PARALLEL_C3_C4 = False
+BESS_BLOCK_ROWS = None
+BESS_CACHE_STATIC = False
+STIC_IN_PLACE_ITERATION = False
+# maximum number of model stages running concurrently, with one running them in sequence
+STAGE_WORKERS = DEFAULT_STAGE_WORKERS
+# GEOS-5 FP products read by the models, prefetched together before the models run
+GEOS5FP_PRODUCTS = [
+    "tavg1_2d_slv_Nx",
+    "tavg1_2d_rad_Nx",
+    "tavg1_2d_lnd_Nx",
+    "inst3_2d_asm_Nx",
+    "tavg3_2d_aer_Nx"
+]
+# read only the window of each GEOS-5 FP granule around the tile
+GEOS5FP_SUBSET_READS = True
 INCLUDE_SEB_DIAGNOSTICS = False
 INCLUDE_JET_DIAGNOSTICS = False
 BIAS_CORRECT_FLIES_ANN = True
@@ -824,6 +850,16 @@ def L3T_L4T_JET(
         strip_console: bool = STRIP_CONSOLE,
         save_intermediate: bool = SAVE_INTERMEDIATE,
         show_distribution: bool = SHOW_DISTRIBUTION,
+        distribution_sample_fraction: float = DISTRIBUTION_SAMPLE_FRACTION,
+        memoize: bool = MEMOIZE,
+        compute_dtype: str = COMPUTE_DTYPE,
+        BESS_fused_kernel: bool = BESS_FUSED_KERNEL,
+        BESS_convergence_tolerance: float = BESS_CONVERGENCE_TOLERANCE,
+        BESS_parallel_C3_C4: bool = BESS_PARALLEL_C3_C4,
+        BESS_block_rows: int = BESS_BLOCK_ROWS,
+        BESS_cache_static: bool = BESS_CACHE_STATIC,
+        STIC_in_place_iteration: bool = STIC_IN_PLACE_ITERATION,
+        stage_workers: int = STAGE_WORKERS,
         floor_Topt: bool = FLOOR_TOPT) -> int:
     """
     ECOSTRESS Collection 2 L3T L4T JET PGE
@@ -839,6 +875,8 @@ def L3T_L4T_JET(
     if downsampling is None:
         downsampling = "linear"
 
+    intermediate_writer = None
+
     try:
         runconfig = L3TL4TJETConfig(runconfig_filename)
         working_directory = runconfig.working_directory
@@ -951,6 +989,13 @@ def L3T_L4T_JET(
         logger.info(f"MCD12C1 IGBP directory: {cl.dir(MCD12_directory)}")
         soil_grids_directory = runconfig.soil_grids_directory
         logger.info(f"SoilGrids directory: {cl.dir(soil_grids_directory)}")
+        BESS_static_cache_directory = join(static_directory, DEFAULT_BESS_STATIC_CACHE_DIRECTORY)
+
+        if BESS_cache_static:
+            logger.info(f"BESS static cache directory: {cl.dir(BESS_static_cache_directory)}")
+
+        logger.info(f"model stage workers: {cl.val(stage_workers)}")
+
         logger.info(f"log: {cl.file(log_filename)}")
         orbit = runconfig.orbit
         logger.info(f"orbit: {cl.val(orbit)}")
@@ -1013,9 +1058,21 @@ def L3T_L4T_JET(
 
         GEOS5FP_connection = GEOS5FP(
             working_directory=working_directory,
-            download_directory=GEOS5FP_directory
+            download_directory=GEOS5FP_directory,
+            subset=GEOS5FP_SUBSET_READS,
+            dtype=compute_dtype
         )
 
+        try:
+            GEOS5FP_connection.prefetch([time_UTC], products=GEOS5FP_PRODUCTS)
+        except Exception as e:
+            logger.warning(e)
+            logger.warning("unable to prefetch GEOS-5 FP granules, continuing with sequential retrieval")
+
+        if save_intermediate:
+            # intermediate files are written in the background while the models run
+            intermediate_writer = IntermediateWriter()
+
         PTJPLSM_model = PTJPLSM(
             working_directory=working_directory,
             GEDI_download=GEDI_directory,
@@ -1024,6 +1081,12 @@ def L3T_L4T_JET(
             GEOS5FP_connection=GEOS5FP_connection,
             save_intermediate=save_intermediate,
             show_distribution=show_distribution,
+            intermediate_writer=intermediate_writer,
+            distribution_sample_fraction=distribution_sample_fraction,
+            memoize=memoize,
+            dtype=compute_dtype,
+            cache_static=BESS_cache_static,
+            static_cache_directory=BESS_static_cache_directory,
             floor_Topt=floor_Topt
         )
 
@@ -1033,14 +1096,24 @@ def L3T_L4T_JET(
             CI_directory=MODISCI_directory,
             GEOS5FP_connection=GEOS5FP_connection,
             save_intermediate=save_intermediate,
-            show_distribution=show_distribution
+            show_distribution=show_distribution,
+            intermediate_writer=intermediate_writer,
+            distribution_sample_fraction=distribution_sample_fraction,
+            memoize=memoize,
+            dtype=compute_dtype,
+            cache_static=BESS_cache_static,
+            static_cache_directory=BESS_static_cache_directory
         )
 
         FLiES_ANN_model = FLiES(
             working_directory=working_directory,
             GEOS5FP_connection=GEOS5FP_connection,
             save_intermediate=save_intermediate,
-            show_distribution=show_distribution
+            show_distribution=show_distribution,
+            intermediate_writer=intermediate_writer,
+            distribution_sample_fraction=distribution_sample_fraction,
+            memoize=memoize,
+            dtype=compute_dtype
         )
 
 
@@ -1055,7 +1128,11 @@ def L3T_L4T_JET(
             GEOS5FP_connection=GEOS5FP_connection,
             MCD12_connnection=MCD12_connnection,
             save_intermediate=save_intermediate,
-            show_distribution=show_distribution
+            show_distribution=show_distribution,
+            intermediate_writer=intermediate_writer,
+            distribution_sample_fraction=distribution_sample_fraction,
+            memoize=memoize,
+            dtype=compute_dtype
         )
 
         BESS_model = BESS(
@@ -1064,7 +1141,17 @@ def L3T_L4T_JET(
             CI_directory=MODISCI_directory,
             GEOS5FP_connection=GEOS5FP_connection,
             save_intermediate=save_intermediate,
-            show_distribution=show_distribution
+            show_distribution=show_distribution,
+            intermediate_writer=intermediate_writer,
+            distribution_sample_fraction=distribution_sample_fraction,
+            memoize=memoize,
+            dtype=compute_dtype,
+            fused_kernel=BESS_fused_kernel,
+            convergence_tolerance=BESS_convergence_tolerance,
+            parallel_C3_C4=BESS_parallel_C3_C4,
+            block_rows=BESS_block_rows,
+            cache_static=BESS_cache_static,
+            static_cache_directory=BESS_static_cache_directory
         )
 
         SZA = FLiES_ANN_model.SZA(day_of_year=day_of_year, hour_of_day=hour_of_day, geometry=geometry)
@@ -1074,480 +1161,573 @@ def L3T_L4T_JET(
         if np.all(SZA >= SZA_DEGREE_CUTOFF):
             raise DaytimeFilter(f"solar zenith angle exceeds {SZA_DEGREE_CUTOFF} for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
 
-        logger.info("retrieving GEOS-5 FP aerosol optical thickness raster")
-        AOT = GEOS5FP_connection.AOT(time_UTC=time_UTC, geometry=geometry)
-        check_distribution(AOT, "AOT", date_UTC=date_UTC, target=tile)
-
-        logger.info("generating GEOS-5 FP cloud optical thickness raster")
-        COT = GEOS5FP_connection.COT(time_UTC=time_UTC, geometry=geometry)
-        check_distribution(COT, "COT", date_UTC=date_UTC, target=tile)
-
-        logger.info("generating GEOS5-FP water vapor raster in grams per square centimeter")
-        vapor_gccm = GEOS5FP_connection.vapor_gccm(time_UTC=time_UTC, geometry=geometry)
-        check_distribution(vapor_gccm, "vapor_gccm", date_UTC=date_UTC, target=tile)
-
-        logger.info("generating GEOS5-FP ozone raster in grams per square centimeter")
-        ozone_cm = GEOS5FP_connection.ozone_cm(time_UTC=time_UTC, geometry=geometry)
-        check_distribution(ozone_cm, "ozone_cm", date_UTC=date_UTC, target=tile)
-
-        logger.info(f"running Forest Light Environmental Simulator for {cl.place(tile)} at {cl.time(time_UTC)} UTC")
-
-        Ra, SWin_FLiES_ANN_raw, UV, VIS, NIR, VISdiff, NIRdiff, VISdir, NIRdir = FLiES_ANN_model.FLiES(
-            geometry=geometry,
-            target=tile,
-            time_UTC=time_UTC,
-            albedo=albedo,
-            COT=COT,
-            AOT=AOT,
-            SZA=SZA,
-            vapor_gccm=vapor_gccm,
-            ozone_cm=ozone_cm,
-            elevation_km=elevation_km
-        )
-
-        SWin_FLiES_LUT = FLiES_LUT_model.FLiES_LUT(
-            geometry=geometry,
-            target=tile,
-            time_UTC=time_UTC,
-            cloud_mask=cloud,
-            COT=COT,
-            albedo=albedo,
-            AOT=AOT
-        )
-
-        # Rg = Rg.mask(~np.isnan(ST_K))
-        # check_distribution(Rg, "Rg", date_UTC=date_UTC, target=tile)
         coarse_geometry = geometry.rescale(GEOS_IN_SENTINEL_COARSE_CELL_SIZE)
+        ST_C = ST_K - 273.15
 
-        SWin_coarse = GEOS5FP_connection.SWin(
-            time_UTC=time_UTC,
-            geometry=coarse_geometry,
-            resampling=downsampling
-        )
-
-        if bias_correct_FLiES_ANN:
-            SWin_FLiES_ANN = bias_correct(
-                coarse_image=SWin_coarse,
-                fine_image=SWin_FLiES_ANN_raw,
-                upsampling=upsampling,
-                downsampling=downsampling
+        # stages declare the rasters they take and produce, so that stages sharing only read-only inputs can run concurrently
+        stages = StageGraph(max_workers=stage_workers)
+
+        @stages.stage(outputs=["AOT", "COT", "vapor_gccm", "ozone_cm"])
+        def atmosphere():
+            logger.info("retrieving GEOS-5 FP aerosol optical thickness raster")
+            AOT = GEOS5FP_connection.AOT(time_UTC=time_UTC, geometry=geometry)
+            check_distribution(AOT, "AOT", date_UTC=date_UTC, target=tile)
+
+            logger.info("generating GEOS-5 FP cloud optical thickness raster")
+            COT = GEOS5FP_connection.COT(time_UTC=time_UTC, geometry=geometry)
+            check_distribution(COT, "COT", date_UTC=date_UTC, target=tile)
+
+            logger.info("generating GEOS5-FP water vapor raster in grams per square centimeter")
+            vapor_gccm = GEOS5FP_connection.vapor_gccm(time_UTC=time_UTC, geometry=geometry)
+            check_distribution(vapor_gccm, "vapor_gccm", date_UTC=date_UTC, target=tile)
+
+            logger.info("generating GEOS5-FP ozone raster in grams per square centimeter")
+            ozone_cm = GEOS5FP_connection.ozone_cm(time_UTC=time_UTC, geometry=geometry)
+            check_distribution(ozone_cm, "ozone_cm", date_UTC=date_UTC, target=tile)
+
+            return AOT, COT, vapor_gccm, ozone_cm
+
+        @stages.stage(
+            inputs=["AOT", "COT", "vapor_gccm", "ozone_cm"],
+            outputs=["SWin_FLiES_ANN_raw", "UV", "VISdiff", "NIRdiff", "VISdir", "NIRdir"])
+        def FLiES_ANN_radiation(AOT, COT, vapor_gccm, ozone_cm):
+            logger.info(f"running Forest Light Environmental Simulator for {cl.place(tile)} at {cl.time(time_UTC)} UTC")
+
+            Ra, SWin_FLiES_ANN_raw, UV, VIS, NIR, VISdiff, NIRdiff, VISdir, NIRdir = FLiES_ANN_model.FLiES(
+                geometry=geometry,
+                target=tile,
+                time_UTC=time_UTC,
+                albedo=albedo,
+                COT=COT,
+                AOT=AOT,
+                SZA=SZA,
+                vapor_gccm=vapor_gccm,
+                ozone_cm=ozone_cm,
+                elevation_km=elevation_km
             )
-        else:
-            SWin_FLiES_ANN = SWin_FLiES_ANN_raw
-
-        check_distribution(SWin_FLiES_ANN, "SWin_FLiES_ANN", date_UTC=date_UTC, target=tile)
 
-        SWin_GEOS5FP = GEOS5FP_connection.SWin(
-            time_UTC=time_UTC,
-            geometry=geometry,
-            resampling=downsampling
-        )
+            return SWin_FLiES_ANN_raw, UV, VISdiff, NIRdiff, VISdir, NIRdir
+
+        @stages.stage(inputs=["AOT", "COT"], outputs=["SWin_FLiES_LUT"])
+        def FLiES_LUT_radiation(AOT, COT):
+            SWin_FLiES_LUT = FLiES_LUT_model.FLiES_LUT(
+                geometry=geometry,
+                target=tile,
+                time_UTC=time_UTC,
+                cloud_mask=cloud,
+                COT=COT,
+                albedo=albedo,
+                AOT=AOT
+            )
 
-        check_distribution(SWin_GEOS5FP, "SWin_GEOS5FP", date_UTC=date_UTC, target=tile)
+            return SWin_FLiES_LUT
+
+        @stages.stage(
+            inputs=["SWin_FLiES_ANN_raw", "SWin_FLiES_LUT"],
+            outputs=["SWin_FLiES_ANN", "SWin_GEOS5FP", "SWin"])
+        def solar_radiation(SWin_FLiES_ANN_raw, SWin_FLiES_LUT):
+            # Rg = Rg.mask(~np.isnan(ST_K))
+            # check_distribution(Rg, "Rg", date_UTC=date_UTC, target=tile)
+            SWin_coarse = GEOS5FP_connection.SWin(
+                time_UTC=time_UTC,
+                geometry=coarse_geometry,
+                resampling=downsampling
+            )
 
-        if SWin_model_name == "GEOS5FP":
-            SWin = SWin_GEOS5FP
-        elif SWin_model_name == "FLiES-ANN":
-            SWin = SWin_FLiES_ANN
-        elif SWin_model_name == "FLiES-LUT":
-            SWin = SWin_FLiES_LUT
-        else:
-            raise ValueError(f"unrecognized solar radiation model: {SWin_model_name}")
+            if bias_correct_FLiES_ANN:
+                SWin_FLiES_ANN = bias_correct(
+                    coarse_image=SWin_coarse,
+                    fine_image=SWin_FLiES_ANN_raw,
+                    upsampling=upsampling,
+                    downsampling=downsampling
+                )
+            else:
+                SWin_FLiES_ANN = SWin_FLiES_ANN_raw
 
-        SWin = rt.where(np.isnan(ST_K), np.nan, SWin)
+            check_distribution(SWin_FLiES_ANN, "SWin_FLiES_ANN", date_UTC=date_UTC, target=tile)
 
-        if np.all(np.isnan(SWin)) or np.all(SWin == 0):
-            raise BlankOutput(f"blank solar radiation output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
+            SWin_GEOS5FP = GEOS5FP_connection.SWin(
+                time_UTC=time_UTC,
+                geometry=geometry,
+                resampling=downsampling
+            )
 
-        ST_C = ST_K - 273.15
+            check_distribution(SWin_GEOS5FP, "SWin_GEOS5FP", date_UTC=date_UTC, target=tile)
 
-        NDVI_coarse = NDVI.to_geometry(coarse_geometry, resampling=upsampling)
-        albedo_coarse = albedo.to_geometry(coarse_geometry, resampling=upsampling)
-
-        if sharpen_meteorology:
-            ST_C_coarse = ST_C.to_geometry(coarse_geometry, resampling=upsampling)
-            Ta_C_coarse = GEOS5FP_connection.Ta_C(time_UTC=time_UTC, geometry=coarse_geometry, resampling=downsampling)
-            Td_C_coarse = GEOS5FP_connection.Td_C(time_UTC=time_UTC, geometry=coarse_geometry, resampling=downsampling)
-            SM_coarse = GEOS5FP_connection.SM(time_UTC=time_UTC, geometry=coarse_geometry, resampling=downsampling)
-
-            coarse_samples = pd.DataFrame({
-                "Ta_C": np.array(Ta_C_coarse).ravel(),
-                "Td_C": np.array(Td_C_coarse).ravel(),
-                "SM": np.array(SM_coarse).ravel(),
-                "ST_C": np.array(ST_C_coarse).ravel(),
-                "NDVI": np.array(NDVI_coarse).ravel(),
-                "albedo": np.array(albedo_coarse).ravel()
-            })
-
-            coarse_samples = coarse_samples.dropna()
-
-            Ta_C_model = sklearn.linear_model.LinearRegression()
-            Ta_C_model.fit(coarse_samples[["ST_C", "NDVI", "albedo"]], coarse_samples["Ta_C"])
-            Ta_C_intercept = Ta_C_model.intercept_
-            ST_C_Ta_C_coef, NDVI_Ta_C_coef, albedo_Ta_C_coef = Ta_C_model.coef_
-            logger.info(
-                f"air temperature regression: Ta_C = {Ta_C_intercept:0.2f} + {ST_C_Ta_C_coef:0.2f} * ST_C + {NDVI_Ta_C_coef:0.2f} * NDVI + {albedo_Ta_C_coef:0.2f} * albedo")
-            Ta_C_prediction = ST_C * ST_C_Ta_C_coef + NDVI * NDVI_Ta_C_coef + albedo * albedo_Ta_C_coef + Ta_C_intercept
-            check_distribution(Ta_C_prediction, "Ta_C_prediction", date_UTC, tile)
-            logger.info(
-                f"up-sampling predicted air temperature from {int(Ta_C_prediction.cell_size)}m to {int(coarse_geometry.cell_size)}m with {upsampling} method")
-            Ta_C_prediction_coarse = Ta_C_prediction.to_geometry(coarse_geometry, resampling=upsampling)
-            check_distribution(Ta_C_prediction_coarse, "Ta_C_prediction_coarse", date_UTC, tile)
-            Ta_C_bias_coarse = Ta_C_prediction_coarse - Ta_C_coarse
-            check_distribution(Ta_C_bias_coarse, "Ta_C_bias_coarse", date_UTC, tile)
-            logger.info(
-                f"down-sampling air temperature bias from {int(Ta_C_bias_coarse.cell_size)}m to {int(geometry.cell_size)}m with {downsampling} method")
-            Ta_C_bias_smooth = Ta_C_bias_coarse.to_geometry(geometry, resampling=downsampling)
-            check_distribution(Ta_C_bias_smooth, "Ta_C_bias_smooth", date_UTC, tile)
-            logger.info("bias-correcting air temperature")
-            Ta_C = Ta_C_prediction - Ta_C_bias_smooth
-            check_distribution(Ta_C, "Ta_C", date_UTC, tile)
-            Ta_C_smooth = GEOS5FP_connection.Ta_C(time_UTC=time_UTC, geometry=geometry, resampling=downsampling)
-            check_distribution(Ta_C_smooth, "Ta_C_smooth", date_UTC, tile)
-            logger.info("gap-filling air temperature")
-            Ta_C = rt.where(np.isnan(Ta_C), Ta_C_smooth, Ta_C)
-            check_distribution(Ta_C, "Ta_C", date_UTC, tile)
-            logger.info(
-                f"up-sampling final air temperature from {int(Ta_C.cell_size)}m to {int(coarse_geometry.cell_size)}m with {upsampling} method")
-            Ta_C_final_coarse = Ta_C.to_geometry(coarse_geometry, resampling=upsampling)
-            check_distribution(Ta_C_final_coarse, "Ta_C_final_coarse", date_UTC, tile)
-            Ta_C_error_coarse = Ta_C_final_coarse - Ta_C_coarse
-            check_distribution(Ta_C_error_coarse, "Ta_C_error_coarse", date_UTC, tile)
-            logger.info(
-                f"down-sampling air temperature error from {int(Ta_C_error_coarse.cell_size)}m to {int(geometry.cell_size)}m with {downsampling} method")
-            Ta_C_error = Ta_C_error_coarse.to_geometry(geometry, resampling=downsampling)
-            check_distribution(Ta_C_error, "Ta_C_error", date_UTC, tile)
-
-            if np.all(np.isnan(Ta_C)):
-                raise BlankOutput(
-                    f"blank air temperature output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
-
-            Td_C_model = sklearn.linear_model.LinearRegression()
-            Td_C_model.fit(coarse_samples[["ST_C", "NDVI", "albedo"]], coarse_samples["Td_C"])
-            Td_C_intercept = Td_C_model.intercept_
-            ST_C_Td_C_coef, NDVI_Td_C_coef, albedo_Td_C_coef = Td_C_model.coef_
-
-            logger.info(
-                f"dew-point temperature regression: Td_C = {Td_C_intercept:0.2f} + {ST_C_Td_C_coef:0.2f} * ST_C + {NDVI_Td_C_coef:0.2f} * NDVI + {albedo_Td_C_coef:0.2f} * albedo")
-            Td_C_prediction = ST_C * ST_C_Td_C_coef + NDVI * NDVI_Td_C_coef + albedo * albedo_Td_C_coef + Td_C_intercept
-            check_distribution(Td_C_prediction, "Td_C_prediction", date_UTC, tile)
-            logger.info(
-                f"up-sampling predicted dew-point temperature from {int(Td_C_prediction.cell_size)}m to {int(coarse_geometry.cell_size)}m with {upsampling} method")
-            Td_C_prediction_coarse = Td_C_prediction.to_geometry(coarse_geometry, resampling=upsampling)
-            check_distribution(Td_C_prediction_coarse, "Td_C_prediction_coarse", date_UTC, tile)
-            Td_C_bias_coarse = Td_C_prediction_coarse - Td_C_coarse
-            check_distribution(Td_C_bias_coarse, "Td_C_bias_coarse", date_UTC, tile)
-            logger.info(
-                f"down-sampling dew-point temperature bias from {int(Td_C_bias_coarse.cell_size)}m to {int(geometry.cell_size)}m with {downsampling} method")
-            Td_C_bias_smooth = Td_C_bias_coarse.to_geometry(geometry, resampling=downsampling)
-            check_distribution(Td_C_bias_smooth, "Td_C_bias_smooth", date_UTC, tile)
-            logger.info("bias-correcting dew-point temperature")
-            Td_C = Td_C_prediction - Td_C_bias_smooth
-            check_distribution(Td_C, "Td_C", date_UTC, tile)
-            Td_C_smooth = GEOS5FP_connection.Td_C(time_UTC=time_UTC, geometry=geometry, resampling=downsampling)
-            check_distribution(Td_C_smooth, "Td_C_smooth", date_UTC, tile)
-            logger.info("gap-filling dew-point temperature")
-            Td_C = rt.where(np.isnan(Td_C), Td_C_smooth, Td_C)
-            check_distribution(Td_C, "Td_C", date_UTC, tile)
-            logger.info(
-                f"up-sampling final dew-point temperature from {int(Td_C.cell_size)}m to {int(coarse_geometry.cell_size)}m with {upsampling} method")
-            Td_C_final_coarse = Td_C.to_geometry(coarse_geometry, resampling=upsampling)
-            check_distribution(Td_C_final_coarse, "Td_C_final_coarse", date_UTC, tile)
-            Td_C_error_coarse = Td_C_final_coarse - Td_C_coarse
-            check_distribution(Td_C_error_coarse, "Td_C_error_coarse", date_UTC, tile)
-            logger.info(
-                f"down-sampling dew-point temperature error from {int(Td_C_error_coarse.cell_size)}m to {int(geometry.cell_size)}m with {downsampling} method")
-            Td_C_error = Td_C_error_coarse.to_geometry(geometry, resampling=downsampling)
-            check_distribution(Td_C_error, "Td_C_error", date_UTC, tile)
-
-            # SM_model = sklearn.linear_model.LinearRegression()
-            # SM_model.fit(coarse_samples[["ST_C", "NDVI", "albedo"]], coarse_samples["SM"])
-            # SM_intercept = SM_model.intercept_
-            # ST_C_SM_coef, NDVI_SM_coef, albedo_SM_coef = SM_model.coef_
-            # logger.info(
-            #     f"soil moisture regression: SM = {SM_intercept:0.2f} + {ST_C_SM_coef:0.2f} * ST_C + {NDVI_SM_coef:0.2f} * NDVI + {albedo_SM_coef:0.2f} * albedo")
-            # SM_prediction = rt.clip(ST_C * ST_C_SM_coef + NDVI * NDVI_SM_coef + albedo * albedo_SM_coef + SM_intercept, 0,
-            #                         1)
-            # check_distribution(SM_prediction, "SM_prediction", date_UTC, tile)
-            # logger.info(
-            #     f"up-sampling predicted soil moisture from {int(SM_prediction.cell_size)}m to {int(coarse_geometry.cell_size)}m with {upsampling} method")
-            # SM_prediction_coarse = SM_prediction.to_geometry(coarse_geometry, resampling=upsampling)
-            # check_distribution(SM_prediction_coarse, "SM_prediction_coarse", date_UTC, tile)
-            # SM_bias_coarse = SM_prediction_coarse - SM_coarse
-            # check_distribution(SM_bias_coarse, "SM_bias_coarse", date_UTC, tile)
-            # logger.info(
-            #     f"down-sampling soil moisture bias from {int(SM_bias_coarse.cell_size)}m to {int(geometry.cell_size)}m with {downsampling} method")
-            # SM_bias_smooth = SM_bias_coarse.to_geometry(geometry, resampling=downsampling)
-            # check_distribution(SM_bias_smooth, "SM_bias_smooth", date_UTC, tile)
-            # logger.info("bias-correcting soil moisture")
-            # SM = rt.clip(SM_prediction - SM_bias_smooth, 0, 1)
-            # check_distribution(SM, "SM", date_UTC, tile)
-            # SM_smooth = GEOS5FP_connection.SM(time_UTC=time_UTC, geometry=geometry, resampling=downsampling)
-            # check_distribution(SM_smooth, "SM_smooth", date_UTC, tile)
-            # logger.info("gap-filling soil moisture")
-            # SM = rt.clip(rt.where(np.isnan(SM), SM_smooth, SM), 0, 1)
-            # SM = rt.where(water, np.nan, SM)
-            # check_distribution(SM, "SM", date_UTC, tile)
-            # logger.info(
-            #     f"up-sampling final soil moisture from {int(SM.cell_size)}m to {int(coarse_geometry.cell_size)}m with {upsampling} method")
-            # SM_final_coarse = SM.to_geometry(coarse_geometry, resampling=upsampling)
-            # check_distribution(SM_final_coarse, "SM_final_coarse", date_UTC, tile)
-            # SM_error_coarse = SM_final_coarse - SM_coarse
-            # check_distribution(SM_error_coarse, "SM_error_coarse", date_UTC, tile)
-            # logger.info(
-            #     f"down-sampling soil moisture error from {int(SM_error_coarse.cell_size)}m to {int(geometry.cell_size)}m with {downsampling} method")
-            # SM_error = rt.where(water, np.nan, SM_error_coarse.to_geometry(geometry, resampling=downsampling))
-            # check_distribution(SM_error, "SM_error", date_UTC, tile)
-
-            # if np.all(np.isnan(SM)):
-            #     raise BlankOutput(
-            #         f"blank soil moisture output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
+            if SWin_model_name == "GEOS5FP":
+                SWin = SWin_GEOS5FP
+            elif SWin_model_name == "FLiES-ANN":
+                SWin = SWin_FLiES_ANN
+            elif SWin_model_name == "FLiES-LUT":
+                SWin = SWin_FLiES_LUT
+            else:
+                raise ValueError(f"unrecognized solar radiation model: {SWin_model_name}")
+
+            SWin = rt.where(np.isnan(ST_K), np.nan, SWin)
+
+            if np.all(np.isnan(SWin)) or np.all(SWin == 0):
+                raise BlankOutput(f"blank solar radiation output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
+
+            return SWin_FLiES_ANN, SWin_GEOS5FP, SWin
+
+        @stages.stage(outputs=["Ta_C", "Ta_C_smooth", "RH", "SM", "Ea_Pa", "Ea_kPa", "Ta_K"])
+        def meteorology():
+            NDVI_coarse = NDVI.to_geometry(coarse_geometry, resampling=upsampling)
+            albedo_coarse = albedo.to_geometry(coarse_geometry, resampling=upsampling)
+
+            if sharpen_meteorology:
+                ST_C_coarse = ST_C.to_geometry(coarse_geometry, resampling=upsampling)
+                Ta_C_coarse = GEOS5FP_connection.Ta_C(time_UTC=time_UTC, geometry=coarse_geometry, resampling=downsampling)
+                Td_C_coarse = GEOS5FP_connection.Td_C(time_UTC=time_UTC, geometry=coarse_geometry, resampling=downsampling)
+                SM_coarse = GEOS5FP_connection.SM(time_UTC=time_UTC, geometry=coarse_geometry, resampling=downsampling)
+
+                coarse_samples = pd.DataFrame({
+                    "Ta_C": np.array(Ta_C_coarse).ravel(),
+                    "Td_C": np.array(Td_C_coarse).ravel(),
+                    "SM": np.array(SM_coarse).ravel(),
+                    "ST_C": np.array(ST_C_coarse).ravel(),
+                    "NDVI": np.array(NDVI_coarse).ravel(),
+                    "albedo": np.array(albedo_coarse).ravel()
+                })
+
+                coarse_samples = coarse_samples.dropna()
+
+                Ta_C_model = sklearn.linear_model.LinearRegression()
+                Ta_C_model.fit(coarse_samples[["ST_C", "NDVI", "albedo"]], coarse_samples["Ta_C"])
+                Ta_C_intercept = Ta_C_model.intercept_
+                ST_C_Ta_C_coef, NDVI_Ta_C_coef, albedo_Ta_C_coef = Ta_C_model.coef_
+                logger.info(
+                    f"air temperature regression: Ta_C = {Ta_C_intercept:0.2f} + {ST_C_Ta_C_coef:0.2f} * ST_C + {NDVI_Ta_C_coef:0.2f} * NDVI + {albedo_Ta_C_coef:0.2f} * albedo")
+                Ta_C_prediction = ST_C * ST_C_Ta_C_coef + NDVI * NDVI_Ta_C_coef + albedo * albedo_Ta_C_coef + Ta_C_intercept
+                check_distribution(Ta_C_prediction, "Ta_C_prediction", date_UTC, tile)
+                logger.info(
+                    f"up-sampling predicted air temperature from {int(Ta_C_prediction.cell_size)}m to {int(coarse_geometry.cell_size)}m with {upsampling} method")
+                Ta_C_prediction_coarse = Ta_C_prediction.to_geometry(coarse_geometry, resampling=upsampling)
+                check_distribution(Ta_C_prediction_coarse, "Ta_C_prediction_coarse", date_UTC, tile)
+                Ta_C_bias_coarse = Ta_C_prediction_coarse - Ta_C_coarse
+                check_distribution(Ta_C_bias_coarse, "Ta_C_bias_coarse", date_UTC, tile)
+                logger.info(
+                    f"down-sampling air temperature bias from {int(Ta_C_bias_coarse.cell_size)}m to {int(geometry.cell_size)}m with {downsampling} method")
+                Ta_C_bias_smooth = Ta_C_bias_coarse.to_geometry(geometry, resampling=downsampling)
+                check_distribution(Ta_C_bias_smooth, "Ta_C_bias_smooth", date_UTC, tile)
+                logger.info("bias-correcting air temperature")
+                Ta_C = Ta_C_prediction - Ta_C_bias_smooth
+                check_distribution(Ta_C, "Ta_C", date_UTC, tile)
+                Ta_C_smooth = GEOS5FP_connection.Ta_C(time_UTC=time_UTC, geometry=geometry, resampling=downsampling)
+                check_distribution(Ta_C_smooth, "Ta_C_smooth", date_UTC, tile)
+                logger.info("gap-filling air temperature")
+                Ta_C = rt.where(np.isnan(Ta_C), Ta_C_smooth, Ta_C)
+                check_distribution(Ta_C, "Ta_C", date_UTC, tile)
+                logger.info(
+                    f"up-sampling final air temperature from {int(Ta_C.cell_size)}m to {int(coarse_geometry.cell_size)}m with {upsampling} method")
+                Ta_C_final_coarse = Ta_C.to_geometry(coarse_geometry, resampling=upsampling)
+                check_distribution(Ta_C_final_coarse, "Ta_C_final_coarse", date_UTC, tile)
+                Ta_C_error_coarse = Ta_C_final_coarse - Ta_C_coarse
+                check_distribution(Ta_C_error_coarse, "Ta_C_error_coarse", date_UTC, tile)
+                logger.info(
+                    f"down-sampling air temperature error from {int(Ta_C_error_coarse.cell_size)}m to {int(geometry.cell_size)}m with {downsampling} method")
+                Ta_C_error = Ta_C_error_coarse.to_geometry(geometry, resampling=downsampling)
+                check_distribution(Ta_C_error, "Ta_C_error", date_UTC, tile)
+
+                if np.all(np.isnan(Ta_C)):
+                    raise BlankOutput(
+                        f"blank air temperature output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
+
+                Td_C_model = sklearn.linear_model.LinearRegression()
+                Td_C_model.fit(coarse_samples[["ST_C", "NDVI", "albedo"]], coarse_samples["Td_C"])
+                Td_C_intercept = Td_C_model.intercept_
+                ST_C_Td_C_coef, NDVI_Td_C_coef, albedo_Td_C_coef = Td_C_model.coef_
+
+                logger.info(
+                    f"dew-point temperature regression: Td_C = {Td_C_intercept:0.2f} + {ST_C_Td_C_coef:0.2f} * ST_C + {NDVI_Td_C_coef:0.2f} * NDVI + {albedo_Td_C_coef:0.2f} * albedo")
+                Td_C_prediction = ST_C * ST_C_Td_C_coef + NDVI * NDVI_Td_C_coef + albedo * albedo_Td_C_coef + Td_C_intercept
+                check_distribution(Td_C_prediction, "Td_C_prediction", date_UTC, tile)
+                logger.info(
+                    f"up-sampling predicted dew-point temperature from {int(Td_C_prediction.cell_size)}m to {int(coarse_geometry.cell_size)}m with {upsampling} method")
+                Td_C_prediction_coarse = Td_C_prediction.to_geometry(coarse_geometry, resampling=upsampling)
+                check_distribution(Td_C_prediction_coarse, "Td_C_prediction_coarse", date_UTC, tile)
+                Td_C_bias_coarse = Td_C_prediction_coarse - Td_C_coarse
+                check_distribution(Td_C_bias_coarse, "Td_C_bias_coarse", date_UTC, tile)
+                logger.info(
+                    f"down-sampling dew-point temperature bias from {int(Td_C_bias_coarse.cell_size)}m to {int(geometry.cell_size)}m with {downsampling} method")
+                Td_C_bias_smooth = Td_C_bias_coarse.to_geometry(geometry, resampling=downsampling)
+                check_distribution(Td_C_bias_smooth, "Td_C_bias_smooth", date_UTC, tile)
+                logger.info("bias-correcting dew-point temperature")
+                Td_C = Td_C_prediction - Td_C_bias_smooth
+                check_distribution(Td_C, "Td_C", date_UTC, tile)
+                Td_C_smooth = GEOS5FP_connection.Td_C(time_UTC=time_UTC, geometry=geometry, resampling=downsampling)
+                check_distribution(Td_C_smooth, "Td_C_smooth", date_UTC, tile)
+                logger.info("gap-filling dew-point temperature")
+                Td_C = rt.where(np.isnan(Td_C), Td_C_smooth, Td_C)
+                check_distribution(Td_C, "Td_C", date_UTC, tile)
+                logger.info(
+                    f"up-sampling final dew-point temperature from {int(Td_C.cell_size)}m to {int(coarse_geometry.cell_size)}m with {upsampling} method")
+                Td_C_final_coarse = Td_C.to_geometry(coarse_geometry, resampling=upsampling)
+                check_distribution(Td_C_final_coarse, "Td_C_final_coarse", date_UTC, tile)
+                Td_C_error_coarse = Td_C_final_coarse - Td_C_coarse
+                check_distribution(Td_C_error_coarse, "Td_C_error_coarse", date_UTC, tile)
+                logger.info(
+                    f"down-sampling dew-point temperature error from {int(Td_C_error_coarse.cell_size)}m to {int(geometry.cell_size)}m with {downsampling} method")
+                Td_C_error = Td_C_error_coarse.to_geometry(geometry, resampling=downsampling)
+                check_distribution(Td_C_error, "Td_C_error", date_UTC, tile)
+
+                # SM_model = sklearn.linear_model.LinearRegression()
+                # SM_model.fit(coarse_samples[["ST_C", "NDVI", "albedo"]], coarse_samples["SM"])
+                # SM_intercept = SM_model.intercept_
+                # ST_C_SM_coef, NDVI_SM_coef, albedo_SM_coef = SM_model.coef_
+                # logger.info(
+                #     f"soil moisture regression: SM = {SM_intercept:0.2f} + {ST_C_SM_coef:0.2f} * ST_C + {NDVI_SM_coef:0.2f} * NDVI + {albedo_SM_coef:0.2f} * albedo")
+                # SM_prediction = rt.clip(ST_C * ST_C_SM_coef + NDVI * NDVI_SM_coef + albedo * albedo_SM_coef + SM_intercept, 0,
+                #                         1)
+                # check_distribution(SM_prediction, "SM_prediction", date_UTC, tile)
+                # logger.info(
+                #     f"up-sampling predicted soil moisture from {int(SM_prediction.cell_size)}m to {int(coarse_geometry.cell_size)}m with {upsampling} method")
+                # SM_prediction_coarse = SM_prediction.to_geometry(coarse_geometry, resampling=upsampling)
+                # check_distribution(SM_prediction_coarse, "SM_prediction_coarse", date_UTC, tile)
+                # SM_bias_coarse = SM_prediction_coarse - SM_coarse
+                # check_distribution(SM_bias_coarse, "SM_bias_coarse", date_UTC, tile)
+                # logger.info(
+                #     f"down-sampling soil moisture bias from {int(SM_bias_coarse.cell_size)}m to {int(geometry.cell_size)}m with {downsampling} method")
+                # SM_bias_smooth = SM_bias_coarse.to_geometry(geometry, resampling=downsampling)
+                # check_distribution(SM_bias_smooth, "SM_bias_smooth", date_UTC, tile)
+                # logger.info("bias-correcting soil moisture")
+                # SM = rt.clip(SM_prediction - SM_bias_smooth, 0, 1)
+                # check_distribution(SM, "SM", date_UTC, tile)
+                # SM_smooth = GEOS5FP_connection.SM(time_UTC=time_UTC, geometry=geometry, resampling=downsampling)
+                # check_distribution(SM_smooth, "SM_smooth", date_UTC, tile)
+                # logger.info("gap-filling soil moisture")
+                # SM = rt.clip(rt.where(np.isnan(SM), SM_smooth, SM), 0, 1)
+                # SM = rt.where(water, np.nan, SM)
+                # check_distribution(SM, "SM", date_UTC, tile)
+                # logger.info(
+                #     f"up-sampling final soil moisture from {int(SM.cell_size)}m to {int(coarse_geometry.cell_size)}m with {upsampling} method")
+                # SM_final_coarse = SM.to_geometry(coarse_geometry, resampling=upsampling)
+                # check_distribution(SM_final_coarse, "SM_final_coarse", date_UTC, tile)
+                # SM_error_coarse = SM_final_coarse - SM_coarse
+                # check_distribution(SM_error_coarse, "SM_error_coarse", date_UTC, tile)
+                # logger.info(
+                #     f"down-sampling soil moisture error from {int(SM_error_coarse.cell_size)}m to {int(geometry.cell_size)}m with {downsampling} method")
+                # SM_error = rt.where(water, np.nan, SM_error_coarse.to_geometry(geometry, resampling=downsampling))
+                # check_distribution(SM_error, "SM_error", date_UTC, tile)
+
+                # if np.all(np.isnan(SM)):
+                #     raise BlankOutput(
+                #         f"blank soil moisture output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
+
+                Ta_K = Ta_C + 273.15
+                RH = rt.clip(np.exp((17.625 * Td_C) / (243.04 + Td_C)) / np.exp((17.625 * Ta_C) / (243.04 + Ta_C)), 0, 1)
+
+                if np.all(np.isnan(RH)):
+                    raise BlankOutput(
+                        f"blank humidity output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
+            else:
+                Ta_C = GEOS5FP_connection.Ta_C(time_UTC=time_UTC, geometry=geometry, resampling=downsampling)
+                Ta_C_smooth = Ta_C
+                RH = GEOS5FP_connection.RH(time_UTC=time_UTC, geometry=geometry, resampling=downsampling)
+                # SM = GEOS5FP_connection.SM(time_UTC=time_UTC, geometry=geometry, resampling=downsampling)
+
+            if sharpen_soil_moisture:
+                SM_model = sklearn.linear_model.LinearRegression()
+                SM_model.fit(coarse_samples[["ST_C", "NDVI", "albedo"]], coarse_samples["SM"])
+                SM_intercept = SM_model.intercept_
+                ST_C_SM_coef, NDVI_SM_coef, albedo_SM_coef = SM_model.coef_
+                logger.info(
+                    f"soil moisture regression: SM = {SM_intercept:0.2f} + {ST_C_SM_coef:0.2f} * ST_C + {NDVI_SM_coef:0.2f} * NDVI + {albedo_SM_coef:0.2f} * albedo")
+                SM_prediction = rt.clip(ST_C * ST_C_SM_coef + NDVI * NDVI_SM_coef + albedo * albedo_SM_coef + SM_intercept, 0,
+                                        1)
+                check_distribution(SM_prediction, "SM_prediction", date_UTC, tile)
+                logger.info(
+                    f"up-sampling predicted soil moisture from {int(SM_prediction.cell_size)}m to {int(coarse_geometry.cell_size)}m with {upsampling} method")
+                SM_prediction_coarse = SM_prediction.to_geometry(coarse_geometry, resampling=upsampling)
+                check_distribution(SM_prediction_coarse, "SM_prediction_coarse", date_UTC, tile)
+                SM_bias_coarse = SM_prediction_coarse - SM_coarse
+                check_distribution(SM_bias_coarse, "SM_bias_coarse", date_UTC, tile)
+                logger.info(
+                    f"down-sampling soil moisture bias from {int(SM_bias_coarse.cell_size)}m to {int(geometry.cell_size)}m with {downsampling} method")
+                SM_bias_smooth = SM_bias_coarse.to_geometry(geometry, resampling=downsampling)
+                check_distribution(SM_bias_smooth, "SM_bias_smooth", date_UTC, tile)
+                logger.info("bias-correcting soil moisture")
+                SM = rt.clip(SM_prediction - SM_bias_smooth, 0, 1)
+                check_distribution(SM, "SM", date_UTC, tile)
+                SM_smooth = GEOS5FP_connection.SM(time_UTC=time_UTC, geometry=geometry, resampling=downsampling)
+                check_distribution(SM_smooth, "SM_smooth", date_UTC, tile)
+                logger.info("gap-filling soil moisture")
+                SM = rt.clip(rt.where(np.isnan(SM), SM_smooth, SM), 0, 1)
+                SM = rt.where(water, np.nan, SM)
+                check_distribution(SM, "SM", date_UTC, tile)
+                logger.info(
+                    f"up-sampling final soil moisture from {int(SM.cell_size)}m to {int(coarse_geometry.cell_size)}m with {upsampling} method")
+                SM_final_coarse = SM.to_geometry(coarse_geometry, resampling=upsampling)
+                check_distribution(SM_final_coarse, "SM_final_coarse", date_UTC, tile)
+                SM_error_coarse = SM_final_coarse - SM_coarse
+                check_distribution(SM_error_coarse, "SM_error_coarse", date_UTC, tile)
+                logger.info(
+                    f"down-sampling soil moisture error from {int(SM_error_coarse.cell_size)}m to {int(geometry.cell_size)}m with {downsampling} method")
+                SM_error = rt.where(water, np.nan, SM_error_coarse.to_geometry(geometry, resampling=downsampling))
+                check_distribution(SM_error, "SM_error", date_UTC, tile)
+
+                if np.all(np.isnan(SM)):
+                    raise BlankOutput(
+                        f"blank soil moisture output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
+            else:
+                SM = GEOS5FP_connection.SM(time_UTC=time_UTC, geometry=geometry, resampling=downsampling)
 
+            SVP_Pa = 0.6108 * np.exp((17.27 * Ta_C) / (Ta_C + 237.3)) * 1000  # [Pa]
+            Ea_Pa = RH * SVP_Pa
+            Ea_kPa = Ea_Pa / 1000
             Ta_K = Ta_C + 273.15
-            RH = rt.clip(np.exp((17.625 * Td_C) / (243.04 + Td_C)) / np.exp((17.625 * Ta_C) / (243.04 + Ta_C)), 0, 1)
-
-            if np.all(np.isnan(RH)):
-                raise BlankOutput(
-                    f"blank humidity output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
-        else:
-            Ta_C = GEOS5FP_connection.Ta_C(time_UTC=time_UTC, geometry=geometry, resampling=downsampling)
-            Ta_C_smooth = Ta_C
-            RH = GEOS5FP_connection.RH(time_UTC=time_UTC, geometry=geometry, resampling=downsampling)
-            # SM = GEOS5FP_connection.SM(time_UTC=time_UTC, geometry=geometry, resampling=downsampling)
-
-        if sharpen_soil_moisture:
-            SM_model = sklearn.linear_model.LinearRegression()
-            SM_model.fit(coarse_samples[["ST_C", "NDVI", "albedo"]], coarse_samples["SM"])
-            SM_intercept = SM_model.intercept_
-            ST_C_SM_coef, NDVI_SM_coef, albedo_SM_coef = SM_model.coef_
-            logger.info(
-                f"soil moisture regression: SM = {SM_intercept:0.2f} + {ST_C_SM_coef:0.2f} * ST_C + {NDVI_SM_coef:0.2f} * NDVI + {albedo_SM_coef:0.2f} * albedo")
-            SM_prediction = rt.clip(ST_C * ST_C_SM_coef + NDVI * NDVI_SM_coef + albedo * albedo_SM_coef + SM_intercept, 0,
-                                    1)
-            check_distribution(SM_prediction, "SM_prediction", date_UTC, tile)
-            logger.info(
-                f"up-sampling predicted soil moisture from {int(SM_prediction.cell_size)}m to {int(coarse_geometry.cell_size)}m with {upsampling} method")
-            SM_prediction_coarse = SM_prediction.to_geometry(coarse_geometry, resampling=upsampling)
-            check_distribution(SM_prediction_coarse, "SM_prediction_coarse", date_UTC, tile)
-            SM_bias_coarse = SM_prediction_coarse - SM_coarse
-            check_distribution(SM_bias_coarse, "SM_bias_coarse", date_UTC, tile)
-            logger.info(
-                f"down-sampling soil moisture bias from {int(SM_bias_coarse.cell_size)}m to {int(geometry.cell_size)}m with {downsampling} method")
-            SM_bias_smooth = SM_bias_coarse.to_geometry(geometry, resampling=downsampling)
-            check_distribution(SM_bias_smooth, "SM_bias_smooth", date_UTC, tile)
-            logger.info("bias-correcting soil moisture")
-            SM = rt.clip(SM_prediction - SM_bias_smooth, 0, 1)
-            check_distribution(SM, "SM", date_UTC, tile)
-            SM_smooth = GEOS5FP_connection.SM(time_UTC=time_UTC, geometry=geometry, resampling=downsampling)
-            check_distribution(SM_smooth, "SM_smooth", date_UTC, tile)
-            logger.info("gap-filling soil moisture")
-            SM = rt.clip(rt.where(np.isnan(SM), SM_smooth, SM), 0, 1)
-            SM = rt.where(water, np.nan, SM)
-            check_distribution(SM, "SM", date_UTC, tile)
-            logger.info(
-                f"up-sampling final soil moisture from {int(SM.cell_size)}m to {int(coarse_geometry.cell_size)}m with {upsampling} method")
-            SM_final_coarse = SM.to_geometry(coarse_geometry, resampling=upsampling)
-            check_distribution(SM_final_coarse, "SM_final_coarse", date_UTC, tile)
-            SM_error_coarse = SM_final_coarse - SM_coarse
-            check_distribution(SM_error_coarse, "SM_error_coarse", date_UTC, tile)
-            logger.info(
-                f"down-sampling soil moisture error from {int(SM_error_coarse.cell_size)}m to {int(geometry.cell_size)}m with {downsampling} method")
-            SM_error = rt.where(water, np.nan, SM_error_coarse.to_geometry(geometry, resampling=downsampling))
-            check_distribution(SM_error, "SM_error", date_UTC, tile)
 
-            if np.all(np.isnan(SM)):
-                raise BlankOutput(
-                    f"blank soil moisture output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
-        else:
-            SM = GEOS5FP_connection.SM(time_UTC=time_UTC, geometry=geometry, resampling=downsampling)
-
-        SVP_Pa = 0.6108 * np.exp((17.27 * Ta_C) / (Ta_C + 237.3)) * 1000  # [Pa]
-        Ea_Pa = RH * SVP_Pa
-        Ea_kPa = Ea_Pa / 1000
-        Ta_K = Ta_C + 273.15
-
-        logger.info(f"running Breathing Earth System Simulator for {cl.place(tile)} at {cl.time(time_UTC)} UTC")
-
-        BESS_results = BESS_model.BESS(
-            geometry=geometry,
-            target=tile,
-            time_UTC=time_UTC,
-            ST_K=ST_K,
-            Ta_K=Ta_K,
-            RH=RH,
-            elevation_km=elevation_km,
-            NDVI=NDVI,
-            albedo=albedo,
-            Rg=SWin_FLiES_ANN,
-            SM=SM,
-            VISdiff=VISdiff,
-            VISdir=VISdir,
-            NIRdiff=NIRdiff,
-            NIRdir=NIRdir,
-            UV=UV,
-            water=water,
-            output_variables=["Rn", "LE", "GPP"]
-        )
-
-        Rn_BESS = BESS_results["Rn"]
-        LE_BESS = BESS_results["LE"]
-        GPP = BESS_results["GPP"]  # [umol m-2 s-1]
-        GPP = GPP.mask(~water)
-
-        if np.all(np.isnan(GPP)):
-            raise BlankOutput(f"blank GPP output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
-
-        NWP_filenames = sorted([posixpath.basename(filename) for filename in BESS_model.GEOS5FP_connection.filenames])
-        AncillaryNWP = ",".join(NWP_filenames)
-        metadata["ProductMetadata"]["AncillaryNWP"] = AncillaryNWP
-
-        Rn_verma = PTJPLSM_model.Rn(
-            date_UTC=date_UTC,
-            target=tile,
-            SWin=SWin,
-            albedo=albedo,
-            ST_C=ST_C,
-            emissivity=emissivity,
-            Ea_kPa=Ea_kPa,
-            Ta_C=Ta_C,
-            cloud_mask=cloud
-        )
-
-        if Rn_model_name == "verma":
-            Rn = Rn_verma
-        elif Rn_model_name == "BESS":
-            Rn = Rn_BESS
-        else:
-            raise ValueError(f"unrecognized net radiation model: {Rn_model_name}")
-
-        if np.all(np.isnan(Rn)) or np.all(Rn == 0):
-            raise BlankOutput(f"blank net radiation output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
-
-        STIC_model = STIC(
-            working_directory=working_directory,
-            static_directory=static_directory,
-            GEOS5FP_connection=GEOS5FP_connection,
-            save_intermediate=save_intermediate,
-            show_distribution=show_distribution
-        )
-
-        STIC_results = STIC_model.STIC(
-            geometry=geometry,
-            target=tile,
-            time_UTC=time_UTC,
-            Rn=Rn,
-            RH=RH,
-            Rg=SWin,
-            Ta_C=Ta_C_smooth,
-            ST_C=ST_C,
-            albedo=albedo,
-            emissivity=emissivity,
-            NDVI=NDVI,
-            water=water,
-            max_iterations=3
-        )
+            return Ta_C, Ta_C_smooth, RH, SM, Ea_Pa, Ea_kPa, Ta_K
+
+        @stages.stage(
+            inputs=["Ta_K", "RH", "SM", "SWin_FLiES_ANN", "VISdiff", "VISdir", "NIRdiff", "NIRdir", "UV"],
+            outputs=["Rn_BESS", "LE_BESS", "GPP", "AncillaryNWP"])
+        def BESS_fluxes(Ta_K, RH, SM, SWin_FLiES_ANN, VISdiff, VISdir, NIRdiff, NIRdir, UV):
+            logger.info(f"running Breathing Earth System Simulator for {cl.place(tile)} at {cl.time(time_UTC)} UTC")
+
+            BESS_results = BESS_model.BESS(
+                geometry=geometry,
+                target=tile,
+                time_UTC=time_UTC,
+                ST_K=ST_K,
+                Ta_K=Ta_K,
+                RH=RH,
+                elevation_km=elevation_km,
+                NDVI=NDVI,
+                albedo=albedo,
+                Rg=SWin_FLiES_ANN,
+                SM=SM,
+                VISdiff=VISdiff,
+                VISdir=VISdir,
+                NIRdiff=NIRdiff,
+                NIRdir=NIRdir,
+                UV=UV,
+                water=water,
+                output_variables=["Rn", "LE", "GPP"]
+            )
 
-        LE_STIC = STIC_results["LE"]
-        LEt_STIC = STIC_results["LEt"]
-        G_STIC = STIC_results["G"]
+            Rn_BESS = BESS_results["Rn"]
+            LE_BESS = BESS_results["LE"]
+            GPP = BESS_results["GPP"]  # [umol m-2 s-1]
+            GPP = GPP.mask(~water)
+
+            if np.all(np.isnan(GPP)):
+                raise BlankOutput(f"blank GPP output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
+
+            # the granules read by the time BESS finishes, snapshotted under the lock while other stages may still be reading
+            NWP_filenames = sorted(posixpath.basename(filename) for filename in BESS_model.GEOS5FP_connection.snapshot_filenames())
+            AncillaryNWP = ",".join(NWP_filenames)
+
+            return Rn_BESS, LE_BESS, GPP, AncillaryNWP
+
+        # net radiation only waits for BESS when it is taken from BESS
+        @stages.stage(
+            inputs=["SWin", "Ea_kPa", "Ta_C"] + (["Rn_BESS"] if Rn_model_name == "BESS" else []),
+            outputs=["Rn_verma", "Rn"])
+        def net_radiation(SWin, Ea_kPa, Ta_C, Rn_BESS=None):
+            Rn_verma = PTJPLSM_model.Rn(
+                date_UTC=date_UTC,
+                target=tile,
+                SWin=SWin,
+                albedo=albedo,
+                ST_C=ST_C,
+                emissivity=emissivity,
+                Ea_kPa=Ea_kPa,
+                Ta_C=Ta_C,
+                cloud_mask=cloud
+            )
 
-        # STICcanopy = rt.clip((LEt_STIC / LE_STIC) * 100, 0, 100)
-        STICcanopy = rt.clip(rt.where((LEt_STIC == 0) | (LE_STIC == 0), 0, LEt_STIC / LE_STIC), 0, 1)
+            if Rn_model_name == "verma":
+                Rn = Rn_verma
+            elif Rn_model_name == "BESS":
+                Rn = Rn_BESS
+            else:
+                raise ValueError(f"unrecognized net radiation model: {Rn_model_name}")
+
+            if np.all(np.isnan(Rn)) or np.all(Rn == 0):
+                raise BlankOutput(f"blank net radiation output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
+
+            return Rn_verma, Rn
+
+        @stages.stage(
+            inputs=["Rn", "RH", "SWin", "Ta_C_smooth"],
+            outputs=["LE_STIC", "LEt_STIC", "G_STIC", "STICcanopy"])
+        def STIC_fluxes(Rn, RH, SWin, Ta_C_smooth):
+            STIC_model = STIC(
+                working_directory=working_directory,
+                static_directory=static_directory,
+                GEOS5FP_connection=GEOS5FP_connection,
+                save_intermediate=save_intermediate,
+                show_distribution=show_distribution,
+                intermediate_writer=intermediate_writer,
+                distribution_sample_fraction=distribution_sample_fraction,
+                memoize=memoize,
+                dtype=compute_dtype,
+                in_place_iteration=STIC_in_place_iteration
+            )
 
-        # G = calculate_G_SEBAL(Rn, ST_C, NDVI, albedo)
-        # G = G_STIC
+            STIC_results = STIC_model.STIC(
+                geometry=geometry,
+                target=tile,
+                time_UTC=time_UTC,
+                Rn=Rn,
+                RH=RH,
+                Rg=SWin,
+                Ta_C=Ta_C_smooth,
+                ST_C=ST_C,
+                albedo=albedo,
+                emissivity=emissivity,
+                NDVI=NDVI,
+                water=water,
+                max_iterations=3
+            )
 
-        PTJPLSM_results = PTJPLSM_model.PTJPL(
-            geometry=geometry,
-            target=tile,
-            time_UTC=time_UTC,
-            ST_C=ST_C,
-            emissivity=emissivity,
-            NDVI=NDVI,
-            albedo=albedo,
-            SWin=SWin,
-            Rn=Rn,
-            # G=G,
-            Ta_C=Ta_C,
-            RH=RH,
-            SM=SM,
-            Ea_kPa=Ea_kPa,
-            water=water,
-            output_variables=["LE", "canopy_proportion", "LE_canopy", "soil_proportion", "interception_proportion",
-                              "ET", "ESI", "PET", "SM", "Rn", "Rn_daily"]
-        )
+            LE_STIC = STIC_results["LE"]
+            LEt_STIC = STIC_results["LEt"]
+            G_STIC = STIC_results["G"]
+
+            # STICcanopy = rt.clip((LEt_STIC / LE_STIC) * 100, 0, 100)
+            STICcanopy = rt.clip(rt.where((LEt_STIC == 0) | (LE_STIC == 0), 0, LEt_STIC / LE_STIC), 0, 1)
+
+            return LE_STIC, LEt_STIC, G_STIC, STICcanopy
+
+        @stages.stage(
+            inputs=["SWin", "Rn", "Ta_C", "RH", "SM", "Ea_kPa"],
+            outputs=[
+                "LE_PTJPLSM", "LEt_PTJPLSM", "PTJPLSMcanopy", "PTJPLSMsoil", "PTJPLSMinterception",
+                "ESI_PTJPLSM", "PET_PTJPLSM", "SM_PTJPLSM", "Rn_daily"
+            ])
+        def PTJPLSM_fluxes(SWin, Rn, Ta_C, RH, SM, Ea_kPa):
+            PTJPLSM_results = PTJPLSM_model.PTJPL(
+                geometry=geometry,
+                target=tile,
+                time_UTC=time_UTC,
+                ST_C=ST_C,
+                emissivity=emissivity,
+                NDVI=NDVI,
+                albedo=albedo,
+                SWin=SWin,
+                Rn=Rn,
+                # G=G,
+                Ta_C=Ta_C,
+                RH=RH,
+                SM=SM,
+                Ea_kPa=Ea_kPa,
+                water=water,
+                output_variables=["LE", "canopy_proportion", "LE_canopy", "soil_proportion", "interception_proportion",
+                                  "ET", "ESI", "PET", "SM", "Rn", "Rn_daily"]
+            )
 
-        if Rn is None:
-            Rn = rt.clip(PTJPLSM_results["Rn"], 0, None)
+            if Rn is None:
+                Rn = rt.clip(PTJPLSM_results["Rn"], 0, None)
 
-        if np.all(np.isnan(Rn)):
-            raise BlankOutput(
-                f"blank instantaneous net radiation output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
+            if np.all(np.isnan(Rn)):
+                raise BlankOutput(
+                    f"blank instantaneous net radiation output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
 
-        Rn_daily = rt.clip(PTJPLSM_results["Rn_daily"], 0, None)
+            Rn_daily = rt.clip(PTJPLSM_results["Rn_daily"], 0, None)
 
-        if np.all(np.isnan(Rn_daily)):
-            raise BlankOutput(
-                f"blank daily net radiation output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
+            if np.all(np.isnan(Rn_daily)):
+                raise BlankOutput(
+                    f"blank daily net radiation output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
 
-        LE_PTJPLSM = rt.clip(PTJPLSM_results["LE"], 0, None)
+            LE_PTJPLSM = rt.clip(PTJPLSM_results["LE"], 0, None)
 
-        if np.all(np.isnan(LE_PTJPLSM)):
-            raise BlankOutput(
-                f"blank PT-JPL-SM instantaneous ET output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
+            if np.all(np.isnan(LE_PTJPLSM)):
+                raise BlankOutput(
+                    f"blank PT-JPL-SM instantaneous ET output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
 
-        if np.all(np.isnan(LE_PTJPLSM)):
-            raise BlankOutput(
-                f"blank daily ET output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
+            if np.all(np.isnan(LE_PTJPLSM)):
+                raise BlankOutput(
+                    f"blank daily ET output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
 
-        LEt_PTJPLSM = rt.clip(PTJPLSM_results["LE_canopy"], 0, None)
+            LEt_PTJPLSM = rt.clip(PTJPLSM_results["LE_canopy"], 0, None)
 
-        PTJPLSMcanopy = rt.clip(PTJPLSM_results["canopy_proportion"], 0, 1)
-        PTJPLSMsoil = rt.clip(PTJPLSM_results["soil_proportion"], 0, 1)
-        PTJPLSMinterception = rt.clip(PTJPLSM_results["interception_proportion"], 0, 1)
-        ESI_PTJPLSM = rt.clip(PTJPLSM_results["ESI"], 0, 1)
+            PTJPLSMcanopy = rt.clip(PTJPLSM_results["canopy_proportion"], 0, 1)
+            PTJPLSMsoil = rt.clip(PTJPLSM_results["soil_proportion"], 0, 1)
+            PTJPLSMinterception = rt.clip(PTJPLSM_results["interception_proportion"], 0, 1)
+            ESI_PTJPLSM = rt.clip(PTJPLSM_results["ESI"], 0, 1)
 
-        if np.all(np.isnan(ESI_PTJPLSM)):
-            raise BlankOutput(f"blank ESI output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
+            if np.all(np.isnan(ESI_PTJPLSM)):
+                raise BlankOutput(f"blank ESI output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
 
-        PET_PTJPLSM = rt.clip(PTJPLSM_results["PET"], 0, None)
-        SM = rt.clip(PTJPLSM_results["SM"], 0, 1)
+            PET_PTJPLSM = rt.clip(PTJPLSM_results["PET"], 0, None)
+            SM = rt.clip(PTJPLSM_results["SM"], 0, 1)
 
-        if np.all(np.isnan(SM)):
-            raise BlankOutput(
-                f"blank soil moisture output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
+            if np.all(np.isnan(SM)):
+                raise BlankOutput(
+                    f"blank soil moisture output for orbit {orbit} scene {scene} tile {tile} at {time_UTC} UTC")
 
-        MOD16_model = MOD16(
-            working_directory=working_directory,
-            static_directory=static_directory,
-            GEOS5FP_connection=GEOS5FP_connection,
-            MCD12_connnection=MCD12_connnection,
-            save_intermediate=save_intermediate,
-            show_distribution=show_distribution
-        )
+            return (
+                LE_PTJPLSM, LEt_PTJPLSM, PTJPLSMcanopy, PTJPLSMsoil, PTJPLSMinterception,
+                ESI_PTJPLSM, PET_PTJPLSM, SM, Rn_daily
+            )
 
-        # Ta_K = Ta_C + 273.15
-        # Ea_Pa = Ea_kPa * 1000
+        @stages.stage(inputs=["Ta_K", "Ea_Pa", "SWin", "Rn", "Rn_daily"], outputs=["LE_MOD16"])
+        def MOD16_fluxes(Ta_K, Ea_Pa, SWin, Rn, Rn_daily):
+            MOD16_model = MOD16(
+                working_directory=working_directory,
+                static_directory=static_directory,
+                GEOS5FP_connection=GEOS5FP_connection,
+                MCD12_connnection=MCD12_connnection,
+                save_intermediate=save_intermediate,
+                show_distribution=show_distribution,
+                intermediate_writer=intermediate_writer,
+                distribution_sample_fraction=distribution_sample_fraction,
+                memoize=memoize,
+                dtype=compute_dtype
+            )
 
-        MOD16_results = MOD16_model.MOD16(
-            geometry=geometry,
-            target=tile,
-            time_UTC=time_UTC,
-            ST_K=ST_K,
-            emissivity=emissivity,
-            NDVI=NDVI,
-            albedo=albedo,
-            Ta_K=Ta_K,
-            Ea_Pa=Ea_Pa,
-            elevation_km=elevation_km,
-            SWin=SWin,
-            Rn=Rn,
-            Rn_daily=Rn_daily,
-            # G=G,
-            water=water
-        )
+            # Ta_K = Ta_C + 273.15
+            # Ea_Pa = Ea_kPa * 1000
+
+            MOD16_results = MOD16_model.MOD16(
+                geometry=geometry,
+                target=tile,
+                time_UTC=time_UTC,
+                ST_K=ST_K,
+                emissivity=emissivity,
+                NDVI=NDVI,
+                albedo=albedo,
+                Ta_K=Ta_K,
+                Ea_Pa=Ea_Pa,
+                elevation_km=elevation_km,
+                SWin=SWin,
+                Rn=Rn,
+                Rn_daily=Rn_daily,
+                # G=G,
+                water=water
+            )
 
-        LE_MOD16 = MOD16_results["LE"]
+            LE_MOD16 = MOD16_results["LE"]
+
+            return LE_MOD16
+
+        values = stages.run()
+        stages.report_timings()
+
+        metadata["ProductMetadata"]["AncillaryNWP"] = values["AncillaryNWP"]
+        SWin_FLiES_ANN = values["SWin_FLiES_ANN"]
+        SWin_FLiES_LUT = values["SWin_FLiES_LUT"]
+        SWin_GEOS5FP = values["SWin_GEOS5FP"]
+        SWin = values["SWin"]
+        Ta_C = values["Ta_C"]
+        RH = values["RH"]
+        GPP = values["GPP"]
+        LE_BESS = values["LE_BESS"]
+        Rn_verma = values["Rn_verma"]
+        Rn = values["Rn"]
+        LE_STIC = values["LE_STIC"]
+        STICcanopy = values["STICcanopy"]
+        LE_PTJPLSM = values["LE_PTJPLSM"]
+        LEt_PTJPLSM = values["LEt_PTJPLSM"]
+        PTJPLSMcanopy = values["PTJPLSMcanopy"]
+        PTJPLSMsoil = values["PTJPLSMsoil"]
+        PTJPLSMinterception = values["PTJPLSMinterception"]
+        ESI_PTJPLSM = values["ESI_PTJPLSM"]
+        PET_PTJPLSM = values["PET_PTJPLSM"]
+        LE_MOD16 = values["LE_MOD16"]
+        SM = values["SM_PTJPLSM"]
 
         LE_BESS = LE_BESS.mask(~water)
 
@@ -1877,6 +2057,14 @@ def L3T_L4T_JET(
         logger.info(f"removing L4T WUE tile granule directory: {cl.dir(L4T_WUE_directory)}")
         shutil.rmtree(L4T_WUE_directory)
 
+        if intermediate_writer is not None:
+            try:
+                intermediate_writer.close()
+            except IntermediateWriteError as e:
+                raise ProductWriteFailed(str(e))
+
+        logger.info(f"GEOS-5 FP cache hits: {cl.val(GEOS5FP_connection.cache.hits)} misses: {cl.val(GEOS5FP_connection.cache.misses)}")
+        GEOS5FP_connection.clear_cache()
         logger.info(f"finished L3T L4T JET run in {cl.time(timer)} seconds")
 
     except (BlankOutput, BlankOutputError) as exception:
@@ -1891,6 +2079,10 @@ def L3T_L4T_JET(
         logger.exception(exception)
         exit_code = exception.exit_code
 
+    finally:
+        if intermediate_writer is not None:
+            intermediate_writer.close(raise_errors=False)
+
     return exit_code
 
 
@@ -1907,13 +2099,23 @@ def main(argv=sys.argv):
     strip_console = "--strip-console" in argv
     save_intermediate = "--save-intermediate" in argv
     show_distribution = "--show-distribution" in argv
+    memoize = "--memoize" in argv
+    compute_dtype = "float32" if "--float32" in argv else COMPUTE_DTYPE
+    BESS_cache_static = "--cache-static" in argv or BESS_CACHE_STATIC
+    STIC_in_place_iteration = "--in-place-STIC" in argv or STIC_IN_PLACE_ITERATION
+    stage_workers = int(argv[argv.index("--stage-workers") + 1]) if "--stage-workers" in argv else STAGE_WORKERS
     runconfig_filename = str(argv[1])
 
     exit_code = L3T_L4T_JET(
         runconfig_filename=runconfig_filename,
         strip_console=strip_console,
         save_intermediate=save_intermediate,
-        show_distribution=show_distribution
+        show_distribution=show_distribution,
+        memoize=memoize,
+        compute_dtype=compute_dtype,
+        BESS_cache_static=BESS_cache_static,
+        STIC_in_place_iteration=STIC_in_place_iteration,
+        stage_workers=stage_workers
     )
 
     logger.info(f"L3T_L4T_JET exit code: {exit_code}")
@@ -7,7 +7,8 @@ https://landweb.nascom.nasa.gov/QA_WWW/forPage/user_guide/MOD16UsersGuide2016.pd
 Developed by Gregory Halverson in the Jet Propulsion Laboratory Year-Round Internship Program (Columbus Technologies and Services), in coordination with the ECOSTRESS mission and master's thesis studies at California State University, Northridge.
 """
 import logging
-from typing import Callable
+from collections import namedtuple
+from typing import Callable, Union
 from datetime import datetime
 from os.path import join, abspath, dirname, expanduser
 
@@ -21,6 +22,8 @@ from GEOS5FP import GEOS5FP
 from MCD12.MCD12C1 import MCD12C1
 from SRTM import SRTM
 from model.model import DEFAULT_PREVIEW_QUALITY, DEFAULT_RESAMPLING
+from model.precision import DEFAULT_DTYPE, precision_inputs
+from model.writer import IntermediateWriter
 from rasters import Raster, RasterGrid, RasterGeometry
 
 __author__ = 'Kaniska Mallick, Adam Purdy, Gregory Halverson'
@@ -66,6 +69,24 @@ CUTICULAR_CONDUCTANCE = 0.00001
 # lookup table
 LUT = pd.read_csv(join(abspath(dirname(__file__)), 'mod16.csv'))
 
+# biome parameters and their columns in the lookup table
+BIOME_PARAMETER_COLUMNS = {
+    "gl_sh": "gl_sh",
+    "gl_e_wv": "gl_e_wv",
+    "CL": "cl",
+    "tmin_open": "tmin_open",
+    "tmin_close": "tmin_close",
+    "vpd_open": "vpd_open",
+    "vpd_close": "vpd_close",
+    "rbl_max": "rbl_max",
+    "rbl_min": "rbl_min"
+}
+
+# one row per biome parameter and one column per IGBP class
+BIOME_PARAMETER_TABLE = LUT[list(BIOME_PARAMETER_COLUMNS.values())].to_numpy(dtype=np.float32).T
+
+BiomeParameters = namedtuple("BiomeParameters", list(BIOME_PARAMETER_COLUMNS))
+
 
 def kelvin_to_celsius(temperature_K):
     """
@@ -430,7 +451,11 @@ class MOD16(FLiES):
             downscale_vapor: bool = True,
             save_intermediate: bool = False,
             include_preview: bool = True,
-            show_distribution: bool = True):
+            show_distribution: bool = True,
+            intermediate_writer: IntermediateWriter = None,
+            distribution_sample_fraction: float = None,
+            memoize: bool = False,
+            dtype: Union[str, type, np.dtype] = DEFAULT_DTYPE):
         if working_directory is None:
             working_directory = DEFAULT_WORKING_DIRECTORY
 
@@ -459,7 +484,11 @@ class MOD16(FLiES):
             resampling=resampling,
             save_intermediate=save_intermediate,
             show_distribution=show_distribution,
-            include_preview=include_preview
+            include_preview=include_preview,
+            intermediate_writer=intermediate_writer,
+            distribution_sample_fraction=distribution_sample_fraction,
+            memoize=memoize,
+            dtype=dtype
         )
 
         if MCD12_connnection is None:
@@ -478,6 +507,28 @@ class MOD16(FLiES):
     def IGBP_subset(self, geometry: RasterGeometry, resampling: str = None, buffer=3, **kwargs):
         return self.IGBP(geometry=geometry.bbox, resampling=resampling, buffer=buffer, **kwargs)
 
+    def biome_parameters(self, geometry: RasterGeometry, IGBP: Raster = None, resampling: str = None) -> BiomeParameters:
+        """
+        query every biome-specific parameter of the lookup table with a single read of IGBP land-cover
+        :param geometry: target geometry
+        :param IGBP: IGBP land-cover subset at its native resolution, read with IGBP_subset if not given
+        :param resampling: resampling method from the land-cover grid to the target geometry
+        :return: bundle of float32 biome parameter rasters
+        """
+        if resampling is None:
+            resampling = self.resampling
+
+        if IGBP is None:
+            IGBP = self.IGBP_subset(geometry)
+
+        # gather the parameters of every pixel in one step, with one contiguous image per parameter
+        images = np.take(BIOME_PARAMETER_TABLE, np.asarray(IGBP), axis=1)
+
+        return BiomeParameters(*[
+            Raster(image, geometry=IGBP.geometry).to_geometry(geometry, resampling=resampling)
+            for image in images
+        ])
+
     def gl_sh(self, geometry: RasterGeometry, IGBP: Raster = None, resampling: str = None) -> Raster:
         """
         query leaf conductance to sensible heat (gl_sh)
@@ -617,6 +668,7 @@ class MOD16(FLiES):
         return image
 
     # TODO check units of minimum temperature
+    @precision_inputs
     def MOD16(
             self,
             geometry: RasterGrid,
@@ -913,12 +965,12 @@ class MOD16(FLiES):
 
         logger.info("calculating PM-MOD resistances")
 
-        IGBP_subset = self.IGBP_subset(geometry=geometry)
+        biome_parameters = self.biome_parameters(geometry=geometry)
 
         # query leaf conductance to sensible heat (gl_sh)
         # in seconds per meter
         # gl_sh = float32(array(LUT['gl_sh'])[IGBP])
-        gl_sh = self.gl_sh(geometry=geometry, IGBP=IGBP_subset)
+        gl_sh = biome_parameters.gl_sh
 
         if 'gl_sh' in output_variables or diagnostic:
             # print('saving gl_sh')
@@ -956,7 +1008,7 @@ class MOD16(FLiES):
 
         # calculate leaf conductance to evaporated water vapor (gl_e_wv)
         # gl_e_wv = float32(array(LUT['gl_e_wv'])[IGBP])
-        gl_e_wv = self.gl_e_wv(geometry=geometry, IGBP=IGBP_subset)
+        gl_e_wv = biome_parameters.gl_e_wv
 
         if 'gl_e_wv' in output_variables or diagnostic:
             # print('saving gl_e_wv')
@@ -1001,7 +1053,7 @@ class MOD16(FLiES):
 
         # query biome-specific mean potential stomatal conductance per unit leaf area
         # CL = array(LUT['cl'])[IGBP]
-        CL = self.CL(geometry=geometry, IGBP=IGBP_subset)
+        CL = biome_parameters.CL
 
         CL = where(water, nan, CL)
 
@@ -1012,14 +1064,14 @@ class MOD16(FLiES):
 
         # query open minimum temperature by land-cover
         # tmin_open = float32(array(LUT['tmin_open'])[IGBP])
-        tmin_open = self.tmin_open(geometry=geometry, IGBP=IGBP_subset)
+        tmin_open = biome_parameters.tmin_open
 
         if 'tmin_open' in output_variables or diagnostic:
             results['tmin_open'] = tmin_open
 
         # query closed minimum temperature by land-cover
         # tmin_close = float32(array(LUT['tmin_close'])[IGBP])
-        tmin_close = self.tmin_close(geometry=geometry, IGBP=IGBP_subset)
+        tmin_close = biome_parameters.tmin_close
 
         if 'tmin_close' in output_variables or diagnostic:
             results['tmin_close'] = tmin_close
@@ -1037,7 +1089,7 @@ class MOD16(FLiES):
 
         # query open vapor pressure deficit by land-cover
         # vpd_open = float32(array(LUT['vpd_open'])[IGBP])
-        vpd_open = self.vpd_open(geometry=geometry, IGBP=IGBP_subset)
+        vpd_open = biome_parameters.vpd_open
 
         vpd_open = where(water, nan, vpd_open)
 
@@ -1046,7 +1098,7 @@ class MOD16(FLiES):
 
         # query closed vapor pressure deficit by land-cover
         # vpd_close = float32(array(LUT['vpd_close'])[IGBP])
-        vpd_close = self.vpd_close(geometry=geometry, IGBP=IGBP_subset)
+        vpd_close = biome_parameters.vpd_close
 
         vpd_close = where(water, nan, vpd_close)
 
@@ -1133,9 +1185,9 @@ class MOD16(FLiES):
 
         # query aerodynamic resistant constraints from land-cover
         # rbl_max = float32(array(LUT['rbl_max'])[IGBP])
-        rbl_max = self.rbl_max(geometry=geometry, IGBP=IGBP_subset)
+        rbl_max = biome_parameters.rbl_max
         # rbl_min = float32(array(LUT['rbl_min'])[IGBP])
-        rbl_min = self.rbl_min(geometry=geometry, IGBP=IGBP_subset)
+        rbl_min = biome_parameters.rbl_min
 
         rbl_max = where(water, nan, rbl_max)
         rbl_min = where(water, nan, rbl_min)
@@ -5,20 +5,22 @@ import logging
 import warnings
 from datetime import datetime
 from os.path import join, abspath, dirname, expanduser
-from typing import Callable, Dict, List
+from typing import Callable, Dict, List, Union
 
 import numpy as np
 from scipy.stats import zscore
 from datetime import date
 import rasters as rt
 
-from BESS import BESS, DEFAULT_DOWNSCALE_AIR, DEFAULT_DOWNSCALE_HUMIDITY, DEFAULT_DOWNSCALE_MOISTURE
+from BESS import BESS, DEFAULT_DOWNSCALE_AIR, DEFAULT_DOWNSCALE_HUMIDITY, DEFAULT_DOWNSCALE_MOISTURE, DEFAULT_CACHE_STATIC
 
 from GEDI import GEDICanopyHeight
 
 from GEOS5FP import GEOS5FP
 from ORNL.MODISCI import MODISCI
 from SRTM import SRTM
+from model.precision import DEFAULT_DTYPE, precision_inputs
+from model.writer import IntermediateWriter
 
 from rasters import Raster, RasterGeometry, RasterGrid
 
@@ -95,7 +97,13 @@ class PTJPL(BESS):
             floor_Topt: bool = FLOOR_TOPT,
             save_intermediate: bool = False,
             include_preview: bool = True,
-            show_distribution: bool = True):
+            show_distribution: bool = True,
+            intermediate_writer: IntermediateWriter = None,
+            distribution_sample_fraction: float = None,
+            memoize: bool = False,
+            dtype: Union[str, type, np.dtype] = DEFAULT_DTYPE,
+            cache_static: bool = DEFAULT_CACHE_STATIC,
+            static_cache_directory: str = None):
         if working_directory is None:
             working_directory = DEFAULT_WORKING_DIRECTORY
 
@@ -129,6 +137,12 @@ class PTJPL(BESS):
             save_intermediate=save_intermediate,
             show_distribution=show_distribution,
             include_preview=include_preview,
+            intermediate_writer=intermediate_writer,
+            distribution_sample_fraction=distribution_sample_fraction,
+            memoize=memoize,
+            dtype=dtype,
+            cache_static=cache_static,
+            static_cache_directory=static_cache_directory,
             downscale_air=downscale_air,
             downscale_humidity=downscale_humidity,
             downscale_moisture=downscale_moisture
@@ -141,7 +155,7 @@ class PTJPL(BESS):
     def load_Topt(self, geometry: RasterGeometry) -> Raster:
         SCALE_FACTOR = 0.01
         filename = join(abspath(dirname(__file__)), "Topt_mean_CMG_int16.tif")
-        image = rt.clip(rt.Raster.open(filename, geometry=geometry, resampling="cubic") * SCALE_FACTOR, 0, None)
+        image = rt.clip(self.cast(rt.Raster.open(filename, geometry=geometry, resampling="cubic")) * SCALE_FACTOR, 0, None)
         image.nodata = np.nan
 
         return image
@@ -149,7 +163,7 @@ class PTJPL(BESS):
     def load_fAPARmax(self, geometry: RasterGeometry) -> Raster:
         SCALE_FACTOR = 0.0001
         filename = join(abspath(dirname(__file__)), "fAPARmax_mean_CMG_int16.tif")
-        image = rt.clip(rt.Raster.open(filename, geometry=geometry, resampling="cubic") * SCALE_FACTOR, 0, None)
+        image = rt.clip(self.cast(rt.Raster.open(filename, geometry=geometry, resampling="cubic")) * SCALE_FACTOR, 0, None)
         image.nodata = np.nan
 
         return image
@@ -359,6 +373,7 @@ class PTJPL(BESS):
 
         return Rn
 
+    @precision_inputs
     def PTJPL(
             self,
             geometry: RasterGrid,
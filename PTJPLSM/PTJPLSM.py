@@ -5,7 +5,7 @@ import logging
 import warnings
 from datetime import datetime
 from os.path import join, abspath, expanduser
-from typing import Callable, Dict, List
+from typing import Callable, Dict, List, Union
 
 import numpy as np
 
@@ -13,13 +13,15 @@ import rasters as rt
 
 __author__ = "Gregory Halverson"
 
-from BESS import DEFAULT_DOWNSCALE_AIR, DEFAULT_DOWNSCALE_HUMIDITY, DEFAULT_DOWNSCALE_MOISTURE
+from BESS import DEFAULT_DOWNSCALE_AIR, DEFAULT_DOWNSCALE_HUMIDITY, DEFAULT_DOWNSCALE_MOISTURE, DEFAULT_CACHE_STATIC
 
 from GEDI import GEDICanopyHeight
 
 from GEOS5FP import GEOS5FP
 from ORNL.MODISCI import MODISCI
 from SRTM import SRTM
+from model.precision import DEFAULT_DTYPE, precision_inputs
+from model.writer import IntermediateWriter
 
 from PTJPL import PTJPL
 from SoilGrids import SoilGrids
@@ -98,7 +100,13 @@ class PTJPLSM(PTJPL):
             floor_Topt: bool = FLOOR_TOPT,
             save_intermediate: bool = False,
             include_preview: bool = True,
-            show_distribution: bool = True):
+            show_distribution: bool = True,
+            intermediate_writer: IntermediateWriter = None,
+            distribution_sample_fraction: float = None,
+            memoize: bool = False,
+            dtype: Union[str, type, np.dtype] = DEFAULT_DTYPE,
+            cache_static: bool = DEFAULT_CACHE_STATIC,
+            static_cache_directory: str = None):
         if working_directory is None:
             working_directory = DEFAULT_WORKING_DIRECTORY
 
@@ -138,6 +146,12 @@ class PTJPLSM(PTJPL):
             save_intermediate=save_intermediate,
             show_distribution=show_distribution,
             include_preview=include_preview,
+            intermediate_writer=intermediate_writer,
+            distribution_sample_fraction=distribution_sample_fraction,
+            memoize=memoize,
+            dtype=dtype,
+            cache_static=cache_static,
+            static_cache_directory=static_cache_directory,
             downscale_air=downscale_air,
             downscale_humidity=downscale_humidity,
             downscale_moisture=downscale_moisture,
@@ -162,6 +176,7 @@ class PTJPLSM(PTJPL):
 
         return fREW
 
+    @precision_inputs
     def PTJPL(
             self,
             geometry: RasterGeometry,
@@ -2,7 +2,7 @@ import logging
 from typing import Callable
 from datetime import datetime, timedelta
 from os.path import join, abspath, expanduser
-from typing import Dict, List
+from typing import Dict, List, Union
 
 import numpy as np
 import warnings
@@ -12,15 +12,21 @@ import rasters as rt
 from GEOS5FP import GEOS5FP
 from SRTM import SRTM
 from model.model import DEFAULT_PREVIEW_QUALITY, DEFAULT_RESAMPLING, Model
+from model.memoization import memoize_stage
+from model.precision import DEFAULT_DTYPE, precision_inputs
+from model.writer import IntermediateWriter
 from rasters import Raster, RasterGrid
 from timer import Timer
 
+from .iteration import STIC_iteration
+
 __author__ = 'Kaniska Mallick, Madeleine Pascolini-Campbell, Gregory Halverson'
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_WORKING_DIRECTORY = "."
 DEFAULT_STIC_INTERMEDIATE = "STIC_intermediate"
+DEFAULT_IN_PLACE_ITERATION = False
 
 DEFAULT_OUTPUT_VARIABLES = [
     "LE",
@@ -351,7 +357,12 @@ class STIC(Model):
             downscale_vapor: bool = True,
             save_intermediate: bool = False,
             include_preview: bool = True,
-            show_distribution: bool = True):
+            show_distribution: bool = True,
+            intermediate_writer: IntermediateWriter = None,
+            distribution_sample_fraction: float = None,
+            memoize: bool = False,
+            dtype: Union[str, type, np.dtype] = DEFAULT_DTYPE,
+            in_place_iteration: bool = DEFAULT_IN_PLACE_ITERATION):
         if working_directory is None:
             working_directory = DEFAULT_WORKING_DIRECTORY
 
@@ -373,12 +384,19 @@ class STIC(Model):
             resampling=resampling,
             save_intermediate=save_intermediate,
             show_distribution=show_distribution,
-            include_preview=include_preview
+            include_preview=include_preview,
+            intermediate_writer=intermediate_writer,
+            distribution_sample_fraction=distribution_sample_fraction,
+            memoize=memoize,
+            dtype=dtype
         )
 
         self.downscale_air = downscale_air
         self.downscale_vapor = downscale_vapor
+        self.in_place_iteration = in_place_iteration
 
+    @precision_inputs
+    @memoize_stage(parameters=("in_place_iteration",), results="results", modules=("STIC.iteration",))
     def STIC(
             self,
             geometry: RasterGrid,
@@ -570,126 +588,186 @@ class STIC(Model):
         LE_max_change = 0
         t = Timer()
 
-        while (np.nanmax(LE_change) >= LE_convergence_target and iteration <= max_iterations):
-            logger.info(f"running STIC iteration {cl.val(iteration)} / {cl.val(max_iterations)}")
-
+        if self.in_place_iteration:
             if Rg is None:
-
-                # canopy air stream vapor pressures
-                e0star = Ea_hPa + (GAMMA * LE_new * (gB + gS)) / (RHO * CP * gB * gS)
-                e0star = rt.where(e0star < 0, Estar, e0star)
-                e0star = rt.where(e0star > 250, Estar, e0star)
-                self.diagnostic(e0star, f"e0star_{iteration}", date_UTC, target)
-                D0 = VPD_hPa + (delta * phi - (delta + GAMMA) * LE_new) / (
-                        RHO * CP * gB)  # vapor pressure deficit at source
-                D0 = rt.where(D0 < 0, Ds, D0)
-                self.diagnostic(D0, f"D0_{iteration}", date_UTC, target)
-                e0 = e0star - D0
-                e0 = rt.where(e0 < 0, Es, e0)
-                e0 = rt.where(e0 > e0star, e0star, e0)
-                self.diagnostic(e0, f"e0_{iteration}", date_UTC, target)
-                # re-estimating M (direct LST feedback into M computation)
-                s1 = (45.03 + 3.014 * Td_C + 0.05345 * Td_C ** 2 + 0.00224 * Td_C ** 3) * 1e-2
-                self.diagnostic(s1, f"s1_{iteration}", date_UTC, target)
-                Tsd_C = Td_C + (GAMMA * LE_new) / (RHO * CP * gB * s1)
-                self.diagnostic(Tsd_C, f"Tsd_C_{iteration}", date_UTC, target)
-                # Surface Moisture Ms
-                Ms = rt.clip(s1 * (Tsd_C - Td_C) / (s3 * (ST_C - Td_C)), 0, 1)
-                self.diagnostic(Ms, f"Ms_{iteration}", date_UTC, target)
-                # Root zone moisture Mrz
-                Mrz = rt.clip(((GAMMA * s1 * (Tsd_C - Td_C)) / (
-                        delta * s3 * (ST_C - Td_C) + GAMMA * s44 * (Ta_C - Td_C) - delta * s1 * (Tsd_C - Td_C))), 0, 1)
-                self.diagnostic(Mrz, f"Mrz_{iteration}", date_UTC, target)
-                # combining hysteresis logic to differentiate surface vs. rootzone water control
-                M = rt.where((D0 > VPD_hPa) & (PET > phi) & (dTS > 0), Mrz, M)
-                M = rt.where((phi > 0) & (dTS > 0) & (Td_C <= 0), Mrz, M)
-                M = rt.clip(M, 0, 1)
-                self.diagnostic(M, f"M_{iteration}", date_UTC, target)
-                # checking convergence
-                # re-estimating alpha
-                alphaN = ((gS * (e0star - Ea_hPa) * (2 * delta + 2 * GAMMA + GAMMA * gB_by_gS * (1 + M))) / (
-                        2 * delta * (GAMMA * (T0 - Ta_C) * (gB + gS) + gS * (e0star - Ea_hPa))))
-                self.diagnostic(alphaN, f"alphaN_{iteration}", date_UTC, target)
-
-
-
+                inputs = dict(
+                    Mrz_base=delta * s3 * (ST_C - Td_C) + GAMMA * s44 * (Ta_C - Td_C),
+                    s1=s1,
+                    Td_C=Td_C,
+                    Ds=Ds,
+                    warm_surface=dTS > 0,
+                    rootzone_control=(phi > 0) & (dTS > 0) & (Td_C <= 0)
+                )
             else:
+                s44 = (SVP_hPa - Ea_hPa) / (Ta_C - Td_C)
+                TdewIndex = (ST_C - Tsd_C) / (Ta_C - Td_C)
+                Ep_PT = (1.26 * delta * Rn) / (delta + GAMMA)
+
+                inputs = dict(
+                    Rn=Rn,
+                    Td_C=Td_C,
+                    gSS=gSS,
+                    e0star_factor=(GAMMA * (gBB + gSS)) / (RHO * CP * gBB * gSS),
+                    gBB_RHO_CP=RHO * CP * gBB,
+                    gBB_gSS_GAMMA=GAMMA * (gBB + gSS),
+                    gBB_by_gSS_GAMMA=GAMMA * gBB_by_gSS,
+                    s1_s3=s1 / s3,
+                    TSD_TD=Tsd_C - Td_C,
+                    ST_TD=ST_C - Td_C,
+                    delta_s3=delta * s3,
+                    Mrz_numerator=GAMMA * s1 * (Tsd_C - Td_C),
+                    Mrz_offset=GAMMA * s44 * (Ta_C - Td_C),
+                    Mrz_dewpoint=delta * s1 * (Tsd_C - Td_C),
+                    absolute_moisture=(((Rn < 0) | (Rn > 0)) & ((dTS < 0) | (dTS > 0))) | (Rg > 0) | (Rg < 0) | (Td_C < 0),
+                    rootzone_control=(dTS > 0) & (fc <= 0.25) & (
+                            ((Ep_PT > Rn) & (TdewIndex < 1)) | ((Ta_C > 10) & (Td_C < 0) & (Lnet < -125)))
+                )
+
+            inputs.update(delta=delta, Ea_hPa=Ea_hPa, VPD_hPa=VPD_hPa, Estar=Estar, Es=Es, Ta_C=Ta_C)
+
+            state = dict(
+                LE=LE_new,
+                LE_change=np.nan,
+                LEt=np.nan,
+                PT=np.nan,
+                PET=PET,
+                G=G,
+                gB=gB,
+                gS=gS,
+                gB_by_gS=gB_by_gS,
+                T0=T0,
+                M=M,
+                phi=phi
+            )
+
+            outputs, iteration, LE_max_change = STIC_iteration(inputs, state, LE_convergence_target, max_iterations, ttSEC)
+            LE_new, LE_change, LEt, PT, PET, G = [
+                Raster(outputs[name], geometry=Rn.geometry)
+                for name
+                in ("LE", "LE_change", "LEt", "PT", "PET", "G")
+            ]
+        else:
+            while (np.nanmax(LE_change) >= LE_convergence_target and iteration <= max_iterations):
+                logger.info(f"running STIC iteration {cl.val(iteration)} / {cl.val(max_iterations)}")
+
+                if Rg is None:
+
+                    # canopy air stream vapor pressures
+                    e0star = Ea_hPa + (GAMMA * LE_new * (gB + gS)) / (RHO * CP * gB * gS)
+                    e0star = rt.where(e0star < 0, Estar, e0star)
+                    e0star = rt.where(e0star > 250, Estar, e0star)
+                    self.diagnostic(e0star, f"e0star_{iteration}", date_UTC, target)
+                    D0 = VPD_hPa + (delta * phi - (delta + GAMMA) * LE_new) / (
+                            RHO * CP * gB)  # vapor pressure deficit at source
+                    D0 = rt.where(D0 < 0, Ds, D0)
+                    self.diagnostic(D0, f"D0_{iteration}", date_UTC, target)
+                    e0 = e0star - D0
+                    e0 = rt.where(e0 < 0, Es, e0)
+                    e0 = rt.where(e0 > e0star, e0star, e0)
+                    self.diagnostic(e0, f"e0_{iteration}", date_UTC, target)
+                    # re-estimating M (direct LST feedback into M computation)
+                    s1 = (45.03 + 3.014 * Td_C + 0.05345 * Td_C ** 2 + 0.00224 * Td_C ** 3) * 1e-2
+                    self.diagnostic(s1, f"s1_{iteration}", date_UTC, target)
+                    Tsd_C = Td_C + (GAMMA * LE_new) / (RHO * CP * gB * s1)
+                    self.diagnostic(Tsd_C, f"Tsd_C_{iteration}", date_UTC, target)
+                    # Surface Moisture Ms
+                    Ms = rt.clip(s1 * (Tsd_C - Td_C) / (s3 * (ST_C - Td_C)), 0, 1)
+                    self.diagnostic(Ms, f"Ms_{iteration}", date_UTC, target)
+                    # Root zone moisture Mrz
+                    Mrz = rt.clip(((GAMMA * s1 * (Tsd_C - Td_C)) / (
+                            delta * s3 * (ST_C - Td_C) + GAMMA * s44 * (Ta_C - Td_C) - delta * s1 * (Tsd_C - Td_C))), 0, 1)
+                    self.diagnostic(Mrz, f"Mrz_{iteration}", date_UTC, target)
+                    # combining hysteresis logic to differentiate surface vs. rootzone water control
+                    M = rt.where((D0 > VPD_hPa) & (PET > phi) & (dTS > 0), Mrz, M)
+                    M = rt.where((phi > 0) & (dTS > 0) & (Td_C <= 0), Mrz, M)
+                    M = rt.clip(M, 0, 1)
+                    self.diagnostic(M, f"M_{iteration}", date_UTC, target)
+                    # checking convergence
+                    # re-estimating alpha
+                    alphaN = ((gS * (e0star - Ea_hPa) * (2 * delta + 2 * GAMMA + GAMMA * gB_by_gS * (1 + M))) / (
+                            2 * delta * (GAMMA * (T0 - Ta_C) * (gB + gS) + gS * (e0star - Ea_hPa))))
+                    self.diagnostic(alphaN, f"alphaN_{iteration}", date_UTC, target)
+
+
+
+                else:
+
+                    # =============================================================================
+                    # Call these modules to use the NEW version of STIC.
+
+                    # =============================================================================
+                    # CANOPY-AIR STREAM vapor pressures
+                    e0star = Ea_hPa + (GAMMA * LE_new * (gBB + gSS)) / (RHO * CP * gBB * gSS)
+                    e0star = rt.where(e0star < 0, Estar, e0star)
+                    e0star = rt.where(e0star > 250, Estar, e0star)
+
+                    D0 = VPD_hPa + (delta * phi - (delta + GAMMA) * LE_new) / (
+                                RHO * CP * gBB)  # vapor pressure deficit at source/
+
+                    e0 = e0star - D0
+                    e0 = rt.where(e0 < 0, Es, e0)
+                    e0 = rt.where(e0 > e0star, e0star, e0)
+
+                    # Get M from f_soilmoisture initialize
+                    M = f_SoilMoisture_ITERATE2(GAMMA, delta, s1, s3, ST_C, Ta_C, dTS, Td_C, Tsd_C, Rg, Rn, Lnet, fc,
+                                                VPD_hPa, D0, SVP_hPa, Ea_hPa, T0)
+
+                    # get G from new function
+                    # G = f_G_PHI_actualsurface(Rn,ttSEC,M)
+                    # re-calculate G!
+
+                    # update this
+                    # G = f_G_PHI_actualsurface(Rn, Rnsoil, ttSEC, M)
+                    G = f_G_PHI_actualsurface(Rn, ttSEC, M)
+                    # recompute phi
+                    phi = Rn - G
+
+                    alphaN = ((gSS * (e0star - Ea_hPa) * (2 * delta + 2 * GAMMA + GAMMA * gBB_by_gSS * (1 + M))) / (
+                                2 * delta * (GAMMA * (T0 - Ta_C) * (gBB + gSS) + gSS * (e0star - Ea_hPa))))
+
+                # re-estimated conductances and states
+                [gB, gS, dT, EF] = STIC_closure(delta, phi, e0, Ea_hPa, e0star, M, RHO, CP, GAMMA, alphaN)
+
+                self.diagnostic(gB, f"gB_{iteration}", date_UTC, target)
+                self.diagnostic(gS, f"gS_{iteration}", date_UTC, target)
+                self.diagnostic(dT, f"dT_{iteration}", date_UTC, target)
+                self.diagnostic(EF, f"EF_{iteration}", date_UTC, target)
+                gB_by_gS = rt.where(gS == 0, 0, gB / gS)
+                self.diagnostic(gB_by_gS, f"gB_by_gS_{iteration}", date_UTC, target)
+                T0 = dT + Ta_C
+                self.diagnostic(T0, f"T0_{iteration}", date_UTC, target)
+                # latent heat flux
+                LE_new = ((delta * phi + RHO * CP * gB * VPD_hPa) / (delta + GAMMA * (1 + gB_by_gS)))
+                LE_new = rt.where(LE_new > phi, phi, LE_new)
+                self.diagnostic(LE_new, f"LE_new_{iteration}", date_UTC, target)
+                # Sensible Heat Flux
+                H = ((GAMMA * phi * (1 + gB_by_gS) - RHO * CP * gB * VPD_hPa) / (delta + GAMMA * (1 + (gB_by_gS))))
+                self.diagnostic(H, f"H_{iteration}", date_UTC, target)
+                # potential evaporation (Penman)
+                PET = ((delta * phi + RHO * CP * gB * VPD_hPa) / (delta + GAMMA))
+                self.diagnostic(PET, f"PET_{iteration}", date_UTC, target)
+                # Potential Transpiration
+                PT = (delta * phi + RHO * CP * gB * VPD_hPa) / (
+                        delta + GAMMA * (1 + M * gB_by_gS))  # potential transpiration
+                PT = PT.mask(~water)
+                self.diagnostic(PT, f"PT_{iteration}", date_UTC, target)
+                # ET PARTITIONING
+                LEs = rt.clip(M * PET, 0, None).mask(~water)
+                self.diagnostic(LEs, f"LEs_{iteration}", date_UTC, target)
+                LEt = rt.clip(LE_new - LEs, 0, None).mask(~water)
+                self.diagnostic(LEt, f"LEt_{iteration}", date_UTC, target)
+                # change in latent heat flux estimate
+                LE_change = np.abs(LE_old - LE_new)
+                self.diagnostic(LE_change, f"LE_change_{iteration}", date_UTC, target)
+                LE_new = rt.where(np.isnan(LE_new), LE_old, LE_new)
+                LE_old = LE_new
+                LE_max_change = np.nanmax(LE_change)
+                logger.info(
+                    f"completed STIC iteration {cl.val(iteration)} / {cl.val(max_iterations)} with max LE change: {cl.val(LE_max_change)} ({t} seconds)")
+                iteration += 1
+
+            iteration -= 1
 
-                # =============================================================================
-                # Call these modules to use the NEW version of STIC.
-
-                # =============================================================================
-                # CANOPY-AIR STREAM vapor pressures
-                e0star = Ea_hPa + (GAMMA * LE_new * (gBB + gSS)) / (RHO * CP * gBB * gSS)
-                e0star = rt.where(e0star < 0, Estar, e0star)
-                e0star = rt.where(e0star > 250, Estar, e0star)
-
-                D0 = VPD_hPa + (delta * phi - (delta + GAMMA) * LE_new) / (
-                            RHO * CP * gBB)  # vapor pressure deficit at source/
-
-                e0 = e0star - D0
-                e0 = rt.where(e0 < 0, Es, e0)
-                e0 = rt.where(e0 > e0star, e0star, e0)
-
-                # Get M from f_soilmoisture initialize
-                M = f_SoilMoisture_ITERATE2(GAMMA, delta, s1, s3, ST_C, Ta_C, dTS, Td_C, Tsd_C, Rg, Rn, Lnet, fc,
-                                            VPD_hPa, D0, SVP_hPa, Ea_hPa, T0)
-
-                # get G from new function
-                # G = f_G_PHI_actualsurface(Rn,ttSEC,M)
-                # re-calculate G!
-
-                # update this
-                # G = f_G_PHI_actualsurface(Rn, Rnsoil, ttSEC, M)
-                G = f_G_PHI_actualsurface(Rn, ttSEC, M)
-                # recompute phi
-                phi = Rn - G
-
-                alphaN = ((gSS * (e0star - Ea_hPa) * (2 * delta + 2 * GAMMA + GAMMA * gBB_by_gSS * (1 + M))) / (
-                            2 * delta * (GAMMA * (T0 - Ta_C) * (gBB + gSS) + gSS * (e0star - Ea_hPa))))
-
-            # re-estimated conductances and states
-            [gB, gS, dT, EF] = STIC_closure(delta, phi, e0, Ea_hPa, e0star, M, RHO, CP, GAMMA, alphaN)
-
-            self.diagnostic(gB, f"gB_{iteration}", date_UTC, target)
-            self.diagnostic(gS, f"gS_{iteration}", date_UTC, target)
-            self.diagnostic(dT, f"dT_{iteration}", date_UTC, target)
-            self.diagnostic(EF, f"EF_{iteration}", date_UTC, target)
-            gB_by_gS = rt.where(gS == 0, 0, gB / gS)
-            self.diagnostic(gB_by_gS, f"gB_by_gS_{iteration}", date_UTC, target)
-            T0 = dT + Ta_C
-            self.diagnostic(T0, f"T0_{iteration}", date_UTC, target)
-            # latent heat flux
-            LE_new = ((delta * phi + RHO * CP * gB * VPD_hPa) / (delta + GAMMA * (1 + gB_by_gS)))
-            LE_new = rt.where(LE_new > phi, phi, LE_new)
-            self.diagnostic(LE_new, f"LE_new_{iteration}", date_UTC, target)
-            # Sensible Heat Flux
-            H = ((GAMMA * phi * (1 + gB_by_gS) - RHO * CP * gB * VPD_hPa) / (delta + GAMMA * (1 + (gB_by_gS))))
-            self.diagnostic(H, f"H_{iteration}", date_UTC, target)
-            # potential evaporation (Penman)
-            PET = ((delta * phi + RHO * CP * gB * VPD_hPa) / (delta + GAMMA))
-            self.diagnostic(PET, f"PET_{iteration}", date_UTC, target)
-            # Potential Transpiration
-            PT = (delta * phi + RHO * CP * gB * VPD_hPa) / (
-                    delta + GAMMA * (1 + M * gB_by_gS))  # potential transpiration
-            PT = PT.mask(~water)
-            self.diagnostic(PT, f"PT_{iteration}", date_UTC, target)
-            # ET PARTITIONING
-            LEs = rt.clip(M * PET, 0, None).mask(~water)
-            self.diagnostic(LEs, f"LEs_{iteration}", date_UTC, target)
-            LEt = rt.clip(LE_new - LEs, 0, None).mask(~water)
-            self.diagnostic(LEt, f"LEt_{iteration}", date_UTC, target)
-            # change in latent heat flux estimate
-            LE_change = np.abs(LE_old - LE_new)
-            self.diagnostic(LE_change, f"LE_change_{iteration}", date_UTC, target)
-            LE_new = rt.where(np.isnan(LE_new), LE_old, LE_new)
-            LE_old = LE_new
-            LE_max_change = np.nanmax(LE_change)
-            logger.info(
-                f"completed STIC iteration {cl.val(iteration)} / {cl.val(max_iterations)} with max LE change: {cl.val(LE_max_change)} ({t} seconds)")
-            iteration += 1
-
-        iteration -= 1
         results["LE_max_change"] = LE_max_change
         results["iteration"] = iteration
 
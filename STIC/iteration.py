@@ -0,0 +1,518 @@
+"""
+Preallocated in-place iteration of the STIC closure with per-pixel convergence
+
+The iteration in STIC.STIC evaluates the closure equations as whole-raster operations,
+allocating a temporary raster for every operator and passing every intermediate through the model diagnostics.
+This engine runs the same iteration over 1-D arrays of the pixels that have not converged,
+updating preallocated working buffers in place with out= ufuncs.
+After each iteration the pixels whose latent heat flux changed by less than the convergence target keep their state
+and are dropped from the iteration, and the iteration stops when no pixels remain or the iteration limit is reached.
+
+The expanded polynomials of the STIC closure factor into a common denominator,
+so the closure is evaluated in factored form.
+Terms of the moisture equations that do not depend on the iterated state are calculated once before the iteration.
+"""
+
+import logging
+from typing import Dict, Tuple, Union
+
+import numpy as np
+
+import colored_logging as cl
+from rasters import Raster
+from timer import Timer
+
+__author__ = "Gregory Halverson"
+
+logger = logging.getLogger(__name__)
+
+# constants
+RHO = 1.2  # Air density (kg m-3)
+CP = 1013  # Specific heat of air at constant pressure (J/kg/K)
+GAMMA = 0.67  # Psychrometric constant (hpa/K)
+
+# constants of the ground heat flux of Santanello and Friedl (2003)
+CG_MIN = 0.05  # for wet surface
+CG_MAX = 0.35  # for dry surface
+TG_MIN = 74000  # for wet surface
+TG_MAX = 100000  # for dry surface
+SOLAR_NOON_SECONDS = 12. * 60. * 60
+
+# outputs of the iteration
+OUTPUT_VARIABLES = ["LE", "LE_change", "LEt", "PT", "PET", "G"]
+
+# iterated state of each pixel in addition to the outputs
+STATE_VARIABLES = ["gB", "gS", "gB_by_gS", "T0", "M", "phi"]
+
+# floating-point working buffers of the iteration
+SCRATCH_VARIABLES = ["e0star", "D0", "e0", "alpha", "K", "Es_Ea", "Estar_Es", "a", "b", "Mrz"]
+
+
+def replace_less(array: np.ndarray, threshold, value, mask: np.ndarray):
+    np.less(array, threshold, out=mask)
+    np.copyto(array, value, where=mask)
+
+
+def replace_greater(array: np.ndarray, threshold, value, mask: np.ndarray):
+    np.greater(array, threshold, out=mask)
+    np.copyto(array, value, where=mask)
+
+
+def abs_where(array: np.ndarray, condition: np.ndarray, mask: np.ndarray):
+    """
+    Take the absolute value of the negative elements of an array in place where a condition holds.
+    """
+    np.less(array, 0, out=mask)
+    mask &= condition
+    np.abs(array, out=array, where=mask)
+
+
+def closure(
+        delta: np.ndarray,
+        phi: np.ndarray,
+        Es: np.ndarray,
+        Ea: np.ndarray,
+        Estar: np.ndarray,
+        M: np.ndarray,
+        alpha: np.ndarray,
+        Ta_C: np.ndarray,
+        gB: np.ndarray,
+        gS: np.ndarray,
+        T0: np.ndarray,
+        scratch: Dict[str, np.ndarray],
+        mask: np.ndarray):
+    """
+    STIC closure equations with modified Priestley Taylor and Penman Monteith
+    (Mallick et al., 2015, Water Resources research), updating the conductances and surface temperature in place.
+    With K = 2 delta (Es - Ea) + gamma (Es + Estar - 2 Ea) + gamma M (Estar - Es),
+    the closure is gB = 2 PHI alpha delta gamma / (CP rho K), gS = gB (Es - Ea) / (Estar - Es),
+    dT = (K - 2 alpha delta (Es - Ea)) / (2 alpha delta gamma).
+    """
+    K = scratch["K"]
+    Es_Ea = scratch["Es_Ea"]
+    Estar_Es = scratch["Estar_Es"]
+    a = scratch["a"]
+    b = scratch["b"]
+
+    np.subtract(Es, Ea, out=Es_Ea)
+    np.subtract(Estar, Es, out=Estar_Es)
+
+    np.add(Es, Estar, out=K)
+    K -= Ea
+    K -= Ea
+    K *= GAMMA
+    np.multiply(M, Estar_Es, out=b)
+    b *= GAMMA
+    K += b
+    np.multiply(delta, Es_Ea, out=b)
+    b *= 2
+    K += b
+
+    # 2 alpha delta
+    np.multiply(alpha, delta, out=a)
+    a *= 2
+
+    np.multiply(phi, a, out=gB)
+    gB *= GAMMA
+    np.multiply(K, CP * RHO, out=b)
+    gB /= b
+
+    np.multiply(gB, Es_Ea, out=gS)
+    gS /= Estar_Es
+
+    replace_less(gB, 0, 0.0001, mask)
+    replace_greater(gB, 0.2, 0.2, mask)
+    replace_less(gS, 0, 0.0001, mask)
+    replace_greater(gS, 0.2, 0.2, mask)
+
+    np.multiply(a, Es_Ea, out=b)
+    np.subtract(K, b, out=T0)
+    a *= GAMMA
+    T0 /= a
+    np.clip(T0, -10, 50, out=T0)
+    T0 += Ta_C
+
+
+def surface_fluxes(
+        delta: np.ndarray,
+        phi: np.ndarray,
+        VPD_hPa: np.ndarray,
+        state: Dict[str, np.ndarray],
+        scratch: Dict[str, np.ndarray],
+        mask: np.ndarray):
+    """
+    Latent heat flux, potential evaporation, potential transpiration and transpiration from the updated conductances.
+    The previous latent heat flux is kept where the new one is undefined.
+    """
+    gB = state["gB"]
+    gS = state["gS"]
+    gB_by_gS = state["gB_by_gS"]
+    M = state["M"]
+    LE = state["LE"]
+    LE_change = state["LE_change"]
+    PET = state["PET"]
+    PT = state["PT"]
+    LEt = state["LEt"]
+    numerator = scratch["a"]
+    denominator = scratch["b"]
+    LE_new = scratch["K"]
+
+    np.divide(gB, gS, out=gB_by_gS)
+    np.equal(gS, 0, out=mask)
+    np.copyto(gB_by_gS, 0, where=mask)
+
+    # delta phi + rho CP gB VPD
+    np.multiply(gB, VPD_hPa, out=numerator)
+    numerator *= RHO * CP
+    np.multiply(delta, phi, out=denominator)
+    numerator += denominator
+
+    # latent heat flux
+    np.add(gB_by_gS, 1, out=denominator)
+    denominator *= GAMMA
+    denominator += delta
+    np.divide(numerator, denominator, out=LE_new)
+    np.greater(LE_new, phi, out=mask)
+    np.copyto(LE_new, phi, where=mask)
+
+    # potential evaporation (Penman)
+    np.add(delta, GAMMA, out=denominator)
+    np.divide(numerator, denominator, out=PET)
+
+    # potential transpiration
+    np.multiply(M, gB_by_gS, out=denominator)
+    denominator += 1
+    denominator *= GAMMA
+    denominator += delta
+    np.divide(numerator, denominator, out=PT)
+
+    # ET partitioning, where the maximum keeps NaN like clipping
+    np.multiply(M, PET, out=denominator)
+    np.maximum(denominator, 0, out=denominator)
+    np.subtract(LE_new, denominator, out=LEt)
+    np.maximum(LEt, 0, out=LEt)
+
+    # change in latent heat flux estimate
+    np.subtract(LE, LE_new, out=LE_change)
+    np.abs(LE_change, out=LE_change)
+    np.isnan(LE_new, out=mask)
+    np.logical_not(mask, out=mask)
+    np.copyto(LE, LE_new, where=mask)
+
+
+def iterate_classic(
+        inputs: Dict[str, np.ndarray],
+        state: Dict[str, np.ndarray],
+        scratch: Dict[str, np.ndarray],
+        mask: np.ndarray,
+        condition: np.ndarray):
+    """
+    One iteration of the STIC closure with moisture from the surface and root zone dewpoint temperatures.
+    """
+    delta = inputs["delta"]
+    phi = state["phi"]
+    Ea_hPa = inputs["Ea_hPa"]
+    VPD_hPa = inputs["VPD_hPa"]
+    gB = state["gB"]
+    gS = state["gS"]
+    M = state["M"]
+    LE = state["LE"]
+    T0 = state["T0"]
+    e0star = scratch["e0star"]
+    D0 = scratch["D0"]
+    e0 = scratch["e0"]
+    alpha = scratch["alpha"]
+    Mrz = scratch["Mrz"]
+    b = scratch["b"]
+
+    # canopy air stream vapor pressures
+    np.add(gB, gS, out=e0star)
+    e0star *= LE
+    e0star *= GAMMA
+    np.multiply(gB, gS, out=b)
+    b *= RHO * CP
+    e0star /= b
+    e0star += Ea_hPa
+    replace_less(e0star, 0, inputs["Estar"], mask)
+    replace_greater(e0star, 250, inputs["Estar"], mask)
+
+    # vapor pressure deficit at source
+    np.add(delta, GAMMA, out=b)
+    b *= LE
+    np.multiply(delta, phi, out=D0)
+    D0 -= b
+    np.multiply(gB, RHO * CP, out=b)
+    D0 /= b
+    D0 += VPD_hPa
+    replace_less(D0, 0, inputs["Ds"], mask)
+
+    np.subtract(e0star, D0, out=e0)
+    replace_less(e0, 0, inputs["Es"], mask)
+    np.greater(e0, e0star, out=mask)
+    np.copyto(e0, e0star, where=mask)
+
+    # re-estimating M (direct LST feedback into M computation)
+    s1 = inputs["s1"]
+    Td_C = inputs["Td_C"]
+    np.multiply(gB, RHO * CP, out=b)
+    b *= s1
+    np.multiply(LE, GAMMA, out=Mrz)
+    np.divide(Mrz, b, out=b)
+    # Tsd_C - Td_C
+    b += Td_C
+    b -= Td_C
+    # rootzone moisture
+    b *= s1
+    np.multiply(delta, b, out=Mrz)
+    np.subtract(inputs["Mrz_base"], Mrz, out=Mrz)
+    b *= GAMMA
+    np.divide(b, Mrz, out=Mrz)
+    np.clip(Mrz, 0, 1, out=Mrz)
+
+    # combining hysteresis logic to differentiate surface vs. rootzone water control
+    np.greater(D0, VPD_hPa, out=mask)
+    np.greater(state["PET"], phi, out=condition)
+    mask &= condition
+    mask &= inputs["warm_surface"]
+    mask |= inputs["rootzone_control"]
+    np.copyto(M, Mrz, where=mask)
+    np.clip(M, 0, 1, out=M)
+
+    # re-estimating alpha
+    np.subtract(e0star, Ea_hPa, out=Mrz)
+    Mrz *= gS
+    np.subtract(T0, inputs["Ta_C"], out=alpha)
+    np.add(gB, gS, out=b)
+    alpha *= b
+    alpha *= GAMMA
+    alpha += Mrz
+    alpha *= delta
+    alpha *= 2
+    np.add(M, 1, out=b)
+    b *= state["gB_by_gS"]
+    b *= GAMMA
+    b += 2 * GAMMA
+    np.add(b, delta, out=b)
+    np.add(b, delta, out=b)
+    b *= Mrz
+    np.divide(b, alpha, out=alpha)
+
+    # re-estimated conductances and states
+    closure(delta, phi, e0, Ea_hPa, e0star, M, alpha, inputs["Ta_C"], gB, gS, T0, scratch, mask)
+    surface_fluxes(delta, phi, VPD_hPa, state, scratch, mask)
+
+
+def iterate_moisture(
+        inputs: Dict[str, np.ndarray],
+        state: Dict[str, np.ndarray],
+        scratch: Dict[str, np.ndarray],
+        mask: np.ndarray,
+        ttSEC: float):
+    """
+    One iteration of the STIC closure with moisture from f_SoilMoisture_ITERATE2
+    and ground heat flux from f_G_PHI_actualsurface.
+    """
+    delta = inputs["delta"]
+    Ea_hPa = inputs["Ea_hPa"]
+    VPD_hPa = inputs["VPD_hPa"]
+    Rn = inputs["Rn"]
+    Td_C = inputs["Td_C"]
+    phi = state["phi"]
+    G = state["G"]
+    M = state["M"]
+    LE = state["LE"]
+    T0 = state["T0"]
+    e0star = scratch["e0star"]
+    D0 = scratch["D0"]
+    e0 = scratch["e0"]
+    alpha = scratch["alpha"]
+    Mrz = scratch["Mrz"]
+    a = scratch["a"]
+    b = scratch["b"]
+
+    # canopy air stream vapor pressures from the initial conductances
+    np.multiply(LE, inputs["e0star_factor"], out=e0star)
+    e0star += Ea_hPa
+    replace_less(e0star, 0, inputs["Estar"], mask)
+    replace_greater(e0star, 250, inputs["Estar"], mask)
+
+    # vapor pressure deficit at source
+    np.add(delta, GAMMA, out=b)
+    b *= LE
+    np.multiply(delta, phi, out=D0)
+    D0 -= b
+    D0 /= inputs["gBB_RHO_CP"]
+    D0 += VPD_hPa
+
+    np.subtract(e0star, D0, out=e0)
+    replace_less(e0, 0, inputs["Es"], mask)
+    np.greater(e0, e0star, out=mask)
+    np.copyto(e0, e0star, where=mask)
+
+    # surface moisture
+    ST_TD = inputs["ST_TD"]
+    np.subtract(T0, Td_C, out=a)
+    # kTSTD
+    a /= ST_TD
+    np.multiply(a, ST_TD, out=b)
+    np.divide(inputs["TSD_TD"], b, out=M)
+    M *= inputs["s1_s3"]
+    abs_where(M, inputs["absolute_moisture"], mask)
+    replace_greater(M, 1, 1, mask)
+    replace_less(M, 0, 0.0001, mask)
+
+    # rootzone moisture
+    np.multiply(inputs["delta_s3"], a, out=Mrz)
+    Mrz *= ST_TD
+    Mrz += inputs["Mrz_offset"]
+    Mrz -= inputs["Mrz_dewpoint"]
+    np.divide(inputs["Mrz_numerator"], Mrz, out=Mrz)
+    abs_where(Mrz, inputs["absolute_moisture"], mask)
+    replace_greater(Mrz, 1, 1, mask)
+    replace_less(Mrz, 0, 0.0001, mask)
+
+    # combine M to account for hysteresis
+    np.greater(D0, VPD_hPa, out=mask)
+    mask &= inputs["rootzone_control"]
+    np.copyto(M, Mrz, where=mask)
+
+    # ground heat flux according to Santanello and Friedl (2003)
+    np.subtract(1, M, out=a)
+    a *= CG_MAX
+    np.multiply(M, CG_MIN, out=b)
+    a += b
+    a *= Rn
+    np.subtract(1, M, out=b)
+    b *= TG_MAX
+    np.multiply(M, TG_MIN, out=G)
+    b += G
+    np.divide(2 * np.pi * (SOLAR_NOON_SECONDS - ttSEC + 10800), b, out=b)
+    np.cos(b, out=b)
+    np.multiply(a, b, out=G)
+    np.less(Rn, 0, out=mask)
+    np.negative(G, out=G, where=mask)
+    np.subtract(Rn, G, out=phi)
+
+    # re-estimating alpha
+    np.subtract(e0star, Ea_hPa, out=Mrz)
+    Mrz *= inputs["gSS"]
+    np.subtract(T0, inputs["Ta_C"], out=alpha)
+    alpha *= inputs["gBB_gSS_GAMMA"]
+    alpha += Mrz
+    alpha *= delta
+    alpha *= 2
+    np.add(M, 1, out=b)
+    b *= inputs["gBB_by_gSS_GAMMA"]
+    b += 2 * GAMMA
+    np.add(b, delta, out=b)
+    np.add(b, delta, out=b)
+    b *= Mrz
+    np.divide(b, alpha, out=alpha)
+
+    # re-estimated conductances and states
+    closure(delta, phi, e0, Ea_hPa, e0star, M, alpha, inputs["Ta_C"], state["gB"], state["gS"], T0, scratch, mask)
+    surface_fluxes(delta, phi, VPD_hPa, state, scratch, mask)
+
+
+def STIC_iteration(
+        inputs: Dict[str, Union[np.ndarray, Raster]],
+        state: Dict[str, Union[np.ndarray, Raster, float]],
+        LE_convergence_target: float,
+        max_iterations: int,
+        ttSEC: float = None) -> Tuple[Dict[str, np.ndarray], int, float]:
+    """
+    Iterate the STIC closure on the pixels that have not converged.
+    The first iteration covers every pixel and reads the input images without copying them.
+    The unconverged pixels are then copied out into working arrays that are compacted in place as pixels converge,
+    and the inputs are released from their dictionary so that derived input images are not kept alongside them.
+    Pixels with an undefined change, such as masked water and cloud, leave the iteration after the first pass.
+    :param inputs: images of the inputs of the iteration, including Rn and the terms of the moisture equations
+        when iterating with f_SoilMoisture_ITERATE2
+    :param state: images of the initial state of the iteration, in the precision of the iteration
+    :param LE_convergence_target: change in latent heat flux below which a pixel has converged
+    :param max_iterations: maximum number of iterations
+    :param ttSEC: solar time of day in seconds for the ground heat flux of f_G_PHI_actualsurface
+    :return: tuple of the output images, the number of iterations and the last maximum change in LE
+    """
+    moisture = "Rn" in inputs
+    shape = np.shape(state["LE"])
+    dtype = np.asarray(state["LE"]).dtype
+    size = int(np.prod(shape))
+
+    def flatten(image) -> np.ndarray:
+        return np.asarray(np.broadcast_to(image, shape)).ravel()
+
+    # outputs are the only full-size arrays kept, written as pixels converge
+    outputs = {name: np.array(flatten(state.pop(name)), dtype=dtype) for name in OUTPUT_VARIABLES}
+    active = np.arange(size)
+    count = size
+    compacted = False
+    active_inputs = {name: flatten(inputs.pop(name)) for name in list(inputs)}
+    active_state = {name: np.array(flatten(state.pop(name)), dtype=dtype) for name in STATE_VARIABLES}
+    active_state.update(outputs)
+    scratch = {name: np.empty(count, dtype=dtype) for name in SCRATCH_VARIABLES}
+    mask_buffer = np.empty(count, dtype=bool)
+    condition_buffer = np.empty(count, dtype=bool)
+    iteration = 0
+    LE_max_change = 0
+
+    while count > 0 and iteration < max_iterations:
+        iteration += 1
+        timer = Timer()
+        logger.info(
+            f"running STIC iteration {cl.val(iteration)} / {cl.val(max_iterations)} "
+            f"active pixels: {cl.val(count)} ({cl.val(f'{100 * count / size:0.2f}%')})")
+
+        views = {name: value[:count] for name, value in active_inputs.items()}
+        state_views = {name: value[:count] for name, value in active_state.items()}
+        scratch_views = {name: value[:count] for name, value in scratch.items()}
+        mask = mask_buffer[:count]
+
+        if moisture:
+            iterate_moisture(views, state_views, scratch_views, mask, ttSEC)
+        else:
+            iterate_classic(views, state_views, scratch_views, mask, condition_buffer[:count])
+
+        LE_change = state_views["LE_change"]
+        LE_max_change = np.nanmax(LE_change)
+        logger.info(
+            f"completed STIC iteration {cl.val(iteration)} / {cl.val(max_iterations)} "
+            f"with max LE change: {cl.val(LE_max_change)} ({cl.time(timer)} seconds)")
+
+        # pixels with an undefined change cannot improve
+        unconverged = LE_change >= LE_convergence_target
+
+        if compacted:
+            converged = ~unconverged
+
+            for name, value in outputs.items():
+                value[active[converged]] = state_views[name][converged]
+
+        active = active[unconverged]
+        count = active.size
+
+        if compacted:
+            # working arrays are compacted to the front of their buffers
+            for name, value in views.items():
+                value[:count] = value[unconverged]
+
+            for name, value in state_views.items():
+                value[:count] = value[unconverged]
+        else:
+            # the outputs already hold every pixel, and the unconverged pixels are copied out of the other images
+            # one image at a time, so each image is released as soon as it has been copied
+            del views, state_views, LE_change
+
+            for working in (active_inputs, active_state):
+                for name in list(working):
+                    working[name] = working[name][unconverged]
+
+            compacted = True
+
+    if compacted:
+        for name, value in outputs.items():
+            value[active] = active_state[name][:count]
+
+    logger.info(f"STIC iteration finished with {cl.val(count)} unconverged pixels")
+
+    return {name: value.reshape(shape) for name, value in outputs.items()}, iteration, LE_max_change
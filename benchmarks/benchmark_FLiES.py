@@ -0,0 +1,80 @@
+"""
+This module contains micro-benchmarks for the FLiES package.
+"""
+
+import sys
+import timeit
+from typing import Tuple
+
+import numpy as np
+
+__author__ = 'Gregory Halverson'
+
+DEFAULT_SHAPE = (1568, 1568)
+DEFAULT_REPEAT = 5
+
+
+def chained_atype_ctype(COT: np.ndarray, KG_climate: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Previous aerosol type and cloud type classification with chained np.where passes, kept as a baseline.
+    """
+    atype = np.full(COT.shape, 1, dtype=np.uint16)
+    ctype = np.full(COT.shape, 0, dtype=np.uint16)
+
+    atype = np.where((COT == 0) & ((KG_climate == 5) | (KG_climate == 6)), 1, atype)
+    ctype = np.where((COT == 0) & ((KG_climate == 5) | (KG_climate == 6)), 0, ctype)
+
+    atype = np.where((COT == 0) & ((KG_climate == 3) | (KG_climate == 4)), 2, atype)
+    ctype = np.where((COT == 0) & ((KG_climate == 3) | (KG_climate == 4)), 0, ctype)
+
+    atype = np.where((COT == 0) & (KG_climate == 1), 4, atype)
+    ctype = np.where((COT == 0) & (KG_climate == 1), 0, ctype)
+
+    atype = np.where((COT == 0) & (KG_climate == 2), 5, atype)
+    ctype = np.where((COT == 0) & (KG_climate == 2), 0, ctype)
+
+    atype = np.where((COT > 0) & ((KG_climate == 5) | (KG_climate == 6)), 1, atype)
+    ctype = np.where((COT > 0) & ((KG_climate == 5) | (KG_climate == 6)), 1, ctype)
+
+    atype = np.where((COT > 0) & ((KG_climate == 3) | (KG_climate == 4)), 2, atype)
+    ctype = np.where((COT > 0) & ((KG_climate == 3) | (KG_climate == 4)), 1, ctype)
+
+    atype = np.where((COT > 0) & (KG_climate == 2), 5, atype)
+    ctype = np.where((COT > 0) & (KG_climate == 2), 1, ctype)
+
+    atype = np.where((COT > 0) & (KG_climate == 1), 4, atype)
+    ctype = np.where((COT > 0) & (KG_climate == 1), 3, ctype)
+
+    return atype, ctype
+
+
+def benchmark_atype_ctype(shape: Tuple[int, int] = DEFAULT_SHAPE, repeat: int = DEFAULT_REPEAT):
+    """
+    Compare the table-driven aerosol type and cloud type classifier to the chained np.where baseline.
+    :param shape: shape of the synthetic scene
+    :param repeat: number of timed runs, the best of which is reported
+    """
+    from FLiES.atype_ctype import ANN_atype_ctype
+
+    rng = np.random.default_rng(0)
+    COT = rng.choice([np.nan, 0, 0.5, 20], shape)
+    KG_climate = rng.integers(0, 7, shape).astype(np.uint8)
+
+    expected_atype, expected_ctype = chained_atype_ctype(COT, KG_climate)
+    atype, ctype = ANN_atype_ctype(COT, KG_climate)
+
+    if not (np.array_equal(atype, expected_atype) and np.array_equal(ctype, expected_ctype)):
+        raise AssertionError("table-driven atype/ctype does not match chained np.where classification")
+
+    chained_seconds = min(timeit.repeat(lambda: chained_atype_ctype(COT, KG_climate), number=1, repeat=repeat))
+    table_seconds = min(timeit.repeat(lambda: ANN_atype_ctype(COT, KG_climate), number=1, repeat=repeat))
+
+    print(f"atype/ctype {shape[0]}x{shape[1]}: chained np.where {chained_seconds * 1000:0.1f} ms, table {table_seconds * 1000:0.1f} ms, speed-up {chained_seconds / table_seconds:0.1f}x")
+
+
+def main(argv=sys.argv):
+    benchmark_atype_ctype()
+
+
+if __name__ == "__main__":
+    sys.exit(main(argv=sys.argv))
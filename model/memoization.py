@@ -0,0 +1,321 @@
+"""
+Content-addressed memoization of model stages
+"""
+
+import hashlib
+import importlib
+import inspect
+import json
+import logging
+from collections import namedtuple
+from datetime import date, datetime
+from functools import wraps
+from os import makedirs, replace
+from os.path import join, exists, dirname
+from typing import Any, Callable, Dict, Tuple
+
+import numpy as np
+from affine import Affine
+
+import colored_logging as cl
+from rasters import Raster, RasterGrid, RasterGeometry
+
+__author__ = "Gregory Halverson"
+
+DEFAULT_MEMOIZE = False
+DEFAULT_MEMOIZATION = "memoized"
+MEMOIZATION_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+class MemoizationError(ValueError):
+    pass
+
+
+def hash_value(value: Any, hasher) -> None:
+    """
+    Feed the content of a stage input into a hash.
+    Rasters and arrays are hashed by their bytes, shape and dtype, and raster grids by their affine transform and CRS,
+    so any change to an input raster or its geometry changes the key.
+    :param value: input value
+    :param hasher: hashlib hash object
+    """
+    if value is None:
+        hasher.update(b"None")
+    elif isinstance(value, Raster):
+        hasher.update(b"Raster")
+        hash_value(value.geometry, hasher)
+        hash_value(value.array, hasher)
+    elif isinstance(value, RasterGrid):
+        hasher.update(b"RasterGrid")
+        hasher.update(repr(tuple(value.affine)[:6]).encode())
+        hasher.update(repr(value.shape).encode())
+        hasher.update(value.crs.to_wkt().encode())
+    elif isinstance(value, RasterGeometry):
+        hasher.update(type(value).__name__.encode())
+        hash_value(np.asarray(value.x), hasher)
+        hash_value(np.asarray(value.y), hasher)
+        hasher.update(value.crs.to_wkt().encode())
+    elif isinstance(value, np.ndarray):
+        hasher.update(f"ndarray{value.shape}{value.dtype.str}".encode())
+        hasher.update(np.ascontiguousarray(value).view(np.uint8).data)
+    elif isinstance(value, dict):
+        hasher.update(f"dict{len(value)}".encode())
+
+        for key in sorted(value, key=str):
+            hash_value(key, hasher)
+            hash_value(value[key], hasher)
+    elif isinstance(value, (list, tuple)):
+        hasher.update(f"{type(value).__name__}{len(value)}".encode())
+
+        for item in value:
+            hash_value(item, hasher)
+    elif isinstance(value, (str, bool, int, float, np.generic, date, datetime)):
+        hasher.update(f"{type(value).__name__}:{value!r}".encode())
+    else:
+        raise MemoizationError(f"unable to hash stage input of type {type(value).__name__}")
+
+
+def encode_output(value: Any, arrays: Dict[str, np.ndarray], path: str) -> Dict:
+    """
+    Split a stage output into arrays and a JSON description of its structure.
+    :param value: stage output
+    :param arrays: dictionary receiving the arrays of the output keyed by path
+    :param path: path of this value within the output
+    :return: JSON-serializable description of the value
+    """
+    if isinstance(value, Raster):
+        if not isinstance(value.geometry, RasterGrid):
+            raise MemoizationError(f"unable to memoize raster with {type(value.geometry).__name__} geometry")
+
+        arrays[path] = value.array
+
+        return {
+            "type": "Raster",
+            "path": path,
+            "affine": list(tuple(value.geometry.affine)[:6]),
+            "crs": value.geometry.crs.to_wkt(),
+            "nodata": None if value.nodata is None else float(value.nodata)
+        }
+    elif isinstance(value, (np.ndarray, np.generic, float, int)) and not isinstance(value, bool):
+        arrays[path] = np.asarray(value)
+
+        return {"type": "array", "path": path, "scalar": np.ndim(value) == 0}
+    elif isinstance(value, tuple) and hasattr(value, "_fields"):
+        return {
+            "type": "namedtuple",
+            "name": type(value).__name__,
+            "fields": {field: encode_output(item, arrays, f"{path}.{field}") for field, item in zip(value._fields, value)}
+        }
+    elif isinstance(value, (list, tuple)):
+        return {
+            "type": type(value).__name__,
+            "items": [encode_output(item, arrays, f"{path}.{index}") for index, item in enumerate(value)]
+        }
+    elif isinstance(value, dict):
+        if not all(isinstance(key, str) for key in value):
+            raise MemoizationError("unable to memoize dictionary with non-string keys")
+
+        return {"type": "dict", "items": {key: encode_output(item, arrays, f"{path}.{key}") for key, item in value.items()}}
+    elif value is None or isinstance(value, (str, bool)):
+        return {"type": "value", "value": value}
+    else:
+        raise MemoizationError(f"unable to memoize stage output of type {type(value).__name__}")
+
+
+def decode_output(description: Dict, arrays: Dict[str, np.ndarray]) -> Any:
+    """
+    Rebuild a stage output from its arrays and structure.
+    :param description: JSON description of the value
+    :param arrays: dictionary of arrays keyed by path
+    :return: stage output
+    """
+    kind = description["type"]
+
+    if kind == "Raster":
+        array = arrays[description["path"]]
+        rows, cols = array.shape[-2:]
+        geometry = RasterGrid.from_affine(Affine(*description["affine"]), rows, cols, crs=description["crs"])
+        nodata = description["nodata"]
+
+        return Raster(array, geometry=geometry, nodata=np.nan if nodata is None else nodata)
+    elif kind == "array":
+        array = arrays[description["path"]]
+
+        return array[()] if description["scalar"] else array
+    elif kind == "namedtuple":
+        fields = description["fields"]
+
+        return namedtuple(description["name"], list(fields))(*[decode_output(item, arrays) for item in fields.values()])
+    elif kind in ("list", "tuple"):
+        items = [decode_output(item, arrays) for item in description["items"]]
+
+        return items if kind == "list" else tuple(items)
+    elif kind == "dict":
+        return {key: decode_output(item, arrays) for key, item in description["items"].items()}
+    elif kind == "value":
+        return description["value"]
+    else:
+        raise MemoizationError(f"unrecognized memoized output type: {kind}")
+
+
+class StageCache:
+    """
+    Directory of memoized stage outputs, one compressed NumPy archive per key.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"StageCache(directory={self.directory}, hits={self.hits}, misses={self.misses})"
+
+    def filename(self, stage: str, key: str) -> str:
+        return join(self.directory, stage, f"{key}.npz")
+
+    def load(self, stage: str, key: str) -> Tuple[bool, Any]:
+        """
+        Load a memoized stage output.
+        :param stage: name of stage
+        :param key: content hash of stage inputs
+        :return: tuple of whether the output was found and the output
+        """
+        filename = self.filename(stage, key)
+
+        if not exists(filename):
+            self.misses += 1
+            return False, None
+
+        try:
+            with np.load(filename, allow_pickle=False) as file:
+                arrays = {name: file[name] for name in file.files}
+
+            description = json.loads(str(arrays.pop("__structure__")))
+            output = decode_output(description, arrays)
+        except Exception as e:
+            logger.warning(f"unable to load memoized {cl.name(stage)}: {cl.file(filename)}")
+            logger.warning(e)
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+
+        return True, output
+
+    def save(self, stage: str, key: str, output: Any) -> str:
+        """
+        Memoize a stage output.
+        :param stage: name of stage
+        :param key: content hash of stage inputs
+        :param output: stage output
+        :return: filename of memoized output
+        """
+        arrays = {}
+        description = encode_output(output, arrays, "output")
+        filename = self.filename(stage, key)
+        makedirs(dirname(filename), exist_ok=True)
+        # write to a temporary file so that a crash never leaves a partial archive under the key
+        temporary_filename = f"{filename}.{id(output)}.tmp.npz"
+        np.savez_compressed(temporary_filename, __structure__=np.array(json.dumps(description)), **arrays)
+        replace(temporary_filename, filename)
+
+        return filename
+
+
+def stage_source(method: Callable, modules: Tuple[str, ...] = ()) -> str:
+    """
+    Collect the source code that a memoized stage depends on.
+    :param method: stage method
+    :param modules: names of further modules holding functions called by the stage
+    :return: source of the module defining the stage followed by the source of each named module
+    """
+    sources = []
+
+    for module in [inspect.getmodule(method)] + [importlib.import_module(name) for name in modules]:
+        try:
+            sources.append(inspect.getsource(module))
+        except (OSError, TypeError):
+            sources.append(getattr(module, "__name__", method.__qualname__))
+
+    return "\n".join(sources)
+
+
+def memoize_stage(parameters: Tuple[str, ...] = (), results: str = None, modules: Tuple[str, ...] = ()) -> Callable:
+    """
+    Decorate a model stage method to return memoized outputs when its inputs have not changed.
+    The key hashes the source code of the module defining the stage and of the named modules,
+    every argument, and the named model attributes,
+    so changing an input raster, a parameter, the stage or a function it calls within those modules computes the stage again.
+    Changes to code outside those modules, such as the rasters package, are not detected,
+    so MEMOIZATION_VERSION is bumped when such a change alters the outputs of a stage.
+    Memoization only takes effect when the model has a stage_cache.
+    A memoized output is returned without running the stage, so the diagnostics within the stage
+    are neither checked nor written as intermediate files on a hit.
+    :param parameters: names of model attributes that affect the output of the stage
+    :param results: name of a dictionary argument that the stage fills and returns
+    :param modules: names of modules outside the one defining the stage whose functions the stage calls
+    :return: decorator
+    """
+    def decorator(method: Callable) -> Callable:
+        signature = inspect.signature(method)
+        stage = method.__qualname__
+        # the source is read on the first call, once the modules of the stage have finished importing
+        sources = []
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            stage_cache = getattr(self, "stage_cache", None)
+
+            if stage_cache is None:
+                return method(self, *args, **kwargs)
+
+            if not sources:
+                sources.append(stage_source(method, modules))
+
+            source = sources[0]
+
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            del arguments["self"]
+            hasher = hashlib.sha256()
+            hasher.update(f"{MEMOIZATION_VERSION}:{type(self).__name__}:{stage}".encode())
+            hasher.update(source.encode())
+
+            try:
+                hash_value(arguments, hasher)
+                hash_value({name: getattr(self, name) for name in parameters}, hasher)
+            except MemoizationError as e:
+                logger.warning(f"not memoizing {cl.name(stage)}: {e}")
+                return method(self, *args, **kwargs)
+
+            key = hasher.hexdigest()
+            found, output = stage_cache.load(stage, key)
+
+            if found:
+                logger.info(f"using memoized {cl.name(stage)}: {cl.file(stage_cache.filename(stage, key))}")
+
+                if getattr(self, "save_intermediate", False):
+                    logger.warning(f"intermediate files of memoized {cl.name(stage)} are not written")
+
+                if results is not None and isinstance(arguments.get(results), dict):
+                    arguments[results].update(output)
+                    output = arguments[results]
+
+                return output
+
+            output = method(self, *args, **kwargs)
+
+            try:
+                filename = stage_cache.save(stage, key, output)
+                logger.info(f"memoized {cl.name(stage)}: {cl.file(filename)}")
+            except Exception as e:
+                logger.warning(f"unable to memoize {cl.name(stage)}: {e}")
+
+            return output
+
+        return wrapper
+
+    return decorator
@@ -1,4 +1,8 @@
 import logging
+import math
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
 from os.path import abspath, expanduser, join, exists
 from datetime import date
 from typing import Union
@@ -6,8 +10,17 @@ from typing import Union
 import numpy as np
 from rasters import Raster
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
 import colored_logging as cl
 
+from .memoization import DEFAULT_MEMOIZE, DEFAULT_MEMOIZATION, StageCache
+from .precision import DEFAULT_DTYPE, cast, precision_dtype
+from .writer import IntermediateWriter
+
 
 DEFAULT_WORKING_DIRECTORY = "."
 DEFAULT_INTERMEDIATE = "intermediate"
@@ -16,42 +29,198 @@ DEFAULT_INCLUDE_PREVIEW = True
 DEFAULT_RESAMPLING = "cubic"
 DEFAULT_SAVE_INTERMEDIATE = True
 DEFAULT_SHOW_DISTRIBUTION = True
+DEFAULT_DISTRIBUTION_SAMPLE_FRACTION = 1.0
+DEFAULT_DISTRIBUTION_CHUNK_SIZE = 2 ** 20
+DISTRIBUTION_MAX_UNIQUE = 10
+DISTRIBUTION_PROBE_SIZE = 1024
 
 logger = logging.getLogger(__name__)
 
+# diagnostics are suppressed per thread, so that concurrent model branches do not silence each other
+_diagnostics = threading.local()
+
 class BlankOutputError(Exception):
     pass
 
+
+DistributionStatistics = namedtuple("DistributionStatistics", [
+    "count",
+    "nan_count",
+    "zero_count",
+    "minimum",
+    "maximum",
+    "mean",
+    "histogram"
+])
+
+
+@contextmanager
+def suppress_diagnostics():
+    """
+    Skip model diagnostics in this thread while calculating on subsets of pixels.
+    """
+    suppressed = getattr(_diagnostics, "suppressed", False)
+    _diagnostics.suppressed = True
+
+    try:
+        yield
+    finally:
+        _diagnostics.suppressed = suppressed
+
+
+def peak_memory_MB() -> Union[float, None]:
+    """
+    Peak resident memory of this process.
+    :return: peak resident set size in megabytes, or None where it cannot be measured
+    """
+    if resource is None:
+        return None
+
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def distribution_stride(sample_fraction: float, width: int) -> int:
+    """
+    Choose the stride through a flattened image that samples a fraction of its pixels.
+    A stride sharing a factor with the width of the image would only ever visit some of its columns,
+    so the stride nearest to the reciprocal of the fraction that is coprime with the width is used.
+    :param sample_fraction: fraction of pixels to sample
+    :param width: number of columns of image
+    :return: stride between sampled pixels
+    """
+    stride = max(1, int(round(1 / sample_fraction)))
+
+    for offset in range(stride + width):
+        for candidate in (stride - offset, stride + offset):
+            if candidate >= 1 and math.gcd(candidate, width) == 1:
+                return candidate
+
+    return 1
+
+
+def distribution_statistics(
+        image: Union[Raster, np.ndarray],
+        sample_fraction: float = DEFAULT_DISTRIBUTION_SAMPLE_FRACTION,
+        max_unique: int = DISTRIBUTION_MAX_UNIQUE,
+        chunk_size: int = DEFAULT_DISTRIBUTION_CHUNK_SIZE) -> DistributionStatistics:
+    """
+    Summarize the distribution of an image in a single streaming pass over cache-sized chunks.
+    :param image: raster or array to summarize
+    :param sample_fraction: fraction of pixels to check, taken as a regular stride through the image coprime with its width
+    :param max_unique: number of distinct values below which a histogram of values is kept
+    :param chunk_size: number of pixels processed per chunk
+    :return: count of checked pixels, counts of NaN and zero pixels, minimum, maximum and mean of non-NaN pixels,
+        and a dictionary of counts by value if the image has fewer than max_unique distinct values, otherwise None
+    """
+    if not 0 < sample_fraction <= 1:
+        raise ValueError(f"invalid distribution sample fraction: {sample_fraction}")
+
+    values = np.asarray(image)
+    width = values.shape[-1] if values.ndim > 1 else 1
+    values = values.ravel()
+
+    if sample_fraction < 1:
+        values = values[::distribution_stride(sample_fraction, width)]
+
+    count = values.size
+    nan_count = 0
+    zero_count = 0
+    minimum = np.nan
+    maximum = np.nan
+    total = 0.0
+    histogram = {}
+
+    for start in range(0, count, chunk_size):
+        chunk = values[start:start + chunk_size]
+
+        if chunk.dtype.kind == "f":
+            nan = np.isnan(chunk)
+            chunk_nan_count = int(np.count_nonzero(nan))
+
+            if chunk_nan_count > 0:
+                nan_count += chunk_nan_count
+                chunk = chunk[~nan]
+
+        if chunk.size == 0:
+            continue
+
+        zero_count += int(np.count_nonzero(chunk == 0))
+        chunk_minimum = chunk.min()
+        chunk_maximum = chunk.max()
+        minimum = chunk_minimum if np.isnan(minimum) else min(minimum, chunk_minimum)
+        maximum = chunk_maximum if np.isnan(maximum) else max(maximum, chunk_maximum)
+        total += float(np.sum(chunk, dtype=np.float64))
+
+        if histogram is not None:
+            # a probe at the start of the chunk rules out continuous images without sorting the whole chunk
+            if len(np.unique(chunk[:DISTRIBUTION_PROBE_SIZE])) >= max_unique:
+                histogram = None
+                continue
+
+            chunk_values, chunk_counts = np.unique(chunk, return_counts=True)
+
+            for value, value_count in zip(chunk_values.tolist(), chunk_counts.tolist()):
+                histogram[value] = histogram.get(value, 0) + value_count
+
+            if len(histogram) + (nan_count > 0) >= max_unique:
+                histogram = None
+
+    valid_count = count - nan_count
+    mean = total / valid_count if valid_count > 0 else np.nan
+
+    if histogram is not None and len(histogram) + (nan_count > 0) >= max_unique:
+        histogram = None
+
+    return DistributionStatistics(
+        count=count,
+        nan_count=nan_count,
+        zero_count=zero_count,
+        minimum=minimum,
+        maximum=maximum,
+        mean=mean,
+        histogram=histogram
+    )
+
+
 def check_distribution(
         image: Raster,
         variable: str,
         date_UTC: date or str,
-        target: str):
-    unique = np.unique(image)
-    nan_proportion = np.count_nonzero(np.isnan(image)) / np.size(image)
+        target: str,
+        blank_OK: bool = False,
+        sample_fraction: float = DEFAULT_DISTRIBUTION_SAMPLE_FRACTION):
+    statistics = distribution_statistics(image, sample_fraction=sample_fraction)
+    nan_proportion = statistics.nan_count / statistics.count if statistics.count > 0 else 1
+    dtype = np.asarray(image).dtype
 
-    if len(unique) < 10:
-        logger.info(f"variable {cl.name(variable)} ({image.dtype}) on {cl.time(f'{date_UTC:%Y-%m-%d}')} at {cl.place(target)} with {cl.val(unique)} unique values")
+    if statistics.histogram is not None:
+        unique = sorted(statistics.histogram)
+
+        if statistics.nan_count > 0:
+            unique.append(np.nan)
+
+        logger.info(f"variable {cl.name(variable)} ({dtype}) on {cl.time(f'{date_UTC:%Y-%m-%d}')} at {cl.place(target)} with {cl.val(unique)} unique values")
 
         for value in unique:
             if np.isnan(value):
-                count = np.count_nonzero(np.isnan(image))
+                count = statistics.nan_count
             else:
-                count = np.count_nonzero(image == value)
+                count = statistics.histogram[value]
 
             if value == 0 or np.isnan(value):
                 logger.info(f"* {cl.colored(value, 'red')}: {cl.colored(count, 'red')}")
             else:
                 logger.info(f"* {cl.val(value)}: {cl.val(count)}")
     else:
-        minimum = np.nanmin(image)
+        minimum = statistics.minimum
 
         if minimum < 0:
             minimum_string = cl.colored(f"{minimum:0.3f}", "red")
         else:
             minimum_string = cl.val(f"{minimum:0.3f}")
 
-        maximum = np.nanmax(image)
+        maximum = statistics.maximum
 
         if maximum <= 0:
             maximum_string = cl.colored(f"{maximum:0.3f}", "red")
@@ -69,17 +238,23 @@ def check_distribution(
             " on " + cl.time(f"{date_UTC:%Y-%m-%d}") + \
             " at " + cl.place(target) + \
             " min: " + minimum_string + \
-            " mean: " + cl.val(f"{np.nanmean(image):0.3f}") + \
+            " mean: " + cl.val(f"{statistics.mean:0.3f}") + \
             " max: " + maximum_string + \
-            " nan: " + nan_proportion_string + f" ({cl.val(image.nodata)})"
+            " nan: " + nan_proportion_string + f" ({cl.val(getattr(image, 'nodata', np.nan))})"
+
+        if sample_fraction < 1:
+            message += f" sampled: {cl.val(f'{(sample_fraction * 100):0.2f}%')}"
 
-        if np.all(image == 0):
+        if statistics.zero_count == statistics.count:
             message += " all zeros"
             logger.warning(message)
         else:
             logger.info(message)
 
-    if nan_proportion == 1:
+    # a blank sample is confirmed against the full image
+    blank = nan_proportion == 1 and (sample_fraction == 1 or np.all(np.isnan(image)))
+
+    if blank and not blank_OK:
         raise BlankOutputError(f"variable {variable} on {date_UTC:%Y-%m-%d} at {target} is a blank image")
 
 class Model:
@@ -92,7 +267,12 @@ class Model:
             resampling: str = DEFAULT_RESAMPLING,
             save_intermediate: bool = DEFAULT_SAVE_INTERMEDIATE,
             show_distribution: bool = DEFAULT_SHOW_DISTRIBUTION,
-            include_preview: bool = DEFAULT_INCLUDE_PREVIEW):
+            include_preview: bool = DEFAULT_INCLUDE_PREVIEW,
+            intermediate_writer: IntermediateWriter = None,
+            distribution_sample_fraction: float = None,
+            memoize: bool = DEFAULT_MEMOIZE,
+            memoization_directory: str = None,
+            dtype: Union[str, type, np.dtype] = DEFAULT_DTYPE):
 
         if working_directory is None:
             working_directory = DEFAULT_WORKING_DIRECTORY
@@ -113,6 +293,19 @@ class Model:
 
         logger.info(f"intermediate directory: {cl.dir(intermediate_directory)}")
 
+        if memoize:
+            if memoization_directory is None:
+                memoization_directory = join(working_directory, DEFAULT_MEMOIZATION)
+
+            memoization_directory = abspath(expanduser(memoization_directory))
+            logger.info(f"memoization directory: {cl.dir(memoization_directory)}")
+            stage_cache = StageCache(memoization_directory)
+        else:
+            stage_cache = None
+
+        if distribution_sample_fraction is None:
+            distribution_sample_fraction = DEFAULT_DISTRIBUTION_SAMPLE_FRACTION
+
         self.working_directory = working_directory
         self.static_directory = static_directory
         self.intermediate_directory = intermediate_directory
@@ -121,6 +314,21 @@ class Model:
         self.show_distribution = show_distribution
         self.save_intermediate = save_intermediate
         self.include_preview = include_preview
+        self.intermediate_writer = intermediate_writer
+        self.distribution_sample_fraction = distribution_sample_fraction
+        self.stage_cache = stage_cache
+        self.dtype = precision_dtype(dtype)
+
+        if self.dtype is not None:
+            logger.info(f"model precision: {cl.val(self.dtype.name)}")
+
+    def cast(self, image: Union[Raster, np.ndarray]) -> Union[Raster, np.ndarray]:
+        """
+        Cast a floating-point image to the precision of the model.
+        :param image: raster or array
+        :return: image in the precision of the model, or unchanged if the model has no precision policy
+        """
+        return cast(image, self.dtype)
 
     def intermediate_filename(
             self,
@@ -140,6 +348,7 @@ class Model:
             variable_name: str,
             date_UTC: date or str,
             target: str) -> bool:
+        self.flush_intermediate()
         filename = self.intermediate_filename(
             variable_name=variable_name,
             acquisition_date=date_UTC,
@@ -161,65 +370,21 @@ class Model:
             target: str,
             blank_OK: bool = False):
         if self.show_distribution:
-            unique = np.unique(image)
-            nan_proportion = np.count_nonzero(np.isnan(image)) / np.size(image)
-
-            if len(unique) < 10:
-                logger.info(
-                    "variable " + cl.name(variable) + " on " + cl.time(f"{date_UTC:%Y-%m-%d}") + " at " + cl.place(
-                        target))
-
-                for value in unique:
-                    count = np.count_nonzero(image == value)
-
-                    if value == 0:
-                        logger.info(f"* {cl.colored(value, 'red')}: {cl.colored(count, 'red')}")
-                    else:
-                        logger.info(f"* {cl.val(value)}: {cl.val(count)}")
-            else:
-                minimum = np.nanmin(image)
-
-                if minimum < 0:
-                    minimum_string = cl.colored(f"{minimum:0.3f}", "red")
-                else:
-                    minimum_string = cl.val(f"{minimum:0.3f}")
-
-                maximum = np.nanmax(image)
-
-                if maximum <= 0:
-                    maximum_string = cl.colored(f"{maximum:0.3f}", "red")
-                else:
-                    maximum_string = cl.val(f"{maximum:0.3f}")
-
-                if nan_proportion > 0.5:
-                    nan_proportion_string = cl.colored(f"{(nan_proportion * 100):0.2f}%", "yellow")
-                elif nan_proportion == 1:
-                    nan_proportion_string = cl.colored(f"{(nan_proportion * 100):0.2f}%", "red")
-                else:
-                    nan_proportion_string = cl.val(f"{(nan_proportion * 100):0.2f}%")
-
-                message = "variable " + cl.name(variable) + \
-                    " on " + cl.time(f"{date_UTC:%Y-%m-%d}") + \
-                    " at " + cl.place(target) + \
-                    " min: " + minimum_string + \
-                    " mean: " + cl.val(f"{np.nanmean(image):0.3f}") + \
-                    " max: " + maximum_string + \
-                    " nan: " + nan_proportion_string + f" ({cl.val(image.nodata)})"
-
-                if np.all(image == 0):
-                    message += " all zeros"
-                    logger.warning(message)
-                else:
-                    logger.info(message)
-
-            if nan_proportion == 1 and not blank_OK:
-                raise BlankOutputError(f"variable {variable} on {date_UTC:%Y-%m-%d} at {target} is a blank image")
+            check_distribution(
+                image=image,
+                variable=variable,
+                date_UTC=date_UTC,
+                target=target,
+                blank_OK=blank_OK,
+                sample_fraction=self.distribution_sample_fraction
+            )
 
     def load_intermediate(
             self,
             variable_name: str,
             date_UTC: date or str,
             target: str) -> Raster or None:
+        self.flush_intermediate()
         filename = self.intermediate_filename(
             variable_name=variable_name,
             acquisition_date=date_UTC,
@@ -248,12 +413,27 @@ class Model:
             target_name=target
         )
 
+        if self.intermediate_writer is not None:
+            logger.info(f"queueing {cl.name(variable)} intermediate: {cl.file(filename)}")
+            # write a copy so that later in-place updates do not reach the queued image
+            image = image.contain(np.copy(image.array))
+            self.intermediate_writer.submit(filename, image.to_geotiff, filename, include_preview=True, preview_quality=self.preview_quality)
+
+            return filename
+
         logger.info(f"writing {cl.name(variable)} intermediate: {cl.file(filename)}")
 
         image.to_geotiff(filename, include_preview=True, preview_quality=self.preview_quality)
 
         return filename
 
+    def flush_intermediate(self):
+        """
+        Wait for queued intermediate files to be written.
+        """
+        if self.intermediate_writer is not None:
+            self.intermediate_writer.flush()
+
     def diagnostic(
             self,
             image: Raster,
@@ -261,5 +441,8 @@ class Model:
             date_UTC: date or str,
             target: str,
             blank_OK: bool = False):
+        if getattr(_diagnostics, "suppressed", False):
+            return
+
         self.check_distribution(image=image, variable=variable, date_UTC=date_UTC, target=target, blank_OK=blank_OK)
         self.write_intermediate(image=image, variable=variable, date_UTC=date_UTC, target=target)
@@ -0,0 +1,173 @@
+"""
+Floating-point precision policy for models
+"""
+
+import inspect
+import logging
+from collections import namedtuple
+from functools import wraps
+from typing import Any, Callable, Dict, Union
+
+import numpy as np
+
+import colored_logging as cl
+from rasters import Raster
+
+__author__ = "Gregory Halverson"
+
+# None keeps the precision of the inputs, following NumPy promotion
+DEFAULT_DTYPE = None
+
+logger = logging.getLogger(__name__)
+
+PrecisionDelta = namedtuple("PrecisionDelta", [
+    "max_absolute",
+    "max_relative",
+    "RMSE",
+    "reference_mean",
+    "NaN_mismatch"
+])
+
+
+def precision_dtype(dtype: Union[str, type, np.dtype, None]) -> Union[np.dtype, None]:
+    """
+    Validate a model precision.
+    :param dtype: floating-point data type or None to keep the precision of the inputs
+    :return: NumPy floating-point data type or None
+    """
+    if dtype is None:
+        return None
+
+    dtype = np.dtype(dtype)
+
+    if not np.issubdtype(dtype, np.floating):
+        raise ValueError(f"model precision must be a floating-point type: {dtype}")
+
+    return dtype
+
+
+def cast(value: Any, dtype: Union[np.dtype, None]) -> Any:
+    """
+    Cast floating-point rasters and arrays to a precision, passing everything else through unchanged.
+    Integer and boolean images such as classifications and masks keep their types.
+    :param value: raster, array or other value
+    :param dtype: floating-point data type or None to leave the value unchanged
+    :return: value in the given precision
+    """
+    if dtype is None or not isinstance(value, (Raster, np.ndarray, np.floating)):
+        return value
+
+    if not np.issubdtype(value.dtype, np.floating) or value.dtype == dtype:
+        return value
+
+    return value.astype(dtype)
+
+
+def precision_inputs(method: Callable) -> Callable:
+    """
+    Decorate a model method to cast its floating-point raster and array arguments to the precision of the model,
+    so that inputs read in float64 do not promote every intermediate calculated from them.
+    :param method: model method
+    :return: decorated method
+    """
+    signature = inspect.signature(method)
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        dtype = getattr(self, "dtype", None)
+
+        if dtype is None:
+            return method(self, *args, **kwargs)
+
+        bound = signature.bind(self, *args, **kwargs)
+
+        for name, value in bound.arguments.items():
+            if name != "self":
+                bound.arguments[name] = cast(value, dtype)
+
+        return method(*bound.args, **bound.kwargs)
+
+    return wrapper
+
+
+def precision_deltas(reference: Dict[str, Any], candidate: Dict[str, Any]) -> Dict[str, PrecisionDelta]:
+    """
+    Compare the outputs of a model run at reduced precision to a reference run, usually in float64.
+    Statistics are calculated in float64 over the pixels defined in both runs.
+    :param reference: dictionary of reference output images keyed by variable name
+    :param candidate: dictionary of output images at reduced precision keyed by variable name
+    :return: dictionary of output deltas keyed by variable name
+    """
+    deltas = {}
+
+    for variable, reference_image in reference.items():
+        if variable not in candidate:
+            continue
+
+        reference_array = np.asarray(reference_image, dtype=np.float64)
+        candidate_array = np.asarray(candidate[variable], dtype=np.float64)
+
+        if reference_array.shape != candidate_array.shape:
+            raise ValueError(f"shape of {variable} differs between runs: {reference_array.shape} {candidate_array.shape}")
+
+        reference_NaN = np.isnan(reference_array)
+        candidate_NaN = np.isnan(candidate_array)
+        defined = ~reference_NaN & ~candidate_NaN
+        NaN_mismatch = int(np.count_nonzero(reference_NaN != candidate_NaN))
+
+        if not np.any(defined):
+            deltas[variable] = PrecisionDelta(np.nan, np.nan, np.nan, np.nan, NaN_mismatch)
+            continue
+
+        difference = np.abs(candidate_array[defined] - reference_array[defined])
+        magnitude = np.abs(reference_array[defined])
+        # relative differences are only meaningful away from zero
+        relative = difference[magnitude > 1e-6] / magnitude[magnitude > 1e-6]
+
+        deltas[variable] = PrecisionDelta(
+            max_absolute=float(np.max(difference)),
+            max_relative=float(np.max(relative)) if relative.size > 0 else 0.0,
+            RMSE=float(np.sqrt(np.mean(difference ** 2))),
+            reference_mean=float(np.mean(reference_array[defined])),
+            NaN_mismatch=NaN_mismatch
+        )
+
+    return deltas
+
+
+def report_precision_deltas(deltas: Dict[str, PrecisionDelta], label: str = "float32"):
+    """
+    Log output deltas of a reduced precision run against its reference.
+    :param deltas: dictionary of output deltas keyed by variable name
+    :param label: description of the reduced precision run
+    """
+    for variable, delta in deltas.items():
+        logger.info(
+            f"{label} {cl.name(variable)}: "
+            f"max absolute delta {cl.val(f'{delta.max_absolute:0.3g}')} "
+            f"max relative delta {cl.val(f'{delta.max_relative:0.3g}')} "
+            f"RMSE {cl.val(f'{delta.RMSE:0.3g}')} "
+            f"(mean {cl.val(f'{delta.reference_mean:0.3g}')}, "
+            f"{cl.val(delta.NaN_mismatch)} NaN mismatches)"
+        )
+
+
+def compare_precision(
+        run: Callable[[np.dtype], Dict[str, Any]],
+        dtype: Union[str, type, np.dtype] = np.float32,
+        reference_dtype: Union[str, type, np.dtype] = np.float64) -> Dict[str, PrecisionDelta]:
+    """
+    Regression harness for the precision policy, running a model at reduced precision and at reference precision.
+    :param run: function running the model at a given precision and returning its output images keyed by variable name
+    :param dtype: reduced precision under test
+    :param reference_dtype: reference precision
+    :return: dictionary of output deltas keyed by variable name
+    """
+    dtype = precision_dtype(dtype)
+    reference_dtype = precision_dtype(reference_dtype)
+    reference = run(reference_dtype)
+    candidate = run(dtype)
+    deltas = precision_deltas(reference, candidate)
+    report_precision_deltas(deltas, label=dtype.name)
+
+    return deltas
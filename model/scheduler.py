@@ -0,0 +1,217 @@
+"""
+Dependency-graph scheduler for the processing stages of a PGE
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from threading import Lock
+from typing import Any, Callable, Dict, List, Sequence
+
+import colored_logging as cl
+from timer import Timer
+
+__author__ = "Gregory Halverson"
+
+# a single worker runs the stages in sequence in the calling thread
+DEFAULT_STAGE_WORKERS = 1
+
+logger = logging.getLogger(__name__)
+
+
+class StageGraphError(ValueError):
+    pass
+
+
+class Stage:
+    """
+    Processing stage taking named values as keyword arguments and producing named values.
+    A stage with one output returns its value, and a stage with several outputs returns them in declared order.
+    """
+    def __init__(self, name: str, function: Callable, inputs: Sequence[str] = (), outputs: Sequence[str] = ()):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+    def __repr__(self):
+        return f"Stage(name={self.name}, inputs={self.inputs}, outputs={self.outputs})"
+
+    def __call__(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        result = self.function(**{name: values[name] for name in self.inputs})
+
+        if len(self.outputs) == 0:
+            return {}
+
+        if len(self.outputs) == 1:
+            return {self.outputs[0]: result}
+
+        if not isinstance(result, (tuple, list)) or len(result) != len(self.outputs):
+            raise StageGraphError(f"stage {self.name} did not return its {len(self.outputs)} outputs: {self.outputs}")
+
+        return dict(zip(self.outputs, result))
+
+
+class StageGraph:
+    """
+    Graph of processing stages that declare the named values they take and produce.
+    A stage is ready once all of its inputs exist, and ready stages run concurrently on a thread pool
+    with a cap on the number of workers, since the models share connections and caches and release the GIL in NumPy.
+    The first failure cancels the stages that have not started and is raised once the running stages finish.
+    """
+    def __init__(self, max_workers: int = DEFAULT_STAGE_WORKERS):
+        if max_workers is None:
+            max_workers = DEFAULT_STAGE_WORKERS
+
+        if max_workers < 1:
+            raise ValueError(f"invalid number of stage workers: {max_workers}")
+
+        self.max_workers = max_workers
+        self.stages: List[Stage] = []
+        self.timings: Dict[str, float] = {}
+        self.wall_seconds = None
+        self._lock = Lock()
+
+    def __repr__(self):
+        return f"StageGraph(stages={[stage.name for stage in self.stages]}, max_workers={self.max_workers})"
+
+    def __len__(self):
+        return len(self.stages)
+
+    def add(self, name: str, function: Callable, inputs: Sequence[str] = (), outputs: Sequence[str] = ()) -> Stage:
+        """
+        Add a stage to the graph.
+        :param name: unique name of the stage
+        :param function: function taking the inputs of the stage as keyword arguments
+        :param inputs: names of the values the stage takes
+        :param outputs: names of the values the stage produces
+        :return: stage
+        """
+        if any(stage.name == name for stage in self.stages):
+            raise StageGraphError(f"duplicate stage: {name}")
+
+        stage = Stage(name, function, inputs=inputs, outputs=outputs)
+        self.stages.append(stage)
+
+        return stage
+
+    def stage(self, inputs: Sequence[str] = (), outputs: Sequence[str] = ()) -> Callable:
+        """
+        Decorate a function to add it to the graph as a stage named after the function.
+        :param inputs: names of the values the stage takes
+        :param outputs: names of the values the stage produces
+        :return: decorator
+        """
+        def decorator(function: Callable) -> Callable:
+            self.add(function.__name__, function, inputs=inputs, outputs=outputs)
+
+            return function
+
+        return decorator
+
+    def order(self, values: Dict[str, Any] = None) -> List[Stage]:
+        """
+        Validate the graph and order its stages so that every stage follows the stages producing its inputs.
+        Stages are kept in the order they were added wherever their dependencies allow.
+        :param values: names of the values available before any stage runs
+        :return: list of stages in dependency order
+        """
+        available = set(values) if values is not None else set()
+        producers = {}
+
+        for stage in self.stages:
+            for name in stage.outputs:
+                if name in available or name in producers:
+                    raise StageGraphError(f"value {name} of stage {stage.name} is produced more than once")
+
+                producers[name] = stage.name
+
+        for stage in self.stages:
+            missing = [name for name in stage.inputs if name not in available and name not in producers]
+
+            if missing:
+                raise StageGraphError(f"inputs of stage {stage.name} are never produced: {missing}")
+
+        ordered = []
+        remaining = list(self.stages)
+
+        while remaining:
+            ready = next((stage for stage in remaining if all(name in available for name in stage.inputs)), None)
+
+            if ready is None:
+                raise StageGraphError(f"dependency cycle between stages: {[stage.name for stage in remaining]}")
+
+            ordered.append(ready)
+            remaining.remove(ready)
+            available.update(ready.outputs)
+
+        return ordered
+
+    def run_stage(self, stage: Stage, values: Dict[str, Any]) -> Dict[str, Any]:
+        logger.info(f"starting stage {cl.name(stage.name)}")
+        timer = Timer()
+        outputs = stage(values)
+        seconds = timer.duration
+
+        with self._lock:
+            self.timings[stage.name] = seconds
+
+        logger.info(f"finished stage {cl.name(stage.name)} in {cl.time(timer)} seconds")
+
+        return outputs
+
+    def run(self, values: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Run every stage of the graph once its inputs exist.
+        :param values: dictionary of values available before any stage runs
+        :return: dictionary of the given values and every value produced by the stages
+        """
+        values = dict(values) if values is not None else {}
+        ordered = self.order(values)
+        timer = Timer()
+
+        if self.max_workers == 1:
+            for stage in ordered:
+                values.update(self.run_stage(stage, values))
+        else:
+            self._run_concurrent(ordered, values)
+
+        self.wall_seconds = timer.duration
+
+        return values
+
+    def _run_concurrent(self, ordered: List[Stage], values: Dict[str, Any]):
+        pending = list(ordered)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="stage") as executor:
+            try:
+                while pending or running:
+                    # values are only updated here, so stages read a consistent set of inputs
+                    for stage in [stage for stage in pending if all(name in values for name in stage.inputs)]:
+                        pending.remove(stage)
+                        running[executor.submit(self.run_stage, stage, dict(values))] = stage
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                    for future in sorted(done, key=lambda future: ordered.index(running[future])):
+                        running.pop(future)
+                        values.update(future.result())
+            except Exception:
+                for future in running:
+                    future.cancel()
+
+                raise
+
+    def report_timings(self):
+        """
+        Log the time spent in each stage and the wall-clock time of the last run.
+        """
+        for stage in self.stages:
+            if stage.name in self.timings:
+                logger.info(f"stage {cl.name(stage.name)}: {cl.time(f'{self.timings[stage.name]:0.2f}')} seconds")
+
+        if self.wall_seconds is not None:
+            logger.info(
+                f"{cl.val(len(self.timings))} stages took {cl.time(f'{sum(self.timings.values()):0.2f}')} seconds "
+                f"in {cl.time(f'{self.wall_seconds:0.2f}')} seconds with {cl.val(self.max_workers)} workers"
+            )
@@ -0,0 +1,115 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+from typing import Callable, List, Tuple
+
+import colored_logging as cl
+
+DEFAULT_WRITER_WORKERS = 4
+DEFAULT_WRITER_QUEUE_SIZE = 16
+
+logger = logging.getLogger(__name__)
+
+
+class IntermediateWriteError(IOError):
+    def __init__(self, failures: List[Tuple[str, Exception]]):
+        self.failures = failures
+        super(IntermediateWriteError, self).__init__(
+            f"failed to write {len(failures)} intermediate files: " +
+            ", ".join(f"{description} ({exception})" for description, exception in failures)
+        )
+
+
+class IntermediateWriter:
+    """
+    Background writer for intermediate files.
+    Writes are queued to a thread pool so that processing can continue while files are written.
+    The queue is bounded, so submitting blocks when it is full to cap the memory held by pending writes.
+    Failures are collected and raised together when the writer is closed.
+    """
+    def __init__(self, max_workers: int = DEFAULT_WRITER_WORKERS, max_queued: int = DEFAULT_WRITER_QUEUE_SIZE):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="intermediate")
+        self._slots = BoundedSemaphore(max_workers + max_queued)
+        self._lock = Lock()
+        self._pending: List[Tuple[str, Future]] = []
+        self._written = 0
+        self._failures: List[Tuple[str, Exception]] = []
+        self._blocked_seconds = 0.0
+        self._closed = False
+
+    def __repr__(self):
+        return f"IntermediateWriter(max_workers={self.max_workers}, max_queued={self.max_queued}, pending={len(self._pending)})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # do not mask an exception raised during processing with write failures
+        self.close(raise_errors=exc_type is None)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, description: str, function: Callable, *args, **kwargs) -> Future:
+        """
+        Queue a write, blocking while the queue is full.
+        :param description: description of the write for logging and error reports
+        :param function: function performing the write
+        :return: future of the write
+        """
+        start = perf_counter()
+        self._slots.acquire()
+
+        with self._lock:
+            self._blocked_seconds += perf_counter() - start
+
+        try:
+            future = self._executor.submit(function, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda future: self._slots.release())
+
+        with self._lock:
+            self._pending.append((description, future))
+
+        return future
+
+    def flush(self) -> List[Tuple[str, Exception]]:
+        """
+        Wait for all queued writes to complete, in the order they were submitted.
+        :return: list of descriptions and exceptions of failed writes so far
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+
+        for description, future in pending:
+            try:
+                future.result()
+                self._written += 1
+            except Exception as e:
+                logger.error(f"failed to write intermediate {cl.name(description)}: {e}")
+                self._failures.append((description, e))
+
+        return list(self._failures)
+
+    def close(self, raise_errors: bool = True):
+        """
+        Complete all queued writes and shut down the thread pool.
+        :param raise_errors: raise IntermediateWriteError if any write failed
+        """
+        if self._closed:
+            return
+
+        self.flush()
+        self._executor.shutdown(wait=True)
+        self._closed = True
+        logger.info(f"intermediate writer completed {cl.val(self._written)} writes ({cl.val(f'{self._blocked_seconds:0.2f}')} seconds blocked on full queue)")
+
+        if self._failures and raise_errors:
+            raise IntermediateWriteError(self._failures)
@@ -0,0 +1,52 @@
+"""
+This module contains helpers shared by the unit tests of the models.
+"""
+
+from typing import Callable, Tuple
+
+__author__ = 'Gregory Halverson'
+
+
+def UTM_grid(shape: Tuple[int, int] = (20, 30)):
+    """
+    Build a 70 m UTM raster grid like an ECOSTRESS tile.
+    :param shape: rows and columns of grid
+    :return: raster grid
+    """
+    from affine import Affine
+    from rasters import RasterGrid
+
+    return RasterGrid.from_affine(Affine(70, 0, 300000, 0, -70, 4000000), *shape, crs="EPSG:32611")
+
+
+def uniform_rasters(geometry, seed: int = 0) -> Callable:
+    """
+    Make a function drawing rasters of uniform random values over a geometry from one random generator.
+    :param geometry: raster grid
+    :param seed: seed of random generator
+    :return: function taking the low and high bounds and returning a raster
+    """
+    import numpy as np
+    from rasters import Raster
+
+    rng = np.random.default_rng(seed)
+
+    def uniform(low: float, high: float) -> Raster:
+        return Raster(rng.uniform(low, high, geometry.shape), geometry=geometry)
+
+    return uniform
+
+
+def bypass_constructor(model_class: type, **attributes):
+    """
+    Create a model without running its constructor, which connects to the static datasets and ancillary sources.
+    :param model_class: class of model
+    :param attributes: attributes to set on the model
+    :return: model
+    """
+    model = object.__new__(model_class)
+
+    for name, value in attributes.items():
+        setattr(model, name, value)
+
+    return model
@@ -0,0 +1,267 @@
+"""
+This module contains the unit tests for the BESS package.
+"""
+
+import unittest
+from datetime import date
+
+from tests.helpers import UTM_grid, uniform_rasters, bypass_constructor
+
+__author__ = 'Gregory Halverson'
+
+
+def carbon_water_flux_inputs(shape=(20, 30)):
+    uniform = uniform_rasters(UTM_grid(shape))
+    Ta_K = uniform(280, 305)
+
+    return dict(
+        ST_K=Ta_K + uniform(-2, 8), LAI=uniform(0.1, 5), Ta_K=Ta_K, APAR_Sun=uniform(100, 1500),
+        APAR_Sh=uniform(20, 400), ASW_Sun=uniform(100, 600), ASW_Sh=uniform(20, 200), Vcmax25_Sun=uniform(10, 60),
+        Vcmax25_Sh=uniform(5, 40), m=uniform(4, 12), b0=uniform(0.005, 0.02), fSun=uniform(0.2, 0.9),
+        ASW_Soil=uniform(20, 200), G=uniform(10, 80), SZA=uniform(10, 70), Ca=uniform(390, 420),
+        Ps_Pa=uniform(85000, 101000), gamma=uniform(60, 67), Cp=uniform(1005, 1015), rhoa=uniform(1.0, 1.25),
+        VPD_Pa=uniform(200, 3000), RH=uniform(0.2, 0.9), desTa=uniform(80, 250), ddesTa=uniform(5, 14),
+        epsa=uniform(0.7, 0.85), Rc=uniform(20, 80), Rs=uniform(100, 400), alf=uniform(0.03, 0.08),
+        fStress=uniform(0.3, 1), FVC=uniform(0, 1)
+    )
+
+
+def flux_model(passes: int = 2):
+    from BESS import BESS
+
+    return bypass_constructor(
+        BESS,
+        show_distribution=False,
+        save_intermediate=False,
+        passes=passes,
+        initialize_Tf_with_ST=True,
+        fused_kernel=False,
+        convergence_tolerance=None,
+        block_rows=None,
+        dtype=None
+    )
+
+
+class TestBESS(unittest.TestCase):
+    def test_fused_kernel_matches_vectorized(self):
+        import numpy as np
+
+        model = flux_model()
+        inputs = carbon_water_flux_inputs()
+
+        for C4 in (False, True):
+            model.fused_kernel = False
+            expected = model.carbon_water_fluxes(date(2022, 7, 1), "11SPS", C4=C4, **inputs)
+            model.fused_kernel = True
+            fused = model.carbon_water_fluxes(date(2022, 7, 1), "11SPS", C4=C4, **inputs)
+
+            for name in ("GPP", "LE", "LE_soil", "LE_canopy", "Rn", "Rn_soil", "Rn_canopy"):
+                self.assertTrue(np.allclose(getattr(fused, name), getattr(expected, name), rtol=1e-5, atol=1e-3), name)
+
+    def test_active_set_matches_full_iteration(self):
+        import numpy as np
+
+        model = flux_model(passes=3)
+        inputs = carbon_water_flux_inputs()
+        # masked pixels are never iterated
+        inputs["ST_K"].array[:5] = np.nan
+        expected = model.carbon_water_fluxes(date(2022, 7, 1), "11SPS", C4=False, **inputs)
+        # with a tolerance of zero every pixel with a defined change stays active
+        model.convergence_tolerance = 0
+        active_set = model.carbon_water_fluxes(date(2022, 7, 1), "11SPS", C4=False, **inputs)
+
+        for name in ("GPP", "LE", "LE_soil", "LE_canopy", "Rn", "Rn_soil", "Rn_canopy"):
+            self.assertTrue(np.array_equal(getattr(active_set, name), getattr(expected, name), equal_nan=True), name)
+
+    def test_active_set_freezes_converged_pixels(self):
+        import numpy as np
+
+        model = flux_model(passes=4)
+        inputs = carbon_water_flux_inputs()
+        inputs["ST_K"].array[:5] = np.nan
+        carbon_water_flux_pass = model.carbon_water_flux_pass
+        initial = {}
+        passes = []
+
+        # record the initial state and the state after each pass of the full iteration
+        def recording_pass(date_UTC, target, state, iteration_inputs, C4, iter):
+            if iter == 1:
+                initial.update(state=state, inputs=iteration_inputs)
+
+            updated_state = carbon_water_flux_pass(date_UTC, target, state, iteration_inputs, C4, iter)
+            passes.append({name: np.asarray(value) for name, value in updated_state.items()})
+
+            return updated_state
+
+        model.carbon_water_flux_pass = recording_pass
+        model.carbon_water_fluxes(date(2022, 7, 1), "11SPS", C4=False, **inputs)
+        model.carbon_water_flux_pass = carbon_water_flux_pass
+
+        # each pixel keeps the state of the first pass changing its temperatures by less than the tolerance
+        tolerance = 0.5
+        previous = {name: np.array(np.broadcast_to(value, inputs["ST_K"].shape)) for name, value in initial["state"].items()}
+        expected = {name: value.copy() for name, value in passes[-1].items()}
+        frozen = np.isnan(previous["Tf_K"])
+
+        for state in passes:
+            change = np.fmax(np.abs(state["Tf_K"] - previous["Tf_K"]), np.abs(state["Ts_K"] - previous["Ts_K"]))
+            converged = ~frozen & ~(change >= tolerance)
+
+            for name, value in state.items():
+                expected[name][converged] = value[converged]
+
+            frozen |= converged
+            previous = state
+
+        unconverged = ~frozen
+        converged = frozen & ~np.isnan(inputs["ST_K"].array)
+        self.assertTrue(np.any(converged))
+        self.assertTrue(np.any(unconverged))
+
+        model.convergence_tolerance = tolerance
+        active_set = model.carbon_water_fluxes_active_set(date(2022, 7, 1), "11SPS", initial["state"], initial["inputs"], C4=False)
+
+        for name, value in expected.items():
+            active_image = np.asarray(active_set[name])
+
+            self.assertTrue(np.array_equal(active_image[converged], value[converged], equal_nan=True), name)
+            # unconverged pixels match the full iteration
+            self.assertTrue(np.array_equal(active_image[unconverged], passes[-1][name][unconverged], equal_nan=True), name)
+
+    def test_parallel_C3_C4_matches_sequential(self):
+        from functools import partial
+        import numpy as np
+
+        model = flux_model()
+        inputs = carbon_water_flux_inputs()
+        uniform = uniform_rasters(inputs["ST_K"].geometry, seed=1)
+        branch_names = ("Vcmax25_Sun", "Vcmax25_Sh", "m", "b0")
+        shared = {name: image for name, image in inputs.items() if name not in branch_names}
+        carbon_water_fluxes = partial(model.carbon_water_fluxes, date(2022, 7, 1), "11SPS", **shared)
+        C3_inputs = dict({name: inputs[name] for name in branch_names}, C4=False)
+        C4_inputs = dict(Vcmax25_Sun=uniform(20, 80), Vcmax25_Sh=uniform(10, 50), m=uniform(2, 6), b0=uniform(0.02, 0.06), C4=True)
+        results = []
+
+        for parallel_C3_C4 in (False, True):
+            model.parallel_C3_C4 = parallel_C3_C4
+            results.append(model.C3_C4_fluxes(carbon_water_fluxes, C3_inputs, C4_inputs))
+
+        for expected, parallel in zip(*results):
+            for name in ("GPP", "LE", "LE_soil", "LE_canopy", "Rn", "Rn_soil", "Rn_canopy"):
+                self.assertTrue(np.array_equal(getattr(parallel, name), getattr(expected, name), equal_nan=True), name)
+
+    def test_block_processing_matches_tile(self):
+        import numpy as np
+
+        model = flux_model()
+        inputs = carbon_water_flux_inputs()
+        geometry = inputs["ST_K"].geometry
+        expected = model.process_blocks(model.carbon_water_fluxes, geometry, date_UTC=date(2022, 7, 1), target="11SPS", C4=True, **inputs)
+        # strips that do not divide the tile evenly
+        model.block_rows = 6
+        blocked = model.process_blocks(model.carbon_water_fluxes, geometry, date_UTC=date(2022, 7, 1), target="11SPS", C4=True, **inputs)
+
+        for name in ("GPP", "LE", "LE_soil", "LE_canopy", "Rn", "Rn_soil", "Rn_canopy"):
+            self.assertTrue(np.array_equal(getattr(blocked, name), getattr(expected, name), equal_nan=True), name)
+            self.assertEqual(getattr(blocked, name).geometry.affine, geometry.affine)
+
+    def test_float32_matches_float64(self):
+        from model.precision import compare_precision
+
+        model = flux_model(passes=3)
+        inputs = carbon_water_flux_inputs()
+
+        def run(dtype):
+            fluxes = model.carbon_water_fluxes(
+                date(2022, 7, 1),
+                "11SPS",
+                C4=False,
+                **{name: image.astype(dtype) for name, image in inputs.items()}
+            )
+
+            return {name: getattr(fluxes, name) for name in ("GPP", "LE", "LE_soil", "LE_canopy", "Rn", "Rn_soil", "Rn_canopy")}
+
+        for name, delta in compare_precision(run).items():
+            self.assertEqual(delta.NaN_mismatch, 0, name)
+            # fluxes are in W m-2 and umol m-2 s-1
+            self.assertLess(delta.max_absolute, 0.05, name)
+
+    def test_memoize_meteorology(self):
+        import tempfile
+        import numpy as np
+        from model.memoization import StageCache
+
+        model = flux_model()
+        inputs = carbon_water_flux_inputs()
+        geometry = inputs["Ta_K"].geometry
+        uniform = uniform_rasters(geometry, seed=1)
+        meteorology_inputs = dict(
+            day_of_year=uniform(182, 183), hour_of_day=uniform(10, 14), latitude=np.asarray(geometry.lat),
+            elevation_m=uniform(0, 2000), SZA=inputs["SZA"], Ta_K=inputs["Ta_K"], Ea_Pa=uniform(500, 2000),
+            Rg=uniform(200, 1000), wind_speed_mps=uniform(0.5, 8), canopy_height_meters=uniform(0.5, 20)
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            model.stage_cache = StageCache(directory)
+            expected = model.meteorology(date(2022, 7, 1), "11SPS", **meteorology_inputs)
+            memoized = model.meteorology(date(2022, 7, 1), "11SPS", **meteorology_inputs)
+
+            self.assertEqual((model.stage_cache.hits, model.stage_cache.misses), (1, 1))
+            self.assertEqual(memoized._fields, expected._fields)
+
+            for name in expected._fields:
+                self.assertTrue(np.array_equal(np.asarray(getattr(memoized, name)), np.asarray(getattr(expected, name)), equal_nan=True), name)
+
+    def test_static_cache(self):
+        import os
+        import tempfile
+        import numpy as np
+        from affine import Affine
+        from rasters import Raster, RasterGrid
+        from BESS.static_cache import StaticCache
+
+        geometry = RasterGrid.from_affine(Affine(70, 0, 300000, 0, -70, 4000000), 8, 9, crs="EPSG:32611")
+        calls = []
+        # a value that float32 cannot hold exactly
+        alf_value = 0.1
+
+        def build():
+            calls.append(geometry)
+
+            return {
+                "alf": Raster(np.full(geometry.shape, alf_value, dtype=np.float64), geometry=geometry),
+                "kn": Raster(np.full(geometry.shape, 1, dtype=np.float32), geometry=geometry)
+            }
+
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "source.tif")
+
+            with open(source, "w") as file:
+                file.write("source")
+
+            kn = StaticCache(directory, ["alf", "kn"], sources=[source]).layer("kn", geometry, "cubic", build)
+            # a new cache reads the tile written by the first one
+            static_cache = StaticCache(directory, ["alf", "kn"], sources=[source])
+            alf = static_cache.layer("alf", geometry, "cubic", build)
+            cached_kn = static_cache.layer("kn", geometry, "cubic", build)
+
+            self.assertEqual(len(calls), 1)
+            self.assertEqual((static_cache.hits, static_cache.misses), (2, 0))
+            self.assertTrue(np.all(np.asarray(kn) == 1))
+            # each layer keeps the precision it was resampled in
+            self.assertTrue(np.all(np.asarray(alf) == alf_value))
+            self.assertEqual(alf.dtype, np.float64)
+            self.assertEqual(cached_kn.dtype, np.float32)
+            self.assertEqual(alf.geometry.affine, geometry.affine)
+
+            static_cache.layer("kn", geometry, "nearest", build)
+            self.assertEqual(len(calls), 2)
+
+            # an updated source dataset resamples the static parameters again
+            status = os.stat(source)
+            os.utime(source, ns=(status.st_atime_ns, status.st_mtime_ns + 10 ** 9))
+            StaticCache(directory, ["alf", "kn"], sources=[source]).layer("kn", geometry, "nearest", build)
+            self.assertEqual(len(calls), 3)
+
+if __name__ == '__main__':
+    unittest.main()
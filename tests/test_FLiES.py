@@ -0,0 +1,253 @@
+"""
+This module contains the unit tests for the FLiES package.
+"""
+
+import importlib.util
+import unittest
+
+from tests.helpers import UTM_grid, bypass_constructor
+
+__author__ = 'Gregory Halverson'
+
+KERAS_AVAILABLE = importlib.util.find_spec("keras") is not None and importlib.util.find_spec("tensorflow") is not None
+
+
+def ANN_inputs(count: int = 10000):
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    ctype = rng.choice([0, 1, 3], count)
+    atype = rng.choice([1, 2, 4, 5], count)
+
+    return np.column_stack([
+        ctype == 0,
+        ctype == 1,
+        ctype == 3,
+        atype == 1,
+        atype == 2,
+        atype == 4,
+        atype == 5,
+        rng.uniform(0, 100, count),
+        rng.uniform(0, 2, count),
+        rng.uniform(0, 8, count),
+        rng.uniform(0.2, 0.5, count),
+        rng.uniform(0, 0.8, count),
+        rng.uniform(0, 5, count),
+        rng.uniform(0, 90, count)
+    ]).astype(np.float32)
+
+
+def chained_ANN_atype_ctype(COT, KG_climate):
+    import numpy as np
+
+    # classification of the ANN aerosol and cloud types as chained np.where passes, as FLiES ran it before the tables
+    atype = np.full(COT.shape, 1, dtype=np.uint16)
+    ctype = np.full(COT.shape, 0, dtype=np.uint16)
+
+    atype = np.where((COT == 0) & ((KG_climate == 5) | (KG_climate == 6)), 1, atype)
+    ctype = np.where((COT == 0) & ((KG_climate == 5) | (KG_climate == 6)), 0, ctype)
+    atype = np.where((COT == 0) & ((KG_climate == 3) | (KG_climate == 4)), 2, atype)
+    ctype = np.where((COT == 0) & ((KG_climate == 3) | (KG_climate == 4)), 0, ctype)
+    atype = np.where((COT == 0) & (KG_climate == 1), 4, atype)
+    ctype = np.where((COT == 0) & (KG_climate == 1), 0, ctype)
+    atype = np.where((COT == 0) & (KG_climate == 2), 5, atype)
+    ctype = np.where((COT == 0) & (KG_climate == 2), 0, ctype)
+    atype = np.where((COT > 0) & ((KG_climate == 5) | (KG_climate == 6)), 1, atype)
+    ctype = np.where((COT > 0) & ((KG_climate == 5) | (KG_climate == 6)), 1, ctype)
+    atype = np.where((COT > 0) & ((KG_climate == 3) | (KG_climate == 4)), 2, atype)
+    ctype = np.where((COT > 0) & ((KG_climate == 3) | (KG_climate == 4)), 1, ctype)
+    atype = np.where((COT > 0) & (KG_climate == 2), 5, atype)
+    ctype = np.where((COT > 0) & (KG_climate == 2), 1, ctype)
+    atype = np.where((COT > 0) & (KG_climate == 1), 4, atype)
+    ctype = np.where((COT > 0) & (KG_climate == 1), 3, ctype)
+
+    return atype, ctype
+
+
+def per_pixel_FLiES_lookup(LUT, ctype, atype, ctop, albedo, The0, ctauref, tauref, interpolate_cot=True):
+    import numpy as np
+
+    # the lookup table interpolation as FLiES ran it before the vectorized gather,
+    # with a separate query of the table for every bracketing solar zenith angle and cloud optical thickness
+    def interpolate_The0(ctauref_index):
+        The0_clipped = np.clip(The0, 5, 85)
+        The0_index_low = np.clip(np.floor(The0_clipped / 5.0).astype(np.int32) - 1, 0, 16).astype(np.int32)
+        The0_index_high = np.clip(np.ceil(The0_clipped / 5.0).astype(np.int32) - 1, 0, 16).astype(np.int32)
+        SWin_The0_low = LUT[ctype, atype, ctop_index, albedo_index, The0_index_low, ctauref_index, tauref_index]
+        SWin_The0_high = LUT[ctype, atype, ctop_index, albedo_index, The0_index_high, ctauref_index, tauref_index]
+        The0_slope = (SWin_The0_high - SWin_The0_low) / 5.0
+        The0_intermediate = The0_clipped - np.floor(The0_clipped / 5.0) * 5.0
+
+        return SWin_The0_low + The0_slope * The0_intermediate
+
+    ctop = np.where(np.isnan(ctop), 0.1, ctop)
+    ctop = np.where(ctop > 10000, 10000, ctop)
+    ctop = np.where(ctop <= 0, 100, ctop)
+    ctop_factors = np.linspace(1000, 9000, 5)
+    ctop_index = np.digitize(ctop, (ctop_factors[1:] + ctop_factors[:-1]) / 2.0, right=True)
+
+    albedo = np.where(np.isnan(albedo), 0.01, albedo)
+    albedo = np.where(albedo <= 0, 0.01, albedo)
+    albedo = np.where(albedo > 0.9, 0.9, albedo)
+    albedo_factors = np.linspace(0.1, 0.7, 3)
+    albedo_index = np.digitize(albedo, albedo_factors[1:] + albedo_factors[:-1] / 2.0, right=True)
+
+    tauref = np.where(np.isnan(tauref), 0.1, tauref)
+    tauref = np.where(tauref > 1, 1, tauref)
+    tauref_factors = np.linspace(0.1, 0.9, 5)[:-1]
+    tauref_index = np.digitize(tauref, (tauref_factors[1:] + tauref_factors[:-1]) / 2.0, right=True)
+
+    ctauref = np.where(np.isnan(ctauref), 0.1, ctauref)
+    ctauref = np.where(ctauref > 130, 130, ctauref)
+    ctauref = np.where(ctauref <= 0, 0.01, ctauref)
+    ctauref_factors = np.array([0.1, 0.5, 1, 5, 10, 20, 40, 60, 80, 110])
+
+    if not interpolate_cot:
+        ctauref_index = np.digitize(ctauref, (ctauref_factors[1:] + ctauref_factors[:-1]) / 2.0, right=True)
+        SWin = interpolate_The0(ctauref_index)
+    else:
+        ctauref_index = np.digitize(np.clip(ctauref, 0.1, 110), ctauref_factors[:-1])
+        ctauref_intermediate = ctauref - ctauref_factors[ctauref_index]
+        ctauref_index2 = np.clip(np.where(ctauref_intermediate < 0, ctauref_index - 1, ctauref_index + 1), 0, 9)
+        ctauref_delta = ctauref_factors[ctauref_index2] - ctauref_factors[ctauref_index]
+        SWin_ctauref1 = interpolate_The0(ctauref_index)
+        SWin_ctauref2 = interpolate_The0(ctauref_index2)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correction = (SWin_ctauref2 - SWin_ctauref1) / ctauref_delta * ctauref_intermediate
+
+        SWin = SWin_ctauref1 + np.where(np.isnan(correction), 0, correction)
+
+    return np.where(np.isinf(SWin), np.nan, SWin)
+
+
+class TestFLiES(unittest.TestCase):
+    def test_numpy_backend(self):
+        import numpy as np
+        from FLiES.ANN import load_ANN_model
+        from FLiES.FLiES import MODEL_FILENAME
+
+        model = load_ANN_model(MODEL_FILENAME, backend="numpy")
+        outputs = model.predict(ANN_inputs(), batch_size=4096)
+
+        self.assertEqual(outputs.shape, (10000, 7))
+        self.assertEqual(outputs.dtype, np.float32)
+        self.assertTrue(np.all(np.isfinite(outputs)))
+
+    @unittest.skipUnless(KERAS_AVAILABLE, "keras is not installed")
+    def test_numpy_backend_matches_keras(self):
+        import numpy as np
+        from FLiES.ANN import load_ANN_model
+        from FLiES.FLiES import MODEL_FILENAME
+
+        inputs = ANN_inputs()
+        expected = load_ANN_model(MODEL_FILENAME, backend="keras").predict(inputs)
+        outputs = load_ANN_model(MODEL_FILENAME, backend="numpy").predict(inputs)
+
+        self.assertTrue(np.allclose(outputs, expected, atol=1e-4))
+
+    def test_ANN_matches_full_raster(self):
+        import numpy as np
+        from rasters import Raster
+        from FLiES.ANN import load_ANN_model
+        from FLiES.FLiES import FLiES, MODEL_FILENAME
+
+        model = bypass_constructor(FLiES, ANN_model=load_ANN_model(MODEL_FILENAME, backend="numpy"))
+
+        shape = (60, 50)
+        geometry = UTM_grid(shape)
+        rng = np.random.default_rng(0)
+        features = ANN_inputs(shape[0] * shape[1]).astype(np.float64)
+        ctype = rng.choice([0, 1, 3], shape).astype(np.uint8)
+        atype = rng.choice([1, 2, 4, 5], shape).astype(np.uint8)
+        images = [features[:, column].reshape(shape) for column in range(7, 14)]
+
+        # masked pixels in every input, including whole rows like swath gaps
+        for image in images:
+            image[rng.random(shape) < 0.05] = np.nan
+
+        images[0][10:15] = np.nan
+
+        # the previous path predicted every pixel of the full raster, with the aerosol type columns encoded from the cloud type
+        ctype_flat = ctype.ravel()
+        full_inputs = np.column_stack(
+            [ctype_flat == value for value in (0, 1, 3)] +
+            [ctype_flat == value for value in (1, 2, 4, 5)] +
+            [image.ravel() for image in images]
+        )
+        expected = np.clip(np.asarray(model.ANN_model.predict(full_inputs)), 0, 1).astype(np.float32)
+
+        # a chunk size that does not divide the number of valid pixels puts a chunk boundary mid-raster
+        outputs = model.FLiES_ANN(
+            geometry,
+            Raster(atype, geometry=geometry),
+            Raster(ctype, geometry=geometry),
+            *[Raster(image, geometry=geometry) for image in images],
+            chunk_size=997
+        )
+
+        masked = np.any([np.isnan(image.ravel()) for image in images], axis=0)
+        self.assertTrue(np.any(masked))
+
+        for index, output in enumerate(outputs):
+            output = np.asarray(output).ravel()
+
+            self.assertEqual(output.dtype, np.float32)
+            self.assertTrue(np.all(np.isnan(output[masked])))
+            self.assertTrue(np.allclose(output[~masked], expected[~masked, index], rtol=1e-5, atol=1e-6))
+
+    def test_atype_ctype_matches_chained(self):
+        import numpy as np
+        from FLiES.atype_ctype import ANN_atype_ctype, LUT_atype_ctype
+
+        rng = np.random.default_rng(0)
+        count = 10000
+        # COT missing, negative, clear and cloudy
+        COT = rng.choice([np.nan, -1, 0, 0.5, 20], count)
+
+        # Koppen-Geiger classes as float rasters with missing and unknown classes and as uint8 rasters
+        for KG_climate in (rng.choice([np.nan, 0, 1, 2, 3, 4, 5, 6, 7, 2.5], count), rng.integers(0, 256, count).astype(np.uint8)):
+            atype, ctype = ANN_atype_ctype(COT, KG_climate)
+            expected_atype, expected_ctype = chained_ANN_atype_ctype(COT, KG_climate)
+
+            # the tables return uint8 where the chained passes returned uint16
+            self.assertEqual(atype.dtype, np.uint8)
+            self.assertEqual(ctype.dtype, np.uint8)
+            self.assertTrue(np.array_equal(atype, expected_atype))
+            self.assertTrue(np.array_equal(ctype, expected_ctype))
+
+            cloud_mask = rng.random(count) < 0.5
+            IGBP = rng.integers(0, 18, count)
+            atype, ctype = LUT_atype_ctype(cloud_mask, KG_climate, IGBP)
+            expected_ctype = np.where(np.logical_and(cloud_mask, KG_climate == 1), 2, 1)
+            expected_ctype = np.where(np.logical_not(cloud_mask), 0, expected_ctype)
+
+            self.assertTrue(np.array_equal(atype, np.where(IGBP == 13, 1, 0)))
+            self.assertTrue(np.array_equal(ctype, expected_ctype))
+
+    def test_LUT_matches_per_pixel_interpolation(self):
+        import numpy as np
+        from FLiES.FLiESLUT import FLiES_lookup, load_LUT
+
+        rng = np.random.default_rng(0)
+        count = 10000
+        ctype = rng.choice([0, 1, 2], count)
+        atype = rng.choice([0, 1], count)
+        # missing and out of range values in every input, and cloud optical thickness on the table factors
+        ctop = rng.choice([np.nan, -1, 500, 3000, 7500, 12000], count)
+        albedo = rng.choice([np.nan, -0.1, 0.05, 0.3, 0.95], count)
+        The0 = rng.uniform(0, 90, count)
+        ctauref = np.where(rng.random(count) < 0.1, rng.choice([np.nan, -1, 0.5, 20, 110], count), rng.uniform(0, 140, count))
+        tauref = rng.choice([np.nan, 0.05, 0.3, 0.6, 1.5], count)
+
+        for interpolate_cot in (True, False):
+            expected = per_pixel_FLiES_lookup(load_LUT(), ctype, atype, ctop, albedo, The0, ctauref, tauref, interpolate_cot=interpolate_cot)
+            SWin = FLiES_lookup(ctype, atype, ctop, albedo, The0, ctauref, tauref, interpolate_cot=interpolate_cot)
+
+            # the gather interpolates in float64 where the per-pixel queries stayed in the float32 of the table,
+            # so the two agree to within rounding of the table values rather than bit for bit
+            self.assertTrue(np.allclose(SWin, expected, rtol=0, atol=1e-5, equal_nan=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
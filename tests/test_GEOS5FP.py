@@ -0,0 +1,480 @@
+"""
+This module contains the unit tests for the GEOS5FP package.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from os.path import join
+from unittest import mock
+
+__author__ = 'Gregory Halverson'
+
+PRODUCT = "tavg1_2d_slv_Nx"
+TIME_UTC = datetime(2023, 8, 1, 12, 30)
+FILENAME = f"GEOS.fp.asm.{PRODUCT}.{TIME_UTC:%Y%m%d_%H%M}.V01.nc4"
+AFTER_FILENAME = f"GEOS.fp.asm.{PRODUCT}.{TIME_UTC + timedelta(hours=1):%Y%m%d_%H%M}.V01.nc4"
+
+
+def write_granule(filename: str):
+    import numpy as np
+    import netCDF4
+
+    lat = np.linspace(-90, 90, 9)
+    lon = np.linspace(-180, 135, 8)
+
+    with netCDF4.Dataset(filename, "w") as dataset:
+        dataset.createDimension("time", 1)
+        dataset.createDimension("lat", len(lat))
+        dataset.createDimension("lon", len(lon))
+        dataset.createVariable("lat", "f8", ("lat",))[:] = lat
+        dataset.createVariable("lon", "f8", ("lon",))[:] = lon
+        T2M = dataset.createVariable("T2M", "f4", ("time", "lat", "lon"), fill_value=1e15)
+        T2M[:] = np.full((1, len(lat), len(lon)), 290, dtype=np.float32)
+
+
+def write_global_granule(filename: str):
+    import numpy as np
+    import netCDF4
+
+    lat = np.linspace(-90, 90, 721)
+    lon = np.arange(1152) * 0.3125 - 180
+
+    with netCDF4.Dataset(filename, "w") as dataset:
+        dataset.createDimension("time", 1)
+        dataset.createDimension("lat", len(lat))
+        dataset.createDimension("lon", len(lon))
+        dataset.createVariable("lat", "f8", ("lat",))[:] = lat
+        dataset.createVariable("lon", "f8", ("lon",))[:] = lon
+        T2M = dataset.createVariable("T2M", "f4", ("time", "lat", "lon"), fill_value=1e15)
+        T2M[:] = (280 + 10 * np.sin(np.radians(lat))[:, None] + 5 * np.cos(np.radians(lon * 3))[None, :])[None].astype(np.float32)
+
+
+def write_linear_granule(filename: str, offset: float):
+    import numpy as np
+    import netCDF4
+
+    lat = np.linspace(-90, 90, 721)
+    lon = np.arange(1152) * 0.3125 - 180
+
+    with netCDF4.Dataset(filename, "w") as dataset:
+        dataset.createDimension("time", 1)
+        dataset.createDimension("lat", len(lat))
+        dataset.createDimension("lon", len(lon))
+        dataset.createVariable("lat", "f8", ("lat",))[:] = lat
+        dataset.createVariable("lon", "f8", ("lon",))[:] = lon
+        T2M = dataset.createVariable("T2M", "f4", ("time", "lat", "lon"), fill_value=1e15)
+        T2M[:] = (offset + 0.1 * lat[:, None] + 0.01 * lon[None, :])[None].astype(np.float32)
+
+
+def UTM_tile_grid():
+    from rasters import RasterGrid
+
+    return RasterGrid.from_bbox(
+        (400000, 3700000, 509800, 3809800),
+        cell_size=700,
+        crs="+proj=utm +zone=11 +datum=WGS84 +units=m +no_defs"
+    )
+
+
+class RecordingHandler(SimpleHTTPRequestHandler):
+    """
+    Static file handler that records the paths requested from the stand-in GEOS-5 FP portal.
+    """
+    requests = []
+
+    def do_HEAD(self):
+        self.requests.append(("HEAD", self.path))
+        super(RecordingHandler, self).do_HEAD()
+
+    def do_GET(self):
+        self.requests.append(("GET", self.path))
+        range_header = self.headers.get("Range")
+
+        if range_header is None:
+            super(RecordingHandler, self).do_GET()
+            return
+
+        with open(self.translate_path(self.path), "rb") as file:
+            content = file.read()
+
+        start = int(range_header.split("=")[1].split("-")[0])
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(content) - start))
+        self.send_header("Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}")
+        self.end_headers()
+        self.wfile.write(content[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestGEOS5FP(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.remote_directory = join(self.directory, "remote")
+        self.download_directory = join(self.directory, "download")
+        day_directory = join(self.remote_directory, f"Y{TIME_UTC:%Y}", f"M{TIME_UTC:%m}", f"D{TIME_UTC:%d}")
+        os.makedirs(day_directory)
+        write_granule(join(day_directory, FILENAME))
+        write_granule(join(day_directory, AFTER_FILENAME))
+
+        RecordingHandler.requests = []
+        handler = partial(RecordingHandler, directory=self.remote_directory)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.remote = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.URL = f"{self.remote}/Y{TIME_UTC:%Y}/M{TIME_UTC:%m}/D{TIME_UTC:%d}/{FILENAME}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def stage_granule(self) -> str:
+        date_directory = join(self.download_directory, f"{TIME_UTC:%Y.%m.%d}")
+        os.makedirs(date_directory, exist_ok=True)
+        filename = join(date_directory, FILENAME)
+        write_granule(filename)
+
+        return filename
+
+    def test_import_GEOS5FP(self):
+        print('testing GEOS5FP import')
+        from GEOS5FP import GEOS5FP
+
+    def test_local_first_skips_remote(self):
+        from GEOS5FP import GEOS5FP
+
+        filename = self.stage_granule()
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote, local_first=True)
+        granule = connection.download_file(self.URL)
+
+        self.assertEqual(granule.filename, filename)
+        self.assertEqual(RecordingHandler.requests, [])
+
+    def test_subset_read(self):
+        import numpy as np
+        from GEOS5FP import GEOS5FPGranule
+
+        filename = join(self.directory, FILENAME)
+        write_global_granule(filename)
+        geometry = UTM_tile_grid()
+        full = GEOS5FPGranule(filename, working_directory=self.directory, subset=False).read("T2M", geometry=geometry)
+        subset = GEOS5FPGranule(filename, working_directory=self.directory, subset=True).read("T2M", geometry=geometry)
+
+        self.assertEqual(subset.shape, full.shape)
+        self.assertTrue(np.allclose(np.array(subset), np.array(full), equal_nan=True))
+
+    def test_regridding_plans(self):
+        import numpy as np
+        from GEOS5FP import GEOS5FPGranule, RegriddingPlans
+
+        filename = join(self.directory, FILENAME)
+        write_global_granule(filename)
+        geometry = UTM_tile_grid()
+        plans_directory = join(self.directory, "plans")
+        expected = GEOS5FPGranule(filename, working_directory=self.directory).read("T2M", geometry=geometry)
+        planned = GEOS5FPGranule(filename, working_directory=self.directory, plans=RegriddingPlans(plans_directory)).read("T2M", geometry=geometry)
+
+        self.assertEqual(planned.shape, expected.shape)
+        self.assertTrue(np.allclose(np.array(planned), np.array(expected), atol=0.05, equal_nan=True))
+        self.assertEqual(len(os.listdir(plans_directory)), 1)
+
+        plans = RegriddingPlans(plans_directory)
+        reloaded = GEOS5FPGranule(filename, working_directory=self.directory, plans=plans).read("T2M", geometry=geometry)
+
+        self.assertEqual(len(plans), 1)
+        self.assertTrue(np.array_equal(np.array(reloaded), np.array(planned), equal_nan=True))
+
+    def test_extract_points(self):
+        import numpy as np
+        from GEOS5FP import GEOS5FP
+
+        day_directory = join(self.remote_directory, f"Y{TIME_UTC:%Y}", f"M{TIME_UTC:%m}", f"D{TIME_UTC:%d}")
+        write_linear_granule(join(day_directory, FILENAME), 280)
+        write_linear_granule(join(day_directory, AFTER_FILENAME), 284)
+        lats = [34.1, -12.33, 60.7]
+        lons = [-118.17, 25.01, 100.4]
+        times_UTC = [TIME_UTC + timedelta(minutes=15), TIME_UTC + timedelta(minutes=45), TIME_UTC + timedelta(minutes=30)]
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote)
+        table = connection.extract_points(lats, lons, times_UTC, ["T2M"], product=PRODUCT)
+        expected = 280 + 4 * np.array([0.25, 0.75, 0.5]) + 0.1 * np.array(lats) + 0.01 * np.array(lons)
+
+        self.assertEqual(list(table.columns), ["point", "lat", "lon", "time_UTC", "product", "variable", "value"])
+        self.assertTrue(np.allclose(table.value, expected, atol=1e-3))
+        self.assertEqual(len([request for request in RecordingHandler.requests if request[0] == "GET"]), 2)
+
+    def test_consolidate(self):
+        import numpy as np
+        from GEOS5FP import GEOS5FP
+
+        day_directory = join(self.remote_directory, f"Y{TIME_UTC:%Y}", f"M{TIME_UTC:%m}", f"D{TIME_UTC:%d}")
+        write_linear_granule(join(day_directory, FILENAME), 280)
+        write_linear_granule(join(day_directory, AFTER_FILENAME), 284)
+        geometry = UTM_tile_grid()
+        stores_directory = join(self.directory, "stores")
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote, stores_directory=stores_directory)
+        stores = connection.consolidate(TIME_UTC + timedelta(minutes=15), TIME_UTC + timedelta(minutes=45), [PRODUCT], ["T2M"], (-121, 31, -115, 37))
+
+        self.assertEqual(len(stores), 1)
+        self.assertEqual(len(stores[0]), 2)
+
+        # stores are only read from a directory given explicitly
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote)
+        self.assertEqual(connection.stores, [])
+
+        RecordingHandler.requests = []
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote, stores_directory=stores_directory)
+        self.assertEqual(len(connection.stores), 1)
+        consolidated = connection.interpolate(TIME_UTC + timedelta(minutes=30), PRODUCT, "T2M", geometry=geometry)
+
+        self.assertEqual(consolidated["filenames"], [stores[0].filename])
+        self.assertEqual(connection.snapshot_filenames(), [stores[0].filename])
+        self.assertEqual(RecordingHandler.requests, [])
+
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote, stores_directory=join(self.directory, "empty"), local_first=True)
+        expected = connection.interpolate(TIME_UTC + timedelta(minutes=30), PRODUCT, "T2M", geometry=geometry)
+
+        self.assertTrue(np.allclose(np.array(consolidated), np.array(expected), equal_nan=True))
+
+    def test_store_bracket_gap(self):
+        import numpy as np
+        from GEOS5FP.store import GEOS5FPStore
+
+        filename = join(self.directory, "store.nc")
+        lat = np.linspace(30, 38, 5)
+        lon = np.linspace(-122, -114, 5)
+        dataset = GEOS5FPStore.create(filename, PRODUCT, ["T2M"], lat, lon)
+
+        # the time step at 13:30 is missing
+        for time_UTC in (TIME_UTC, TIME_UTC + timedelta(hours=2)):
+            GEOS5FPStore.append(dataset, time_UTC, {"T2M": np.full((5, 5), 280, dtype=np.float32)})
+
+        dataset.close()
+        store = GEOS5FPStore(filename)
+
+        self.assertEqual(store.bracket(TIME_UTC + timedelta(minutes=30)), (0, 1))
+        self.assertIsNone(store.bracket(TIME_UTC + timedelta(minutes=30), max_gap_hours=1))
+        self.assertEqual(store.bracket(TIME_UTC + timedelta(minutes=30), max_gap_hours=2), (0, 1))
+
+    def test_interpolation_precision(self):
+        import numpy as np
+        from GEOS5FP import GEOS5FP
+
+        self.stage_granule()
+        date_directory = join(self.download_directory, f"{TIME_UTC:%Y.%m.%d}")
+        write_granule(join(date_directory, AFTER_FILENAME))
+        geometry = UTM_tile_grid()
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote, local_first=True)
+        expected = connection.interpolate(TIME_UTC + timedelta(minutes=30), PRODUCT, "T2M", geometry=geometry)
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote, local_first=True, dtype=np.float32)
+        interpolated = connection.interpolate(TIME_UTC + timedelta(minutes=30), PRODUCT, "T2M", geometry=geometry)
+        cached = connection.interpolate(TIME_UTC + timedelta(minutes=30), PRODUCT, "T2M", geometry=geometry)
+
+        self.assertEqual(interpolated.dtype, np.float32)
+        self.assertEqual(cached.dtype, np.float32)
+        self.assertTrue(np.allclose(np.array(interpolated), np.array(expected), equal_nan=True))
+
+    def test_interpolation_cache(self):
+        from GEOS5FP import GEOS5FP
+
+        geometry = UTM_tile_grid()
+        time_UTC = TIME_UTC + timedelta(minutes=30)
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote)
+        connection.interpolate(time_UTC, PRODUCT, "T2M", geometry=geometry)
+
+        self.assertEqual((connection.cache.hits, connection.cache.misses), (0, 1))
+        request_count = len(RecordingHandler.requests)
+
+        # a cached field is returned without probing or downloading its granules
+        connection.interpolate(time_UTC, PRODUCT, "T2M", geometry=geometry)
+        connection.interpolate_many(time_UTC, PRODUCT, ["T2M"], geometry=geometry)
+
+        self.assertEqual((connection.cache.hits, connection.cache.misses), (2, 1))
+        self.assertEqual(len(RecordingHandler.requests), request_count)
+        self.assertEqual([os.path.basename(filename) for filename in connection.snapshot_filenames()], [FILENAME, AFTER_FILENAME])
+
+        connection.clear_cache()
+
+        self.assertEqual((len(connection.cache), connection.cache.nbytes), (0, 0))
+        self.assertEqual((connection.cache.hits, connection.cache.misses), (0, 0))
+
+        connection.interpolate(time_UTC, PRODUCT, "T2M", geometry=geometry)
+
+        self.assertEqual((connection.cache.hits, connection.cache.misses), (0, 1))
+
+    def test_manifest(self):
+        from GEOS5FP import GEOS5FPManifest
+
+        filename = self.stage_granule()
+        manifest = GEOS5FPManifest(self.download_directory)
+        self.assertFalse(manifest.verify(filename))
+        manifest.record(filename)
+        self.assertTrue(GEOS5FPManifest(self.download_directory).verify(filename))
+
+        # a copied file keeps its contents but not its modification time
+        status = os.stat(filename)
+        os.utime(filename, ns=(status.st_atime_ns, status.st_mtime_ns + 10 ** 9))
+        self.assertTrue(manifest.verify(filename))
+        self.assertEqual(manifest.entry(filename)[1], status.st_mtime_ns + 10 ** 9)
+
+        with open(filename, "r+b") as file:
+            file.write(b"\0" * 8)
+
+        os.utime(filename, ns=(status.st_atime_ns, status.st_mtime_ns + 2 * 10 ** 9))
+        self.assertFalse(manifest.verify(filename))
+
+        with open(filename, "ab") as file:
+            file.write(b"\0")
+
+        self.assertFalse(manifest.verify(filename))
+
+    def test_manifest_skips_revalidation(self):
+        from GEOS5FP import GEOS5FP
+
+        filename = self.stage_granule()
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote, local_first=True)
+        connection.download_file(self.URL)
+        self.assertTrue(connection.manifest.verify(filename))
+
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote, local_first=True)
+
+        with mock.patch.object(sys.modules["GEOS5FP.GEOS5FP"].rasterio, "open", side_effect=AssertionError):
+            granule = connection.download_file(self.URL)
+
+        self.assertEqual(granule.filename, filename)
+        self.assertEqual(len(connection.manifest), 1)
+        self.assertEqual(RecordingHandler.requests, [])
+
+    def test_local_first_downloads_missing_granule(self):
+        from GEOS5FP import GEOS5FP
+
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote, local_first=True)
+        granule = connection.download_file(self.URL, retries=1, wait_seconds=0)
+
+        self.assertTrue(os.path.exists(granule.filename))
+        self.assertIn(("HEAD", self.URL[len(self.remote):]), RecordingHandler.requests)
+
+    def test_prefetch(self):
+        from GEOS5FP import GEOS5FP
+
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote)
+        filenames = connection.prefetch([TIME_UTC + timedelta(minutes=15), TIME_UTC + timedelta(minutes=45)], products=[PRODUCT], wait_seconds=0)
+
+        self.assertEqual([os.path.basename(filename) for filename in filenames], [FILENAME, AFTER_FILENAME])
+        self.assertTrue(all(os.path.exists(filename) for filename in filenames))
+        self.assertEqual(len([request for request in RecordingHandler.requests if request[0] == "GET"]), 2)
+
+    def test_fetch_resume(self):
+        from GEOS5FP import GEOS5FP
+        from GEOS5FP.GEOS5FP import partial_download_filename
+
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote)
+        filename = connection.download_filename(self.URL)
+        os.makedirs(os.path.dirname(filename))
+
+        with open(join(self.remote_directory, f"Y{TIME_UTC:%Y}", f"M{TIME_UTC:%m}", f"D{TIME_UTC:%d}", FILENAME), "rb") as file:
+            content = file.read()
+
+        with open(partial_download_filename(filename), "wb") as file:
+            file.write(content[:100])
+
+        # the partial download of another process sharing the directory is left alone
+        other_partial_filename = f"{filename}.otherhost.1.download"
+
+        with open(other_partial_filename, "wb") as file:
+            file.write(b"\0" * 50)
+
+        connection.fetch_file(self.URL, wait_seconds=0)
+
+        with open(filename, "rb") as file:
+            self.assertEqual(file.read(), content)
+
+        self.assertFalse(os.path.exists(partial_download_filename(filename)))
+
+        with open(other_partial_filename, "rb") as file:
+            self.assertEqual(file.read(), b"\0" * 50)
+
+    def test_concurrent_reads(self):
+        import numpy as np
+        from concurrent.futures import ThreadPoolExecutor
+        from GEOS5FP import GEOS5FP
+
+        day_directory = join(self.remote_directory, f"Y{TIME_UTC:%Y}", f"M{TIME_UTC:%m}", f"D{TIME_UTC:%d}")
+        write_linear_granule(join(day_directory, FILENAME), 280)
+        write_linear_granule(join(day_directory, AFTER_FILENAME), 290)
+        geometry = UTM_tile_grid()
+        time_UTC = TIME_UTC + timedelta(minutes=30)
+        workers = 8
+        # concurrent stages share one connection without a cache, so every thread downloads and reads the granules
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote, cache_size_bytes=0)
+        barrier = threading.Barrier(workers)
+
+        def read(index: int):
+            barrier.wait()
+
+            if index % 2 == 0:
+                return connection.interpolate(time_UTC, PRODUCT, "T2M", geometry=geometry)
+            else:
+                return connection.interpolate_many(time_UTC, PRODUCT, ["T2M"], geometry=geometry)["T2M"]
+
+        # colliding downloads would be retried without waiting, so they show up as extra requests
+        with mock.patch("GEOS5FP.GEOS5FP.sleep"), ThreadPoolExecutor(max_workers=workers) as executor:
+            images = list(executor.map(read, range(workers)))
+
+        expected = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote, cache_size_bytes=0).interpolate(time_UTC, PRODUCT, "T2M", geometry=geometry)
+
+        for image in images:
+            self.assertTrue(np.allclose(np.array(image), np.array(expected), equal_nan=True))
+
+        self.assertEqual(len([request for request in RecordingHandler.requests if request[0] == "GET"]), 2)
+        self.assertEqual([os.path.basename(filename) for filename in connection.snapshot_filenames()], [FILENAME, AFTER_FILENAME])
+        self.assertEqual(sorted(os.listdir(os.path.dirname(connection.snapshot_filenames()[0]))), [FILENAME, AFTER_FILENAME])
+
+    def test_offline_missing_granule(self):
+        from GEOS5FP import GEOS5FP, GEOS5FPGranuleNotAvailable
+
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote, offline=True)
+
+        with self.assertRaises(GEOS5FPGranuleNotAvailable):
+            connection.download_file(self.URL)
+
+        self.assertEqual(RecordingHandler.requests, [])
+
+    def test_offline_listing(self):
+        from GEOS5FP import GEOS5FP
+
+        self.stage_granule()
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote, offline=True)
+        listing = connection.http_listing(TIME_UTC.date(), product_name=PRODUCT)
+
+        self.assertEqual(list(listing.URL), [self.URL])
+        self.assertEqual(RecordingHandler.requests, [])
+
+    def test_day_published_later(self):
+        from GEOS5FP import GEOS5FP, GEOS5FPDayNotAvailable
+
+        connection = GEOS5FP(working_directory=self.directory, download_directory=self.download_directory, remote=self.remote)
+        later = TIME_UTC + timedelta(days=1)
+
+        with self.assertRaises(GEOS5FPDayNotAvailable):
+            connection.http_listing(later.date(), product_name=PRODUCT)
+
+        day_directory = join(self.remote_directory, f"Y{later:%Y}", f"M{later:%m}", f"D{later:%d}")
+        os.makedirs(day_directory)
+        write_granule(join(day_directory, FILENAME.replace(f"{TIME_UTC:%Y%m%d}", f"{later:%Y%m%d}")))
+        listing = connection.http_listing(later.date(), product_name=PRODUCT)
+
+        self.assertEqual(len(listing), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
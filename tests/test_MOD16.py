@@ -0,0 +1,39 @@
+"""
+This module contains the unit tests for the MOD16 package.
+"""
+
+import unittest
+
+from tests.helpers import bypass_constructor
+
+__author__ = 'Gregory Halverson'
+
+
+class TestMOD16(unittest.TestCase):
+    def test_biome_parameters(self):
+        import numpy as np
+        from affine import Affine
+        from rasters import Raster, RasterGrid
+        from MOD16.MOD16 import MOD16, BIOME_PARAMETER_COLUMNS
+
+        model = bypass_constructor(MOD16, resampling="cubic")
+
+        rng = np.random.default_rng(0)
+        IGBP_geometry = RasterGrid.from_affine(Affine(0.05, 0, -118.5, 0, -0.05, 34.5), 20, 20, crs="EPSG:4326")
+        IGBP = Raster(rng.integers(0, 17, IGBP_geometry.shape).astype(np.uint8), geometry=IGBP_geometry)
+        geometry = RasterGrid.from_affine(Affine(0.01, 0, -118.3, 0, -0.01, 34.3), 30, 40, crs="EPSG:4326")
+        biome_parameters = model.biome_parameters(geometry, IGBP=IGBP)
+
+        self.assertEqual(list(biome_parameters._fields), list(BIOME_PARAMETER_COLUMNS))
+
+        for name in BIOME_PARAMETER_COLUMNS:
+            image = getattr(biome_parameters, name)
+            expected = getattr(model, name)(geometry, IGBP=IGBP)
+
+            self.assertEqual(image.dtype, np.float32, name)
+            self.assertEqual(image.shape, geometry.shape, name)
+            self.assertTrue(np.array_equal(np.asarray(image), np.asarray(expected), equal_nan=True), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
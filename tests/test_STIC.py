@@ -0,0 +1,151 @@
+"""
+This module contains the unit tests for the STIC package.
+"""
+
+import unittest
+from datetime import datetime
+
+from tests.helpers import UTM_grid, uniform_rasters
+
+__author__ = 'Gregory Halverson'
+
+
+def STIC_inputs(shape=(30, 40)):
+    import numpy as np
+    from rasters import Raster
+
+    geometry = UTM_grid(shape)
+    uniform = uniform_rasters(geometry)
+    Ta_C = uniform(5, 35)
+
+    return geometry, dict(
+        Rn=uniform(-50, 700), RH=uniform(0.1, 0.95), Rg=uniform(0, 1000), Ta_C=Ta_C, ST_C=Ta_C + uniform(-3, 15),
+        albedo=uniform(0.05, 0.3), emissivity=uniform(0.93, 0.99), NDVI=uniform(-0.1, 0.9),
+        water=Raster(np.asarray(uniform(0, 1)) < 0.05, geometry=geometry)
+    )
+
+
+def run_STIC(geometry, inputs, in_place_iteration: bool, LE_convergence_target: float, max_iterations: int = 3):
+    from STIC import STIC
+
+    model = STIC(save_intermediate=False, show_distribution=False, in_place_iteration=in_place_iteration)
+
+    return model.STIC(
+        geometry=geometry,
+        target="11SPS",
+        time_UTC=datetime(2022, 7, 1, 19),
+        LE_convergence_target=LE_convergence_target,
+        max_iterations=max_iterations,
+        **inputs
+    )
+
+
+class TestSTIC(unittest.TestCase):
+    def test_factored_closure(self):
+        import numpy as np
+        from STIC.STIC import STIC_closure
+        from STIC.iteration import closure, SCRATCH_VARIABLES
+
+        rng = np.random.default_rng(0)
+        count = 1000
+        delta = rng.uniform(0.5, 3, count)
+        phi = rng.uniform(10, 600, count)
+        Ea = rng.uniform(5, 20, count)
+        Es = Ea + rng.uniform(0.5, 10, count)
+        Estar = Es + rng.uniform(0.5, 20, count)
+        M = rng.uniform(0, 1, count)
+        alpha = rng.uniform(0.5, 2, count)
+        Ta_C = rng.uniform(5, 35, count)
+        expected_gB, expected_gS, dT, EF = STIC_closure(delta, phi, Es, Ea, Estar, M, alpha=alpha)
+
+        gB, gS, T0 = np.empty(count), np.empty(count), np.empty(count)
+        scratch = {name: np.empty(count) for name in SCRATCH_VARIABLES}
+        closure(delta, phi, Es, Ea, Estar, M, alpha, Ta_C, gB, gS, T0, scratch, np.empty(count, dtype=bool))
+
+        self.assertTrue(np.allclose(gB, expected_gB, rtol=1e-9))
+        self.assertTrue(np.allclose(gS, expected_gS, rtol=1e-9))
+        self.assertTrue(np.allclose(T0, dT + Ta_C, rtol=1e-9))
+
+    def test_in_place_iteration_matches_loop(self):
+        import sys
+        from unittest import mock
+        import numpy as np
+
+        STIC_module = sys.modules["STIC.STIC"]
+        STIC_closure = STIC_module.STIC_closure
+
+        for Rg in (False, True):
+            geometry, inputs = STIC_inputs()
+
+            if not Rg:
+                inputs.pop("Rg")
+
+            # the closure is singular where e0 meets e0star, and the loop resolves the conductances there
+            # by the sign of the roundoff in its expanded polynomials, so those pixels are compared by neither path
+            singular = np.zeros(geometry.shape, dtype=bool)
+            calls = []
+
+            def closure(delta, phi, Es, Ea, Estar, M, *args):
+                calls.append(len(calls))
+
+                # the first call sets the initial state shared by both paths
+                if len(calls) > 1:
+                    singular[...] |= np.asarray(Es) == np.asarray(Estar)
+
+                return STIC_closure(delta, phi, Es, Ea, Estar, M, *args)
+
+            with mock.patch.object(STIC_module, "STIC_closure", closure):
+                expected = run_STIC(geometry, inputs, in_place_iteration=False, LE_convergence_target=0)
+
+            # with a target of zero every pixel with a defined change keeps iterating
+            in_place = run_STIC(geometry, inputs, in_place_iteration=True, LE_convergence_target=0)
+            self.assertEqual(in_place["iteration"], expected["iteration"])
+            self.assertLess(np.count_nonzero(singular), 0.2 * singular.size)
+
+            for name in ("LE", "LEt", "PT", "PET", "G"):
+                expected_image = np.asarray(expected[name], dtype=np.float64)[~singular]
+                in_place_image = np.asarray(in_place[name], dtype=np.float64)[~singular]
+                self.assertTrue(np.allclose(in_place_image, expected_image, rtol=1e-6, atol=1e-6, equal_nan=True), name)
+
+    def test_in_place_iteration_freezes_converged_pixels(self):
+        import numpy as np
+        from STIC.iteration import OUTPUT_VARIABLES
+
+        for Rg in (False, True):
+            geometry, inputs = STIC_inputs()
+
+            if not Rg:
+                inputs.pop("Rg")
+
+            # the state of every pixel after each iteration, with no pixel converging
+            passes = [
+                run_STIC(geometry, inputs, in_place_iteration=True, LE_convergence_target=0, max_iterations=iteration)
+                for iteration
+                in (1, 2, 3)
+            ]
+
+            results = run_STIC(geometry, inputs, in_place_iteration=True, LE_convergence_target=1.0, max_iterations=3)
+            self.assertEqual(results["iteration"], 3)
+
+            # a pixel keeps its state from the first iteration that changed its LE by less than the target
+            expected = {name: np.array(passes[-1][name]) for name in OUTPUT_VARIABLES}
+            active = np.ones(geometry.shape, dtype=bool)
+
+            for iteration, outputs in enumerate(passes, start=1):
+                converged = active & ~(np.asarray(outputs["LE_change"]) >= 1.0)
+
+                for name in OUTPUT_VARIABLES:
+                    expected[name][converged] = np.asarray(outputs[name])[converged]
+
+                if iteration < len(passes):
+                    active &= ~converged
+
+            self.assertGreater(np.count_nonzero(~active), 0)
+            self.assertGreater(np.count_nonzero(active & ~np.isnan(np.asarray(passes[0]["LE_change"]))), 0)
+            self.assertEqual(results["LE_max_change"], np.nanmax(np.asarray(passes[-1]["LE_change"])[active]))
+
+            for name in OUTPUT_VARIABLES:
+                self.assertTrue(np.array_equal(np.asarray(results[name]), expected[name], equal_nan=True), name)
+
+if __name__ == '__main__':
+    unittest.main()
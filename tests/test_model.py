@@ -0,0 +1,290 @@
+"""
+This module contains the unit tests for the model package.
+"""
+
+import time
+import unittest
+from threading import Event, Timer
+
+__author__ = 'Gregory Halverson'
+
+
+class TestModel(unittest.TestCase):
+    def test_intermediate_writer_order(self):
+        from model.writer import IntermediateWriter
+
+        written = []
+
+        def write(index):
+            time.sleep(0.01 * (5 - index % 5))
+            written.append(index)
+
+        with IntermediateWriter(max_workers=4, max_queued=2) as writer:
+            futures = [writer.submit(f"intermediate {index}", write, index) for index in range(20)]
+            self.assertEqual(writer.flush(), [])
+
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(sorted(written), list(range(20)))
+
+    def test_intermediate_writer_backpressure(self):
+        from model.writer import IntermediateWriter
+
+        release = Event()
+        timer = Timer(0.2, release.set)
+        writer = IntermediateWriter(max_workers=1, max_queued=1)
+        writer.submit("blocking", release.wait)
+        writer.submit("queued", lambda: None)
+        start = time.perf_counter()
+        timer.start()
+        # the queue is full until the first write is released
+        writer.submit("blocked", lambda: None)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.1)
+        writer.close()
+        timer.join()
+
+    def test_intermediate_writer_failures(self):
+        from model.writer import IntermediateWriter, IntermediateWriteError
+
+        def fail():
+            raise IOError("disk full")
+
+        writer = IntermediateWriter(max_workers=2, max_queued=2)
+        writer.submit("good", lambda: None)
+        writer.submit("bad", fail)
+
+        with self.assertRaises(IntermediateWriteError) as context:
+            writer.close()
+
+        self.assertEqual([description for description, exception in context.exception.failures], ["bad"])
+
+    def test_distribution_statistics(self):
+        import numpy as np
+        from model.model import distribution_statistics
+
+        rng = np.random.default_rng(0)
+        image = rng.normal(10, 5, (1000, 1100)).astype(np.float32)
+        image[rng.random(image.shape) < 0.2] = np.nan
+        image[:10] = 0
+        statistics = distribution_statistics(image, chunk_size=100000)
+
+        self.assertEqual(statistics.count, image.size)
+        self.assertEqual(statistics.nan_count, np.count_nonzero(np.isnan(image)))
+        self.assertEqual(statistics.zero_count, np.count_nonzero(image == 0))
+        self.assertEqual(statistics.minimum, np.nanmin(image))
+        self.assertEqual(statistics.maximum, np.nanmax(image))
+        self.assertAlmostEqual(statistics.mean, np.nanmean(image.astype(np.float64)))
+        self.assertIsNone(statistics.histogram)
+
+        sample = distribution_statistics(image, sample_fraction=0.1)
+        self.assertAlmostEqual(sample.count / image.size, 0.1, delta=0.02)
+        self.assertAlmostEqual(sample.mean, statistics.mean, places=1)
+
+    def test_distribution_sample_columns(self):
+        import numpy as np
+        from model.model import distribution_statistics
+
+        # a stride of 10 through rows of 1100 pixels would only ever see every tenth column
+        for column in (0, 5):
+            image = np.ones((1000, 1100), dtype=np.float32)
+            image[:, column] = np.nan
+            sample = distribution_statistics(image, sample_fraction=0.1)
+
+            self.assertAlmostEqual(sample.nan_count, sample.count / image.shape[1], delta=2)
+
+    def test_distribution_histogram(self):
+        import numpy as np
+        from model.model import distribution_statistics
+
+        image = np.tile(np.array([0, 1, 2, 2, np.nan], dtype=np.float32), 100000)
+        statistics = distribution_statistics(image, chunk_size=65536)
+
+        self.assertEqual(statistics.histogram, {0.0: 100000, 1.0: 100000, 2.0: 200000})
+        self.assertEqual(statistics.nan_count, 100000)
+
+    def test_memoize_stage(self):
+        import tempfile
+        from collections import namedtuple
+        import numpy as np
+        from affine import Affine
+        from rasters import Raster, RasterGrid
+        from model.memoization import memoize_stage
+        from model.model import Model
+
+        calls = []
+
+        class Stages(Model):
+            @memoize_stage(parameters=("scale",))
+            def stage(self, image: Raster, offset: float):
+                calls.append(offset)
+                Output = namedtuple("Output", "total, mean")
+                total = image * self.scale + offset
+
+                return Output(total, np.nanmean(total))
+
+        geometry = RasterGrid.from_affine(Affine(70, 0, 300000, 0, -70, 4000000), 8, 9, crs="EPSG:32611")
+        image = Raster(np.arange(72, dtype=np.float32).reshape(8, 9), geometry=geometry)
+
+        with tempfile.TemporaryDirectory() as directory:
+            model = Stages(working_directory=directory, save_intermediate=False, memoize=True)
+            model.scale = 2
+            first = model.stage(image, 1.0)
+            second = model.stage(image, offset=1.0)
+
+            self.assertEqual(calls, [1.0])
+            self.assertTrue(np.array_equal(np.asarray(first.total), np.asarray(second.total)))
+            self.assertEqual(second.mean, first.mean)
+            self.assertEqual(second.total.geometry.affine, geometry.affine)
+
+            model.stage(image + 1, 1.0)
+            model.scale = 3
+            model.stage(image, 1.0)
+            self.assertEqual(calls, [1.0, 1.0, 1.0])
+            self.assertEqual(model.stage_cache.hits, 1)
+
+    def test_memoize_stage_callees(self):
+        import importlib
+        import sys
+        import tempfile
+        from os.path import join
+        from model.memoization import memoize_stage
+        from model.model import Model
+
+        calls = []
+
+        def define_stages():
+            class Stages(Model):
+                @memoize_stage(modules=("memoized_callee",))
+                def stage(self, offset: float):
+                    calls.append(offset)
+
+                    return importlib.import_module("memoized_callee").callee(offset)
+
+            return Stages
+
+        with tempfile.TemporaryDirectory() as directory:
+            with open(join(directory, "memoized_callee.py"), "w") as file:
+                file.write("def callee(offset):\n    return offset + 1\n")
+
+            sys.path.insert(0, directory)
+
+            try:
+                self.assertEqual(define_stages()(working_directory=directory, save_intermediate=False, memoize=True).stage(1.0), 2.0)
+                self.assertEqual(define_stages()(working_directory=directory, save_intermediate=False, memoize=True).stage(1.0), 2.0)
+                self.assertEqual(calls, [1.0])
+
+                # editing the callee computes the stage again instead of returning the output of the old code
+                with open(join(directory, "memoized_callee.py"), "w") as file:
+                    file.write("def callee(offset):\n    return offset + 10\n")
+
+                importlib.reload(sys.modules["memoized_callee"])
+                self.assertEqual(define_stages()(working_directory=directory, save_intermediate=False, memoize=True).stage(1.0), 11.0)
+                self.assertEqual(calls, [1.0, 1.0])
+            finally:
+                sys.path.remove(directory)
+                sys.modules.pop("memoized_callee", None)
+
+    def test_precision_inputs(self):
+        import numpy as np
+        from model.model import Model
+        from model.precision import precision_inputs
+
+        class Stages(Model):
+            @precision_inputs
+            def stage(self, image, mask, scale=2.0):
+                return image * scale, mask
+
+        model = Stages(save_intermediate=False, dtype="float32")
+        image, mask = model.stage(np.ones((4, 5)), np.zeros((4, 5), dtype=np.uint8))
+
+        self.assertEqual(image.dtype, np.float32)
+        self.assertEqual(mask.dtype, np.uint8)
+        self.assertEqual(Stages(save_intermediate=False).stage(np.ones(3), None)[0].dtype, np.float64)
+
+        with self.assertRaises(ValueError):
+            Model(save_intermediate=False, dtype=np.int16)
+
+    def test_precision_deltas(self):
+        import numpy as np
+        from model.precision import compare_precision
+
+        rng = np.random.default_rng(0)
+        reference = rng.uniform(1, 100, (30, 40))
+        reference[0, 0] = np.nan
+
+        def run(dtype):
+            return {"LE": reference.astype(dtype) * 1.1}
+
+        deltas = compare_precision(run)
+
+        self.assertEqual(deltas["LE"].NaN_mismatch, 0)
+        self.assertLess(deltas["LE"].max_relative, 1e-6)
+        self.assertGreater(deltas["LE"].max_absolute, 0)
+
+    def test_stage_graph(self):
+        from threading import Barrier
+        from model.scheduler import StageGraph
+
+        for max_workers in (1, 3):
+            stages = StageGraph(max_workers=max_workers)
+            started = []
+            # the two branches only finish when they run at the same time
+            barrier = Barrier(2, timeout=5) if max_workers > 1 else None
+
+            def branch(name, value):
+                started.append(name)
+
+                if barrier is not None:
+                    barrier.wait()
+
+                return value
+
+            stages.add("total", lambda left, right: left + right, inputs=["left", "right"], outputs=["total"])
+            stages.add("left", lambda base: branch("left", base + 1), inputs=["base"], outputs=["left"])
+            stages.add("right", lambda base: branch("right", base * 10), inputs=["base"], outputs=["right"])
+
+            @stages.stage(outputs=["base", "unused"])
+            def source():
+                return 2, None
+
+            values = stages.run({"offset": 0})
+
+            self.assertEqual(values["total"], 23)
+            self.assertEqual(values["offset"], 0)
+            self.assertEqual(set(stages.timings), {"source", "left", "right", "total"})
+
+            if max_workers == 1:
+                self.assertEqual(started, ["left", "right"])
+
+    def test_stage_graph_errors(self):
+        from model.scheduler import StageGraph, StageGraphError
+
+        stages = StageGraph()
+        stages.add("a", lambda b: b, inputs=["b"], outputs=["a"])
+        stages.add("b", lambda a: a, inputs=["a"], outputs=["b"])
+
+        with self.assertRaises(StageGraphError):
+            stages.run()
+
+        stages = StageGraph()
+        stages.add("a", lambda missing: missing, inputs=["missing"], outputs=["a"])
+
+        with self.assertRaises(StageGraphError):
+            stages.run()
+
+        ran = []
+
+        def fail():
+            raise IOError("disk full")
+
+        stages = StageGraph(max_workers=2)
+        stages.add("fail", fail, outputs=["failed"])
+        stages.add("after", lambda failed: ran.append(failed), inputs=["failed"])
+
+        # the failure of a stage is raised as is, and its dependents never run
+        with self.assertRaises(IOError):
+            stages.run()
+
+        self.assertEqual(ran, [])
+
+if __name__ == '__main__':
+    unittest.main()